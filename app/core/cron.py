@@ -0,0 +1,107 @@
+# app/core/cron.py
+# Espressioni cron a 5 campi (minuto ora giorno-mese mese giorno-settimana).
+#   *  5  1,15  9-17  */10  8-18/2      (giorno-settimana: 0-7, 0 e 7 = domenica)
+# Alias: @hourly @daily @weekly @monthly.
+# Come cron: se giorno-mese e giorno-settimana sono entrambi ristretti basta uno dei due.
+
+from __future__ import annotations
+
+from datetime import datetime, timedelta
+from typing import FrozenSet, Tuple
+
+_ALIASES = {
+    "@hourly": "0 * * * *",
+    "@daily": "0 0 * * *",
+    "@midnight": "0 0 * * *",
+    "@weekly": "0 0 * * 0",
+    "@monthly": "0 0 1 * *",
+}
+
+# (minimo, massimo) per campo
+_BOUNDS: Tuple[Tuple[int, int], ...] = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+
+class CronError(ValueError):
+    """Espressione cron non valida."""
+
+
+def _parse_field(text: str, lo: int, hi: int) -> FrozenSet[int]:
+    values = set()
+    for part in text.split(","):
+        step = 1
+        if "/" in part:
+            part, step_s = part.split("/", 1)
+            step = int(step_s)
+            if step <= 0:
+                raise CronError(f"passo non valido: {text}")
+        if part == "*":
+            start, end = lo, hi
+        elif "-" in part:
+            a, b = part.split("-", 1)
+            start, end = int(a), int(b)
+        else:
+            start = int(part)
+            end = hi if step > 1 else start
+        if start < lo or end > hi or start > end:
+            raise CronError(f"valore fuori intervallo {lo}-{hi}: {text}")
+        values.update(range(start, end + 1, step))
+    return frozenset(values)
+
+
+class CronSchedule:
+    def __init__(self, expr: str):
+        self.expr = expr.strip()
+        fields = _ALIASES.get(self.expr, self.expr).split()
+        if len(fields) != 5:
+            raise CronError(f"attesi 5 campi: '{expr}'")
+        try:
+            parsed = [_parse_field(f, lo, hi) for f, (lo, hi) in zip(fields, _BOUNDS)]
+        except ValueError as e:
+            raise CronError(f"'{expr}': {e}") from e
+        self.minutes, self.hours, self.days, self.months, dow = parsed
+        self.weekdays = frozenset(d % 7 for d in dow)          # 0 = domenica
+        self._dom_any = fields[2] == "*"
+        self._dow_any = fields[4] == "*"
+
+    def __repr__(self) -> str:
+        return f"CronSchedule({self.expr!r})"
+
+    def _day_matches(self, dt: datetime) -> bool:
+        dom = dt.day in self.days
+        dow = (dt.isoweekday() % 7) in self.weekdays
+        if self._dom_any and self._dow_any:
+            return True
+        if self._dom_any:
+            return dow
+        if self._dow_any:
+            return dom
+        return dom or dow
+
+    def matches(self, dt: datetime) -> bool:
+        return (
+            dt.minute in self.minutes
+            and dt.hour in self.hours
+            and dt.month in self.months
+            and self._day_matches(dt)
+        )
+
+    def next_after(self, dt: datetime) -> datetime:
+        """Primo istante (al minuto) strettamente successivo a dt."""
+        t = dt.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = t + timedelta(days=366 * 5)
+        while t <= limit:
+            if t.month not in self.months:
+                # primo giorno del mese successivo
+                t = (t.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+                continue
+            if not self._day_matches(t):
+                t = t.replace(hour=0, minute=0) + timedelta(days=1)
+                continue
+            if t.hour not in self.hours:
+                t = t.replace(minute=0) + timedelta(hours=1)
+                continue
+            if t.minute not in self.minutes:
+                t += timedelta(minutes=1)
+                continue
+            return t
+        raise CronError(f"nessuna esecuzione possibile per '{self.expr}'")
@@ -1,10 +1,18 @@
 # core/db.py
 from abc import ABC, abstractmethod
+from contextlib import contextmanager
 from enum import Enum
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+import keyword
+import logging
+import threading
+import time
 import traceback
 import mysql.connector
 import os
 
+logger = logging.getLogger(__name__)
+
 
 # ======================================================
 # 1️⃣ Eccezione custom (al posto di HTTPException)
@@ -26,6 +34,9 @@ def get_settings():
         API_MYSQL_USERNAME = os.getenv("API_MYSQL_USERNAME", "root")
         API_MYSQL_PASSWORD = os.getenv("API_MYSQL_PASSWORD", "")
         API_MYSQL_DB = os.getenv("API_MYSQL_DB", "plax")
+        # Pool di connessioni (MySQLPoolDb): dimensione e attesa massima se esaurito
+        API_MYSQL_POOL_SIZE = int(os.getenv("API_MYSQL_POOL_SIZE", "3"))
+        API_MYSQL_POOL_TIMEOUT = float(os.getenv("API_MYSQL_POOL_TIMEOUT", "30"))
     return Settings()
 
 
@@ -43,6 +54,13 @@ class DbConnection(Enum):
     DEFAULT = 1
 
 
+# formati riga di iter_query: dict (come execute_query), tuple, Row con __slots__
+ROW_DICT = "dict"
+ROW_TUPLE = "tuple"
+ROW_SLOTS = "row"
+ROW_FORMATS = (ROW_DICT, ROW_TUPLE, ROW_SLOTS)
+
+
 # ======================================================
 # 4️⃣ Classe astratta generica
 # ======================================================
@@ -59,6 +77,14 @@ class Db(ABC):
     def execute_query(self, sql, param, fetchall, query_type: QueryType):
         pass
 
+    @abstractmethod
+    def execute_many(self, sql, params_seq):
+        pass
+
+    @abstractmethod
+    def iter_query(self, sql, param=(), batch_size: int = 1000, row_format: str = "dict"):
+        pass
+
     @abstractmethod
     def close(self):
         pass
@@ -71,25 +97,75 @@ class Db(ABC):
     def rollback(self):
         pass
 
+    @abstractmethod
+    def transaction(self):
+        pass
+
 
 # ======================================================
 # 5️⃣ Context manager per usare "with DbManager(MySQLDb()) as db:"
 # ======================================================
 class DbManager:
-    def __init__(self, db_connection: Db):
-        self.db = db_connection
+    """
+    Apre la connessione all'ingresso e la chiude all'uscita.
+
+    - senza argomenti usa una connessione del pool (MySQLPoolDb)
+    - transaction=True: tutte le scritture del blocco vanno in un'unica transazione
+      (commit all'uscita, rollback in caso di errore)
+    """
+    def __init__(self, db_connection: Optional[Db] = None, transaction: bool = False):
+        self.db = db_connection if db_connection is not None else MySQLPoolDb()
+        self._tx = None
+        self._use_tx = transaction
 
     def __enter__(self):
         self.db.open()
+        if self._use_tx:
+            self._tx = self.db.transaction()
+            self._tx.__enter__()
         return self.db
 
     def __exit__(self, exc_type, exc_value, tb):
+        if self._tx is not None:
+            tx, self._tx = self._tx, None
+            try:
+                tx.__exit__(exc_type, exc_value, tb)
+            except Exception as e:
+                if exc_type is None:
+                    # COMMIT fallito: le scritture non ci sono, il chiamante deve saperlo
+                    logger.error("DbManager: commit fallito: %s", e)
+                    self.db.close()
+                    raise
+                logger.error("DbManager: rollback fallito: %s", e)
         if exc_type is not None:
             traceback.print_exception(exc_type, exc_value, tb)
         self.db.close()
         return True
 
 
+class _BorrowedDb:
+    """Context manager su una connessione già aperta da altri: non la chiude all'uscita."""
+    def __init__(self, db: Db):
+        self.db = db
+
+    def __enter__(self):
+        return self.db
+
+    def __exit__(self, exc_type, exc_value, tb):
+        return False
+
+
+def db_session(db: Optional[Db] = None):
+    """
+    Per le funzioni che accettano una sessione opzionale:
+    - `db` già aperto (es. passato da un job) -> lo riusa senza chiuderlo
+    - altrimenti -> DbManager con una connessione del pool
+    """
+    if db is not None:
+        return _BorrowedDb(db)
+    return DbManager(MySQLPoolDb())
+
+
 # ======================================================
 # 6️⃣ Implementazione MySQL
 # ======================================================
@@ -101,6 +177,9 @@ class MySQLDb(Db):
     db_name: str = None
     conn = None
     cursor = None
+    _in_transaction: bool = False
+    # LOAD DATA LOCAL INFILE (dwh_etl): va abilitato per connessione, lato client
+    allow_local_infile: bool = False
 
     def __init__(self, connection: DbConnection = DbConnection.DEFAULT):
         if connection == DbConnection.DEFAULT:
@@ -123,6 +202,7 @@ class MySQLDb(Db):
                 port=self.port,
                 database=self.db_name,
                 autocommit=False,
+                allow_local_infile=self.allow_local_infile,
             )
         except mysql.connector.Error as e:
             raise SchedulerDbException(f"Errore connessione MySQL: {e}")
@@ -142,14 +222,94 @@ class MySQLDb(Db):
                 result = self.cursor.fetchall() if fetchall else self.cursor.fetchone()
             elif query_type in [QueryType.INSERT, QueryType.UPDATE, QueryType.DELETE]:
                 self.cursor.execute(sql, param)
-                self.conn.commit()
+                if not self._in_transaction:
+                    self.conn.commit()
                 result = self.cursor.rowcount
         except mysql.connector.Error as e:
-            if query_type in [QueryType.INSERT, QueryType.UPDATE, QueryType.DELETE]:
+            # dentro transaction() il rollback lo decide il chiamante
+            if query_type in [QueryType.INSERT, QueryType.UPDATE, QueryType.DELETE] and not self._in_transaction:
                 self.conn.rollback()
             raise SchedulerDbException(f"Errore query MySQL: {e}")
         return result
 
+    def execute_many(self, sql, params_seq) -> int:
+        """
+        Stessa scrittura per più tuple di parametri in un solo round trip
+        (per gli INSERT ... VALUES il connector genera un INSERT multi-riga).
+        """
+        params_seq = list(params_seq or [])
+        if not params_seq:
+            return 0
+        try:
+            self.cursor.executemany(sql, params_seq)
+            if not self._in_transaction:
+                self.conn.commit()
+            return self.cursor.rowcount
+        except mysql.connector.Error as e:
+            if not self._in_transaction:
+                self.conn.rollback()
+            raise SchedulerDbException(f"Errore query MySQL: {e}")
+
+    def iter_query(self, sql, param=(), batch_size: int = 1000, row_format: str = ROW_DICT) -> Iterator[Any]:
+        """
+        Righe di una SELECT una alla volta, lette dal server a lotti di `batch_size`
+        con un cursore dedicato NON bufferizzato: in memoria c'è al più un lotto.
+
+        row_format: "dict" (come execute_query), "tuple" oppure "row" (oggetti con
+        __slots__: accesso r.colonna, r["colonna"], r.get("colonna")).
+
+        Finché il generatore è aperto la connessione è occupata dal risultato: niente
+        altre query sulla stessa connessione prima di averlo esaurito o chiuso.
+        """
+        if row_format not in ROW_FORMATS:
+            raise ValueError(f"row_format non valido: {row_format}")
+        batch_size = max(1, int(batch_size))
+        cur = self.conn.cursor(buffered=False)
+        try:
+            try:
+                cur.execute(sql, param)
+            except mysql.connector.Error as e:
+                raise SchedulerDbException(f"Errore query MySQL: {e}")
+            make = _row_maker(tuple(cur.column_names or ()), row_format)
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    return
+                for r in rows:
+                    yield make(r)
+        finally:
+            try:
+                # generatore abbandonato a metà: le righe non lette vanno scartate (a lotti)
+                # prima di chiudere, altrimenti la connessione resta con un risultato pendente
+                while cur.fetchmany(batch_size):
+                    pass
+            except Exception:
+                pass
+            cur.close()
+
+    # -------------------------
+    # Transazione esplicita
+    # -------------------------
+    @contextmanager
+    def transaction(self):
+        """
+        with db.transaction(): ... -> le scritture NON fanno commit una per una,
+        commit unico all'uscita, rollback se il blocco solleva un'eccezione.
+        Le transazioni annidate confluiscono in quella esterna.
+        """
+        if self._in_transaction:
+            yield self
+            return
+        self._in_transaction = True
+        try:
+            yield self
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        finally:
+            self._in_transaction = False
+
     # -------------------------
     # Commit / Rollback / Close
     # -------------------------
@@ -172,3 +332,264 @@ class MySQLDb(Db):
                 self.conn.close()
             except Exception:
                 pass
+
+
+# ======================================================
+# 7️⃣ Implementazione MySQL con pool di connessioni
+# ======================================================
+# dimensione massima di un pool (come il pool di mysql-connector)
+POOL_MAX_SIZE = 32
+
+
+class _ConnectionPool:
+    """
+    Pool di connessioni con le sole API pubbliche del connector (connect / is_connected /
+    reset_session / close): il pool conosce le connessioni inattive e quante ne sono
+    state create, quindi può chiuderle senza toccare interni di mysql-connector.
+    """
+
+    def __init__(self, size: int, **config: Any):
+        self.size = size
+        self._config = config
+        self._idle: List[Any] = []
+        self._created = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def get(self, timeout: float):
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while not self._idle and self._created >= self.size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise SchedulerDbException(f"Pool MySQL esaurito ({self.size} connessioni in uso)")
+                self._cond.wait(remaining)
+            if self._idle:
+                cnx = self._idle.pop()
+            else:
+                cnx = None
+                self._created += 1      # posto riservato: la connessione si apre fuori dal lock
+        if cnx is not None:
+            try:
+                # health check: la connessione può essere stata chiusa dal server
+                if cnx.is_connected():
+                    return cnx
+            except mysql.connector.Error:
+                pass
+            self._discard(cnx)
+            return self.get(max(0.0, deadline - time.monotonic()))
+        try:
+            return mysql.connector.connect(**self._config)
+        except mysql.connector.Error as e:
+            with self._cond:
+                self._created -= 1
+                self._cond.notify()
+            raise SchedulerDbException(f"Errore connessione MySQL: {e}")
+
+    def put(self, cnx) -> None:
+        if self._closed:   # pool chiuso (shutdown) mentre la connessione era in uso
+            self._discard(cnx)
+            return
+        try:
+            # come pool_reset_session: variabili e stato di sessione non passano al prossimo
+            cnx.reset_session()
+        except Exception:
+            self._discard(cnx)
+            return
+        with self._cond:
+            self._idle.append(cnx)
+            self._cond.notify()
+
+    def _discard(self, cnx) -> None:
+        try:
+            cnx.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._created -= 1
+            self._cond.notify()
+
+    def close_idle(self) -> None:
+        """Chiude le connessioni inattive; quelle in uso vengono chiuse alla restituzione."""
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._created -= len(idle)
+            self._cond.notify_all()
+        for cnx in idle:
+            try:
+                cnx.close()
+            except Exception:
+                pass
+
+
+_POOLS: Dict[tuple, _ConnectionPool] = {}
+_POOLS_LOCK = threading.Lock()
+
+
+class MySQLPoolDb(MySQLDb):
+    """
+    Come MySQLDb, ma le connessioni arrivano da un pool condiviso nel processo
+    (uno per host/porta/utente/db): close() restituisce la connessione al pool
+    invece di chiuderla, quindi niente handshake TCP/auth a ogni DbManager.
+
+    - API_MYSQL_POOL_SIZE: connessioni nel pool (max 32)
+    - API_MYSQL_POOL_TIMEOUT: secondi di attesa se il pool è tutto occupato
+    Health check: il pool verifica la connessione (is_connected) prima di
+    consegnarla e ne apre una nuova se il server l'ha chiusa.
+    """
+    pool_size: int = None
+    pool_timeout: float = None
+    _owner: Optional[_ConnectionPool] = None
+
+    def __init__(self, connection: DbConnection = DbConnection.DEFAULT, pool_size: Optional[int] = None):
+        super().__init__(connection)
+        settings = get_settings()
+        size = pool_size if pool_size is not None else settings.API_MYSQL_POOL_SIZE
+        self.pool_size = max(1, min(int(size), POOL_MAX_SIZE))
+        self.pool_timeout = settings.API_MYSQL_POOL_TIMEOUT
+
+    def _pool(self) -> _ConnectionPool:
+        key = (self.hostname, self.port, self.username, self.db_name)
+        with _POOLS_LOCK:
+            pool = _POOLS.get(key)
+            if pool is None:
+                pool = _ConnectionPool(
+                    self.pool_size,
+                    user=self.username,
+                    password=self.password,
+                    host=self.hostname,
+                    port=self.port,
+                    database=self.db_name,
+                    autocommit=False,
+                )
+                _POOLS[key] = pool
+        return pool
+
+    def get_connection(self):
+        self._owner = self._pool()
+        self.conn = self._owner.get(self.pool_timeout)
+
+    def close(self):
+        if self.conn and self._in_transaction:
+            # una transazione lasciata a metà non deve tornare nel pool
+            try:
+                self.conn.rollback()
+            except Exception:
+                pass
+        if self.cursor:
+            try:
+                self.cursor.close()
+            except Exception:
+                pass
+        if self.conn and self._owner is not None:
+            self._owner.put(self.conn)
+        self.conn = None
+        self.cursor = None
+
+
+def close_pools() -> None:
+    """Chiude tutte le connessioni inattive dei pool (fine processo / shutdown)."""
+    with _POOLS_LOCK:
+        pools = list(_POOLS.values())
+        _POOLS.clear()
+    for pool in pools:
+        pool.close_idle()
+
+
+# ======================================================
+# 8️⃣ Righe compatte + paginazione keyset
+# ======================================================
+class Row:
+    """
+    Base delle righe compatte: una classe per insieme di colonne, con __slots__
+    (niente dict per istanza). Compatibile in lettura con le righe dict.
+    """
+    __slots__ = ()
+    _columns: Tuple[str, ...] = ()
+    _attrs: Dict[str, str] = {}
+
+    def __init__(self, values: Sequence[Any]):
+        for attr, v in zip(self.__slots__, values):
+            setattr(self, attr, v)
+
+    def __getitem__(self, key: str) -> Any:
+        try:
+            return getattr(self, self._attrs[key])
+        except KeyError:
+            raise KeyError(key) from None
+
+    def get(self, key: str, default: Any = None) -> Any:
+        attr = self._attrs.get(key)
+        return getattr(self, attr) if attr is not None else default
+
+    def keys(self) -> Tuple[str, ...]:
+        return self._columns
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {c: self[c] for c in self._columns}
+
+    def __repr__(self) -> str:
+        return f"Row({self.as_dict()!r})"
+
+
+_ROW_TYPES: Dict[Tuple[str, ...], type] = {}
+_ROW_TYPES_LOCK = threading.Lock()
+
+
+def row_type(columns: Tuple[str, ...]) -> type:
+    """Classe Row per queste colonne (in cache). Nomi non validi come attributo -> _<posizione>."""
+    with _ROW_TYPES_LOCK:
+        cls = _ROW_TYPES.get(columns)
+        if cls is None:
+            attrs = [
+                c if c.isidentifier() and not keyword.iskeyword(c) and not c.startswith("_") else f"_{i}"
+                for i, c in enumerate(columns)
+            ]
+            cls = type("Row", (Row,), {
+                "__slots__": tuple(attrs),
+                "_columns": columns,
+                "_attrs": dict(zip(columns, attrs)),
+            })
+            _ROW_TYPES[columns] = cls
+    return cls
+
+
+def _row_maker(columns: Tuple[str, ...], row_format: str) -> Callable[[tuple], Any]:
+    if row_format == ROW_TUPLE:
+        return tuple
+    if row_format == ROW_SLOTS:
+        return row_type(columns)
+    return lambda r: dict(zip(columns, r))
+
+
+def iter_keyset(
+    db: Db,
+    page_sql: Callable[[bool], str],
+    params: Sequence[Any],
+    key: Callable[[Any], Tuple[Any, ...]],
+    *,
+    page_size: int = 500,
+    row_format: str = ROW_DICT,
+) -> Iterator[Any]:
+    """
+    Paginazione keyset ("seek"): ogni pagina è una query breve che riparte dalla chiave
+    dell'ultima riga letta (WHERE (a, b) < (%s, %s) ... LIMIT %s), senza OFFSET.
+
+    - page_sql(has_after): SQL della pagina, con i segnaposto della chiave se has_after
+    - params: parametri fissi; seguono quelli della chiave (se presente) e il LIMIT
+    - key(row): tupla ordinata della chiave (deve essere univoca, es. (done_at, id))
+
+    Ogni pagina viene letta per intero prima di essere restituita: tra una pagina e
+    l'altra la connessione è libera per altre query.
+    """
+    page_size = max(1, int(page_size))
+    after: Optional[Tuple[Any, ...]] = None
+    while True:
+        sql = page_sql(after is not None)
+        page = list(db.iter_query(sql, (*params, *(after or ()), page_size),
+                                  batch_size=page_size, row_format=row_format))
+        yield from page
+        if len(page) < page_size:
+            return
+        after = key(page[-1])
@@ -0,0 +1,205 @@
+# app/core/mail_dispatch.py
+# Invio email concorrente: il chiamante prepara i messaggi (producer), N worker li
+# inviano ognuno con la propria SmtpSession.
+#   - limite globale messaggi/secondo (token bucket condiviso tra i worker)
+#   - retry con backoff esponenziale sugli errori SMTP temporanei (4xx, disconnessioni, timeout)
+#   - i worker restano vivi tra un batch e l'altro (connessioni calde) fino a close()
+
+from __future__ import annotations
+
+import os
+import time
+import queue
+import random
+import logging
+import threading
+from dataclasses import dataclass
+from email.message import EmailMessage
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from app.core.mailer import SchedulerEmailException, SmtpSession
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class MailJob:
+    msg: EmailMessage
+    rcpts: List[str]
+    tag: Any = None          # dato del chiamante, restituito nel risultato (es. righe da loggare)
+
+
+@dataclass
+class MailResult:
+    job: MailJob
+    ok: bool
+    attempts: int
+    error: Optional[str] = None
+    transient: bool = False  # l'ultimo errore era temporaneo (ha senso ritentare più tardi)
+
+
+class RateLimiter:
+    """Token bucket thread-safe: al massimo `rate` acquire() al secondo. rate <= 0 => nessun limite."""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = float(rate)
+        self.capacity = max(1, int(burst))
+        self._tokens = float(self.capacity)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class _Batch:
+    """Raccoglie i risultati di un send_batch nell'ordine di invio."""
+
+    def __init__(self):
+        self.results: Dict[int, MailResult] = {}
+        self.expected = 0
+        self.closed = False
+        self._cond = threading.Condition()
+
+    def add(self, index: int, result: MailResult) -> None:
+        with self._cond:
+            self.results[index] = result
+            self._cond.notify_all()
+
+    def close(self, expected: int) -> None:
+        with self._cond:
+            self.expected = expected
+            self.closed = True
+            self._cond.notify_all()
+
+    def wait(self) -> List[MailResult]:
+        with self._cond:
+            self._cond.wait_for(lambda: self.closed and len(self.results) >= self.expected)
+            return [self.results[i] for i in range(self.expected)]
+
+
+class MailDispatcher:
+    """
+    Pool di worker SMTP.
+
+        with MailDispatcher() as dispatcher:
+            results = dispatcher.send_batch(jobs)   # jobs può essere un generatore
+
+    Default da env: SMTP_WORKERS (4), SMTP_RATE_PER_SEC (0 = nessun limite),
+    SMTP_RETRIES (3 tentativi oltre il primo), SMTP_RETRY_BACKOFF (2 secondi, raddoppia a ogni tentativo).
+    """
+
+    def __init__(
+        self,
+        workers: Optional[int] = None,
+        rate_per_sec: Optional[float] = None,
+        retries: Optional[int] = None,
+        backoff_sec: Optional[float] = None,
+        session_factory: Callable[[], SmtpSession] = SmtpSession,
+    ):
+        if workers is None:
+            workers = int(os.getenv("SMTP_WORKERS", "4"))
+        if rate_per_sec is None:
+            rate_per_sec = float(os.getenv("SMTP_RATE_PER_SEC", "0"))
+        if retries is None:
+            retries = int(os.getenv("SMTP_RETRIES", "3"))
+        if backoff_sec is None:
+            backoff_sec = float(os.getenv("SMTP_RETRY_BACKOFF", "2"))
+
+        self.workers = max(1, int(workers))
+        self.retries = max(0, int(retries))
+        self.backoff_sec = max(0.0, float(backoff_sec))
+        self._limiter = RateLimiter(rate_per_sec)
+        self._session_factory = session_factory
+        self._queue: "queue.Queue" = queue.Queue(maxsize=self.workers * 4)
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> "MailDispatcher":
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+        return False
+
+    # ---------------------------
+    # Worker
+    # ---------------------------
+    def _ensure_started(self) -> None:
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                t = threading.Thread(target=self._worker, name=f"smtp-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def _worker(self) -> None:
+        session = self._session_factory()
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    break
+                index, job, batch = item
+                batch.add(index, self._deliver(session, job))
+        finally:
+            session.close()
+
+    def _deliver(self, session: SmtpSession, job: MailJob) -> MailResult:
+        attempt = 0
+        while True:
+            attempt += 1
+            self._limiter.acquire()
+            try:
+                session.send(job.msg, job.rcpts)
+                return MailResult(job, True, attempt)
+            except SchedulerEmailException as ex:
+                if not ex.transient or attempt > self.retries:
+                    logger.warning("Invio a %s fallito (tentativo %s): %s", ", ".join(job.rcpts), attempt, ex)
+                    return MailResult(job, False, attempt, str(ex), transient=ex.transient)
+                delay = self.backoff_sec * (2 ** (attempt - 1))
+                delay += random.uniform(0, delay / 4)
+                logger.info("Invio a %s: errore temporaneo (%s), nuovo tentativo tra %.1fs",
+                            ", ".join(job.rcpts), ex, delay)
+                time.sleep(delay)
+            except Exception as ex:
+                logger.exception("Invio a %s fallito", ", ".join(job.rcpts))
+                return MailResult(job, False, attempt, str(ex))
+
+    # ---------------------------
+    # API
+    # ---------------------------
+    def send_batch(self, jobs: Iterable[MailJob]) -> List[MailResult]:
+        """
+        Invia tutti i job e attende l'esito. I job vengono consumati man mano:
+        con un generatore la preparazione dei messaggi si sovrappone agli invii.
+        Ritorna un MailResult per job, nello stesso ordine.
+        """
+        self._ensure_started()
+        batch = _Batch()
+        n = 0
+        for job in jobs:
+            self._queue.put((n, job, batch))
+            n += 1
+        batch.close(n)
+        return batch.wait()
+
+    def close(self) -> None:
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            self._queue.put(None)
+        for t in threads:
+            t.join()
@@ -4,13 +4,29 @@ from __future__ import annotations
 import os
 import smtplib
 import mimetypes
-from typing import Iterable, Optional, Sequence
+from typing import Iterable, List, Optional, Sequence, Tuple
 from email.message import EmailMessage
 
 
 class SchedulerEmailException(Exception):
     """Errore generico di invio email nello scheduler."""
 
+    def __init__(self, message: str = "", *, transient: bool = False):
+        super().__init__(message)
+        # True se l'errore è temporaneo (4xx, disconnessione, timeout): ha senso ritentare
+        self.transient = transient
+
+
+def _is_transient(ex: Exception) -> bool:
+    if isinstance(ex, smtplib.SMTPServerDisconnected):
+        return True
+    if isinstance(ex, smtplib.SMTPRecipientsRefused):
+        codes = [code for code, _ in ex.recipients.values()]
+        return bool(codes) and all(400 <= code < 500 for code in codes)
+    if isinstance(ex, smtplib.SMTPResponseException):
+        return 400 <= ex.smtp_code < 500
+    return isinstance(ex, OSError)
+
 
 def _env_bool(name: str, default: bool = False) -> bool:
     val = os.getenv(name)
@@ -33,7 +49,15 @@ def _get_cfg():
     return Cfg()
 
 
-_CFG = _get_cfg()
+_CFG = None
+
+
+def _cfg():
+    """Configurazione SMTP letta al primo uso (non all'import: .env può essere caricato dopo)."""
+    global _CFG
+    if _CFG is None:
+        _CFG = _get_cfg()
+    return _CFG
 
 
 def _flatten(items: Optional[Iterable[str]]) -> list[str]:
@@ -79,7 +103,7 @@ def _attach_files(msg: EmailMessage, attachments: Optional[Sequence[str]]):
             raise SchedulerEmailException(f"Errore allegando '{path}': {ex}")
 
 
-def send_email(
+def build_message(
     subject: str,
     html: str,
     to: Iterable[str],
@@ -89,12 +113,12 @@ def send_email(
     bcc: Optional[Iterable[str]] = None,
     reply_to: Optional[str] = None,
     attachments: Optional[Sequence[str]] = None,
-) -> int:
+) -> Tuple[EmailMessage, List[str]]:
     """
-    Invia una email HTML (con fallback testo) usando la semantica SMTP_* definita nell'ambiente.
+    Costruisce il messaggio (HTML + fallback testo, allegati) senza inviarlo.
 
-    Ritorna il numero totale di destinatari (To+Cc+Bcc) a cui si è tentato l'invio.
-    Lancia SchedulerEmailException in caso di errore.
+    Ritorna (messaggio, destinatari To+Cc+Bcc).
+    Lancia SchedulerEmailException se mancano i destinatari o un allegato.
     """
     to_list = _flatten(to)
     cc_list = _flatten(cc)
@@ -107,10 +131,11 @@ def send_email(
     msg["Subject"] = subject
 
     # Mittente: "Nome <email>" se SMTP_SENDER_NAME presente, altrimenti solo email
-    if _CFG.SMTP_SENDER_NAME:
-        msg["From"] = f"{_CFG.SMTP_SENDER_NAME} <{_CFG.SMTP_FROM}>"
+    cfg = _cfg()
+    if cfg.SMTP_SENDER_NAME:
+        msg["From"] = f"{cfg.SMTP_SENDER_NAME} <{cfg.SMTP_FROM}>"
     else:
-        msg["From"] = _CFG.SMTP_FROM
+        msg["From"] = cfg.SMTP_FROM
 
     if to_list:
         msg["To"] = ", ".join(to_list)
@@ -127,23 +152,127 @@ def send_email(
     # Allegati (opzionali)
     _attach_files(msg, attachments)
 
-    all_rcpts = to_list + cc_list + bcc_list
+    return msg, to_list + cc_list + bcc_list
+
 
-    try:
+class SmtpSession:
+    """
+    Una connessione SMTP (STARTTLS + login) riusata per più messaggi.
+
+        with SmtpSession() as smtp:
+            for ...:
+                send_email(..., session=smtp)
+
+    - si connette al primo invio (nessun costo se non si invia nulla)
+    - dopo SMTP_MAX_PER_SESSION messaggi riapre la connessione (limite per sessione del relay)
+    - se il server chiude la connessione (disconnessione / 421) si riconnette e
+      ritenta UNA volta lo stesso messaggio
+    """
+
+    def __init__(self, max_messages: Optional[int] = None):
+        if max_messages is None:
+            max_messages = int(os.getenv("SMTP_MAX_PER_SESSION", "100"))
+        self.max_messages = max(1, int(max_messages))
+        self.connections = 0      # connessioni aperte (diagnostica)
+        self.sent = 0             # messaggi inviati in totale
+        self._server: Optional[smtplib.SMTP] = None
+        self._sent_in_session = 0
+
+    def __enter__(self) -> "SmtpSession":
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+        return False
+
+    def _connect(self) -> None:
+        self.close()
         # Connessione semplice; STARTTLS se SMTP_TLS=true
-        server = smtplib.SMTP(_CFG.SMTP_HOST, _CFG.SMTP_PORT, timeout=_CFG.SMTP_TIMEOUT)
-        with server as s:
-            if _CFG.SMTP_TLS:
-                s.starttls()
+        cfg = _cfg()
+        server = smtplib.SMTP(cfg.SMTP_HOST, cfg.SMTP_PORT, timeout=cfg.SMTP_TIMEOUT)
+        try:
+            if cfg.SMTP_TLS:
+                server.starttls()
 
-            if _CFG.SMTP_USER and _CFG.SMTP_PASSWORD:
-                s.login(_CFG.SMTP_USER, _CFG.SMTP_PASSWORD)
+            if cfg.SMTP_USER and cfg.SMTP_PASSWORD:
+                server.login(cfg.SMTP_USER, cfg.SMTP_PASSWORD)
+        except Exception:
+            server.close()
+            raise
+        self._server = server
+        self._sent_in_session = 0
+        self.connections += 1
 
-            s.send_message(msg, to_addrs=all_rcpts)
+    def close(self) -> None:
+        server, self._server = self._server, None
+        if server is None:
+            return
+        try:
+            server.quit()
+        except Exception:
+            try:
+                server.close()
+            except Exception:
+                pass
 
-        return len(all_rcpts)
+    def _send_once(self, msg: EmailMessage, rcpts: List[str]) -> None:
+        if self._server is None or self._sent_in_session >= self.max_messages:
+            self._connect()
+        self._server.send_message(msg, to_addrs=rcpts)
+        self._sent_in_session += 1
+        self.sent += 1
 
-    except smtplib.SMTPException as ex:
-        raise SchedulerEmailException(f"Errore SMTP: {ex}")
-    except OSError as ex:
-        raise SchedulerEmailException(f"Errore di rete/connessione: {ex}")
+    def send(self, msg: EmailMessage, rcpts: List[str]) -> int:
+        """Invia un messaggio già costruito. Lancia SchedulerEmailException in caso di errore."""
+        try:
+            try:
+                self._send_once(msg, rcpts)
+            except smtplib.SMTPServerDisconnected:
+                self._server = None
+                self._send_once(msg, rcpts)
+            except smtplib.SMTPResponseException as ex:
+                if ex.smtp_code != 421:
+                    raise
+                # 421: il server chiude la sessione (limite messaggi, idle, ...)
+                self.close()
+                self._send_once(msg, rcpts)
+            return len(rcpts)
+
+        except smtplib.SMTPException as ex:
+            if isinstance(ex, smtplib.SMTPServerDisconnected):
+                self._server = None
+            raise SchedulerEmailException(f"Errore SMTP: {ex}", transient=_is_transient(ex)) from ex
+        except OSError as ex:
+            self.close()
+            raise SchedulerEmailException(f"Errore di rete/connessione: {ex}", transient=True) from ex
+
+
+def send_email(
+    subject: str,
+    html: str,
+    to: Iterable[str],
+    *,
+    text: Optional[str] = None,
+    cc: Optional[Iterable[str]] = None,
+    bcc: Optional[Iterable[str]] = None,
+    reply_to: Optional[str] = None,
+    attachments: Optional[Sequence[str]] = None,
+    session: Optional[SmtpSession] = None,
+) -> int:
+    """
+    Invia una email HTML (con fallback testo) usando la semantica SMTP_* definita nell'ambiente.
+
+    Con `session` riusa la connessione già autenticata di una SmtpSession,
+    altrimenti apre (e chiude) una connessione solo per questo messaggio.
+
+    Ritorna il numero totale di destinatari (To+Cc+Bcc) a cui si è tentato l'invio.
+    Lancia SchedulerEmailException in caso di errore.
+    """
+    msg, all_rcpts = build_message(
+        subject, html, to,
+        text=text, cc=cc, bcc=bcc, reply_to=reply_to, attachments=attachments,
+    )
+    if session is not None:
+        return session.send(msg, all_rcpts)
+    with SmtpSession() as s:
+        return s.send(msg, all_rcpts)
@@ -0,0 +1,173 @@
+# app/jobs/dwh_bulk.py
+# Profilo di caricamento "bulk" per il refresh completo (dwh-refresh --profile bulk).
+#
+# Con il profilo standard fact_docrig / fact_magmov nascono con tutti gli indici secondari
+# e le FOREIGN KEY: l'INSERT ... SELECT aggiorna ogni indice e controlla ogni FK riga per
+# riga. Con il profilo bulk lo script viene riscritto prima dell'esecuzione:
+#   1) SET SESSION foreign_key_checks = 0 / unique_checks = 0 su ogni connessione (prelude)
+#   2) CREATE TABLE dei fatti con la sola PRIMARY KEY
+#   3) dopo l'INSERT del fatto, un unico ALTER TABLE che aggiunge indici e FK rimandati
+#      (stesso blocco del fatto: gli aggregati che leggono la tabella partono dopo)
+#   4) a fine caricamento, controllo set-based delle righe orfane per ogni FK
+#      (le FK aggiunte con i controlli disattivati non verificano i dati esistenti)
+# Lo schema finale è identico a quello del profilo standard.
+# I tempi vengono sommati per fase: base (dimensioni, aggregati, viste), facts, indexes,
+# integrity.
+
+from __future__ import annotations
+
+import re
+import logging
+import threading
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Tuple
+
+from app.core.db import Db, QueryType
+from app.sql.query.dwh_queries import QuerySqlDwhMYSQL as Q
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DEFAULT = "default"
+PROFILE_BULK = "bulk"
+PROFILES = (PROFILE_DEFAULT, PROFILE_BULK)
+
+FACT_TABLES = ("fact_docrig", "fact_magmov")
+
+PHASE_BASE = "base"
+PHASE_FACTS = "facts"
+PHASE_INDEXES = "indexes"
+PHASE_INTEGRITY = "integrity"
+
+SESSION_SETTINGS = [
+    "SET SESSION foreign_key_checks = 0",
+    "SET SESSION unique_checks = 0",
+]
+
+_FACTS = "|".join(FACT_TABLES)
+_CREATE_FACT = re.compile(rf"^CREATE\s+TABLE\s+`?({_FACTS})`?\s*\(", re.I)
+_INSERT_FACT = re.compile(rf"^INSERT\s+INTO\s+`?({_FACTS})`?\b", re.I)
+_ALTER_FACT = re.compile(rf"^ALTER\s+TABLE\s+`?({_FACTS})`?\s+ADD\b", re.I)
+_SECONDARY_KEY = re.compile(r"^(?:UNIQUE\s+|FULLTEXT\s+|SPATIAL\s+)?(?:KEY|INDEX)\b", re.I)
+_FOREIGN_KEY = re.compile(
+    r"^CONSTRAINT\s+`?(\w+)`?\s+FOREIGN\s+KEY\s*\(\s*`?(\w+)`?\s*\)\s+"
+    r"REFERENCES\s+`?(\w+)`?\s*\(\s*`?(\w+)`?\s*\)",
+    re.I,
+)
+
+ForeignKey = Tuple[str, str, str, str]  # (nome, colonna, tabella riferita, colonna riferita)
+
+
+def _split_definitions(body: str) -> List[str]:
+    """Divide il corpo di un CREATE TABLE sulle virgole di primo livello (non in DECIMAL(18,6))."""
+    parts: List[str] = []
+    depth = 0
+    start = 0
+    for i, ch in enumerate(body):
+        if ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+        elif ch == "," and depth == 0:
+            parts.append(body[start:i].strip())
+            start = i + 1
+    parts.append(body[start:].strip())
+    return [p for p in parts if p]
+
+
+def defer_keys(create_sql: str) -> Tuple[str, List[str], List[ForeignKey]]:
+    """
+    Toglie da un CREATE TABLE indici secondari e FOREIGN KEY.
+    Ritorna (CREATE con la sola PK, definizioni rimandate, FK come tuple).
+    """
+    open_at = create_sql.index("(")
+    close_at = create_sql.rindex(")")
+    kept: List[str] = []
+    deferred: List[str] = []
+    fks: List[ForeignKey] = []
+    for d in _split_definitions(create_sql[open_at + 1:close_at]):
+        one_line = " ".join(d.split())
+        fk = _FOREIGN_KEY.match(one_line)
+        if fk:
+            fks.append(fk.groups())
+            deferred.append(one_line)
+        elif _SECONDARY_KEY.match(one_line):
+            deferred.append(one_line)
+        else:
+            kept.append(d)
+    create = create_sql[:open_at + 1] + "\n  " + ",\n  ".join(kept) + "\n" + create_sql[close_at:]
+    return create, deferred, fks
+
+
+def prepare(stmts: List[str]) -> Tuple[List[str], Dict[str, List[ForeignKey]]]:
+    """Riscrive lo script completo per il profilo bulk. Ritorna (statement, FK rimandate per fatto)."""
+    out: List[str] = list(SESSION_SETTINGS)
+    pending: Dict[str, List[str]] = {}
+    fks: Dict[str, List[ForeignKey]] = {}
+    for stmt in stmts:
+        m = _CREATE_FACT.match(stmt)
+        if m:
+            table = m.group(1).lower()
+            stmt, pending[table], fks[table] = defer_keys(stmt)
+            out.append(stmt)
+            continue
+        out.append(stmt)
+        m = _INSERT_FACT.match(stmt)
+        if m and pending.get(m.group(1).lower()):
+            table = m.group(1).lower()
+            out.append(Q.add_deferred_keys_sql(table, pending.pop(table)))
+    if pending:
+        raise ValueError(f"Profilo bulk: INSERT non trovato per {', '.join(sorted(pending))}")
+    return out, fks
+
+
+def phase_of(stmt: str) -> str:
+    if _INSERT_FACT.match(stmt):
+        return PHASE_FACTS
+    if _ALTER_FACT.match(stmt):
+        return PHASE_INDEXES
+    return PHASE_BASE
+
+
+class PhaseTimer:
+    """
+    Esecutore per execute_blocks che somma il tempo degli statement per fase.
+    Con più job i tempi sono la somma sulle connessioni (non il tempo a parete).
+    """
+
+    def __init__(self, execute: Callable[[Db, str], Any]):
+        self._execute = execute
+        self._lock = threading.Lock()
+        self.seconds: Dict[str, float] = {PHASE_BASE: 0.0, PHASE_FACTS: 0.0, PHASE_INDEXES: 0.0}
+
+    def __call__(self, db: Db, stmt: str) -> Any:
+        t0 = datetime.now()
+        try:
+            return self._execute(db, stmt)
+        finally:
+            elapsed = (datetime.now() - t0).total_seconds()
+            with self._lock:
+                self.seconds[phase_of(stmt)] += elapsed
+
+    def add(self, phase: str, seconds: float) -> None:
+        with self._lock:
+            self.seconds[phase] = self.seconds.get(phase, 0.0) + seconds
+
+    def report(self) -> Dict[str, float]:
+        return {k: round(v, 3) for k, v in self.seconds.items()}
+
+
+def check_integrity(db: Db, schema: str, fks: Dict[str, List[ForeignKey]]) -> Dict[str, Dict[str, int]]:
+    """Righe orfane per fatto e per FK (una scansione per tabella dei fatti)."""
+    out: Dict[str, Dict[str, int]] = {}
+    for table, table_fks in fks.items():
+        if not table_fks:
+            continue
+        row = db.execute_query(Q.orphans_sql(schema, table, table_fks), None,
+                               fetchall=False, query_type=QueryType.GET) or {}
+        out[table] = {name: int(row.get(name) or 0) for name, *_ in table_fks}
+        bad = {k: v for k, v in out[table].items() if v}
+        if bad:
+            logger.error("DWH_BULK %s.%s: righe orfane %s", schema, table, bad)
+        else:
+            logger.info("DWH_BULK %s.%s: integrità referenziale ok (%s FK)", schema, table, len(table_fks))
+    return out
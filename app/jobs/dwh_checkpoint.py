@@ -0,0 +1,114 @@
+# app/jobs/dwh_checkpoint.py
+# Checkpoint dei blocchi del refresh per riprendere un run interrotto (dwh-refresh --resume).
+#
+# Ogni blocco completato (vedi dwh_graph) viene registrato in dwh_refresh_checkpoints (schema
+# applicativo: il DROP DATABASE di dwh non lo tocca) con l'hash dello script preparato (gli
+# statement davvero eseguiti: modalità, profilo e riscritture inclusi) e l'hash di ogni suo
+# statement. Con --resume i blocchi registrati per lo stesso script e con gli stessi statement
+# non vengono rieseguiti (nemmeno il DROP DATABASE iniziale): si riparte dal primo blocco
+# incompleto, insieme agli altri blocchi falliti o mai partiti.
+# Un run senza --resume cancella i checkpoint del proprio script (stessa modalità) e parte
+# da zero; un run riuscito cancella i propri. I checkpoint degli altri script restano: un
+# incrementale che gira nel frattempo non impedisce di riprendere un full interrotto.
+# Quelli più vecchi di DWH_CHECKPOINT_KEEP_DAYS giorni (default 30) vengono eliminati.
+# Tra il run interrotto e la ripresa il DWH non va toccato da altri refresh.
+# I checkpoint sono un aiuto: se non si riesce a scriverli il refresh prosegue (con un warning).
+
+from __future__ import annotations
+
+import os
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from app.core.db import Db, MySQLDb, QueryType
+from app.jobs.dwh_graph import SqlBlock
+from app.jobs.dwh_history import step_hash
+from app.sql.query.dwh_queries import QuerySqlDwhMYSQL as Q
+
+logger = logging.getLogger(__name__)
+
+
+def script_hash(stmts: List[str]) -> str:
+    return step_hash(";\n".join(stmts))
+
+
+class Checkpoints:
+    """Blocchi completati di uno script: lettura per la ripresa e registrazione durante il run."""
+
+    def __init__(self, blocks: List[SqlBlock], stmts: List[str], mode: str):
+        self.blocks = blocks
+        self.mode = mode
+        self.script_hash = script_hash(stmts)
+        self.stmt_hashes: Dict[int, List[str]] = {b.index: [step_hash(s) for s in b.statements] for b in blocks}
+        self._db: Optional[Db] = None
+
+    def _conn(self) -> Db:
+        if self._db is None:
+            db = MySQLDb()
+            db.open()
+            try:
+                db.execute_query(Q.checkpoint_ddl(), None, fetchall=False, query_type=QueryType.INSERT)
+            except Exception:
+                db.close()
+                raise
+            self._db = db
+        return self._db
+
+    def close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def load(self) -> Dict[int, str]:
+        """Blocchi già completati per questo script: indice -> motivo (loggato)."""
+        db = self._conn()
+        rows = db.execute_query(Q.checkpoints_sql(), (self.script_hash,), fetchall=True, query_type=QueryType.GET) or []
+        recorded: Dict[int, Dict[int, str]] = {}
+        when: Dict[int, datetime] = {}
+        for r in rows:
+            recorded.setdefault(r["block_no"], {})[r["stmt_no"]] = r["stmt_hash"]
+            when[r["block_no"]] = max(when.get(r["block_no"], r["completed_at"]), r["completed_at"])
+
+        if not recorded:
+            others = db.execute_query(Q.checkpoint_scripts_sql(), (self.mode,), fetchall=True,
+                                      query_type=QueryType.GET) or []
+            for o in others:
+                logger.warning("DWH_CHECKPOINT: %s blocchi di uno script diverso (%s, mode=%s, ultimo %s) "
+                               "non riutilizzabili", o["blocks"], o["script_hash"], o["mode"], o["last_at"])
+            logger.info("DWH_CHECKPOINT: nessun blocco completato per lo script %s, ripresa da zero", self.script_hash)
+            return {}
+
+        done: Dict[int, str] = {}
+        for b in self.blocks:
+            hashes = self.stmt_hashes[b.index]
+            if recorded.get(b.index) == dict(enumerate(hashes, 1)):
+                done[b.index] = f"completato il {when[b.index]}"
+        first = next((b.name for b in self.blocks if b.index not in done), None)
+        logger.info("DWH_CHECKPOINT ripresa: %s/%s blocchi già completati, riparto da %s",
+                    len(done), len(self.blocks), first or "(nessuno: tutti completati)")
+        return done
+
+    def reset(self) -> None:
+        """Run da zero: i checkpoint precedenti di questo script non valgono più."""
+        db = self._conn()
+        db.execute_query(Q.delete_checkpoints_sql(), (self.script_hash, self.mode),
+                         fetchall=False, query_type=QueryType.DELETE)
+        keep_days = max(1, int(os.getenv("DWH_CHECKPOINT_KEEP_DAYS", "30")))
+        db.execute_query(Q.prune_checkpoints_sql(), (keep_days,), fetchall=False, query_type=QueryType.DELETE)
+
+    def mark(self, block: SqlBlock) -> None:
+        """Registra un blocco riuscito (on_complete di execute_blocks)."""
+        now = datetime.now().replace(microsecond=0)
+        rows = [(self.script_hash, block.index, i, h, block.name, self.mode, now)
+                for i, h in enumerate(self.stmt_hashes[block.index], 1)]
+        try:
+            self._conn().execute_many(Q.upsert_checkpoint_sql(), rows)
+        except Exception as e:   # connessione persa: si riapre al prossimo blocco
+            logger.warning("DWH_CHECKPOINT: blocco %s non registrato: %s", block.name, e)
+            self.close()
+
+    def clear(self) -> None:
+        """Run riuscito: niente da riprendere per questo script."""
+        self._conn().execute_query(Q.delete_checkpoints_sql(), (self.script_hash, self.mode),
+                                   fetchall=False, query_type=QueryType.DELETE)
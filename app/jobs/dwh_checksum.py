@@ -0,0 +1,217 @@
+# app/jobs/dwh_checksum.py
+# Refresh completo che salta le dimensioni con sorgenti invariate (dwh-refresh --skip-unchanged).
+#
+# Per ogni tabella anagrafica di fox_staging (SOURCE_TABLES) si calcola un'impronta:
+# CHECKSUM TABLE, numero di righe e massimo della colonna di ultimo aggiornamento (se esiste).
+# Per ogni blocco dello script (vedi dwh_graph) dwh_refresh_block_state (schema applicativo)
+# conserva l'hash del suo SQL e le impronte delle sorgenti lette all'ultima costruzione
+# riuscita. Un blocco viene saltato se:
+#   - legge solo sorgenti tracciate (o nessuna, es. dim_date) e le impronte sono uguali
+#   - il suo SQL non è cambiato e la tabella/vista esiste ancora in dwh
+#   - nessun blocco da cui dipende viene ricostruito (i fatti leggono docrig/magmov, che non
+#     sono tracciate: fatti, aggregati, viste e watermark vengono sempre ricostruiti)
+# doctes NON è tracciata: non ha colonna di ultimo aggiornamento né un id crescente, e il
+# CHECKSUM TABLE di una delle tabelle più grandi di staging costerebbe quanto ricostruire
+# dim_tipodoc (l'unico blocco che la legge), che quindi viene sempre ricostruita.
+# maggrp/magcls sono piccole: per loro basta CHECKSUM TABLE + righe.
+# Lo script completo viene eseguito senza DROP DATABASE (CREATE DATABASE IF NOT EXISTS): le
+# tabelle saltate restano com'erano. I DROP TABLE girano con foreign_key_checks=0, perché le
+# FK dei fatti ancora presenti impedirebbero di ricreare una dimensione modificata (i fatti
+# dipendono dalle dimensioni e vengono comunque ricostruiti dopo).
+# Una dimensione è funzione deterministica di SQL + dati sorgente: a impronte uguali il
+# contenuto ricostruito sarebbe lo stesso, anche dopo refresh completi senza --skip-unchanged.
+
+from __future__ import annotations
+
+import os
+import re
+import json
+import hashlib
+import logging
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from app.core.db import Db, MySQLDb, QueryType, SchedulerDbException
+from app.jobs.dwh_graph import SqlBlock
+from app.sql.query.dwh_queries import QuerySqlDwhMYSQL as Q
+
+logger = logging.getLogger(__name__)
+
+# sorgente -> colonna di ultimo aggiornamento (None: solo checksum e righe)
+SOURCE_TABLES: Dict[str, Optional[str]] = {
+    "fox_staging.anagrafe": "DTULTAGG",
+    "fox_staging.magart": "TIMESTAMP",
+    "fox_staging.magana": "timestamp_row",
+    "fox_staging.caumag": "timestamp_row",
+    "fox_staging.lotti": "timestamp_row",
+    "fox_staging.maggrp": None,
+    "fox_staging.magcls": None,
+}
+
+_DROP_DATABASE = re.compile(r"^DROP\s+DATABASE\b", re.I)
+_CREATE_DATABASE = re.compile(r"^CREATE\s+DATABASE\s+(?!IF\s+NOT\s+EXISTS\b)", re.I)
+_DROP_TABLE = re.compile(r"^DROP\s+TABLE\b", re.I)
+
+
+def enabled(value: Optional[bool]) -> bool:
+    """--skip-unchanged: argomento > DWH_REFRESH_SKIP_UNCHANGED > no."""
+    if value is not None:
+        return bool(value)
+    return os.getenv("DWH_REFRESH_SKIP_UNCHANGED", "0").strip().lower() in ("1", "true", "yes", "on")
+
+
+def prepare(stmts: List[str]) -> List[str]:
+    """Toglie il DROP DATABASE iniziale: le tabelle saltate devono sopravvivere al refresh."""
+    out: List[str] = []
+    for stmt in stmts:
+        if _DROP_DATABASE.match(stmt):
+            continue
+        out.append(_CREATE_DATABASE.sub("CREATE DATABASE IF NOT EXISTS ", stmt, count=1))
+    return out
+
+
+def without_fk_checks(execute: Callable[[Db, str], Any]) -> Callable[[Db, str], Any]:
+    """Esecutore che lancia i DROP TABLE con foreign_key_checks=0 (vedi intestazione)."""
+    def run(db: Db, stmt: str) -> Any:
+        if not _DROP_TABLE.match(stmt):
+            return execute(db, stmt)
+        # ripristina il valore di sessione (il profilo bulk le tiene già disattivate)
+        db.execute_query("SET @dwh_fk_checks := @@SESSION.foreign_key_checks, SESSION foreign_key_checks = 0",
+                         None, fetchall=False, query_type=QueryType.GET)
+        try:
+            return execute(db, stmt)
+        finally:
+            db.execute_query("SET SESSION foreign_key_checks = @dwh_fk_checks",
+                             None, fetchall=False, query_type=QueryType.GET)
+    return run
+
+
+def _hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+
+def block_sql_hash(block: SqlBlock) -> str:
+    return _hash("\n".join(" ".join(s.split()) for s in block.prelude + block.statements))
+
+
+def fingerprint(db: Db, table: str) -> Dict[str, Any]:
+    """Impronta di una sorgente: checksum, righe, ultimo aggiornamento."""
+    row = db.execute_query(Q.checksum_table_sql(table), None, fetchall=False, query_type=QueryType.GET) or {}
+    stats = db.execute_query(Q.source_stats_sql(table, SOURCE_TABLES.get(table)), None,
+                             fetchall=False, query_type=QueryType.GET) or {}
+    stamp = stats.get("max_stamp")
+    return {
+        "checksum": row.get("Checksum"),
+        "rows": int(stats.get("row_count") or 0),
+        "max_stamp": stamp.isoformat() if hasattr(stamp, "isoformat") else stamp,
+    }
+
+
+def _inputs_hash(inputs: Dict[str, Dict[str, Any]]) -> str:
+    return _hash(json.dumps(inputs, sort_keys=True, default=str))
+
+
+def _describe_changes(old: Dict[str, Dict[str, Any]], new: Dict[str, Dict[str, Any]]) -> str:
+    parts = []
+    for table in sorted(new):
+        a, b = old.get(table), new[table]
+        if a is None:
+            parts.append(f"{table} nuova sorgente")
+            continue
+        changed = [f"{k} {a.get(k)} -> {b.get(k)}" for k in ("rows", "max_stamp", "checksum") if a.get(k) != b.get(k)]
+        if changed:
+            parts.append(f"{table} ({', '.join(changed)})")
+    return "sorgenti modificate: " + ("; ".join(parts) or "insieme delle sorgenti cambiato")
+
+
+class ChangePlan:
+    """Decisione salta/ricostruisci per ogni blocco, con il motivo."""
+
+    def __init__(self, blocks: List[SqlBlock]):
+        self.blocks = blocks
+        self.skip: Dict[int, str] = {}
+        self.rebuild: Dict[int, str] = {}
+        self.inputs: Dict[int, Dict[str, Dict[str, Any]]] = {}
+        self.sql_hashes: Dict[int, str] = {b.index: block_sql_hash(b) for b in blocks}
+
+    def summary(self) -> Dict[str, Dict[str, str]]:
+        names = {b.index: b.name for b in self.blocks}
+        return {
+            "skipped": {names[i]: r for i, r in sorted(self.skip.items())},
+            "rebuilt": {names[i]: r for i, r in sorted(self.rebuild.items())},
+        }
+
+
+def _load_states(db: Db) -> Dict[str, dict]:
+    try:
+        rows = db.execute_query(Q.block_states_sql(), None, fetchall=True, query_type=QueryType.GET) or []
+    except SchedulerDbException as e:   # tabella non ancora creata: primo --skip-unchanged
+        logger.info("DWH_CHECKSUM: nessuno stato precedente (%s)", e)
+        return {}
+    return {r["block_name"]: r for r in rows}
+
+
+def plan(db: Db, blocks: List[SqlBlock], schema: str) -> ChangePlan:
+    """Calcola le impronte delle sorgenti lette e decide quali blocchi saltare (logga il motivo)."""
+    p = ChangePlan(blocks)
+    states = _load_states(db)
+    existing = {r["table_name"].lower() for r in
+                db.execute_query(Q.list_objects_sql(), (schema,), fetchall=True, query_type=QueryType.GET) or []}
+
+    wanted: Set[str] = set()
+    for b in blocks:
+        wanted |= b.external_reads & SOURCE_TABLES.keys()
+    t0 = datetime.now()
+    prints = {t: fingerprint(db, t) for t in sorted(wanted)}
+    logger.info("DWH_CHECKSUM: impronte di %s sorgenti in %.1fs", len(prints), (datetime.now() - t0).total_seconds())
+
+    for b in blocks:
+        if b.barrier:
+            continue
+        inputs = {t: prints[t] for t in sorted(b.external_reads) if t in prints}
+        p.inputs[b.index] = inputs
+        state = states.get(b.name)
+        untracked = sorted(b.external_reads - SOURCE_TABLES.keys())
+        upstream = sorted(blocks[d].name for d in b.deps if d in p.rebuild)
+        if untracked:
+            reason = f"sorgente non tracciata: {', '.join(untracked)}"
+        elif b.name not in existing:
+            reason = f"{b.name} assente in {schema}"
+        elif state is None:
+            reason = "nessuna costruzione registrata"
+        elif state["sql_hash"] != p.sql_hashes[b.index]:
+            reason = "SQL del blocco modificato"
+        elif state["inputs_hash"] != _inputs_hash(inputs):
+            reason = _describe_changes(json.loads(state["inputs_json"] or "{}"), inputs)
+        elif upstream:
+            reason = f"dipende da blocchi ricostruiti: {', '.join(upstream)}"
+        else:
+            sources = ", ".join(inputs) or "nessuna sorgente esterna"
+            p.skip[b.index] = f"invariato dal {state['built_at']} ({sources})"
+            logger.info("DWH_CHECKSUM salto %s: %s", b.name, p.skip[b.index])
+            continue
+        p.rebuild[b.index] = reason
+        logger.info("DWH_CHECKSUM ricostruisco %s: %s", b.name, reason)
+    return p
+
+
+def save(p: ChangePlan, report: List[Dict[str, Any]]) -> int:
+    """Registra SQL e impronte dei blocchi costruiti con successo in questo run. Ritorna quanti."""
+    now = datetime.now().replace(microsecond=0)
+    rows = []
+    for b, entry in zip(p.blocks, report):
+        if b.barrier or entry.get("status") != "ok" or b.index not in p.inputs:
+            continue
+        inputs = p.inputs[b.index]
+        rows.append((b.name, p.sql_hashes[b.index], _inputs_hash(inputs),
+                     json.dumps(inputs, sort_keys=True, default=str), now))
+    if not rows:
+        return 0
+    db = MySQLDb()
+    db.open()
+    try:
+        db.execute_query(Q.block_state_ddl(), None, fetchall=False, query_type=QueryType.INSERT)
+        db.execute_many(Q.upsert_block_state_sql(), rows)
+    finally:
+        db.close()
+    return len(rows)
@@ -0,0 +1,339 @@
+# app/jobs/dwh_etl.py
+# Refresh incrementale dei fatti con risoluzione delle chiavi surrogate in Python.
+#
+# Esegue app/sql/executions/dwh_incremental.sql così com'è (nuovi codici nelle dimensioni,
+# DELETE della finestra, aggregati, watermark) ma sostituisce gli INSERT ... SELECT di
+# fact_docrig / fact_magmov - 5-6 LEFT JOIN per riga - con:
+#   1) una lettura per dimensione: chiave naturale -> chiave surrogata in un dict
+#   2) righe sorgente da fox_staging in streaming (cursore non bufferizzato, connessione
+#      dedicata), chiavi risolte in memoria
+#   3) scrittura a lotti di DWH_ETL_BATCH righe con INSERT multi-riga (executemany)
+#      oppure LOAD DATA LOCAL INFILE (DWH_ETL_METHOD=infile, richiede local_infile=ON
+#      sul server)
+# Le chiavi non risolte restano NULL come con il LEFT JOIN e vengono contate per dimensione.
+#
+# Confronto dei codici come la collation _ci del DWH: maiuscole/minuscole e spazi finali
+# non contano. Un codice vuoto vale NULL e non conta come non risolto.
+
+from __future__ import annotations
+
+import os
+import re
+import logging
+import tempfile
+from datetime import date, datetime, time
+from decimal import Decimal
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from app.core.db import ROW_TUPLE, Db, MySQLDb, QueryType, SchedulerDbException
+from app.jobs.dwh_refresh import SQL_FILE_INCREMENTAL, execute_statement, load_sql_statements, resolve_lookback_days
+from app.sql.query.dwh_queries import QuerySqlDwhMYSQL as Q
+
+logger = logging.getLogger(__name__)
+
+METHOD_INSERT = "insert"
+METHOD_INFILE = "infile"
+METHODS = (METHOD_INSERT, METHOD_INFILE)
+
+# INSERT ... SELECT dei fatti presenti nello script incrementale, sostituiti dal caricamento Python
+_FACT_INSERT = re.compile(r"^INSERT\s+INTO\s+(fact_docrig|fact_magmov)\b", re.I)
+
+_NO_MATCH = object()   # valore sorgente che non può corrispondere a nessuna chiave
+
+
+def _code(v: Any) -> Any:
+    if v is None:
+        return None
+    if isinstance(v, (bytes, bytearray)):
+        v = bytes(v).decode("utf-8", errors="replace")
+    s = str(v).rstrip().upper()
+    return s or None
+
+
+def _day(v: Any) -> Any:
+    if v is None:
+        return None
+    if isinstance(v, datetime):
+        # DATE = DATETIME in MySQL confronta a mezzanotte
+        return v.date() if v.time() == time() else _NO_MATCH
+    if isinstance(v, date):
+        return v
+    try:
+        return date.fromisoformat(str(v))
+    except ValueError:
+        return _NO_MATCH
+
+
+class DimCache:
+    """Chiave naturale -> chiave surrogata di una dimensione, con conteggio dei non risolti."""
+
+    def __init__(self, name: str, table: str, natural_key: str, surrogate_key: str,
+                 norm: Callable[[Any], Any] = _code):
+        self.name = name
+        self.table = table
+        self.natural_key = natural_key
+        self.surrogate_key = surrogate_key
+        self.norm = norm
+        self.keys: Dict[Any, int] = {}
+        self.unresolved = 0
+        self.samples: set = set()
+
+    def load(self, db: Db) -> int:
+        sql = Q.dim_key_map_sql(self.table, self.natural_key, self.surrogate_key)
+        self.keys = {self.norm(nk): sk
+                     for nk, sk in db.iter_query(sql, (), batch_size=10000, row_format=ROW_TUPLE)}
+        return len(self.keys)
+
+    def resolve(self, value: Any) -> Optional[int]:
+        k = self.norm(value)
+        if k is None:
+            return None
+        sk = self.keys.get(k)
+        if sk is None:
+            self.unresolved += 1
+            if len(self.samples) < 10:
+                self.samples.add(str(value).rstrip())
+        return sk
+
+
+def _dimensions() -> Dict[str, DimCache]:
+    return {
+        "date": DimCache("date", "dim_date", "full_date", "date_key", norm=_day),
+        "customer": DimCache("customer", "dim_customer", "codice", "customer_key"),
+        "article": DimCache("article", "dim_article", "codicearti", "article_key"),
+        "warehouse": DimCache("warehouse", "dim_warehouse", "codice", "warehouse_key"),
+        "tipodoc": DimCache("tipodoc", "dim_tipodoc", "tipodoc", "tipodoc_key"),
+        "causale": DimCache("causale", "dim_causale_mag", "codice", "causale_key"),
+    }
+
+
+# ---------------------------
+# Fatti: colonne e trasformazione riga sorgente -> riga fatto
+# ---------------------------
+DOCRIG_COLUMNS = (
+    "tipodoc", "esanno", "numerodoc", "numeroriga",
+    "doc_date_key", "deliv_date_key",
+    "customer_key", "article_key", "warehouse_key", "tipodoc_key",
+    "codicecf", "codicearti", "magpartenz", "magarrivo", "lotto",
+    "quantita", "quantitare", "prezzoun", "prezzotot", "scontiv", "aliiva",
+    "valuta", "cambio", "eurocambio",
+)
+
+MAGMOV_COLUMNS = (
+    "mov_id", "mov_date_key",
+    "customer_key", "article_key", "warehouse_key", "causale_key",
+    "codicecf", "codicearti", "magazzino", "codcausale", "lotto",
+    "quantita", "quantitare", "qtaindist", "valore", "ultcosto",
+    "ordin", "impegn", "qtacar", "qtascar", "qtatcar", "qtatscar", "qtaret",
+)
+
+
+def _docrig_row(r: tuple, d: Dict[str, DimCache]) -> tuple:
+    (tipodoc, esanno, numerodoc, numeroriga, datadoc, dataconseg,
+     codicecf, codicearti, magpartenz, magarrivo, lotto, *measures) = r
+    return (
+        tipodoc, esanno, numerodoc, numeroriga,
+        d["date"].resolve(datadoc), d["date"].resolve(dataconseg),
+        d["customer"].resolve(codicecf), d["article"].resolve(codicearti),
+        d["warehouse"].resolve(magpartenz), d["tipodoc"].resolve(tipodoc),
+        codicecf, codicearti, magpartenz, magarrivo, lotto,
+        *measures,
+    )
+
+
+def _magmov_row(r: tuple, d: Dict[str, DimCache]) -> tuple:
+    (mov_id, datamov, codicecf, codicearti, magazzino, codcausale, lotto, *measures) = r
+    return (
+        mov_id, d["date"].resolve(datamov),
+        d["customer"].resolve(codicecf), d["article"].resolve(codicearti),
+        d["warehouse"].resolve(magazzino), d["causale"].resolve(codcausale),
+        codicecf, codicearti, magazzino, codcausale, lotto,
+        *measures,
+    )
+
+
+# tabella -> (colonne, SQL sorgente, parametri dalla finestra, trasformazione)
+_FACTS: Dict[str, Tuple[Sequence[str], str, Callable[[dict], tuple], Callable]] = {
+    "fact_docrig": (
+        DOCRIG_COLUMNS, Q.etl_docrig_source_sql(),
+        lambda w: (w["doc_from"],),
+        _docrig_row,
+    ),
+    "fact_magmov": (
+        MAGMOV_COLUMNS, Q.etl_magmov_source_sql(),
+        lambda w: (w["wm_mov_id"] if w["wm_mov_id"] is not None else -1, w["mov_from"]),
+        _magmov_row,
+    ),
+}
+
+
+# ---------------------------
+# Scrittura a lotti
+# ---------------------------
+def _tsv_value(v: Any) -> str:
+    if v is None:
+        return "\\N"
+    if isinstance(v, bool):
+        return "1" if v else "0"
+    if isinstance(v, (int, float, Decimal)):
+        return str(v)
+    if isinstance(v, (date, datetime)):
+        return v.isoformat(sep=" ") if isinstance(v, datetime) else v.isoformat()
+    if isinstance(v, (bytes, bytearray)):
+        v = bytes(v).decode("utf-8", errors="replace")
+    return (str(v).replace("\\", "\\\\").replace("\t", "\\t")
+            .replace("\n", "\\n").replace("\r", "\\r"))
+
+
+class _FactWriter:
+    def __init__(self, db: MySQLDb, table: str, columns: Sequence[str], method: str, batch_size: int):
+        self.db = db
+        self.table = table
+        self.columns = list(columns)
+        self.method = method
+        self.batch_size = batch_size
+        self.rows = 0
+        self.batches = 0
+        self._buf: List[tuple] = []
+        self._insert_sql = Q.insert_rows_sql(table, self.columns)
+
+    def add(self, row: tuple) -> None:
+        self._buf.append(row)
+        if len(self._buf) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self._buf:
+            return
+        if self.method == METHOD_INFILE:
+            self._load_infile(self._buf)
+        else:
+            self.db.execute_many(self._insert_sql, self._buf)
+        self.rows += len(self._buf)
+        self.batches += 1
+        self._buf = []
+        if self.batches % 20 == 0:
+            logger.info("DWH_ETL %s: %s righe scritte", self.table, self.rows)
+
+    def _load_infile(self, rows: List[tuple]) -> None:
+        fh = tempfile.NamedTemporaryFile("w", encoding="utf-8", newline="\n",
+                                         suffix=".tsv", prefix=f"{self.table}_", delete=False)
+        try:
+            with fh:
+                for r in rows:
+                    fh.write("\t".join(_tsv_value(v) for v in r))
+                    fh.write("\n")
+            self.db.execute_query(Q.load_data_local_sql(fh.name, self.table, self.columns), None,
+                                  fetchall=False, query_type=QueryType.INSERT)
+        finally:
+            os.unlink(fh.name)
+
+
+def load_fact(
+    table: str,
+    window: Dict[str, Any],
+    dims: Dict[str, DimCache],
+    *,
+    reader: Db,
+    writer: MySQLDb,
+    method: str,
+    batch_size: int,
+) -> Dict[str, Any]:
+    """Legge le righe sorgente della finestra, risolve le chiavi e le scrive a lotti."""
+    columns, source_sql, params, transform = _FACTS[table]
+    out = _FactWriter(writer, table, columns, method, batch_size)
+    t0 = datetime.now()
+    for r in reader.iter_query(source_sql, params(window), batch_size=batch_size, row_format=ROW_TUPLE):
+        out.add(transform(r, dims))
+    out.flush()
+    elapsed = (datetime.now() - t0).total_seconds()
+    return {
+        "rows": out.rows,
+        "batches": out.batches,
+        "elapsed_sec": round(elapsed, 3),
+        "rows_per_sec": round(out.rows / elapsed) if elapsed else out.rows,
+    }
+
+
+def _method(value: Optional[str]) -> str:
+    method = (value or os.getenv("DWH_ETL_METHOD", METHOD_INSERT)).strip().lower()
+    if method not in METHODS:
+        raise ValueError(f"Metodo DWH_ETL non valido: {method}")
+    return method
+
+
+def _batch_size(value: Optional[int]) -> int:
+    if value is not None:
+        return max(1, int(value))
+    return max(1, int(os.getenv("DWH_ETL_BATCH", "5000")))
+
+
+def run(
+    *,
+    lookback_days: Optional[int] = None,
+    method: Optional[str] = None,
+    batch_size: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    Refresh incrementale con i fatti caricati da Python (vedi intestazione).
+    Stessa finestra/watermark di `dwh-refresh --incremental`.
+    """
+    start_ts = datetime.now()
+    method = _method(method)
+    n_batch = _batch_size(batch_size)
+
+    stmts = load_sql_statements(SQL_FILE_INCREMENTAL)
+    stmts.insert(0, f"SET @lookback_days := {resolve_lookback_days(lookback_days)}")
+    logger.info("DWH_ETL start: statements=%s, method=%s, batch=%s", len(stmts), method, n_batch)
+
+    writer = MySQLDb()
+    writer.allow_local_infile = method == METHOD_INFILE
+    reader = MySQLDb()
+    dims: Optional[Dict[str, DimCache]] = None
+    facts: Dict[str, Any] = {}
+    executed = 0
+    res: Dict[str, Any] = {"ok": True, "method": method}
+
+    writer.open()
+    reader.open()
+    try:
+        for i, stmt in enumerate(stmts, 1):
+            m = _FACT_INSERT.match(stmt)
+            try:
+                if m is None:
+                    logger.info("[DWH_ETL] #%s: %s", i, " ".join(stmt.split())[:120])
+                    execute_statement(writer, stmt)
+                    executed += 1
+                    continue
+                if dims is None:
+                    # dopo gli INSERT dei nuovi codici: le mappe includono anche quelli
+                    dims = _dimensions()
+                    for d in dims.values():
+                        logger.info("DWH_ETL dimensione %s: %s chiavi", d.name, d.load(writer))
+                window = writer.execute_query(Q.etl_window_sql(), None, fetchall=False,
+                                              query_type=QueryType.GET) or {}
+                table = m.group(1).lower()
+                facts[table] = load_fact(table, window, dims, reader=reader, writer=writer,
+                                         method=method, batch_size=n_batch)
+                logger.info("DWH_ETL %s: %s", table, facts[table])
+            except SchedulerDbException as e:
+                logger.error("DWH_ETL fallito allo statement %s: %s\nSQL: %s", i, e, " ".join(stmt.split())[:200])
+                res.update({"ok": False, "statement": i, "error": str(e)})
+                break
+    finally:
+        reader.close()
+        writer.close()
+
+    unresolved = {d.name: d.unresolved for d in (dims or {}).values()}
+    for d in (dims or {}).values():
+        if d.unresolved:
+            logger.warning("DWH_ETL %s: %s valori non risolti (es. %s)",
+                           d.name, d.unresolved, ", ".join(sorted(d.samples)))
+    res.update({
+        "statements": len(stmts),
+        "executed": executed,
+        "facts": facts,
+        "unresolved": unresolved,
+        "elapsed_sec": round((datetime.now() - start_ts).total_seconds(), 3),
+    })
+    return res
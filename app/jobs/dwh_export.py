@@ -0,0 +1,221 @@
+# app/jobs/dwh_export.py
+# Estrazione di una vista/tabella del DWH su file (CSV o Parquet) per BI e amministrazione.
+#
+# Lettura in streaming con Db.iter_query: cursore NON bufferizzato (le righe restano sul
+# server finché non vengono lette) a lotti di DWH_EXPORT_BATCH righe (default 50000).
+# Ogni lotto viene scritto subito - con Parquet diventa un row group - e poi scartato:
+# la memoria resta quella di un lotto qualunque sia il numero di righe.
+#
+# I tipi delle colonne vengono letti da information_schema (non dal primo lotto), così lo
+# schema Parquet è stabile anche se le prime righe hanno solo NULL.
+# Parquet richiede pyarrow (facoltativo, importato solo con --format parquet).
+
+from __future__ import annotations
+
+import os
+import csv
+import logging
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+from app.core.db import ROW_TUPLE, Db, MySQLDb, QueryType
+from app.sql.query.dwh_queries import QuerySqlDwhMYSQL as Q
+
+logger = logging.getLogger(__name__)
+
+FORMAT_CSV = "csv"
+FORMAT_PARQUET = "parquet"
+FORMATS = (FORMAT_CSV, FORMAT_PARQUET)
+
+DWH_SCHEMA = "dwh"
+
+pa = None  # pyarrow (facoltativo), caricato da _pyarrow()
+pq = None
+
+_INT_TYPES = {"tinyint", "smallint", "mediumint", "int", "integer", "bigint", "year", "bit"}
+_FLOAT_TYPES = {"float", "double", "real"}
+_BINARY_TYPES = {"binary", "varbinary", "tinyblob", "blob", "mediumblob", "longblob"}
+
+
+def _pyarrow():
+    global pa, pq
+    if pa is None:
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            return None
+        pa, pq = pyarrow, pyarrow.parquet
+    return pa
+
+
+def _batch_size(value: Optional[int]) -> int:
+    if value is not None:
+        return max(1, int(value))
+    return max(1, int(os.getenv("DWH_EXPORT_BATCH", "50000")))
+
+
+# ---------------------------
+# Writer
+# ---------------------------
+class _CsvWriter:
+    def __init__(self, path: Path, columns: List[Dict[str, Any]]):
+        self._fh = open(path, "w", encoding="utf-8", newline="")
+        self._csv = csv.writer(self._fh)
+        self._csv.writerow([c["column_name"] for c in columns])
+
+    def write(self, rows: Sequence[tuple]) -> None:
+        self._csv.writerows(rows)
+
+    def close(self) -> None:
+        self._fh.close()
+
+
+def _arrow_type(col: Dict[str, Any]):
+    dt = (col.get("data_type") or "").lower()
+    unsigned = "unsigned" in (col.get("column_type") or "").lower()
+    if dt in _INT_TYPES:
+        return pa.uint64() if unsigned and dt == "bigint" else pa.int64()
+    if dt in _FLOAT_TYPES:
+        return pa.float64()
+    if dt == "decimal":
+        prec = int(col.get("num_precision") or 65)
+        scale = int(col.get("num_scale") or 0)
+        return pa.decimal128(prec, scale) if prec <= 38 else pa.decimal256(prec, scale)
+    if dt == "date":
+        return pa.date32()
+    if dt in ("datetime", "timestamp"):
+        return pa.timestamp("us")
+    if dt == "time":
+        return pa.duration("us")
+    if dt in _BINARY_TYPES:
+        return pa.binary()
+    return pa.string()
+
+
+def _as_text(v: Any) -> Any:
+    if v is None or isinstance(v, str):
+        return v
+    if isinstance(v, (bytes, bytearray)):
+        return bytes(v).decode("utf-8", errors="replace")
+    return str(v)
+
+
+class _ParquetWriter:
+    def __init__(self, path: Path, columns: List[Dict[str, Any]]):
+        self._schema = pa.schema([pa.field(c["column_name"], _arrow_type(c)) for c in columns])
+        self._writer = pq.ParquetWriter(str(path), self._schema, compression="snappy")
+
+    def write(self, rows: Sequence[tuple]) -> None:
+        arrays = []
+        for i, field in enumerate(self._schema):
+            values = [r[i] for r in rows]
+            if pa.types.is_string(field.type):
+                # JSON/ENUM/SET e tipi non mappati arrivano anche come bytes o altri oggetti
+                values = [_as_text(v) for v in values]
+            arrays.append(pa.array(values, type=field.type))
+        self._writer.write_table(pa.Table.from_arrays(arrays, schema=self._schema))
+
+    def close(self) -> None:
+        self._writer.close()
+
+
+# ---------------------------
+# Export
+# ---------------------------
+def _columns(db: Db, schema: str, name: str) -> List[Dict[str, Any]]:
+    cols = db.execute_query(Q.list_columns_sql(), (schema, name), query_type=QueryType.GET) or []
+    if not cols:
+        raise ValueError(f"Vista/tabella non trovata: {schema}.{name}")
+    return cols
+
+
+def export(
+    db: MySQLDb,
+    name: str,
+    *,
+    fmt: str,
+    out: Path,
+    batch_size: int,
+    schema: str = DWH_SCHEMA,
+) -> Dict[str, Any]:
+    """Esporta `schema.name` su `out` con una connessione già aperta. Ritorna le statistiche."""
+    columns = _columns(db, schema, name)
+    writer = _ParquetWriter(out, columns) if fmt == FORMAT_PARQUET else _CsvWriter(out, columns)
+    sql = Q.select_all_sql(schema, name, [c["column_name"] for c in columns])
+
+    rows_total = batches = 0
+    t0 = datetime.now()
+
+    def flush(rows: List[tuple]) -> None:
+        nonlocal rows_total, batches
+        writer.write(rows)
+        rows_total += len(rows)
+        batches += 1
+        if batches % 10 == 0:
+            elapsed = (datetime.now() - t0).total_seconds() or 1e-9
+            logger.info("DWH_EXPORT %s: %s righe (%.0f righe/s)", name, rows_total, rows_total / elapsed)
+
+    try:
+        # cursore non bufferizzato, righe a tuple (niente dict per riga)
+        rows: List[tuple] = []
+        for row in db.iter_query(sql, (), batch_size=batch_size, row_format=ROW_TUPLE):
+            rows.append(row)
+            if len(rows) >= batch_size:
+                flush(rows)
+                rows = []
+        if rows:
+            flush(rows)
+    finally:
+        writer.close()
+
+    elapsed = (datetime.now() - t0).total_seconds()
+    size = out.stat().st_size
+    return {
+        "ok": True,
+        "source": f"{schema}.{name}",
+        "format": fmt,
+        "out": str(out),
+        "columns": len(columns),
+        "rows": rows_total,
+        "batches": batches,
+        "bytes": size,
+        "elapsed_sec": round(elapsed, 3),
+        "rows_per_sec": round(rows_total / elapsed) if elapsed else rows_total,
+        "mb_per_sec": round(size / 1048576 / elapsed, 2) if elapsed else 0.0,
+    }
+
+
+def run_export(
+    name: str,
+    *,
+    fmt: str = FORMAT_CSV,
+    out: str,
+    batch_size: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    Job chiamato da `dwh-export`: apre una connessione dedicata (non dal pool: il cursore
+    non bufferizzato la tiene occupata per tutta l'estrazione) ed esporta la vista.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Formato non valido: {fmt}")
+    if fmt == FORMAT_PARQUET and _pyarrow() is None:
+        raise RuntimeError("Per --format parquet serve pyarrow (pip install pyarrow)")
+
+    out_path = Path(out)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    n = _batch_size(batch_size)
+    logger.info("DWH_EXPORT start: %s.%s -> %s (%s, lotti da %s righe)", DWH_SCHEMA, name, out_path, fmt, n)
+
+    db = MySQLDb()
+    db.open()
+    try:
+        # lettura lunga: il server non deve chiudere la connessione mentre scriviamo il file
+        db.execute_query("SET SESSION net_write_timeout = 3600", None, fetchall=False,
+                         query_type=QueryType.UPDATE)
+        res = export(db, name, fmt=fmt, out=out_path, batch_size=n)
+    finally:
+        db.close()
+    logger.info("DWH_EXPORT completato: %s", res)
+    return res
@@ -0,0 +1,360 @@
+# app/jobs/dwh_graph.py
+# Grafo delle dipendenze di uno script SQL del DWH + esecuzione parallela dei blocchi.
+#
+# Lo script viene diviso in blocchi "per tabella" (statement consecutivi con lo stesso
+# target: DROP/CREATE/INSERT/... su dim_customer => un blocco). Le dipendenze si ricavano
+# dai target scritti e dalle tabelle lette (FROM / JOIN / REFERENCES):
+#   - B legge o riscrive una tabella scritta da A (A prima di B)  => B dipende da A
+#   - B scrive una tabella letta da A (A prima di B)               => B dipende da A
+#   - statement non riconosciuti (DROP/CREATE DATABASE, RENAME...) => barriera
+# USE / SET sono "di sessione": non formano blocchi, vengono rieseguiti su ogni
+# connessione prima del blocco (prelude).
+# Errori temporanei (connessione persa, lock wait timeout, deadlock): il blocco viene
+# rieseguito da capo, prelude compreso, su una connessione nuova (vedi is_transient).
+
+from __future__ import annotations
+
+import re
+import time
+import logging
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from app.core.db import Db
+
+logger = logging.getLogger(__name__)
+
+_IDENT = r"(`?\w+`?(?:\.`?\w+`?)?)"
+
+# (regex, gruppo con il nome del target)
+_TARGET_PATTERNS: List[Tuple[re.Pattern, int]] = [
+    (re.compile(rf"^DROP\s+(?:TABLE|VIEW)\s+(?:IF\s+EXISTS\s+)?{_IDENT}", re.I), 1),
+    (re.compile(rf"^CREATE\s+(?:OR\s+REPLACE\s+)?(?:TABLE|VIEW)\s+(?:IF\s+NOT\s+EXISTS\s+)?{_IDENT}", re.I), 1),
+    (re.compile(rf"^(?:INSERT|REPLACE)\s+(?:IGNORE\s+)?(?:INTO\s+)?{_IDENT}", re.I), 1),
+    (re.compile(rf"^DELETE\s+FROM\s+{_IDENT}", re.I), 1),
+    (re.compile(rf"^DELETE\s+\w+\s+FROM\s+{_IDENT}", re.I), 1),  # DELETE alias FROM tabella alias JOIN ...
+    (re.compile(rf"^UPDATE\s+{_IDENT}", re.I), 1),
+    (re.compile(rf"^TRUNCATE\s+(?:TABLE\s+)?{_IDENT}", re.I), 1),
+    (re.compile(rf"^ALTER\s+TABLE\s+{_IDENT}", re.I), 1),
+]
+_READ_PATTERN = re.compile(rf"\b(?:FROM|JOIN|REFERENCES)\s+{_IDENT}", re.I)
+_USE_PATTERN = re.compile(r"^USE\s+`?(\w+)`?", re.I)
+
+
+def _norm_name(name: str, schema: Optional[str]) -> str:
+    """`dwh`.`dim_date` -> dim_date (se dwh è lo schema corrente), fox_staging.x resta qualificato."""
+    name = name.replace("`", "").lower()
+    if "." in name:
+        sch, tbl = name.split(".", 1)
+        if schema and sch == schema.lower():
+            return tbl
+    return name
+
+
+def _statement_kind(sql: str) -> str:
+    first = sql.split(None, 1)[0].upper() if sql.strip() else ""
+    if first in ("USE", "SET"):
+        return "session"
+    for pattern, _ in _TARGET_PATTERNS:
+        if pattern.match(sql):
+            return "table"
+    return "barrier"
+
+
+def _statement_target(sql: str, schema: Optional[str]) -> Optional[str]:
+    for pattern, group in _TARGET_PATTERNS:
+        m = pattern.match(sql)
+        if m:
+            return _norm_name(m.group(group), schema)
+    return None
+
+
+def _statement_reads(sql: str, schema: Optional[str]) -> Set[str]:
+    return {_norm_name(m.group(1), schema) for m in _READ_PATTERN.finditer(sql)}
+
+
+@dataclass
+class SqlBlock:
+    index: int
+    name: str
+    statements: List[str] = field(default_factory=list)
+    prelude: List[str] = field(default_factory=list)
+    writes: Set[str] = field(default_factory=set)
+    reads: Set[str] = field(default_factory=set)
+    deps: Set[int] = field(default_factory=set)
+    barrier: bool = False
+
+    @property
+    def external_reads(self) -> Set[str]:
+        """Tabelle lette da altri schemi (es. fox_staging.anagrafe)."""
+        return {r for r in self.reads if "." in r}
+
+
+def build_blocks(stmts: List[str]) -> List[SqlBlock]:
+    """Divide gli statement in blocchi per tabella e calcola le dipendenze."""
+    blocks: List[SqlBlock] = []
+    session: List[str] = []        # USE corrente + SET in ordine
+    session_reads: Set[str] = set()
+    schema: Optional[str] = None
+
+    for stmt in stmts:
+        kind = _statement_kind(stmt)
+
+        if kind == "session":
+            m = _USE_PATTERN.match(stmt)
+            if m:
+                schema = m.group(1)
+                session = [s for s in session if not _USE_PATTERN.match(s)]
+                session.insert(0, stmt)
+            else:
+                session.append(stmt)
+                session_reads |= _statement_reads(stmt, schema)
+            continue
+
+        if kind == "barrier":
+            blocks.append(SqlBlock(
+                index=len(blocks), name=f"__barrier_{len(blocks)}__",
+                statements=[stmt], prelude=list(session), barrier=True,
+            ))
+            continue
+
+        target = _statement_target(stmt, schema)
+        last = blocks[-1] if blocks else None
+        if last is None or last.barrier or last.name != target or last.prelude != session:
+            last = SqlBlock(index=len(blocks), name=target or "?", prelude=list(session))
+            last.writes.add(target)
+            last.reads |= session_reads
+            blocks.append(last)
+        last.statements.append(stmt)
+        last.reads |= _statement_reads(stmt, schema) - {target}
+
+    for b in blocks:
+        for a in blocks[: b.index]:
+            if a.barrier or b.barrier:
+                b.deps.add(a.index)
+            elif a.writes & (b.reads | b.writes) or a.reads & b.writes:
+                b.deps.add(a.index)
+    return blocks
+
+
+def describe_blocks(blocks: List[SqlBlock]) -> List[str]:
+    """Righe leggibili del piano (per dry-run / log)."""
+    names = {b.index: b.name for b in blocks}
+    out = []
+    for b in blocks:
+        deps = ", ".join(names[d] for d in sorted(_direct_deps(blocks, b))) or "-"
+        out.append(f"#{b.index} {b.name} ({len(b.statements)} stmt) <- {deps}")
+    return out
+
+
+def _direct_deps(blocks: List[SqlBlock], b: SqlBlock) -> Set[int]:
+    """Dipendenze senza quelle implicite (riduzione transitiva, solo per la lettura)."""
+    implied: Set[int] = set()
+    for d in b.deps:
+        implied |= blocks[d].deps
+    return b.deps - implied
+
+
+# ---------------------------
+# Esecuzione
+# ---------------------------
+# server irraggiungibile/connessione persa (2003, 2006, 2013, 2055), lock wait timeout (1205),
+# deadlock (1213)
+TRANSIENT_ERRNOS = frozenset({2003, 2006, 2013, 2055, 1205, 1213})
+
+_ERRNO = re.compile(r"\b(\d{4})(?: \([0-9A-Z]{5}\))?:")
+
+
+def error_code(error: BaseException) -> Optional[int]:
+    """
+    Codice di errore MySQL: attributo errno lungo la catena delle eccezioni oppure, per
+    SchedulerDbException, dal testo ("Errore query MySQL: 2013 (HY000): Lost connection...").
+    """
+    seen: Set[int] = set()
+    e: Optional[BaseException] = error
+    while e is not None and id(e) not in seen:
+        seen.add(id(e))
+        code = getattr(e, "errno", None)
+        if isinstance(code, int) and code >= 1000:
+            return code
+        m = _ERRNO.search(str(e))
+        if m:
+            return int(m.group(1))
+        e = e.__cause__ or e.__context__
+    return None
+
+
+def is_transient(error: BaseException) -> bool:
+    if isinstance(error, BlockFailure):
+        error = error.error
+    return error_code(error) in TRANSIENT_ERRNOS
+
+
+class BlockFailure(Exception):
+    def __init__(self, block: SqlBlock, stmt_no: int, sql: str, error: Exception):
+        super().__init__(f"{block.name}: statement {stmt_no}/{len(block.statements)}: {error}")
+        self.block = block
+        self.stmt_no = stmt_no
+        self.sql = sql
+        self.error = error
+
+
+def _run_block(db: Db, block: SqlBlock, execute: Callable[[Db, str], Any]) -> int:
+    for stmt in block.prelude:
+        execute(db, stmt)
+    for i, stmt in enumerate(block.statements, 1):
+        logger.info("[%s] statement %s/%s: %s", block.name, i, len(block.statements),
+                    " ".join(stmt.split())[:120])
+        try:
+            execute(db, stmt)
+        except Exception as e:
+            raise BlockFailure(block, i, stmt, e) from e
+    return len(block.statements)
+
+
+def execute_blocks(
+    blocks: List[SqlBlock],
+    *,
+    jobs: int,
+    db_factory: Callable[[], Db],
+    execute: Callable[[Db, str], Any],
+    skip: Optional[Dict[int, str]] = None,
+    resumed: Optional[Dict[int, str]] = None,
+    on_complete: Optional[Callable[[SqlBlock], None]] = None,
+    retries: int = 0,
+    backoff_sec: float = 1.0,
+) -> Dict[str, Any]:
+    """
+    Esegue i blocchi rispettando le dipendenze, con al massimo `jobs` blocchi
+    (e quindi `jobs` connessioni) contemporaneamente.
+    `skip`: indice -> motivo dei blocchi da non eseguire (già aggiornati): contano come
+    completati, nel report con stato "unchanged".
+    `resumed`: come skip, per i blocchi già completati da un run interrotto (stato "resumed").
+    `on_complete(block)`: chiamata (nel thread principale) per ogni blocco riuscito.
+    `retries`: nuovi tentativi di un blocco dopo un errore temporaneo, ognuno su una
+    connessione nuova e dopo `backoff_sec` secondi raddoppiati a ogni tentativo.
+
+    Al primo errore non parte nessun nuovo blocco; quelli in corso terminano.
+    Ritorna un report con l'esito di ogni blocco (ok / failed / skipped / unchanged / resumed).
+    """
+    jobs = max(1, int(jobs))
+    report: Dict[int, Dict[str, Any]] = {
+        b.index: {"block": b.name, "status": "skipped", "statements": len(b.statements)} for b in blocks
+    }
+    skip = skip or {}
+    resumed = {i: r for i, r in (resumed or {}).items() if i not in skip}
+    for index, reason in skip.items():
+        report[index].update(status="unchanged", reason=reason)
+    for index, reason in resumed.items():
+        report[index].update(status="resumed", reason=reason)
+    done: Set[int] = set(skip) | set(resumed)
+    started: Set[int] = set(done)
+    failed = False
+    retries = max(0, int(retries))
+
+    local = threading.local()
+    opened: List[Db] = []
+    opened_lock = threading.Lock()
+    attempts: Dict[int, int] = {}
+
+    def connection(fresh: bool) -> Db:
+        # una connessione per thread, riusata per tutti i blocchi del thread
+        db = getattr(local, "db", None)
+        if db is not None and not fresh:
+            return db
+        if db is not None:
+            db.close()
+            with opened_lock:
+                opened.remove(db)
+            local.db = None
+        db = db_factory()
+        db.open()
+        local.db = db
+        with opened_lock:
+            opened.append(db)
+        return db
+
+    def worker(block: SqlBlock) -> int:
+        attempt = 0
+        while True:
+            try:
+                return _run_block(connection(fresh=attempt > 0), block, execute)
+            except Exception as e:
+                if attempt >= retries or not is_transient(e):
+                    raise
+                attempt += 1
+                with opened_lock:
+                    attempts[block.index] = attempt
+                delay = backoff_sec * 2 ** (attempt - 1)
+                logger.warning("DWH blocco %s: errore temporaneo (%s), tentativo %s/%s tra %.1fs su una nuova connessione",
+                               block.name, e, attempt, retries, delay)
+                time.sleep(delay)
+
+    def on_done(block: SqlBlock, fut: Future, t0: datetime) -> None:
+        nonlocal failed
+        entry = report[block.index]
+        entry["elapsed_sec"] = round((datetime.now() - t0).total_seconds(), 3)
+        if block.index in attempts:
+            entry["retries"] = attempts[block.index]
+        err = fut.exception()
+        if err is None:
+            entry["status"] = "ok"
+            done.add(block.index)
+            if on_complete is not None:
+                on_complete(block)
+            return
+        failed = True
+        entry["status"] = "failed"
+        if isinstance(err, BlockFailure):
+            entry["error"] = str(err.error)
+            entry["statement"] = err.stmt_no
+            entry["sql"] = " ".join(err.sql.split())[:200]
+        else:
+            entry["error"] = str(err)
+        logger.error("DWH blocco %s FALLITO: %s", block.name, entry.get("error"))
+
+    try:
+        with ThreadPoolExecutor(max_workers=jobs, thread_name_prefix="dwh") as pool:
+            running: Dict[Future, Tuple[SqlBlock, datetime]] = {}
+            while True:
+                if not failed:
+                    for b in blocks:
+                        if b.index not in started and b.deps <= done:
+                            started.add(b.index)
+                            running[pool.submit(worker, b)] = (b, datetime.now())
+                if not running:
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for fut in finished:
+                    block, t0 = running.pop(fut)
+                    on_done(block, fut, t0)
+    finally:
+        for db in opened:
+            db.close()
+
+    blocks_report = [report[b.index] for b in blocks]
+    broken = {b.index for b in blocks if report[b.index]["status"] == "failed"}
+    for b in blocks:  # in ordine: le dipendenze sono sempre blocchi precedenti
+        entry = report[b.index]
+        if entry["status"] != "skipped":
+            continue
+        if b.deps & broken:
+            broken.add(b.index)
+            entry["reason"] = "dipendenza fallita"
+        else:
+            entry["reason"] = "interrotto dopo un errore" if failed else "non eseguito"
+    return {
+        "ok": not failed and len(done) == len(blocks),
+        "blocks": len(blocks),
+        "blocks_ok": len(done),
+        "blocks_unchanged": len(skip),
+        "blocks_resumed": len(resumed),
+        "retries": sum(attempts.values()),
+        "executed": sum(len(b.statements) for b in blocks
+                        if b.index in done and b.index not in skip and b.index not in resumed),
+        "failures": [e for e in blocks_report if e["status"] == "failed"],
+        "report": blocks_report,
+    }
@@ -0,0 +1,337 @@
+# app/jobs/dwh_history.py
+# Profilo per statement e storico dei refresh del DWH.
+#
+# StepProfiler avvolge l'esecutore di execute_blocks e registra per ogni statement dello
+# script: tempo a parete, righe modificate (rowcount), warning del server (conteggio +
+# primi messaggi) e, con --explain / DWH_REFRESH_EXPLAIN=1, l'EXPLAIN FORMAT=JSON della
+# parte SELECT (INSERT ... SELECT e SELECT), calcolato prima dell'esecuzione.
+# Gli statement di sessione rieseguiti su ogni connessione (prelude USE/SET) vengono
+# sommati sullo stesso step (executions > 1).
+#
+# A fine refresh (record):
+#   - dwh_refresh_runs / dwh_refresh_steps nello schema applicativo (non in dwh, che il
+#     refresh completo ricrea); DWH_REFRESH_HISTORY=0 per non scrivere
+#   - report JSON in DWH_REFRESH_REPORT_DIR (default reports/dwh_refresh) o in --report-out
+# `dwh-refresh report` (compare) confronta l'ultimo run con la mediana degli N run
+# riusciti precedenti (stessa modalità e profilo): step più lenti e più peggiorati.
+# Gli step si confrontano per hash del testo: se lo statement cambia, riparte da zero.
+
+from __future__ import annotations
+
+import os
+import re
+import json
+import hashlib
+import logging
+import threading
+from datetime import datetime
+from pathlib import Path
+from statistics import median
+from typing import Any, Callable, Dict, List, Optional
+
+from app.core.db import Db, MySQLDb, QueryType
+from app.jobs.dwh_graph import _statement_kind, _statement_target
+from app.sql.query.dwh_queries import QuerySqlDwhMYSQL as Q
+
+logger = logging.getLogger(__name__)
+
+REPORT_DIR = Path(__file__).resolve().parents[2] / "reports" / "dwh_refresh"
+
+_SELECT = re.compile(r"\bSELECT\b", re.I)
+_WARNING_SAMPLE = 3
+
+
+def _one_line(sql: str, size: int) -> str:
+    return " ".join(sql.split())[:size]
+
+
+def step_hash(sql: str) -> str:
+    return hashlib.sha1(" ".join(sql.split()).encode("utf-8")).hexdigest()[:16]
+
+
+def _select_part(sql: str) -> Optional[str]:
+    """SELECT da spiegare: lo statement stesso o la parte SELECT di un INSERT/REPLACE."""
+    first = sql.split(None, 1)[0].upper() if sql.strip() else ""
+    if first == "SELECT":
+        return sql
+    if first in ("INSERT", "REPLACE"):
+        m = _SELECT.search(sql)
+        return sql[m.start():] if m else None
+    return None
+
+
+def explain_enabled(value: Optional[bool]) -> bool:
+    if value is not None:
+        return bool(value)
+    return os.getenv("DWH_REFRESH_EXPLAIN", "0").strip().lower() in ("1", "true", "yes", "on")
+
+
+# ---------------------------
+# Profilo per statement
+# ---------------------------
+class StepProfiler:
+    """Esecutore per execute_blocks: esegue con `execute` e registra le metriche dello step."""
+
+    def __init__(self, stmts: List[str], execute: Callable[[Db, str], Any], *,
+                 explain: bool = False, schema: Optional[str] = "dwh"):
+        self._execute = execute
+        self._explain = explain
+        self._schema = schema
+        self._lock = threading.Lock()
+        self._numbers: Dict[str, int] = {}
+        for i, stmt in enumerate(stmts, 1):
+            self._numbers.setdefault(step_hash(stmt), i)
+        self._steps: Dict[str, Dict[str, Any]] = {}
+
+    def _step(self, key: str, stmt: str) -> Dict[str, Any]:
+        step = self._steps.get(key)
+        if step is None:
+            step = self._steps[key] = {
+                "stmt_no": self._numbers.get(key, 0),
+                "step_hash": key,
+                "target": _statement_target(stmt, self._schema),
+                "label": _one_line(stmt, 255),
+                "executions": 0,
+                "status": "ok",
+                "elapsed_sec": 0.0,
+                "rows_affected": None,
+                "warnings": 0,
+                "warning_sample": None,
+                "explain_json": None,
+            }
+        return step
+
+    def _explain_plan(self, db: Db, stmt: str) -> Optional[str]:
+        select = _select_part(stmt)
+        if select is None:
+            return None
+        try:
+            row = db.execute_query(f"EXPLAIN FORMAT=JSON {select}", None,
+                                   fetchall=False, query_type=QueryType.GET) or {}
+            return next(iter(row.values()), None)
+        except Exception as e:
+            return json.dumps({"error": str(e)})
+
+    def _warnings(self, db: Db) -> tuple[int, Optional[str]]:
+        row = db.execute_query("SHOW COUNT(*) WARNINGS", None, fetchall=False, query_type=QueryType.GET) or {}
+        count = int(next(iter(row.values()), 0) or 0)
+        if not count:
+            return 0, None
+        rows = db.execute_query(f"SHOW WARNINGS LIMIT {_WARNING_SAMPLE}", None,
+                                fetchall=True, query_type=QueryType.GET) or []
+        sample = "; ".join(f"{r.get('Code')} {r.get('Message')}" for r in rows)
+        return count, sample[:1000] or None
+
+    def __call__(self, db: Db, stmt: str) -> Any:
+        key = step_hash(stmt)
+        with self._lock:
+            need_plan = self._explain and key not in self._steps
+            self._step(key, stmt)
+        plan = self._explain_plan(db, stmt) if need_plan else None
+
+        t0 = datetime.now()
+        try:
+            result = self._execute(db, stmt)
+        except Exception:
+            with self._lock:
+                step = self._steps[key]
+                step["executions"] += 1
+                step["elapsed_sec"] += (datetime.now() - t0).total_seconds()
+                step["status"] = "failed"
+            raise
+        elapsed = (datetime.now() - t0).total_seconds()
+
+        warnings, sample = (0, None) if _statement_kind(stmt) == "session" else self._warnings(db)
+        with self._lock:
+            step = self._steps[key]
+            step["executions"] += 1
+            step["elapsed_sec"] += elapsed
+            if step["status"] == "failed":   # riuscito dopo un errore temporaneo (blocco ripetuto)
+                step["status"] = "retried"
+            if isinstance(result, int) and result >= 0:
+                step["rows_affected"] = (step["rows_affected"] or 0) + result
+            step["warnings"] += warnings
+            step["warning_sample"] = step["warning_sample"] or sample
+            if plan is not None:
+                step["explain_json"] = plan
+        return result
+
+    def steps(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            out = [dict(s, elapsed_sec=round(s["elapsed_sec"], 3)) for s in self._steps.values()]
+        return sorted(out, key=lambda s: s["stmt_no"])
+
+
+# ---------------------------
+# Storico + report JSON
+# ---------------------------
+def _history_enabled() -> bool:
+    return os.getenv("DWH_REFRESH_HISTORY", "1").strip().lower() not in ("0", "false", "no", "off")
+
+
+def _save(run: Dict[str, Any], steps: List[Dict[str, Any]]) -> int:
+    db = MySQLDb()
+    db.open()
+    try:
+        for ddl in Q.refresh_history_ddl():
+            db.execute_query(ddl, None, fetchall=False, query_type=QueryType.INSERT)
+        with db.transaction():
+            db.execute_query(Q.insert_refresh_run_sql(), (
+                run["started_at"], run["finished_at"], run["mode"], run["profile"], run["jobs"],
+                int(bool(run["ok"])), run["statements"], run["executed"], run["elapsed_sec"], None,
+            ), fetchall=False, query_type=QueryType.INSERT)
+            run_id = int(db.execute_query("SELECT LAST_INSERT_ID() AS run_id", None,
+                                          fetchall=False, query_type=QueryType.GET)["run_id"])
+            db.execute_many(Q.insert_refresh_step_sql(), [
+                (run_id, s["stmt_no"], s["step_hash"], s["target"], s["label"], s["executions"], s["status"],
+                 s["elapsed_sec"], s["rows_affected"], s["warnings"], s["warning_sample"], s["explain_json"])
+                for s in steps
+            ])
+        return run_id
+    finally:
+        db.close()
+
+
+def _set_report_path(run_id: int, path: Path) -> None:
+    db = MySQLDb()
+    db.open()
+    try:
+        db.execute_query(Q.set_refresh_report_path_sql(), (str(path), run_id),
+                         fetchall=False, query_type=QueryType.UPDATE)
+    finally:
+        db.close()
+
+
+def record(
+    res: Dict[str, Any],
+    profiler: StepProfiler,
+    *,
+    started_at: datetime,
+    report_out: Optional[str] = None,
+) -> None:
+    """
+    Salva run e step nello storico e scrive il report JSON; aggiunge run_id/report a `res`.
+    Un errore qui viene loggato ma non cambia l'esito del refresh.
+    """
+    steps = profiler.steps()
+    run = {
+        "started_at": started_at,
+        "finished_at": datetime.now(),
+        "mode": res.get("mode"),
+        "profile": res.get("profile") or "default",
+        "jobs": res.get("jobs") or 1,
+        "ok": bool(res.get("ok")),
+        "statements": res.get("statements") or 0,
+        "executed": res.get("executed") or 0,
+        "elapsed_sec": round(float(res.get("elapsed_sec") or 0), 3),
+    }
+
+    run_id = None
+    if _history_enabled():
+        try:
+            run_id = _save(run, steps)
+            res["run_id"] = run_id
+        except Exception as e:
+            logger.warning("DWH_HISTORY: storico non salvato: %s", e)
+
+    try:
+        if report_out:
+            path = Path(report_out)
+        else:
+            base = Path(os.getenv("DWH_REFRESH_REPORT_DIR") or REPORT_DIR)
+            path = base / f"dwh_refresh_{started_at:%Y%m%d_%H%M%S}.json"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        slowest = sorted(steps, key=lambda s: s["elapsed_sec"], reverse=True)[:10]
+        payload = {
+            "run": dict(run, run_id=run_id),
+            "result": res,
+            "slowest": [s["stmt_no"] for s in slowest],
+            "steps": steps,
+        }
+        path.write_text(json.dumps(payload, ensure_ascii=False, indent=2, default=str), encoding="utf-8")
+        res["report"] = str(path)
+        if run_id is not None:
+            _set_report_path(run_id, path)
+    except Exception as e:
+        logger.warning("DWH_HISTORY: report JSON non scritto: %s", e)
+
+
+# ---------------------------
+# Confronto con la baseline
+# ---------------------------
+def compare(
+    *,
+    mode: Optional[str] = None,
+    baseline_runs: int = 10,
+    top: int = 10,
+    threshold: float = 1.5,
+    min_delta_sec: float = 1.0,
+) -> Dict[str, Any]:
+    """
+    Ultimo run (eventualmente di `mode`) contro la mediana degli ultimi `baseline_runs` run
+    riusciti con stessa modalità e profilo. Uno step è "peggiorato" se supera la mediana di
+    almeno `threshold` volte e di almeno `min_delta_sec` secondi.
+    """
+    db = MySQLDb()
+    db.open()
+    try:
+        last = db.execute_query(Q.last_refresh_run_sql(mode is not None), (mode,) if mode else (),
+                                fetchall=False, query_type=QueryType.GET)
+        if not last:
+            return {"ok": False, "error": "Nessun refresh registrato in dwh_refresh_runs"}
+        base = db.execute_query(Q.baseline_refresh_runs_sql(),
+                                (last["run_id"], last["mode"], last["profile"], max(1, int(baseline_runs))),
+                                fetchall=True, query_type=QueryType.GET) or []
+        ids = [last["run_id"]] + [b["run_id"] for b in base]
+        rows = db.execute_query(Q.refresh_steps_sql(len(ids)), tuple(ids),
+                                fetchall=True, query_type=QueryType.GET) or []
+    finally:
+        db.close()
+
+    history: Dict[str, List[float]] = {}
+    current: List[Dict[str, Any]] = []
+    for r in rows:
+        if r["run_id"] == last["run_id"]:
+            current.append(r)
+        else:
+            history.setdefault(r["step_hash"], []).append(float(r["elapsed_sec"]))
+
+    steps = []
+    for r in current:
+        elapsed = float(r["elapsed_sec"])
+        past = history.get(r["step_hash"])
+        base_sec = median(past) if past else None
+        steps.append({
+            "stmt_no": r["stmt_no"],
+            "target": r["target"],
+            "label": r["label"][:120],
+            "status": r["status"],
+            "elapsed_sec": elapsed,
+            "baseline_sec": round(base_sec, 3) if base_sec is not None else None,
+            "delta_sec": round(elapsed - base_sec, 3) if base_sec is not None else None,
+            "ratio": round(elapsed / base_sec, 2) if base_sec else None,
+            "rows_affected": r["rows_affected"],
+            "warnings": r["warnings"],
+        })
+
+    regressed = [
+        s for s in steps
+        if s["baseline_sec"] is not None
+        and s["delta_sec"] >= min_delta_sec
+        and s["elapsed_sec"] >= s["baseline_sec"] * threshold
+    ]
+    base_total = [float(b["elapsed_sec"]) for b in base]
+    return {
+        "ok": True,
+        "run_id": last["run_id"],
+        "started_at": last["started_at"],
+        "mode": last["mode"],
+        "profile": last["profile"],
+        "run_ok": bool(last["ok"]),
+        "elapsed_sec": float(last["elapsed_sec"]),
+        "baseline_runs": len(base),
+        "baseline_elapsed_sec": round(median(base_total), 3) if base_total else None,
+        "new_steps": sum(1 for s in steps if s["baseline_sec"] is None),
+        "slowest": sorted(steps, key=lambda s: s["elapsed_sec"], reverse=True)[:top],
+        "regressed": sorted(regressed, key=lambda s: s["delta_sec"], reverse=True)[:top],
+    }
@@ -0,0 +1,174 @@
+# app/jobs/dwh_merge.py
+# Manutenzione delle dimensioni per merge (dwh-refresh --dim-merge).
+#
+# Con il refresh completo ogni dimensione viene ricreata e le chiavi surrogate
+# (AUTO_INCREMENT) cambiano a ogni run. In modalità merge lo script completo viene riscritto
+# prima dell'esecuzione, per ogni tabella dim_*:
+#   1) niente DROP TABLE, CREATE TABLE IF NOT EXISTS (stessa struttura)
+#   2) UPDATE ... JOIN sulla chiave naturale (UNIQUE KEY, oppure la PK se non è AUTO_INCREMENT
+#      come dim_date) delle sole righe con almeno una colonna diversa (confronto <=>)
+#   3) INSERT ... SELECT dei soli codici nuovi (anti-join sulla dimensione)
+# Le righe invariate non vengono scritte e le chiavi surrogate esistenti non cambiano; i
+# codici spariti dalla sorgente restano nella dimensione. Il confronto segue la collation
+# delle colonne (differenze di sole maiuscole/minuscole non contano come modifica).
+# I fatti restano ricostruiti a ogni run: con chiavi stabili si possono caricare anche in
+# modo incrementale. Se la struttura di una dimensione cambia nello script serve un refresh
+# completo senza --dim-merge.
+
+from __future__ import annotations
+
+import os
+import re
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.core.db import Db
+from app.jobs.dwh_bulk import _split_definitions
+from app.sql.query.dwh_queries import QuerySqlDwhMYSQL as Q
+
+logger = logging.getLogger(__name__)
+
+_DROP_DIM = re.compile(r"^DROP\s+TABLE\s+(?:IF\s+EXISTS\s+)?`?dim_\w+`?\s*$", re.I)
+_CREATE_DIM = re.compile(r"^CREATE\s+TABLE\s+`?(dim_\w+)`?\s*\(", re.I)
+_INSERT_DIM = re.compile(r"^INSERT\s+INTO\s+`?(dim_\w+)`?\s*\(", re.I)
+_MERGE_STMT = re.compile(r"^(UPDATE|INSERT\s+INTO)\s+`(dim_\w+)`", re.I)
+_COMMENT = re.compile(r"--[^\n]*")
+_ALIAS = re.compile(r"\s+AS\s+`?\w+`?\s*$", re.I)
+_PRIMARY = re.compile(r"PRIMARY\s+KEY\s*\(([^)]*)\)", re.I)
+_UNIQUE = re.compile(r"UNIQUE\s+(?:KEY|INDEX)\s+`?\w+`?\s*\(([^)]*)\)", re.I)
+
+
+def enabled(value: Optional[bool]) -> bool:
+    """--dim-merge: argomento > DWH_REFRESH_DIM_MERGE > no."""
+    if value is not None:
+        return bool(value)
+    return os.getenv("DWH_REFRESH_DIM_MERGE", "0").strip().lower() in ("1", "true", "yes", "on")
+
+
+def _columns(text: str) -> List[str]:
+    return [c.strip().strip("`") for c in text.split(",") if c.strip()]
+
+
+def _closing_paren(sql: str, open_at: int) -> int:
+    depth = 0
+    for i in range(open_at, len(sql)):
+        if sql[i] == "(":
+            depth += 1
+        elif sql[i] == ")":
+            depth -= 1
+            if depth == 0:
+                return i
+    raise ValueError("parentesi non bilanciate")
+
+
+def _top_level_from(sql: str) -> int:
+    """Posizione del FROM principale di una SELECT (fuori da parentesi e stringhe)."""
+    depth = 0
+    quote: Optional[str] = None
+    for i, ch in enumerate(sql):
+        if quote:
+            if ch == quote:
+                quote = None
+            continue
+        if ch in ("'", '"'):
+            quote = ch
+        elif ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+        elif depth == 0 and sql[i:i + 4].upper() == "FROM" \
+                and (i == 0 or not (sql[i - 1].isalnum() or sql[i - 1] in "_.`")) \
+                and not (sql[i + 4:i + 5].isalnum() or sql[i + 4:i + 5] == "_"):
+            return i
+    raise ValueError("FROM non trovato")
+
+
+def merge_keys(create_sql: str) -> List[str]:
+    """Chiave naturale di una dimensione: UNIQUE KEY, oppure PK se non AUTO_INCREMENT."""
+    sql = _COMMENT.sub("", create_sql)
+    unique = _UNIQUE.search(sql)
+    if unique:
+        return _columns(unique.group(1))
+    pk = _PRIMARY.search(sql)
+    if pk is None:
+        raise ValueError("dimensione senza PRIMARY KEY né UNIQUE KEY")
+    cols = _columns(pk.group(1))
+    for col in cols:
+        if re.search(rf"^\s*`?{col}`?\s+[^\n]*AUTO_INCREMENT", sql, re.I | re.M):
+            raise ValueError(f"PK AUTO_INCREMENT ({col}) senza UNIQUE KEY: manca la chiave naturale")
+    return cols
+
+
+def source_select(insert_sql: str) -> Tuple[str, List[str], str]:
+    """
+    Da INSERT INTO dim (colonne) SELECT ... ricava (tabella, colonne, SELECT sorgente) con
+    ogni espressione rinominata come la colonna di destinazione.
+    """
+    sql = _COMMENT.sub("", insert_sql)
+    m = _INSERT_DIM.match(sql)
+    close = _closing_paren(sql, m.end() - 1)
+    columns = _columns(sql[m.end():close])
+    body = sql[close + 1:].strip()
+    if not body.upper().startswith("SELECT"):
+        raise ValueError(f"{m.group(1)}: INSERT senza SELECT")
+    body = body[len("SELECT"):]
+    from_at = _top_level_from(body)
+    exprs = [_ALIAS.sub("", e) for e in _split_definitions(body[:from_at])]
+    if len(exprs) != len(columns):
+        raise ValueError(f"{m.group(1)}: {len(columns)} colonne e {len(exprs)} espressioni")
+    select = "SELECT\n  " + ",\n  ".join(f"{e} AS `{c}`" for e, c in zip(exprs, columns)) \
+        + "\n" + body[from_at:].strip()
+    return m.group(1).lower(), columns, select
+
+
+def prepare(stmts: List[str]) -> Tuple[List[str], Dict[str, List[str]]]:
+    """
+    Riscrive lo script completo (già senza DROP DATABASE) per il merge delle dimensioni.
+    Ritorna (statement, chiave naturale per dimensione).
+    """
+    out: List[str] = []
+    keys: Dict[str, List[str]] = {}
+    for stmt in stmts:
+        if _DROP_DIM.match(stmt):
+            continue
+        m = _CREATE_DIM.match(stmt)
+        if m:
+            keys[m.group(1).lower()] = merge_keys(stmt)
+            out.append(re.sub(r"^CREATE\s+TABLE\s+", "CREATE TABLE IF NOT EXISTS ", stmt, count=1, flags=re.I))
+            continue
+        m = _INSERT_DIM.match(stmt)
+        if m and m.group(1).lower() in keys:
+            table, columns, select = source_select(stmt)
+            key = keys[table]
+            if set(columns) - set(key):
+                out.append(Q.merge_update_dim_sql(table, columns, key, select))
+            out.append(Q.merge_insert_dim_sql(table, columns, key, select))
+            continue
+        out.append(stmt)
+    return out, keys
+
+
+class MergeCounter:
+    """Esecutore per execute_blocks che conta righe aggiornate/inserite per dimensione."""
+
+    def __init__(self, execute: Callable[[Db, str], Any]):
+        self._execute = execute
+        self._lock = threading.Lock()
+        self.rows: Dict[str, Dict[str, int]] = {}
+
+    def __call__(self, db: Db, stmt: str) -> Any:
+        result = self._execute(db, stmt)
+        m = _MERGE_STMT.match(stmt)
+        if m and isinstance(result, int) and result >= 0:
+            kind = "updated" if m.group(1).upper() == "UPDATE" else "inserted"
+            table = m.group(2).lower()
+            with self._lock:
+                self.rows.setdefault(table, {"updated": 0, "inserted": 0})[kind] += result
+            logger.info("DWH_MERGE %s: %s righe %s", table, result,
+                        "aggiornate" if kind == "updated" else "nuove")
+        return result
+
+    def report(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {t: dict(v) for t, v in sorted(self.rows.items())}
@@ -0,0 +1,199 @@
+# app/jobs/dwh_partitions.py
+# Refresh per partizione dei fatti (dwh-refresh --partitions).
+#
+# fact_docrig / fact_magmov vengono partizionate RANGE per anno sulla chiave data
+# (doc_date_key / mov_date_key, AAAAMMGG): le query filtrate per data leggono solo le
+# partizioni utili (pruning). Vincoli MySQL sulle tabelle partizionate:
+#   - niente FOREIGN KEY: alla conversione vengono rimosse
+#   - ogni chiave univoca deve contenere la colonna di partizione: la PK (fact_id) diventa
+#     un indice semplice, così la chiave data resta NULLable come nel refresh completo
+#     (le righe con data non risolta finiscono nella prima partizione, p_old)
+# La conversione avviene al primo --partitions dopo un refresh completo, che ricrea le
+# tabelle non partizionate.
+#
+# Il refresh esegue dwh_incremental.sql (dimensioni, aggregati, watermark) con lo stesso
+# percorso delle altre modalità (blocchi, storico, checkpoint e nuovi tentativi, vedi
+# dwh_refresh) ma al posto di DELETE/INSERT dei fatti ricostruisce solo le partizioni degli
+# anni toccati (PartitionExecutor): per ognuna carica una tabella di appoggio e la scambia
+# con ALTER TABLE ... EXCHANGE PARTITION.
+# Anni toccati: dall'anno di (watermark - lookback) all'anno corrente; per fact_magmov
+# anche l'anno del movimento più vecchio oltre il watermark id. Gli anni chiusi non vengono
+# riletti; p_old si aggiorna solo con il refresh completo.
+
+from __future__ import annotations
+
+import re
+import logging
+import threading
+from datetime import date, datetime
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from app.core.db import Db, QueryType, SchedulerDbException
+from app.jobs.dwh_refresh import DWH_SCHEMA
+from app.sql.query.dwh_queries import QuerySqlDwhMYSQL as Q
+
+logger = logging.getLogger(__name__)
+
+# tabella -> (colonna di partizione, INSERT nella tabella di appoggio)
+FACT_TABLES = {
+    "fact_docrig": ("doc_date_key", Q.stage_docrig_sql),
+    "fact_magmov": ("mov_date_key", Q.stage_magmov_sql),
+}
+
+# statement dei fatti dello script incrementale, sostituiti dalla ricostruzione per partizione
+_FACT_STMT = re.compile(r"^(?:INSERT\s+INTO|DELETE\s+(?:\w+\s+)?FROM)\s+(fact_docrig|fact_magmov)\b", re.I)
+
+# calcolo del primo mese degli aggregati in dwh_incremental.sql
+_AGG_FROM = re.compile(r"^SET\s+@agg_from_month\s*:=", re.I)
+
+
+def _write(db: Db, sql: str, params: Any = None) -> Any:
+    return db.execute_query(sql, params, fetchall=False, query_type=QueryType.INSERT)
+
+
+def _one(db: Db, sql: str, params: Any = ()) -> dict:
+    return db.execute_query(sql, params, fetchall=False, query_type=QueryType.GET) or {}
+
+
+def partitions(db: Db, table: str) -> List[str]:
+    rows = db.execute_query(Q.partitions_sql(), (DWH_SCHEMA, table), query_type=QueryType.GET) or []
+    return [r["partition_name"] for r in rows]
+
+
+def ensure_partitioned(db: Db, table: str) -> bool:
+    """Converte la tabella dei fatti al layout per anno se non lo è già. True se convertita."""
+    if partitions(db, table):
+        return False
+    col = FACT_TABLES[table][0]
+    cal = _one(db, Q.calendar_years_sql())
+    if not cal.get("first_year"):
+        raise SchedulerDbException("dim_date vuota: impossibile definire le partizioni")
+    constraints = db.execute_query(Q.constraints_sql(), (DWH_SCHEMA, table), query_type=QueryType.GET) or []
+    fks = [c["constraint_name"] for c in constraints if c["constraint_type"] == "FOREIGN KEY"]
+    has_pk = any(c["constraint_type"] == "PRIMARY KEY" for c in constraints)
+
+    t0 = datetime.now()
+    if fks:
+        _write(db, Q.drop_foreign_keys_sql(table, fks))
+    if has_pk:
+        _write(db, Q.drop_primary_key_sql(table))
+    _write(db, Q.partition_by_year_sql(table, col, int(cal["first_year"]), int(cal["last_year"])))
+    logger.info("DWH_PARTITIONS %s partizionata per anno (%s-%s) in %.1fs, FK rimosse: %s",
+                table, cal["first_year"], cal["last_year"], (datetime.now() - t0).total_seconds(), len(fks))
+    return True
+
+
+def rebuild_partition(db: Db, table: str, year: int) -> int:
+    """Ricarica l'anno in una tabella di appoggio e la scambia con la partizione p<anno>."""
+    stage = f"{table}_stage"
+    stage_insert = FACT_TABLES[table][1]
+    for stmt in Q.create_stage_sql(stage, table):
+        _write(db, stmt)
+    # fact_id nuovi, senza sovrapposizioni con quelli delle altre partizioni
+    next_id = int(_one(db, Q.next_fact_id_sql(table)).get("next_id") or 1)
+    _write(db, Q.set_auto_increment_sql(stage, next_id))
+    rows = _write(db, stage_insert(stage), (date(year, 1, 1), date(year + 1, 1, 1))) or 0
+    _write(db, Q.exchange_partition_sql(table, f"p{year}", stage))
+    _write(db, Q.drop_table_sql(stage))   # ora contiene le righe vecchie della partizione
+    return rows
+
+
+def affected_years(db: Db, table: str, window: dict, today: date, first_year: int) -> List[int]:
+    """
+    Anni da ricostruire per la finestra dell'incrementale (vedi intestazione), non prima del
+    primo anno del calendario: senza watermark la finestra parte dal 1900.
+    """
+    if table == "fact_docrig":
+        first = window["doc_from"].year
+    else:
+        first = window["mov_from"].year
+        wm_id = window.get("wm_mov_id")
+        oldest_new = _one(db, Q.min_new_magmov_date_sql(), (wm_id if wm_id is not None else -1,)).get("min_date")
+        if oldest_new is not None:
+            first = min(first, oldest_new.year)
+    return list(range(max(first, first_year), today.year + 1))
+
+
+def prepare(stmts: List[str], years: Optional[List[int]] = None) -> List[str]:
+    """
+    Script incrementale per --partitions: dopo il calcolo di @agg_from_month aggiunge uno
+    statement di sessione che lo estende all'inizio del primo anno ricostruito di fact_docrig
+    (gli aggregati devono coprire per intero gli anni ricaricati). Essendo di sessione, viene
+    rieseguito nel prelude di ogni blocco, anche dopo un nuovo tentativo o una ripresa.
+    """
+    first = f"{min(years)}01" if years else "YEAR(@doc_from) * 100 + 1"
+    out: List[str] = []
+    for stmt in stmts:
+        out.append(stmt)
+        if _AGG_FROM.match(stmt):
+            out.append(f"SET @agg_from_month := LEAST(@agg_from_month, {first})")
+    return out
+
+
+class PartitionExecutor:
+    """
+    Esecutore per execute_blocks: il primo statement dei fatti di ogni tabella nello script
+    diventa la ricostruzione delle partizioni (conversione compresa), gli altri non fanno
+    nulla. Un blocco rieseguito dopo un errore temporaneo ricostruisce di nuovo le stesse
+    partizioni: ogni EXCHANGE sostituisce l'anno per intero.
+    """
+
+    def __init__(self, stmts: List[str], execute: Callable[[Db, str], Any], *,
+                 years: Optional[List[int]] = None):
+        self._execute = execute
+        self._years = sorted(set(years)) if years else None
+        self._lock = threading.Lock()
+        self._rebuild_on: Dict[str, str] = {}
+        seen: Set[str] = set()
+        for stmt in stmts:
+            m = _FACT_STMT.match(stmt)
+            if m and m.group(1).lower() not in seen:
+                seen.add(m.group(1).lower())
+                self._rebuild_on[stmt] = m.group(1).lower()
+        self.converted: List[str] = []
+        self.rebuilt: Dict[str, Dict[int, int]] = {}
+
+    def describe(self) -> List[str]:
+        years = ", ".join(map(str, self._years)) if self._years else "da watermark"
+        return [f"{t}: DELETE/INSERT sostituiti da EXCHANGE PARTITION (anni: {years})"
+                for t in self._rebuild_on.values()]
+
+    def __call__(self, db: Db, stmt: str) -> Any:
+        if _FACT_STMT.match(stmt) is None:
+            return self._execute(db, stmt)
+        table = self._rebuild_on.get(stmt)
+        if table is None:
+            return 0   # già coperto dalla ricostruzione della tabella
+        return self._rebuild(db, table)
+
+    def _rebuild(self, db: Db, table: str) -> int:
+        if ensure_partitioned(db, table):
+            with self._lock:
+                self.converted.append(table)
+        existing = set(partitions(db, table))
+        # variabili di sessione calcolate dallo script (prelude del blocco)
+        window = _one(db, Q.etl_window_sql())
+        if self._years:
+            wanted = self._years
+        else:
+            cal = _one(db, Q.calendar_years_sql())
+            wanted = affected_years(db, table, window, date.today(), int(cal.get("first_year") or 0))
+        rebuilt: Dict[int, int] = {}
+        for y in wanted:
+            if f"p{y}" not in existing:
+                logger.warning("DWH_PARTITIONS %s: partizione p%s assente (fuori calendario), salto", table, y)
+                continue
+            t0 = datetime.now()
+            rebuilt[y] = rebuild_partition(db, table, y)
+            logger.info("DWH_PARTITIONS %s p%s: %s righe in %.1fs",
+                        table, y, rebuilt[y], (datetime.now() - t0).total_seconds())
+        with self._lock:
+            self.rebuilt[table] = rebuilt
+        return sum(rebuilt.values())
+
+    def report(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "converted": list(self.converted),
+                "partitions": {t: {f"p{y}": n for y, n in parts.items()} for t, parts in self.rebuilt.items()},
+            }
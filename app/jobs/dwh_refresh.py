@@ -1,29 +1,65 @@
 # app/jobs/dwh_refresh.py
-# Ricostruzione completa del DWH eseguendo app/sql/executions/dwh_executions.sql
+# Refresh del DWH:
+# - full:        ricostruzione completa eseguendo app/sql/executions/dwh_executions.sql
+# - incremental: solo righe nuove/modificate (watermark) con app/sql/executions/dwh_incremental.sql
+# - swap:        blue/green, costruisce in uno schema ombra (dwh_next) e promuove con RENAME TABLE
+# - partitions:  come incremental, ma i fatti vengono ricostruiti per partizione/anno (dwh_partitions)
+# Profilo di caricamento (full/swap): default, oppure bulk = indici e FK dei fatti rimandati (dwh_bulk)
+# Ogni esecuzione registra tempi/righe/warning per statement nello storico (dwh_history)
+# Con --skip-unchanged (full) le dimensioni con sorgenti invariate non vengono ricostruite (dwh_checksum)
+# Con --dim-merge (full) le dimensioni vengono aggiornate per merge con chiavi surrogate stabili (dwh_merge)
+# I blocchi completati vengono registrati: --resume riprende un run interrotto (dwh_checkpoint);
+# sugli errori temporanei MySQL il blocco viene ripetuto su una nuova connessione (dwh_graph)
 
 from __future__ import annotations
 
+import os
+import re
 import logging
 from datetime import datetime
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
 
-from app.core.db import DbManager, MySQLDb, QueryType
+from app.core.db import Db, MySQLDb, QueryType
+from app.jobs import dwh_bulk, dwh_checkpoint, dwh_checksum, dwh_history, dwh_merge
+from app.jobs.dwh_graph import build_blocks, describe_blocks, execute_blocks
+from app.sql.query.dwh_queries import QuerySqlDwhMYSQL as Q
 
 logger = logging.getLogger(__name__)
 
-# Percorso del file SQL con tutti i CREATE/INSERT del DWH
-SQL_FILE = (
+SQL_DIR = (
     Path(__file__)
     .resolve()
     .parents[1]  # sali da jobs/ a app/
     / "sql"
     / "executions"
-    / "dwh_executions.sql"
 )
 
+# Percorso del file SQL con tutti i CREATE/INSERT del DWH
+SQL_FILE = SQL_DIR / "dwh_executions.sql"
+
+# Refresh incrementale dei fatti (richiede un DWH già costruito in modalità full)
+SQL_FILE_INCREMENTAL = SQL_DIR / "dwh_incremental.sql"
+
+MODE_FULL = "full"
+MODE_INCREMENTAL = "incremental"
+MODE_SWAP = "swap"
+MODE_PARTITIONS = "partitions"
+
+SQL_FILES = {
+    MODE_FULL: SQL_FILE,
+    MODE_INCREMENTAL: SQL_FILE_INCREMENTAL,
+    MODE_SWAP: SQL_FILE,
+    MODE_PARTITIONS: SQL_FILE_INCREMENTAL,
+}
+
+# Schemi usati dal refresh blue/green
+DWH_SCHEMA = "dwh"            # schema letto dai report
+DWH_SHADOW_SCHEMA = "dwh_next"  # costruzione "al buio"
+DWH_BACKUP_SCHEMA = "dwh_old"   # tabelle della versione precedente (rollback manuale)
 
-def _load_sql_statements(path: Path) -> List[str]:
+
+def load_sql_statements(path: Path) -> List[str]:
     """
     Carica il file .sql e lo splitta in statement singoli.
     - Rimuove le righe che iniziano con "--"
@@ -83,59 +119,408 @@ def _guess_query_type(sql: str) -> QueryType:
     return QueryType.GET
 
 
-def run(*, dry_run: bool = False) -> Dict[str, Any]:
+def execute_statement(db: Db, stmt: str) -> Any:
+    return db.execute_query(stmt, None, fetchall=False, query_type=_guess_query_type(stmt))
+
+
+def _is_view_statement(sql: str) -> bool:
+    words = sql.split(None, 4)
+    head = " ".join(w.upper() for w in words[:4])
+    return head.startswith(("CREATE VIEW", "DROP VIEW", "CREATE OR REPLACE VIEW"))
+
+
+def _retarget_schema(sql: str, schema: str) -> str:
+    """Sostituisce lo schema `dwh` (nome nudo o qualificato, es. dwh.dim_date) con `schema`."""
+    sql = sql.replace(f"`{DWH_SCHEMA}`", f"`{schema}`")
+    return re.sub(rf"(?<![\w.`]){DWH_SCHEMA}(?![\w`])", schema, sql)
+
+
+def _split_shadow_build(stmts: List[str]) -> tuple[List[str], List[str]]:
+    """
+    Prepara il refresh blue/green a partire dallo script completo:
+    - build: tutti gli statement NON di vista, puntati sullo schema ombra
+    - views: le CREATE VIEW trasformate in CREATE OR REPLACE VIEW sul DWH live
+      (niente DROP VIEW: la vista viene sostituita in un colpo solo)
+    """
+    build: List[str] = []
+    views: List[str] = []
+    for stmt in stmts:
+        if _is_view_statement(stmt):
+            if stmt.split(None, 1)[0].upper() == "CREATE":
+                views.append(re.sub(r"^\s*CREATE\s+(OR\s+REPLACE\s+)?VIEW",
+                                    "CREATE OR REPLACE VIEW", stmt, count=1, flags=re.IGNORECASE))
+            continue
+        build.append(_retarget_schema(stmt, DWH_SHADOW_SCHEMA))
+    return build, views
+
+
+class PromotionError(Exception):
+    """Promozione dello schema ombra interrotta: `renamed` dice se il RENAME è già avvenuto."""
+
+    def __init__(self, step: str, renamed: bool, error: Exception):
+        super().__init__(f"{step}: {error}")
+        self.step = step
+        self.renamed = renamed
+        self.error = error
+
+
+def _promote_shadow(db, view_stmts: List[str]) -> Dict[str, Any]:
+    """
+    Promuove lo schema ombra sul DWH live:
+    1) dwh_old viene svuotato (tiene solo la versione precedente)
+    2) un UNICO RENAME TABLE sposta dwh.* -> dwh_old.* e dwh_next.* -> dwh.*
+       (atomico: i report vedono o tutte le tabelle vecchie o tutte le nuove)
+    3) le viste vengono ricreate con CREATE OR REPLACE VIEW su dwh
+    4) lo schema ombra (ormai vuoto) viene eliminato
+    Un errore solleva PromotionError con il passo fallito e se il RENAME è già avvenuto.
+    """
+    step = "lettura schema ombra"
+    renamed = False
+    try:
+        shadow_tables = [
+            r["table_name"]
+            for r in db.execute_query(Q.list_base_tables_sql(), (DWH_SHADOW_SCHEMA,), fetchall=True) or []
+        ]
+        if not shadow_tables:
+            raise RuntimeError(f"Schema ombra {DWH_SHADOW_SCHEMA} vuoto: promozione annullata")
+
+        step = f"preparazione {DWH_BACKUP_SCHEMA}"
+        db.execute_query(Q.create_schema_sql(DWH_SCHEMA), None, fetchall=False, query_type=QueryType.INSERT)
+        db.execute_query(Q.drop_schema_sql(DWH_BACKUP_SCHEMA), None, fetchall=False, query_type=QueryType.INSERT)
+        db.execute_query(Q.create_schema_sql(DWH_BACKUP_SCHEMA), None, fetchall=False, query_type=QueryType.INSERT)
+
+        live_tables = [
+            r["table_name"]
+            for r in db.execute_query(Q.list_base_tables_sql(), (DWH_SCHEMA,), fetchall=True) or []
+        ]
+        moves = [(DWH_SCHEMA, t, DWH_BACKUP_SCHEMA, t) for t in live_tables]
+        moves += [(DWH_SHADOW_SCHEMA, t, DWH_SCHEMA, t) for t in shadow_tables]
+
+        logger.info("DWH_SWAP: promozione di %s tabelle (%s archiviate in %s)",
+                    len(shadow_tables), len(live_tables), DWH_BACKUP_SCHEMA)
+        step = "RENAME TABLE"
+        db.execute_query(Q.rename_tables_sql(moves), None, fetchall=False, query_type=QueryType.INSERT)
+        renamed = True
+
+        step = "viste"
+        db.execute_query(f"USE {DWH_SCHEMA}", None, fetchall=False, query_type=QueryType.GET)
+        for stmt in view_stmts:
+            logger.info("DWH_SWAP vista: %s", " ".join(stmt.split())[:120])
+            db.execute_query(stmt, None, fetchall=False, query_type=QueryType.INSERT)
+
+        step = f"DROP {DWH_SHADOW_SCHEMA}"
+        db.execute_query(Q.drop_schema_sql(DWH_SHADOW_SCHEMA), None, fetchall=False, query_type=QueryType.INSERT)
+    except Exception as e:
+        raise PromotionError(step, renamed, e) from e
+    return {"tables_promoted": len(shadow_tables), "views": len(view_stmts)}
+
+
+def resolve_lookback_days(value: Optional[int]) -> int:
+    """Finestra di rilettura (giorni) per il refresh incrementale: argomento > .env > 7."""
+    if value is not None:
+        return max(0, int(value))
+    return max(0, int(os.getenv("DWH_INCREMENTAL_LOOKBACK_DAYS", "7")))
+
+
+def _jobs(value: Optional[int]) -> int:
+    """Blocchi eseguiti in parallelo: argomento > DWH_REFRESH_JOBS > 1 (sequenziale)."""
+    if value is not None:
+        return max(1, int(value))
+    return max(1, int(os.getenv("DWH_REFRESH_JOBS", "1")))
+
+
+def _retries(value: Optional[int]) -> int:
+    """Nuovi tentativi di un blocco dopo un errore temporaneo: argomento > DWH_REFRESH_RETRIES > 2."""
+    if value is not None:
+        return max(0, int(value))
+    return max(0, int(os.getenv("DWH_REFRESH_RETRIES", "2")))
+
+
+def _retry_backoff() -> float:
+    """Attesa prima del primo nuovo tentativo (secondi, raddoppia a ogni tentativo)."""
+    return max(0.0, float(os.getenv("DWH_REFRESH_RETRY_BACKOFF", "5")))
+
+
+def _profile(value: Optional[str]) -> str:
+    """Profilo di caricamento: argomento > DWH_REFRESH_PROFILE > default."""
+    profile = (value or os.getenv("DWH_REFRESH_PROFILE") or dwh_bulk.PROFILE_DEFAULT).strip().lower()
+    if profile not in dwh_bulk.PROFILES:
+        raise ValueError(f"Profilo DWH_REFRESH non valido: {profile}")
+    return profile
+
+
+def run(
+    *,
+    dry_run: bool = False,
+    mode: str = MODE_FULL,
+    lookback_days: Optional[int] = None,
+    jobs: Optional[int] = None,
+    years: Optional[List[int]] = None,
+    profile: Optional[str] = None,
+    explain: Optional[bool] = None,
+    report_out: Optional[str] = None,
+    skip_unchanged: Optional[bool] = None,
+    dim_merge: Optional[bool] = None,
+    resume: bool = False,
+    retries: Optional[int] = None,
+) -> Dict[str, Any]:
     """
     Job principale chiamato dal tuo scheduler.
 
-    - Legge dwh_executions.sql
-    - Esegue TUTTI gli statement in ordine, dentro una singola connessione MySQL
+    - mode="full":        legge dwh_executions.sql (DROP DATABASE + ricarica completa)
+    - mode="incremental": legge dwh_incremental.sql e ricarica solo i documenti/movimenti
+                          successivi al watermark salvato in dwh.etl_watermark
+                          (meno `lookback_days` giorni per intercettare le modifiche)
+    - mode="swap":        esegue dwh_executions.sql sullo schema ombra dwh_next e poi
+                          promuove tutte le tabelle con un solo RENAME TABLE; il DWH resta
+                          interrogabile (versione precedente) per tutta la durata del refresh
+    - mode="partitions":  come incremental, ma fact_docrig/fact_magmov sono partizionate per
+                          anno e vengono ricostruite solo le partizioni toccate (o `years`)
+                          con EXCHANGE PARTITION (vedi dwh_partitions)
+    - profile="bulk" (full/swap): fatti creati con la sola PK e caricati con controlli FK/unique
+      disattivati, indici e FK aggiunti dopo in un solo ALTER, poi conteggio delle righe
+      orfane; tempi per fase nel risultato (vedi dwh_bulk)
+    - skip_unchanged (solo full): niente DROP DATABASE, i blocchi con SQL e sorgenti
+      fox_staging invariati dall'ultima costruzione (e senza dipendenze ricostruite) vengono
+      saltati; motivo di ogni salto/ricostruzione nel log e nel risultato (vedi dwh_checksum)
+    - dim_merge (solo full): le dimensioni non vengono ricreate ma aggiornate sulla chiave
+      naturale (UPDATE delle sole righe cambiate + INSERT dei codici nuovi), le chiavi
+      surrogate restano stabili tra un run e l'altro (vedi dwh_merge)
+    - resume: i blocchi completati da un run interrotto con lo stesso script
+      non vengono rieseguiti, si riparte dal primo blocco incompleto (vedi dwh_checkpoint)
+    - retries: un blocco fallito per un errore temporaneo (connessione persa, lock wait
+      timeout, deadlock) viene rieseguito da capo su una nuova connessione, con attesa
+      crescente (default DWH_REFRESH_RETRIES=2, DWH_REFRESH_RETRY_BACKOFF=5 secondi)
+    - Tempo, righe e warning di ogni statement (più EXPLAIN della SELECT con `explain`)
+      vanno in dwh_refresh_runs/dwh_refresh_steps e in un report JSON (vedi dwh_history)
+    - Divide lo script in blocchi per tabella (vedi dwh_graph) ed esegue i blocchi
+      indipendenti in parallelo su al massimo `jobs` connessioni (jobs=1: tutto in
+      ordine su una sola connessione, come prima)
     - Logga in plax_scheduler.log
     - Restituisce un dict riassuntivo
     """
     start_ts = datetime.now()
 
-    if not SQL_FILE.exists():
-        msg = f"File SQL DWH non trovato: {SQL_FILE}"
+    if mode not in SQL_FILES:
+        raise ValueError(f"Modalità DWH_REFRESH non valida: {mode}")
+    sql_file = SQL_FILES[mode]
+    profile = _profile(profile)
+    if profile == dwh_bulk.PROFILE_BULK and mode not in (MODE_FULL, MODE_SWAP):
+        raise ValueError(f"Il profilo {profile} vale solo per il refresh completo (full/swap)")
+    skip_unchanged = dwh_checksum.enabled(skip_unchanged)
+    if skip_unchanged and mode != MODE_FULL:
+        raise ValueError("--skip-unchanged vale solo per il refresh completo (full)")
+    dim_merge = dwh_merge.enabled(dim_merge)
+    if dim_merge and mode != MODE_FULL:
+        raise ValueError("--dim-merge vale solo per il refresh completo (full)")
+
+    if not sql_file.exists():
+        msg = f"File SQL DWH non trovato: {sql_file}"
         logger.error(msg)
         raise FileNotFoundError(msg)
 
-    stmts = _load_sql_statements(SQL_FILE)
+    stmts = load_sql_statements(sql_file)
+    if mode in (MODE_INCREMENTAL, MODE_PARTITIONS):
+        # parametro di sessione letto da dwh_incremental.sql
+        stmts.insert(0, f"SET @lookback_days := {resolve_lookback_days(lookback_days)}")
+    partitioner = None
+    if mode == MODE_PARTITIONS:
+        # import qui: dwh_partitions usa DWH_SCHEMA di questo modulo
+        from app.jobs import dwh_partitions
+        stmts = dwh_partitions.prepare(stmts, years)
+        partitioner = dwh_partitions.PartitionExecutor(stmts, execute_statement, years=years)
+    bulk_fks: Dict[str, List[dwh_bulk.ForeignKey]] = {}
+    timer: Optional[dwh_bulk.PhaseTimer] = None
+    if profile == dwh_bulk.PROFILE_BULK:
+        stmts, bulk_fks = dwh_bulk.prepare(stmts)
+        timer = dwh_bulk.PhaseTimer(execute_statement)
+    if skip_unchanged or dim_merge:
+        stmts = dwh_checksum.prepare(stmts)
+    merge: Optional[dwh_merge.MergeCounter] = None
+    if dim_merge:
+        stmts, merge_keys = dwh_merge.prepare(stmts)
+        logger.info("DWH_MERGE dimensioni per chiave naturale: %s",
+                    ", ".join(f"{t}({'+'.join(k)})" for t, k in merge_keys.items()))
+    view_stmts: List[str] = []
+    if mode == MODE_SWAP:
+        stmts, view_stmts = _split_shadow_build(stmts)
     total = len(stmts)
-    logger.info("DWH_REFRESH start: file=%s, statements=%s", SQL_FILE, total)
+    n_jobs = _jobs(jobs)
+    blocks = build_blocks(stmts)
+    n_retries = _retries(retries)
+    logger.info("DWH_REFRESH start: mode=%s, profile=%s, dim_merge=%s, resume=%s, file=%s, statements=%s, "
+                "blocks=%s, jobs=%s, retries=%s",
+                mode, profile, dim_merge, resume, sql_file, total, len(blocks), n_jobs, n_retries)
+
+    changes: Optional[dwh_checksum.ChangePlan] = None
+    if skip_unchanged:
+        # sola lettura: le decisioni vengono loggate anche in dry-run
+        db = MySQLDb()
+        db.open()
+        try:
+            changes = dwh_checksum.plan(db, blocks, DWH_SCHEMA)
+        finally:
+            db.close()
+
+    checkpoints = dwh_checkpoint.Checkpoints(blocks, stmts, mode)
+    resumed: Dict[int, str] = {}
+    if resume:
+        try:
+            resumed = checkpoints.load()
+        except Exception as e:
+            checkpoints.close()
+            logger.warning("DWH_CHECKPOINT: checkpoint non leggibili, ripresa da zero: %s", e)
 
     if dry_run:
+        checkpoints.close()
         # solo logga gli statement senza eseguirli
         for i, stmt in enumerate(stmts, 1):
             one_line = " ".join(stmt.split())
             logger.info("[DRY-RUN] #%s: %s", i, one_line[:200])
-        return {"ok": True, "dry_run": True, "statements": total}
+        for line in describe_blocks(blocks):
+            logger.info("[DRY-RUN] blocco %s", line)
+        if partitioner is not None:
+            for line in partitioner.describe():
+                logger.info("[DRY-RUN] %s", line)
+        if mode == MODE_SWAP:
+            logger.info("[DRY-RUN] RENAME TABLE %s.* -> %s.*, %s.* -> %s.*",
+                        DWH_SCHEMA, DWH_BACKUP_SCHEMA, DWH_SHADOW_SCHEMA, DWH_SCHEMA)
+            for stmt in view_stmts:
+                logger.info("[DRY-RUN] vista: %s", " ".join(stmt.split())[:200])
+        res = {"ok": True, "dry_run": True, "mode": mode, "profile": profile,
+               "statements": total, "blocks": len(blocks)}
+        if changes is not None:
+            res["unchanged"] = changes.summary()
+        if resume:
+            res["resumed"] = [b.name for b in blocks if b.index in resumed]
+        return res
 
-    executed = 0
+    if not resume:
+        try:
+            checkpoints.reset()
+        except Exception as e:   # il run prosegue, ma non sarà riprendibile
+            checkpoints.close()
+            logger.warning("DWH_CHECKPOINT: checkpoint non azzerati: %s", e)
 
-    # Usa la stessa infrastruttura DB del resto del progetto
-    with DbManager(MySQLDb()) as db:
-        for i, stmt in enumerate(stmts, 1):
-            qtype = _guess_query_type(stmt)
-            preview = " ".join(stmt.split())[:120]
+    execute = timer or partitioner or execute_statement
+    if changes is not None:
+        execute = dwh_checksum.without_fk_checks(execute)
+    if dim_merge:
+        execute = merge = dwh_merge.MergeCounter(execute)
+    profiler = dwh_history.StepProfiler(
+        stmts, execute, explain=dwh_history.explain_enabled(explain),
+        schema=DWH_SHADOW_SCHEMA if mode == MODE_SWAP else DWH_SCHEMA,
+    )
+    try:
+        res_exec = execute_blocks(blocks, jobs=n_jobs, db_factory=MySQLDb, execute=profiler,
+                                  skip=changes.skip if changes is not None else None,
+                                  resumed=resumed, on_complete=checkpoints.mark,
+                                  retries=n_retries, backoff_sec=_retry_backoff())
+    finally:
+        checkpoints.close()
+    executed = res_exec["executed"]
+    if changes is not None:
+        try:
+            dwh_checksum.save(changes, res_exec["report"])
+        except Exception as e:   # al prossimo run i blocchi vengono solo ricostruiti
+            logger.warning("DWH_CHECKSUM: stato dei blocchi non salvato: %s", e)
 
-            logger.info("Esecuzione statement %s/%s (%s): %s", i, total, qtype.name, preview)
+    orphans: Dict[str, Dict[str, int]] = {}
+    integrity_ok = True
+    integrity_error: Optional[str] = None
+    if bulk_fks and res_exec["ok"]:
+        # prima della promozione: con righe orfane lo schema ombra non va in linea
+        t0 = datetime.now()
+        try:
+            db = MySQLDb()
+            db.open()
+            try:
+                orphans = dwh_bulk.check_integrity(
+                    db, DWH_SHADOW_SCHEMA if mode == MODE_SWAP else DWH_SCHEMA, bulk_fks)
+            finally:
+                db.close()
+            integrity_ok = not any(n for fks in orphans.values() for n in fks.values())
+        except Exception as e:   # controllo non eseguito: niente promozione, run fallito
+            integrity_ok = False
+            integrity_error = str(e)
+            logger.error("DWH_BULK controllo integrità non eseguito: %s", e)
+        timer.add(dwh_bulk.PHASE_INTEGRITY, (datetime.now() - t0).total_seconds())
 
+    swap: Dict[str, Any] = {}
+    swap_error: Optional[str] = None
+    # la promozione avviene SOLO se lo schema ombra è stato costruito per intero
+    if mode == MODE_SWAP and res_exec["ok"] and integrity_ok:
+        try:
+            db = MySQLDb()
+            db.open()
             try:
-                db.execute_query(stmt, None, fetchall=False, query_type=qtype)
-                executed += 1
-            except Exception as e:
-                logger.exception(
-                    "Errore su statement %s/%s (type=%s): %s\nSQL: %s",
-                    i, total, qtype.name, e, stmt,
-                )
-                raise
+                swap = _promote_shadow(db, view_stmts)
+            finally:
+                db.close()
+        except PromotionError as e:
+            swap_error = str(e)
+            if e.renamed:
+                logger.error("DWH_SWAP fallito DOPO il RENAME (%s): le tabelle nuove sono in %s, quelle "
+                             "precedenti in %s; viste e/o %s da sistemare a mano: %s",
+                             e.step, DWH_SCHEMA, DWH_BACKUP_SCHEMA, DWH_SHADOW_SCHEMA, e.error)
+            else:
+                logger.error("DWH_SWAP fallito PRIMA del RENAME (%s): %s invariato, costruzione in %s: %s",
+                             e.step, DWH_SCHEMA, DWH_SHADOW_SCHEMA, e.error)
+        except Exception as e:   # connessione non aperta: nessuna modifica
+            swap_error = f"connessione: {e}"
+            logger.error("DWH_SWAP non eseguito: %s", e)
 
     elapsed = (datetime.now() - start_ts).total_seconds()
-    logger.info("DWH_REFRESH completato: executed=%s/%s, elapsed=%.1fs", executed, total, elapsed)
+    if timer is not None:
+        for phase, sec in timer.report().items():
+            logger.info("DWH_REFRESH fase %s: %.1fs", phase, sec)
+    if res_exec["ok"] and integrity_ok and swap_error is None:
+        logger.info("DWH_REFRESH completato: mode=%s, executed=%s/%s, elapsed=%.1fs", mode, executed, total, elapsed)
+    else:
+        for f in res_exec["failures"]:
+            logger.error("DWH_REFRESH blocco %s fallito allo statement %s: %s\nSQL: %s",
+                         f["block"], f.get("statement"), f.get("error"), f.get("sql"))
 
-    return {
-        "ok": True,
+    res = {
+        "ok": res_exec["ok"] and integrity_ok,
+        "mode": mode,
+        "profile": profile,
         "statements": total,
         "executed": executed,
+        "blocks": res_exec["blocks"],
+        "blocks_ok": res_exec["blocks_ok"],
+        "jobs": n_jobs,
         "elapsed_sec": elapsed,
     }
+    if res_exec["failures"]:
+        res["failures"] = res_exec["failures"]
+    if timer is not None:
+        res["phases"] = timer.report()
+        res["orphans"] = orphans
+        if integrity_error is not None:
+            res["integrity_error"] = integrity_error
+    if merge is not None:
+        res["dim_merge"] = merge.report()
+    if changes is not None:
+        res["blocks_unchanged"] = res_exec["blocks_unchanged"]
+        res["unchanged"] = changes.summary()
+    if partitioner is not None:
+        res.update(partitioner.report())
+    if mode == MODE_SWAP:
+        res["ok"] = res["ok"] and bool(swap)
+        res.update(swap)
+        if swap_error is not None:
+            res["swap_error"] = swap_error
+    if resume:
+        res["blocks_resumed"] = res_exec["blocks_resumed"]
+    if res_exec["retries"]:
+        res["retries"] = res_exec["retries"]
+    if res["ok"]:
+        try:
+            checkpoints.clear()
+        except Exception as e:
+            logger.warning("DWH_CHECKPOINT: checkpoint non cancellati: %s", e)
+        finally:
+            checkpoints.close()
+    dwh_history.record(res, profiler, started_at=start_ts, report_out=report_out)
+    return res
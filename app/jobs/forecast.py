@@ -0,0 +1,359 @@
+# app/jobs/forecast.py
+# Previsione del carico di manutenzione su un orizzonte lungo (capacity planning).
+#
+# Proietta TUTTE le occorrenze future delle regole attive con la stessa logica di
+# vw_maintenance_next_due:
+#   prossima = MIN sulle regole del task di (ancora + intervallo), ancora = ultimo intervento
+#   oppure created_at; ogni occorrenza diventa la nuova ancora (si assume eseguita in data).
+#   MONTHLY/YEARLY seguono DATE_ADD di MySQL (31/01 + 1 mese = 28/02, poi 28/03, ...).
+# Le scadenze già passate vengono contate OGGI e la catena riparte da oggi.
+#
+# Due letture massive (task + ultimo intervento, regole), poi calcolo in memoria:
+# con numpy (facoltativo) a vettori su tutti i task insieme, altrimenti task per task.
+# Risultato aggregato per reparto x settimana ISO: occorrenze e minuti stimati.
+
+from __future__ import annotations
+
+import csv
+import io
+import json
+import logging
+from calendar import monthrange
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.core.db import Db, QueryType, db_session
+from app.jobs.manutenzioni import TZ
+from app.sql.query.maintenance_queries import QuerySqlManutenzioniMYSQL as Q
+
+np = None  # numpy (facoltativo) viene importato da run_forecast, non all'import del modulo
+
+logger = logging.getLogger(__name__)
+
+
+def _numpy():
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:  # calcolo task per task
+            return None
+        np = numpy
+    return np
+
+
+_EPOCH = date(1970, 1, 1)
+_NO_DEPT = "(senza reparto)"
+
+
+@dataclass
+class _TaskPlan:
+    task_id: int
+    department: str
+    minutes: int                 # estimated_minutes (0 se assente)
+    has_estimate: bool
+    anchor: date
+    step_days: Optional[int]     # INTERVAL_DAYS / WEEKLY (minimo tra le regole)
+    step_months: Optional[int]   # MONTHLY / YEARLY (minimo tra le regole)
+
+
+# ---------------------------
+# Util date
+# ---------------------------
+def _as_date(v: Any) -> Optional[date]:
+    if v is None:
+        return None
+    if isinstance(v, datetime):
+        return v.date()
+    if isinstance(v, date):
+        return v
+    return datetime.fromisoformat(str(v)).date()
+
+
+def _add_months(d: date, months: int) -> date:
+    """DATE_ADD(d, INTERVAL n MONTH): il giorno viene troncato all'ultimo del mese."""
+    m = d.month - 1 + months
+    y, m = d.year + m // 12, m % 12 + 1
+    return date(y, m, min(d.day, monthrange(y, m)[1]))
+
+
+def _rule_step(rule: dict) -> Optional[Tuple[str, int]]:
+    kind = rule.get("kind")
+    if kind == "INTERVAL_DAYS":
+        n, unit = rule.get("interval_days"), "D"
+    elif kind == "WEEKLY":
+        n, unit = (rule.get("interval_weeks") or 0) * 7 or None, "D"
+    elif kind == "MONTHLY":
+        n, unit = rule.get("interval_months"), "M"
+    elif kind == "YEARLY":
+        n, unit = (rule.get("interval_years") or 0) * 12 or None, "M"
+    else:
+        return None
+    # intervallo NULL => DATE_ADD NULL, ignorato dal MIN della vista; <= 0 non ha senso proiettarlo
+    if not n or int(n) <= 0:
+        return None
+    return unit, int(n)
+
+
+# ---------------------------
+# Lettura
+# ---------------------------
+def load_plans(db: Optional[Db] = None) -> List[_TaskPlan]:
+    with db_session(db) as db:
+        tasks = db.execute_query(Q.forecast_tasks_sql(), (), query_type=QueryType.GET) or []
+        rules = db.execute_query(Q.forecast_rules_sql(), (), query_type=QueryType.GET) or []
+
+    steps: Dict[int, Dict[str, int]] = {}
+    for r in rules:
+        st = _rule_step(r)
+        if st is None:
+            continue
+        unit, n = st
+        per_task = steps.setdefault(int(r["task_id"]), {})
+        per_task[unit] = min(n, per_task.get(unit, n))
+
+    plans: List[_TaskPlan] = []
+    for t in tasks:
+        st = steps.get(int(t["task_id"]))
+        if not st:
+            continue   # nessuna regola attiva: il task non compare nemmeno nella vista
+        anchor = _as_date(t.get("last_done_at")) or _as_date(t.get("created_at"))
+        if anchor is None:
+            continue
+        minutes = t.get("estimated_minutes")
+        plans.append(_TaskPlan(
+            task_id=int(t["task_id"]),
+            department=t.get("department_name") or _NO_DEPT,
+            minutes=int(minutes or 0),
+            has_estimate=minutes is not None,
+            anchor=anchor,
+            step_days=st.get("D"),
+            step_months=st.get("M"),
+        ))
+    return plans
+
+
+# ---------------------------
+# Proiezione task per task (fallback / regole miste giorni+mesi)
+# ---------------------------
+def _next_after(anchor: date, p: _TaskPlan) -> date:
+    cands = []
+    if p.step_days:
+        cands.append(anchor + timedelta(days=p.step_days))
+    if p.step_months:
+        cands.append(_add_months(anchor, p.step_months))
+    return min(cands)
+
+
+def _occurrences_scalar(p: _TaskPlan, today: date, end: date) -> List[date]:
+    out: List[date] = []
+    anchor = p.anchor
+    nxt = _next_after(anchor, p)
+    if nxt < today:
+        # scaduta: la si conta oggi e la catena riparte da oggi
+        out.append(today)
+        nxt = _next_after(today, p)
+    while nxt <= end:
+        out.append(nxt)
+        nxt = _next_after(nxt, p)
+    return out
+
+
+# ---------------------------
+# Proiezione vettoriale (numpy)
+# ---------------------------
+def _expand(first: "np.ndarray", n: "np.ndarray") -> Tuple["np.ndarray", "np.ndarray"]:
+    """Per ogni riga i ripete i n[i] volte; ritorna (indice riga, k = 0..n[i]-1)."""
+    idx = np.repeat(np.arange(len(first)), n)
+    starts = np.cumsum(n) - n
+    k = np.arange(len(idx)) - np.repeat(starts, n)
+    return idx, k
+
+
+def _month_dim(months: "np.ndarray") -> "np.ndarray":
+    """Giorni del mese; months = anno*12 + (mese-1)."""
+    m = (months - 1970 * 12).astype("datetime64[M]")
+    return ((m + 1).astype("datetime64[D]") - m.astype("datetime64[D]")).astype(np.int64)
+
+
+def _month_day_to_days(months: "np.ndarray", day: "np.ndarray") -> "np.ndarray":
+    m = (months - 1970 * 12).astype("datetime64[M]")
+    return (m.astype("datetime64[D]") - np.datetime64("1970-01-01", "D")).astype(np.int64) + day - 1
+
+
+def _project_days(plans: List[_TaskPlan], rows: "np.ndarray", today: int, end: int):
+    anchor = np.array([(plans[i].anchor - _EPOCH).days for i in rows], dtype=np.int64)
+    step = np.array([plans[i].step_days for i in rows], dtype=np.int64)
+
+    first = anchor + step
+    overdue = first < today
+    first = np.where(overdue, today + step, first)
+
+    n = np.where(first <= end, (end - first) // step + 1, 0)
+    idx, k = _expand(first, n)
+    occ = first[idx] + k * step[idx]
+    return (
+        np.concatenate([np.full(int(overdue.sum()), today, dtype=np.int64), occ]),
+        np.concatenate([rows[overdue], rows[idx]]),
+    )
+
+
+def _project_months(plans: List[_TaskPlan], rows: "np.ndarray", today_d: date, end_d: date):
+    today = (today_d - _EPOCH).days
+    end = (end_d - _EPOCH).days
+    a_month = np.array([plans[i].anchor.year * 12 + plans[i].anchor.month - 1 for i in rows], dtype=np.int64)
+    a_day = np.array([plans[i].anchor.day for i in rows], dtype=np.int64)
+    step = np.array([plans[i].step_months for i in rows], dtype=np.int64)
+
+    first_m = a_month + step
+    first = _month_day_to_days(first_m, np.minimum(a_day, _month_dim(first_m)))
+    overdue = first < today
+    # scadute: occorrenza oggi, la catena riparte da oggi
+    a_month = np.where(overdue, today_d.year * 12 + today_d.month - 1, a_month)
+    a_day = np.where(overdue, today_d.day, a_day)
+    first_m = a_month + step
+
+    end_m = end_d.year * 12 + end_d.month - 1
+    n = np.where(first_m <= end_m, (end_m - first_m) // step + 1, 0)
+    idx, k = _expand(first_m, n)
+    months = first_m[idx] + k * step[idx]
+
+    # giorno "trascinato" da DATE_ADD: minimo cumulato dei giorni-mese, per task.
+    # Il -idx*64 separa i task in un unico accumulate (ogni task parte sotto il precedente).
+    dim = _month_dim(months)
+    day = np.minimum.accumulate(dim - idx * 64) + idx * 64
+    day = np.minimum(day, a_day[idx])
+
+    occ = _month_day_to_days(months, day)
+    keep = occ <= end
+    return (
+        np.concatenate([np.full(int(overdue.sum()), today, dtype=np.int64), occ[keep]]),
+        np.concatenate([rows[overdue], rows[idx][keep]]),
+    )
+
+
+def _project_numpy(plans: List[_TaskPlan], today: date, end: date):
+    kinds = np.array([
+        0 if p.step_days and p.step_months else (1 if p.step_days else 2) for p in plans
+    ], dtype=np.int8)
+    t0, t1 = (today - _EPOCH).days, (end - _EPOCH).days
+
+    parts_occ, parts_idx = [], []
+    day_rows = np.flatnonzero(kinds == 1)
+    if len(day_rows):
+        occ, idx = _project_days(plans, day_rows, t0, t1)
+        parts_occ.append(occ)
+        parts_idx.append(idx)
+    month_rows = np.flatnonzero(kinds == 2)
+    if len(month_rows):
+        occ, idx = _project_months(plans, month_rows, today, end)
+        parts_occ.append(occ)
+        parts_idx.append(idx)
+    for i in np.flatnonzero(kinds == 0):   # regole miste (rare): catena task per task
+        occ = [(d - _EPOCH).days for d in _occurrences_scalar(plans[i], today, end)]
+        parts_occ.append(np.array(occ, dtype=np.int64))
+        parts_idx.append(np.full(len(occ), i, dtype=np.int64))
+
+    if not parts_occ:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return np.concatenate(parts_occ), np.concatenate(parts_idx)
+
+
+# ---------------------------
+# Aggregazione reparto x settimana ISO
+# ---------------------------
+def _week_row(department: str, week_start: date, occurrences: int, minutes: int, missing: int) -> Dict[str, Any]:
+    iso = week_start.isocalendar()
+    return {
+        "department": department,
+        "iso_week": f"{iso[0]}-W{iso[1]:02d}",
+        "week_start": week_start.isoformat(),
+        "occurrences": int(occurrences),
+        "estimated_minutes": int(minutes),
+        "without_estimate": int(missing),
+    }
+
+
+def _aggregate_numpy(plans: List[_TaskPlan], occ: "np.ndarray", idx: "np.ndarray") -> List[Dict[str, Any]]:
+    if not len(occ):
+        return []
+    depts = sorted({p.department for p in plans})
+    dept_no = {d: i for i, d in enumerate(depts)}
+    task_dept = np.array([dept_no[p.department] for p in plans], dtype=np.int64)
+    task_min = np.array([p.minutes for p in plans], dtype=np.int64)
+    task_missing = np.array([0 if p.has_estimate else 1 for p in plans], dtype=np.int64)
+
+    week_start = occ - (occ + 3) % 7        # 01/01/1970 era giovedì: lunedì della settimana
+    key = week_start * len(depts) + task_dept[idx]
+    keys, inv = np.unique(key, return_inverse=True)
+    counts = np.bincount(inv)
+    minutes = np.bincount(inv, weights=task_min[idx]).astype(np.int64)
+    missing = np.bincount(inv, weights=task_missing[idx]).astype(np.int64)
+
+    out = []
+    for j, k in enumerate(keys):
+        ws, d = divmod(int(k), len(depts))
+        out.append(_week_row(depts[d], _EPOCH + timedelta(days=ws), counts[j], minutes[j], missing[j]))
+    return out
+
+
+def _aggregate_python(plans: List[_TaskPlan], today: date, end: date) -> Tuple[List[Dict[str, Any]], int]:
+    acc: Dict[Tuple[date, str], List[int]] = {}
+    total = 0
+    for p in plans:
+        for d in _occurrences_scalar(p, today, end):
+            ws = d - timedelta(days=d.weekday())
+            a = acc.setdefault((ws, p.department), [0, 0, 0])
+            a[0] += 1
+            a[1] += p.minutes
+            a[2] += 0 if p.has_estimate else 1
+            total += 1
+    rows = [_week_row(dept, ws, *a) for (ws, dept), a in sorted(acc.items())]
+    return rows, total
+
+
+# ---------------------------
+# Job
+# ---------------------------
+def run_forecast(horizon_days: int = 365, *, today: Optional[date] = None, db: Optional[Db] = None) -> Dict[str, Any]:
+    """
+    Ritorna {"rows": [...], "summary": {...}}; una riga per reparto x settimana ISO
+    con occurrences, estimated_minutes e without_estimate (occorrenze di task senza stima).
+    """
+    t0 = datetime.now()
+    today = today or datetime.now(TZ).date()
+    end = today + timedelta(days=max(0, int(horizon_days)))
+    plans = load_plans(db)
+    t_read = datetime.now()
+
+    if _numpy() is not None:
+        occ, idx = _project_numpy(plans, today, end)
+        rows = _aggregate_numpy(plans, occ, idx)
+        total = int(len(occ))
+    else:
+        rows, total = _aggregate_python(plans, today, end)
+
+    summary = {
+        "from": today.isoformat(),
+        "to": end.isoformat(),
+        "tasks": len(plans),
+        "occurrences": total,
+        "estimated_minutes": sum(r["estimated_minutes"] for r in rows),
+        "engine": "numpy" if np is not None else "python",
+        "read_sec": round((t_read - t0).total_seconds(), 3),
+        "compute_sec": round((datetime.now() - t_read).total_seconds(), 3),
+    }
+    logger.info("Forecast: %s", summary)
+    return {"rows": rows, "summary": summary}
+
+
+def render(result: Dict[str, Any], fmt: str = "csv") -> str:
+    if fmt == "json":
+        return json.dumps(result, ensure_ascii=False, indent=2)
+    buf = io.StringIO()
+    fields = ["department", "iso_week", "week_start", "occurrences", "estimated_minutes", "without_estimate"]
+    w = csv.DictWriter(buf, fieldnames=fields, lineterminator="\n")
+    w.writeheader()
+    w.writerows(result["rows"])
+    return buf.getvalue()
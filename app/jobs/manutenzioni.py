@@ -2,12 +2,14 @@
 from __future__ import annotations
 
 import os
-from typing import Dict, List
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
 from datetime import datetime
 from zoneinfo import ZoneInfo
 
-from app.core.db import DbManager, MySQLDb, QueryType
-from app.core.mailer import send_email, SchedulerEmailException
+from app.core.db import ROW_DICT, ROW_TUPLE, Db, MySQLPoolDb, QueryType, db_session, iter_keyset
+from app.core.mailer import build_message, send_email, SchedulerEmailException, SmtpSession
+from app.core.mail_dispatch import MailDispatcher, MailJob
+from app.jobs import outbox as ob
 from app.sql.query.maintenance_queries import QuerySqlManutenzioniMYSQL as Q
 
 TZ = ZoneInfo(os.getenv("TZ", "Europe/Rome"))
@@ -27,7 +29,7 @@ def _h(s: object) -> str:
          .replace("'", "&#39;")
     )
 
-def _render_table(rows: List[dict], within_days: int) -> str:
+def _render_table(rows: List[dict], within_days: int, title: Optional[str] = None) -> str:
     trs = []
     for r in rows:
         area = r.get("department_name") or r.get("area_label") or ""
@@ -45,9 +47,10 @@ def _render_table(rows: List[dict], within_days: int) -> str:
         else "<tr><td colspan='4' style='padding:8px;border:1px solid #ddd'>Nessuna scadenza.</td></tr>"
     )
     generated = datetime.now(TZ).strftime("%Y-%m-%d %H:%M")
+    heading = title or f"Scadenze manutenzione entro {within_days} giorni"
     return f"""
     <div style="font-family:system-ui,Segoe UI,Arial,sans-serif">
-      <h2>Scadenze manutenzione entro {within_days} giorni</h2>
+      <h2>{_h(heading)}</h2>
       <p>Generato: {generated}</p>
       <table style="border-collapse:collapse;font-size:14px">
         <thead>
@@ -67,19 +70,19 @@ def _render_table(rows: List[dict], within_days: int) -> str:
 # ---------------------------
 # Lettura scadenze
 # ---------------------------
-def list_due(within_days: int) -> List[dict]:
+def list_due(within_days: int, db: Optional[Db] = None) -> List[dict]:
     sql = Q.list_due_within_sql()
-    with DbManager(MySQLDb()) as db:
+    with db_session(db) as db:
         return db.execute_query(sql, (within_days,), fetchall=True, query_type=QueryType.GET) or []
 
 
 # ---------------------------
 # Destinatari (DB)
 # ---------------------------
-def _recipients_from_db(task_id: int) -> List[str]:
+def _recipients_from_db(task_id: int, db: Optional[Db] = None) -> List[str]:
     sql = Q.recipients_for_task_sql()
     params = (task_id,)
-    with DbManager(MySQLDb()) as db:
+    with db_session(db) as db:
         rows = db.execute_query(sql, params, fetchall=True, query_type=QueryType.GET) or []
     seen, emails = set(), []
     for r in rows:
@@ -118,51 +121,245 @@ def _static_recipients_from_env() -> dict:
 # ---------------------------
 # Throttle / Log
 # ---------------------------
-def was_recently_mailed(task_id: int, email: str, throttle_days: int) -> bool:
+def was_recently_mailed(task_id: int, email: str, throttle_days: int, db: Optional[Db] = None) -> bool:
     sql = Q.throttle_check_sql()
     params = (task_id, email, throttle_days)
-    with DbManager(MySQLDb()) as db:
+    with db_session(db) as db:
         row = db.execute_query(sql, params, fetchall=False, query_type=QueryType.GET) or {}
     return bool(row.get("recent") == 1)
 
-def log_mail(task_id: int, email: str, subject: str, reason: str = "due_time") -> int:
+def log_mail(task_id: int, email: str, subject: str, reason: str = "due_time", db: Optional[Db] = None) -> int:
     sql = Q.insert_log_sql()
     params = (task_id, email, subject, reason)
-    with DbManager(MySQLDb()) as db:
+    with db_session(db) as db:
         return db.execute_query(sql, params, fetchall=True, query_type=QueryType.INSERT)
 
 
+# ---------------------------
+# Pianificazione "a insieme" (round trip costanti, indipendenti dal numero di task)
+# ---------------------------
+_IN_CHUNK = 1000  # elementi massimi per lista IN / batch di INSERT
+
+
+def _chunks(items: List, size: int = _IN_CHUNK) -> Iterable[List]:
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def plan_db_recipients(due_rows: List[dict], throttle_days: int, db: Db) -> Dict[str, List[dict]]:
+    """
+    Modalità DB: email -> righe da notificare, esclusi i (task, email) già
+    notificati entro throttle_days. Una query per blocco di 1000 task
+    (responsabili + throttle insieme) al posto di 1 + N query per task.
+    L'ordine (scadenze, destinatari) è lo stesso del ciclo per-task.
+    """
+    task_ids = list(dict.fromkeys(r["task_id"] for r in due_rows))
+    recipients: Dict[int, List[Tuple[str, bool]]] = {}
+    for chunk in _chunks(task_ids):
+        sql = Q.recipients_with_throttle_sql(len(chunk))
+        rows = db.execute_query(sql, (throttle_days, *chunk), fetchall=True, query_type=QueryType.GET) or []
+        for r in rows:
+            e = (r.get("email") or "").strip()
+            if not e:
+                continue
+            lst = recipients.setdefault(r["task_id"], [])
+            if all(e.lower() != x.lower() for x, _ in lst):
+                lst.append((e, bool(r.get("recent"))))
+
+    per_email: Dict[str, List[dict]] = {}
+    for r in due_rows:
+        for email, recent in recipients.get(r["task_id"], []):
+            if not recent:
+                per_email.setdefault(email, []).append(r)
+    return per_email
+
+
+def throttled_pairs(task_ids: List[int], emails: List[str], throttle_days: int, db: Db) -> Set[Tuple[int, str]]:
+    """(task_id, email minuscola) già notificati negli ultimi throttle_days giorni."""
+    out: Set[Tuple[int, str]] = set()
+    if not task_ids or not emails:
+        return out
+    for chunk in _chunks(list(dict.fromkeys(task_ids))):
+        sql = Q.throttled_pairs_sql(len(chunk), len(emails))
+        rows = db.execute_query(sql, (*chunk, *emails, throttle_days), fetchall=True, query_type=QueryType.GET) or []
+        for r in rows:
+            out.add((r["task_id"], (r.get("email") or "").strip().lower()))
+    return out
+
+
+def log_mails_bulk(rows: List[Tuple[int, str, str, str]], db: Optional[Db] = None) -> int:
+    """Registra (task_id, email, subject, reason) con INSERT multi-riga (blocchi da 1000)."""
+    if not rows:
+        return 0
+    sql = Q.insert_log_sql()
+    inserted = 0
+    with db_session(db) as db:
+        with db.transaction():
+            for chunk in _chunks(rows):
+                inserted += db.execute_many(sql, chunk) or 0
+    return inserted
+
+
+# ---------------------------
+# Prossima scadenza materializzata (maintenance_next_due)
+# ---------------------------
+def _bump_next_due_version(db: Db) -> int:
+    """Nuova versione di maintenance_next_due (la riga resta bloccata fino al commit)."""
+    db.execute_query(Q.bump_next_due_version_sql(), (), query_type=QueryType.UPDATE)
+    row = db.execute_query(Q.next_due_version_sql(), (), fetchall=False, query_type=QueryType.GET) or {}
+    return int(row["version"])
+
+
+def refresh_next_due(task_ids: Iterable[int], db: Optional[Db] = None) -> int:
+    """Ricalcola la riga di maintenance_next_due dei task indicati. Ritorna le righe scritte."""
+    ids = sorted({int(t) for t in task_ids})
+    if not ids:
+        return 0
+    written = 0
+    with db_session(db) as db:
+        with db.transaction():
+            version = _bump_next_due_version(db)
+            db.execute_many(Q.insert_next_due_log_sql(), [(version, t) for t in ids])
+            for chunk in _chunks(ids):
+                db.execute_query(Q.delete_next_due_sql(len(chunk)), tuple(chunk), query_type=QueryType.DELETE)
+                written += db.execute_query(
+                    Q.refresh_next_due_sql(len(chunk)), tuple(chunk) * 2, query_type=QueryType.INSERT
+                ) or 0
+    return written
+
+
+def rebuild_next_due(db: Optional[Db] = None) -> int:
+    """Ricalcolo completo di maintenance_next_due in una transazione. Ritorna i task con scadenza."""
+    with db_session(db) as db:
+        with db.transaction():
+            version = _bump_next_due_version(db)
+            db.execute_query(Q.insert_next_due_log_sql(), (version, None), query_type=QueryType.INSERT)
+            db.execute_query(Q.clear_next_due_sql(), (), query_type=QueryType.DELETE)
+            return db.execute_query(Q.rebuild_next_due_sql(), (), query_type=QueryType.INSERT) or 0
+
+
 # ---------------------------
 # Storico interventi (lasciato per compatibilità, ma NON usato per auto-reset)
 # ---------------------------
-def insert_event(task_id: int, done_by_operator_id: int | None, notes: str | None) -> int:
+def insert_event(task_id: int, done_by_operator_id: int | None, notes: str | None, db: Optional[Db] = None) -> int:
     sql = Q.insert_event_sql()
     params = (task_id, done_by_operator_id, notes)
-    with DbManager(MySQLDb()) as db:
+    with db_session(db) as db:
+        # la prossima scadenza la ricalcola trg_me_ai nella stessa transazione dell'INSERT
         return db.execute_query(sql, params, fetchall=True, query_type=QueryType.INSERT)
 
-def list_events(task_id: int) -> List[dict]:
+def list_events(task_id: int, db: Optional[Db] = None) -> List[dict]:
     sql = Q.list_events_sql()
-    with DbManager(MySQLDb()) as db:
+    with db_session(db) as db:
         return db.execute_query(sql, (task_id,), fetchall=True, query_type=QueryType.GET) or []
 
 
+def iter_events(
+    task_id: int,
+    db: Db,
+    *,
+    page_size: int = 500,
+    row_format: str = ROW_DICT,
+) -> Iterator[Any]:
+    """Storico interventi dal più recente, a pagine keyset: memoria costante su storici lunghi."""
+    # done_at due volte: il seek è "done_at < %s OR (done_at = %s AND id < %s)"
+    # con ROW_TUPLE per posizione (colonne di list_events_page_sql: 0 = id, 2 = done_at)
+    by_position = row_format == ROW_TUPLE
+    return iter_keyset(
+        db, Q.list_events_page_sql, (task_id,),
+        key=lambda r: (r[2], r[2], r[0]) if by_position else (r["done_at"], r["done_at"], r["id"]),
+        page_size=page_size, row_format=row_format,
+    )
+
+
 # ---------------------------
 # Job: invio email scadenze
 # ---------------------------
+def _today_key() -> str:
+    return datetime.now(TZ).date().isoformat()
+
+
+def _env_log_rows(
+    due_rows: List[dict], to_list: List[str], subject: str, throttle_days: int, db: Db
+) -> List[Tuple[int, str, str, str]]:
+    """Righe di log per la mail unica (.env): solo le coppie non già notificate di recente."""
+    task_ids = [r["task_id"] for r in due_rows]
+    recent = throttled_pairs(task_ids, to_list, throttle_days, db)
+    log_rows = []
+    for r in due_rows:
+        for email in to_list:
+            key = (r["task_id"], email.lower())
+            if key not in recent:
+                recent.add(key)
+                log_rows.append((r["task_id"], email, subject, "due_time"))
+    return log_rows
+
+
 def run_send(
     within_days: int = 7,
     throttle_days: int = 7,
     dry_run: bool = False,
     advance_on_send: bool = True,  # parametro mantenuto per compatibilità, MA IGNORATO
+    db: Optional[Db] = None,
+    smtp: Optional[SmtpSession] = None,
+    dispatcher: Optional[MailDispatcher] = None,
+    outbox: Optional[bool] = None,
 ) -> Dict[str, int]:
     """
     Invia le email di scadenza manutenzioni.
 
+    Tutte le query del job passano da UNA sessione DB (quella ricevuta in `db`,
+    altrimenti una connessione del pool aperta qui e chiusa a fine job).
+    Allo stesso modo tutte le email partono da UNA connessione SMTP autenticata
+    (`smtp`, oppure una SmtpSession aperta per il job).
+    In modalità DB le email per responsabile passano dal `dispatcher`
+    (worker concorrenti con limite di velocità e retry; se assente ne apre uno per il job).
+
+    Con `outbox` (default da SCHEDULER_OUTBOX) non invia nulla: accoda le email
+    renderizzate in maintenance_outbox in una transazione, le invia il comando dispatch.
+
     NOTA: non registra più interventi automatici (nessun AUTO_RESET su invio mail).
     La registrazione degli interventi è ora responsabilità della web app / operatori.
     """
-    due_rows = list_due(within_days)
+    if outbox is None:
+        outbox = ob.outbox_enabled()
+    own_db = db is None
+    if own_db:
+        db = MySQLPoolDb()
+        db.open()
+    if outbox:
+        try:
+            return _run_send(within_days, throttle_days, dry_run, db, None, None, outbox=True)
+        finally:
+            if own_db:
+                db.close()
+    own_smtp = smtp is None
+    if own_smtp:
+        smtp = SmtpSession()
+    own_dispatcher = dispatcher is None
+    if own_dispatcher:
+        dispatcher = MailDispatcher()
+    try:
+        return _run_send(within_days, throttle_days, dry_run, db, smtp, dispatcher)
+    finally:
+        if own_dispatcher:
+            dispatcher.close()
+        if own_smtp:
+            smtp.close()
+        if own_db:
+            db.close()
+
+
+def _run_send(
+    within_days: int,
+    throttle_days: int,
+    dry_run: bool,
+    db: Db,
+    smtp: Optional[SmtpSession],
+    dispatcher: Optional[MailDispatcher],
+    outbox: bool = False,
+) -> Dict[str, int]:
+    due_rows = list_due(within_days, db=db)
     use_db = str(os.getenv("SCHEDULER_USE_DB_RECIPIENTS", "1")).strip().lower() in {
         "1",
         "true",
@@ -192,18 +389,25 @@ def run_send(
         if dry_run:
             return {"rows_found": len(due_rows), "distinct_recipients": 1, "sent": 0, "skipped": 1}
 
+        if outbox:
+            queued = ob.enqueue([{
+                "dedupe_key": f"due:{_today_key()}:env",
+                "to": to_list, "cc": cc_list, "bcc": bcc_list,
+                "subject": subject, "html": html_all, "reason": "due_time",
+                "log_rows": [(t, e) for t, e, _, _ in _env_log_rows(due_rows, to_list, subject, throttle_days, db)],
+            }], db=db)
+            return {"rows_found": len(due_rows), "distinct_recipients": 1, "sent": 0, "queued": queued,
+                    "skipped": 1 - queued}
+
         try:
-            send_email(subject=subject, html=html_all, to=to_list, cc=cc_list, bcc=bcc_list)
-
-            # log throttle (solo log, nessun evento auto-reset)
-            for r in due_rows:
-                for email in to_list:
-                    try:
-                        if not was_recently_mailed(r["task_id"], email, throttle_days):
-                            log_mail(r["task_id"], email, subject, reason="due_time")
-                    except Exception:
-                        # il logging non deve bloccare il job
-                        pass
+            send_email(subject=subject, html=html_all, to=to_list, cc=cc_list, bcc=bcc_list, session=smtp)
+
+            # log throttle (solo log, nessun evento auto-reset): una query + un INSERT multi-riga
+            try:
+                log_mails_bulk(_env_log_rows(due_rows, to_list, subject, throttle_days, db), db=db)
+            except Exception:
+                # il logging non deve bloccare il job
+                pass
 
             sent = 1
 
@@ -213,32 +417,56 @@ def run_send(
         return {"rows_found": len(due_rows), "distinct_recipients": 1, "sent": sent, "skipped": skipped}
 
     # --- Modalità DB: una mail per destinatario (responsabile task) ---
-    per_email: Dict[str, List[dict]] = {}
-    for r in due_rows:
-        for email in _recipients_from_db(r["task_id"]):
-            if not was_recently_mailed(r["task_id"], email, throttle_days):
-                per_email.setdefault(email, []).append(r)
-
-    for email, rows in per_email.items():
-        if not rows:
+    per_email = plan_db_recipients(due_rows, throttle_days, db)
+    log_rows: List[Tuple[int, str, str, str]] = []
+
+    if outbox:
+        items = [
+            {
+                "dedupe_key": f"due:{_today_key()}:{email.lower()}",
+                "to": [email], "subject": subject, "reason": "due_time",
+                "html": _render_table(rows, within_days),
+                "log_rows": [(r["task_id"], email) for r in rows],
+            }
+            for email, rows in per_email.items()
+            if rows and not dry_run
+        ]
+        queued = ob.enqueue(items, db=db)
+        return {
+            "rows_found": len(due_rows),
+            "distinct_recipients": len(per_email),
+            "sent": 0,
+            "queued": queued,
+            "skipped": len(per_email) - queued,
+        }
+
+    def jobs():
+        # producer: rende i messaggi mentre i worker inviano quelli già pronti
+        nonlocal skipped
+        for email, rows in per_email.items():
+            if not rows or dry_run:
+                skipped += 1
+                continue
+            try:
+                msg, rcpts = build_message(subject, _render_table(rows, within_days), [email])
+            except SchedulerEmailException:
+                skipped += 1
+                continue
+            yield MailJob(msg=msg, rcpts=rcpts, tag=(email, rows))
+
+    for res in dispatcher.send_batch(jobs()):
+        if not res.ok:
             skipped += 1
             continue
-        if dry_run:
-            skipped += 1
-            continue
-        try:
-            html_email = _render_table(rows, within_days)
-            send_email(subject=subject, html=html_email, to=[email])
-            for r in rows:
-                try:
-                    log_mail(r["task_id"], email, subject, reason="due_time")
-                except Exception:
-                    # idem: il log non deve bloccare l'invio
-                    pass
-
-            sent += 1
-        except SchedulerEmailException:
-            skipped += 1
+        email, rows = res.job.tag
+        log_rows.extend((r["task_id"], email, subject, "due_time") for r in rows)
+        sent += 1
+
+    try:
+        log_mails_bulk(log_rows, db=db)
+    except Exception:
+        # idem: il log non deve bloccare l'invio
+        pass
 
     return {
         "rows_found": len(due_rows),
@@ -0,0 +1,209 @@
+# app/jobs/outbox.py
+# Outbox email delle manutenzioni.
+#   - send (con outbox attiva) scrive le email già renderizzate in maintenance_outbox,
+#     in UNA transazione, e termina subito
+#   - dispatch prende in carico le righe a lotti (lease con scadenza), le invia con il
+#     MailDispatcher e le segna SENT (+ maintenance_notification_log) oppure le rimette
+#     in coda con backoff; dopo OUTBOX_MAX_ATTEMPTS tentativi (o errore permanente) => FAILED
+#
+# Un dispatcher interrotto a metà lascia righe SENDING: allo scadere del lease le riprende
+# il dispatcher successivo. Lo stato viene salvato subito dopo ogni lotto, quindi il rischio
+# di doppio invio è limitato alle email del lotto in corso al momento del crash; il
+# Message-ID è stabile (derivato dalla riga) così i client possono riconoscere i doppioni.
+
+from __future__ import annotations
+
+import os
+import json
+import uuid
+import socket
+import logging
+import threading
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+from app.core.db import Db, MySQLPoolDb, QueryType, db_session
+from app.core.mailer import build_message, SchedulerEmailException
+from app.core.mail_dispatch import MailDispatcher, MailJob
+from app.sql.query.maintenance_queries import QuerySqlManutenzioniMYSQL as Q
+
+logger = logging.getLogger(__name__)
+
+
+def outbox_enabled() -> bool:
+    return str(os.getenv("SCHEDULER_OUTBOX", "0")).strip().lower() in {"1", "true", "yes", "on"}
+
+
+def _lease_owner() -> str:
+    return f"{socket.gethostname()[:40]}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def _retry_delay(attempts: int) -> int:
+    """Backoff esponenziale: OUTBOX_RETRY_BASE_SEC * 2^(tentativi-1), al massimo 1 ora."""
+    base = int(os.getenv("OUTBOX_RETRY_BASE_SEC", "60"))
+    return min(3600, base * (2 ** max(0, attempts - 1)))
+
+
+# ---------------------------
+# Accodamento (lato send)
+# ---------------------------
+def enqueue(items: Iterable[Dict[str, Any]], db: Optional[Db] = None) -> int:
+    """
+    Accoda le email in una sola transazione.
+    Ogni item: dedupe_key, to, cc, bcc, subject, html, log_rows [(task_id, email)], reason.
+    Ritorna quante righe sono state inserite (le dedupe_key già presenti non contano).
+    """
+    params = [
+        (
+            it["dedupe_key"][:190],
+            json.dumps({"to": it.get("to") or [], "cc": it.get("cc") or [], "bcc": it.get("bcc") or []}),
+            it["subject"][:255],
+            it["html"],
+            json.dumps([[int(t), e] for t, e in it.get("log_rows") or []]),
+            it.get("reason"),
+        )
+        for it in items
+    ]
+    if not params:
+        return 0
+    sql = Q.outbox_enqueue_sql()
+    queued = 0
+    with db_session(db) as db:
+        with db.transaction():
+            # una riga alla volta: con INSERT IGNORE il rowcount di executemany
+            # non distingue le righe scartate
+            for p in params:
+                queued += db.execute_query(sql, p, query_type=QueryType.INSERT) or 0
+    return queued
+
+
+# ---------------------------
+# Dispatch
+# ---------------------------
+def _to_job(row: dict) -> MailJob:
+    rcpts = json.loads(row["recipients"] or "{}")
+    msg, all_rcpts = build_message(
+        row["subject"], row["html"], rcpts.get("to") or [],
+        cc=rcpts.get("cc"), bcc=rcpts.get("bcc"),
+    )
+    domain = (msg["From"] or "").rsplit("@", 1)[-1].strip(" >") or "localhost"
+    msg["Message-ID"] = f"<outbox-{row['id']}@{domain}>"
+    return MailJob(msg=msg, rcpts=all_rcpts, tag=row)
+
+
+def _release(db: Db, row: dict, owner: str, error: str, permanent: bool) -> bool:
+    attempts = int(row.get("attempts") or 1)
+    give_up = permanent or attempts >= int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+    db.execute_query(
+        Q.outbox_mark_failed_sql(),
+        (1 if give_up else 0, _retry_delay(attempts), error[:500], row["id"], owner),
+        query_type=QueryType.UPDATE,
+    )
+    return give_up
+
+
+def dispatch_once(
+    *,
+    batch_size: int,
+    lease_sec: int,
+    db: Db,
+    dispatcher: MailDispatcher,
+    owner: Optional[str] = None,
+) -> Dict[str, int]:
+    """Prende in carico un lotto, lo invia e salva l'esito. Ritorna i contatori del lotto."""
+    owner = owner or _lease_owner()
+    db.execute_query(Q.outbox_lease_sql(), (owner, int(lease_sec), int(batch_size)),
+                     query_type=QueryType.UPDATE)
+    rows = db.execute_query(Q.outbox_leased_sql(), (owner,), query_type=QueryType.GET) or []
+    out = {"leased": len(rows), "sent": 0, "retry": 0, "failed": 0, "lost": 0}
+    if not rows:
+        return out
+
+    jobs: List[MailJob] = []
+    for row in rows:
+        try:
+            jobs.append(_to_job(row))
+        except (SchedulerEmailException, ValueError) as ex:
+            # messaggio non costruibile: inutile ritentare
+            _release(db, row, owner, f"Messaggio non valido: {ex}", permanent=True)
+            out["failed"] += 1
+
+    for res in dispatcher.send_batch(jobs):
+        row = res.job.tag
+        if res.ok:
+            log_rows = [(t, e, row["subject"], row.get("reason") or "due_time")
+                        for t, e in json.loads(row.get("log_rows") or "[]")]
+            with db.transaction():
+                marked = db.execute_query(Q.outbox_mark_sent_sql(), (row["id"], owner), query_type=QueryType.UPDATE)
+                if marked:
+                    db.execute_many(Q.insert_log_sql(), log_rows)
+            if marked:
+                out["sent"] += 1
+            else:
+                # lease scaduto e riga ripresa da un altro dispatcher: il log lo scrive lui
+                logger.warning("Outbox: riga %s inviata ma non più in carico a %s, log non registrato",
+                               row["id"], owner)
+                out["lost"] += 1
+        elif _release(db, row, owner, res.error or "errore sconosciuto", permanent=not res.transient):
+            out["failed"] += 1
+        else:
+            out["retry"] += 1
+    return out
+
+
+def run_dispatch(
+    *,
+    batch_size: Optional[int] = None,
+    lease_sec: Optional[int] = None,
+    loop: bool = False,
+    interval_sec: float = 30.0,
+    stop: Optional[threading.Event] = None,
+    db: Optional[Db] = None,
+    dispatcher: Optional[MailDispatcher] = None,
+) -> Dict[str, Any]:
+    """
+    Svuota l'outbox a lotti finché non restano email dovute.
+    Con loop=True continua ad attendere nuove email (ogni interval_sec) finché `stop` non è impostato.
+    """
+    batch_size = int(batch_size or os.getenv("OUTBOX_BATCH_SIZE", "50"))
+    lease_sec = int(lease_sec or os.getenv("OUTBOX_LEASE_SEC", "300"))
+    stop = stop or threading.Event()
+    owner = _lease_owner()
+    totals = {"batches": 0, "leased": 0, "sent": 0, "retry": 0, "failed": 0, "lost": 0}
+    t0 = datetime.now()
+
+    own_db = db is None
+    if own_db:
+        db = MySQLPoolDb()
+        db.open()
+    own_dispatcher = dispatcher is None
+    if own_dispatcher:
+        # i retry li gestisce l'outbox (next_attempt_at), non il dispatcher in memoria
+        dispatcher = MailDispatcher(retries=0)
+    try:
+        while not stop.is_set():
+            res = dispatch_once(batch_size=batch_size, lease_sec=lease_sec, db=db,
+                                dispatcher=dispatcher, owner=owner)
+            if res["leased"]:
+                totals["batches"] += 1
+                for k in ("leased", "sent", "retry", "failed", "lost"):
+                    totals[k] += res[k]
+                logger.info("Outbox: lotto %s", res)
+                continue
+            if not loop:
+                break
+            stop.wait(interval_sec)
+    finally:
+        if own_dispatcher:
+            dispatcher.close()
+        if own_db:
+            db.close()
+
+    totals["elapsed_sec"] = round((datetime.now() - t0).total_seconds(), 3)
+    return totals
+
+
+def outbox_stats(db: Optional[Db] = None) -> Dict[str, int]:
+    with db_session(db) as db:
+        rows = db.execute_query(Q.outbox_stats_sql(), (), query_type=QueryType.GET) or []
+    return {r["status"]: int(r["n"]) for r in rows}
@@ -0,0 +1,181 @@
+# app/jobs/serve.py
+# Modalità demone: un solo processo che esegue i job secondo orari cron da .env,
+# al posto di un interprete nuovo per ogni job (run_scheduler.bat).
+#
+#   SCHEDULE_SEND="0 8,14 * * 1-5"        -> manutenzioni send
+#   SCHEDULE_DISPATCH="*/5 * * * *"       -> svuota l'outbox email
+#   SCHEDULE_DWH_REFRESH="30 6 * * *"     -> dwh-refresh (modalità: SCHEDULE_DWH_REFRESH_MODE)
+#   SCHEDULE_REBUILD_NEXT_DUE="0 3 * * 0" -> ricalcolo maintenance_next_due
+# Variabile assente o vuota = job disattivato.
+# SERVE_WATCH=1 avvia anche il watcher delle scadenze al minuto (app/jobs/watch.py).
+#
+# - pool MySQL, sessione SMTP e worker del MailDispatcher restano caldi tra un'esecuzione e l'altra
+# - ogni job gira nel proprio thread; se l'esecuzione precedente dello stesso job è ancora
+#   in corso quella nuova viene saltata (niente sovrapposizioni)
+# - SIGINT/SIGTERM: nessun nuovo job, attesa di quelli in corso, chiusura ordinata delle risorse
+
+from __future__ import annotations
+
+import os
+import logging
+import threading
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from app.core.cron import CronSchedule
+from app.core.db import MySQLPoolDb, close_pools
+from app.core.mail_dispatch import MailDispatcher
+from app.core.mailer import SmtpSession
+from app.jobs import dwh_refresh, manutenzioni, outbox, watch
+from app.jobs.manutenzioni import TZ
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ScheduledJob:
+    name: str
+    schedule: CronSchedule
+    func: Callable[[], Any]
+    next_run: Optional[datetime] = None
+    runs: int = 0
+    failures: int = 0
+    skipped: int = 0
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+
+class Resources:
+    """Risorse condivise tra le esecuzioni (restano aperte per tutta la vita del demone)."""
+
+    def __init__(self):
+        self.smtp = SmtpSession()
+        self.dispatcher = MailDispatcher()
+        # dispatch: i retry li gestisce l'outbox (attempts/next_attempt_at), non il dispatcher
+        # in memoria, che terrebbe il lease oltre OUTBOX_LEASE_SEC
+        self.outbox_dispatcher = MailDispatcher(retries=0)
+
+    def warm_up(self) -> None:
+        # crea il pool e verifica subito la connessione: un errore di configurazione
+        # emerge all'avvio e non al primo job
+        db = MySQLPoolDb()
+        db.open()
+        db.close()
+
+    def close(self) -> None:
+        self.dispatcher.close()
+        self.outbox_dispatcher.close()
+        self.smtp.close()
+        close_pools()
+
+
+def _now() -> datetime:
+    # gli orari cron sono in ora locale (TZ)
+    return datetime.now(TZ).replace(tzinfo=None)
+
+
+def _env_int(name: str, default: int) -> int:
+    return int(os.getenv(name, str(default)))
+
+
+def _watch_enabled() -> bool:
+    return str(os.getenv("SERVE_WATCH", "0")).strip().lower() in {"1", "true", "yes", "on"}
+
+
+def _run_watch(stop: threading.Event) -> None:
+    try:
+        logger.info("[watch] terminato: %s", watch.run_watch(stop))
+    except Exception:
+        logger.exception("[watch] interrotto da un errore")
+
+
+def build_jobs(res: Resources, stop: threading.Event) -> List[ScheduledJob]:
+    funcs: Dict[str, Callable[[], Any]] = {
+        "send": lambda: manutenzioni.run_send(
+            within_days=_env_int("MAINTENANCE_WITHIN", 7),
+            throttle_days=_env_int("MAINTENANCE_THROTTLE", 7),
+            smtp=res.smtp,
+            dispatcher=res.dispatcher,
+        ),
+        "dispatch": lambda: outbox.run_dispatch(dispatcher=res.outbox_dispatcher, stop=stop),
+        "dwh-refresh": lambda: dwh_refresh.run(
+            mode=os.getenv("SCHEDULE_DWH_REFRESH_MODE", dwh_refresh.MODE_FULL),
+        ),
+        "rebuild-next-due": lambda: manutenzioni.rebuild_next_due(),
+    }
+    jobs = []
+    for name, func in funcs.items():
+        expr = (os.getenv("SCHEDULE_" + name.upper().replace("-", "_")) or "").strip()
+        if expr:
+            jobs.append(ScheduledJob(name=name, schedule=CronSchedule(expr), func=func))
+    return jobs
+
+
+def _run_job(job: ScheduledJob) -> None:
+    t0 = datetime.now()
+    try:
+        res = job.func()
+        job.runs += 1
+        if isinstance(res, dict) and res.get("ok") is False:
+            job.failures += 1
+            logger.error("[%s] terminato con errori: %s", job.name, res)
+        else:
+            logger.info("[%s] completato in %.1fs: %s", job.name, (datetime.now() - t0).total_seconds(), res)
+    except Exception:
+        job.runs += 1
+        job.failures += 1
+        logger.exception("[%s] fallito dopo %.1fs", job.name, (datetime.now() - t0).total_seconds())
+    finally:
+        job.lock.release()
+
+
+def _launch(job: ScheduledJob, threads: List[threading.Thread]) -> None:
+    if not job.lock.acquire(blocking=False):
+        job.skipped += 1
+        logger.warning("[%s] esecuzione precedente ancora in corso: salto questo turno", job.name)
+        return
+    t = threading.Thread(target=_run_job, args=(job,), name=f"job-{job.name}")
+    threads.append(t)
+    t.start()
+
+
+def serve(stop: threading.Event, *, dry_run: bool = False) -> Dict[str, Any]:
+    """Ciclo principale; ritorna le statistiche per job quando `stop` viene impostato."""
+    res = Resources()
+    try:
+        jobs = build_jobs(res, stop)
+        now = _now()
+        for j in jobs:
+            j.next_run = j.schedule.next_after(now)
+            logger.info("Job %-17s '%s' -> prossima esecuzione %s", j.name, j.schedule.expr, j.next_run)
+        if dry_run or not (jobs or _watch_enabled()):
+            if not jobs:
+                logger.warning("Nessun job pianificato (variabili SCHEDULE_* assenti).")
+            return {j.name: {"schedule": j.schedule.expr, "next_run": j.next_run.isoformat()} for j in jobs}
+
+        res.warm_up()
+        threads: List[threading.Thread] = []
+        if _watch_enabled():
+            # il watcher usa una propria SmtpSession (quella condivisa è del job send)
+            watcher = threading.Thread(target=_run_watch, args=(stop,), name="watch")
+            watcher.start()
+            threads.append(watcher)
+        while not stop.is_set():
+            now = _now()
+            for j in jobs:
+                if j.next_run <= now:
+                    _launch(j, threads)
+                    j.next_run = j.schedule.next_after(now)
+            threads = [t for t in threads if t.is_alive()]
+            timeout = 60.0
+            if jobs:
+                wake = min(j.next_run for j in jobs)
+                timeout = min(timeout, (wake - _now()).total_seconds())
+            stop.wait(max(0.5, timeout))
+
+        logger.info("Arresto: attendo %s job in corso...", len(threads))
+        for t in threads:
+            t.join()
+        return {j.name: {"runs": j.runs, "failures": j.failures, "skipped": j.skipped} for j in jobs}
+    finally:
+        res.close()
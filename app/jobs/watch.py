@@ -0,0 +1,268 @@
+# app/jobs/watch.py
+# Notifiche "al minuto": invece di cercare una volta al giorno le scadenze entro N giorni,
+# il watcher carica una volta maintenance_next_due in un heap ordinato per istante e dorme
+# fino al primo evento.
+#
+# Eventi per task = scadenza + ciascun offset di WATCH_OFFSETS_MIN (minuti, es. "-1440,0,240":
+# preavviso di un giorno, alla scadenza, escalation dopo 4 ore).
+#
+# Le modifiche (interventi registrati, regole/task cambiati) arrivano tramite i trigger su
+# maintenance_next_due: ogni ricalcolo incrementa una versione e registra i task toccati in
+# maintenance_next_due_log. Le versioni diventano visibili in ordine di commit (lock sulla
+# riga del contatore), quindi ogni WATCH_POLL_SEC secondi il watcher legge solo la versione
+# corrente e, se è cambiata, rilegge i task registrati sopra l'ultima versione vista:
+# nessuna modifica va persa, anche se la transazione è partita prima dell'ultimo controllo.
+# Ricalcolo completo o registro già ripulito oltre l'ultima versione -> ricarica tutto.
+# Le voci vecchie dell'heap restano dove sono e vengono scartate quando emergono.
+
+from __future__ import annotations
+
+import os
+import heapq
+import logging
+import threading
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from app.core.db import Db, QueryType, db_session
+from app.core.mailer import SchedulerEmailException, SmtpSession, send_email
+from app.jobs import manutenzioni as mt
+from app.jobs.manutenzioni import TZ
+from app.sql.query.maintenance_queries import QuerySqlManutenzioniMYSQL as Q
+
+logger = logging.getLogger(__name__)
+
+
+def _offsets_from_env() -> List[int]:
+    raw = os.getenv("WATCH_OFFSETS_MIN", "0")
+    return sorted({int(x) for x in raw.split(",") if x.strip()})
+
+
+def _now() -> datetime:
+    # next_due_at è un DATETIME locale: confronto con l'ora locale senza tz
+    return datetime.now(TZ).replace(tzinfo=None)
+
+
+def _reason(offset: int) -> str:
+    return f"due_at{offset:+d}m"
+
+
+@dataclass(order=True)
+class _Wakeup:
+    at: datetime
+    task_id: int = field(compare=False)
+    offset: int = field(compare=False)
+    due: datetime = field(compare=False)
+
+
+class DueWatcher:
+    def __init__(
+        self,
+        *,
+        offsets_min: Optional[List[int]] = None,
+        poll_sec: Optional[float] = None,
+        grace_min: Optional[int] = None,
+        dry_run: bool = False,
+        smtp: Optional[SmtpSession] = None,
+    ):
+        self.offsets = offsets_min if offsets_min is not None else _offsets_from_env()
+        self.poll_sec = float(poll_sec if poll_sec is not None else os.getenv("WATCH_POLL_SEC", "60"))
+        # eventi passati da meno di grace_min minuti vengono ancora notificati (riavvio, ritardi)
+        self.grace = timedelta(minutes=int(grace_min if grace_min is not None else os.getenv("WATCH_GRACE_MIN", "10")))
+        self.dry_run = dry_run
+        self.smtp = smtp
+        self.due: Dict[int, Optional[datetime]] = {}   # task_id -> next_due_at attuale
+        self.heap: List[_Wakeup] = []
+        self.version: Optional[int] = None
+        # giorni di registro conservati (il watcher lo ripulisce all'avvio e una volta al giorno)
+        self.log_keep_days = int(os.getenv("WATCH_LOG_KEEP_DAYS", "7"))
+        self.pruned_at: Optional[datetime] = None
+        self.stats = {"loaded": 0, "refreshes": 0, "changed": 0, "fired": 0, "sent": 0, "skipped": 0}
+
+    # ---------------------------
+    # Heap
+    # ---------------------------
+    def _schedule(self, task_id: int, due: Optional[datetime], now: datetime) -> None:
+        if task_id in self.due and self.due[task_id] == due:
+            return
+        self.due[task_id] = due
+        if due is None:
+            return
+        for off in self.offsets:
+            at = due + timedelta(minutes=off)
+            if at >= now - self.grace:
+                heapq.heappush(self.heap, _Wakeup(at, task_id, off, due))
+
+    def _current(self, w: _Wakeup) -> bool:
+        return w.task_id in self.due and self.due[w.task_id] == w.due
+
+    def next_wakeup(self) -> Optional[datetime]:
+        while self.heap and not self._current(self.heap[0]):
+            heapq.heappop(self.heap)   # voce superata da una modifica
+        return self.heap[0].at if self.heap else None
+
+    # ---------------------------
+    # Caricamento / modifiche
+    # ---------------------------
+    def load(self, db: Db) -> None:
+        self._prune(db)
+        # versione letta PRIMA delle righe: tutto ciò che è <= version è già nelle righe
+        self.version, _ = self._read_version(db)
+        rows = self._reload(db)
+        self.stats["loaded"] = rows
+        logger.info("Watch: %s task caricati, %s eventi in coda", rows, len(self.heap))
+
+    def _read_version(self, db: Db) -> Tuple[int, Optional[int]]:
+        row = db.execute_query(Q.next_due_version_sql(), (), fetchall=False, query_type=QueryType.GET) or {}
+        min_logged = row.get("min_logged")
+        return int(row.get("version") or 0), int(min_logged) if min_logged is not None else None
+
+    def _reload(self, db: Db) -> int:
+        """Tutte le righe: aggiorna l'heap e toglie i task spariti. Ritorna quante righe."""
+        now = _now()
+        rows = db.execute_query(Q.next_due_all_sql(), (), query_type=QueryType.GET) or []
+        present = set()
+        for r in rows:
+            task_id = int(r["task_id"])
+            present.add(task_id)
+            self._schedule(task_id, r.get("next_due_at"), now)
+        for task_id in list(self.due):
+            if task_id not in present:
+                del self.due[task_id]
+        return len(rows)
+
+    def _prune(self, db: Db) -> None:
+        now = _now()
+        if self.pruned_at is not None and now - self.pruned_at < timedelta(days=1):
+            return
+        n = db.execute_query(Q.prune_next_due_log_sql(), (self.log_keep_days,), query_type=QueryType.DELETE) or 0
+        self.pruned_at = now
+        if n:
+            logger.info("Watch: %s righe del registro modifiche rimosse", n)
+
+    def refresh(self, db: Db) -> int:
+        """Rilegge i task ricalcolati dopo l'ultima versione vista. Ritorna quanti."""
+        version, min_logged = self._read_version(db)
+        if self.version is not None and version == self.version:
+            return 0
+        self.stats["refreshes"] += 1
+        entries = []
+        if self.version is not None and min_logged is not None and min_logged <= self.version + 1:
+            entries = db.execute_query(Q.next_due_log_sql(), (self.version, version), query_type=QueryType.GET) or []
+        ids = {r["task_id"] for r in entries}
+        if not entries or None in ids:
+            # ricalcolo completo, primo avvio o registro ripulito oltre l'ultima versione vista
+            changed = self._reload(db)
+        else:
+            ids = sorted(int(t) for t in ids)
+            rows = db.execute_query(Q.next_due_for_tasks_sql(len(ids)), tuple(ids), query_type=QueryType.GET) or []
+            by_task = {int(r["task_id"]): r for r in rows}
+            now = _now()
+            for task_id in ids:
+                if task_id in by_task:
+                    self._schedule(task_id, by_task[task_id].get("next_due_at"), now)
+                else:
+                    # riga rimossa: task disattivato / senza regole attive
+                    self.due.pop(task_id, None)
+            changed = len(ids)
+        self.version = version
+        self.stats["changed"] += changed
+        logger.info("Watch: versione %s, %s task ricalcolati", version, changed)
+        self._prune(db)
+        return changed
+
+    # ---------------------------
+    # Notifica
+    # ---------------------------
+    def _recipients(self, task_id: int, db: Db) -> Dict[str, List[str]]:
+        use_db = str(os.getenv("SCHEDULER_USE_DB_RECIPIENTS", "1")).strip().lower() in {"1", "true", "yes", "on"}
+        if use_db:
+            return {"to": mt._recipients_from_db(task_id, db=db), "cc": [], "bcc": []}
+        return mt._static_recipients_from_env()
+
+    def fire(self, events: List[_Wakeup], db: Db) -> None:
+        ids = sorted({w.task_id for w in events})
+        rows = db.execute_query(Q.due_rows_for_tasks_sql(len(ids)), tuple(ids), query_type=QueryType.GET) or []
+        by_task = {int(r["task_id"]): r for r in rows}
+
+        for w in events:
+            self.stats["fired"] += 1
+            row = by_task.get(w.task_id)
+            reason = _reason(w.offset)
+            if row is None:
+                continue
+            done = db.execute_query(Q.notified_since_sql(), (w.task_id, reason, w.at),
+                                    fetchall=False, query_type=QueryType.GET) or {}
+            if int(done.get("n") or 0):
+                self.stats["skipped"] += 1      # già notificato (watcher riavviato)
+                continue
+            rcpts = self._recipients(w.task_id, db)
+            if not (rcpts["to"] or rcpts["cc"] or rcpts["bcc"]):
+                self.stats["skipped"] += 1
+                continue
+
+            if w.offset < 0:
+                what = f"in scadenza fra {-w.offset} minuti"
+            elif w.offset == 0:
+                what = "in scadenza ora"
+            else:
+                what = f"scaduta da {w.offset} minuti"
+            subject = f"[Manutenzioni] {row['title']} - {what}"
+            if self.dry_run:
+                logger.info("Watch (dry-run): %s -> %s", subject, rcpts)
+                continue
+            try:
+                send_email(subject=subject, html=mt._render_table([row], 0, title=subject),
+                           to=rcpts["to"], cc=rcpts["cc"], bcc=rcpts["bcc"], session=self.smtp)
+            except SchedulerEmailException as e:
+                logger.error("Watch: invio per task %s fallito: %s", w.task_id, e)
+                self.stats["skipped"] += 1
+                continue
+            mt.log_mails_bulk([(w.task_id, e, subject, reason) for e in rcpts["to"] + rcpts["cc"] + rcpts["bcc"]],
+                              db=db)
+            self.stats["sent"] += 1
+
+    # ---------------------------
+    # Ciclo
+    # ---------------------------
+    def run(self, stop: threading.Event, db: Optional[Db] = None) -> Dict[str, int]:
+        own_smtp = self.smtp is None
+        if own_smtp:
+            self.smtp = SmtpSession()
+        try:
+            with db_session(db) as conn:
+                self.load(conn)
+            last_poll = _now()
+            while not stop.is_set():
+                now = _now()
+                events = []
+                while self.next_wakeup() is not None and self.heap[0].at <= now:
+                    events.append(heapq.heappop(self.heap))
+                if events:
+                    with db_session(db) as conn:
+                        self.fire(events, conn)
+
+                if (now - last_poll).total_seconds() >= self.poll_sec:
+                    with db_session(db) as conn:
+                        self.refresh(conn)
+                    last_poll = now
+
+                wake = self.next_wakeup()
+                timeout = self.poll_sec - (_now() - last_poll).total_seconds()
+                if wake is not None:
+                    timeout = min(timeout, (wake - _now()).total_seconds())
+                stop.wait(max(0.2, timeout))
+        finally:
+            if own_smtp:
+                self.smtp.close()
+                self.smtp = None
+        return dict(self.stats)
+
+
+def run_watch(stop: threading.Event, *, dry_run: bool = False, smtp: Optional[SmtpSession] = None) -> Dict[str, int]:
+    """
+    Avvia il watcher finché `stop` non viene impostato. Ogni passo prende una connessione
+    dal pool (verificata prima della consegna): nessuna connessione resta ferma per ore.
+    """
+    return DueWatcher(dry_run=dry_run, smtp=smtp).run(stop)
@@ -1,36 +1,49 @@
 # app/main.py
 # MIT License (c) 2025 Riccardo Leonelli
+#
+# Avvio rapido: qui solo librerie standard leggere. .env, mysql.connector, mailer,
+# numpy e i moduli dei job vengono caricati dal singolo comando che li usa
+# (`--help` e gli errori di sintassi non caricano nulla). Controllo: bench/startup.py
 
 from __future__ import annotations
 
 import os
 import argparse
-from datetime import datetime
-from zoneinfo import ZoneInfo
 from pathlib import Path
 
-# Carica .env dalla radice progetto (un livello sopra "app")
-from dotenv import load_dotenv
-load_dotenv(dotenv_path=Path(__file__).resolve().parent.parent / ".env")
 
-# Fuso orario (fallback Europe/Rome)
-os.environ.setdefault("TZ", os.getenv("TZ", "Europe/Rome"))
+def _load_env() -> None:
+    # Carica .env dalla radice progetto (un livello sopra "app")
+    from dotenv import load_dotenv
+    load_dotenv(dotenv_path=Path(__file__).resolve().parent.parent / ".env")
 
-# Import dal package app.*
-from .jobs.manutenzioni import (
-    list_due,
-    list_events,
-    insert_event,
-    run_send,
-)
-from app.jobs import manutenzioni
-from app.jobs import dwh_refresh   # <-- nuovo import
+    # Fuso orario (fallback Europe/Rome)
+    os.environ.setdefault("TZ", os.getenv("TZ", "Europe/Rome"))
 
-TZ = ZoneInfo(os.getenv("TZ", "Europe/Rome"))
+
+def _env_int(value, name: str, default: int) -> int:
+    """Valore da riga di comando, altrimenti da .env (letto solo dopo il parsing)."""
+    return int(value) if value is not None else int(os.getenv(name, str(default)))
+
+
+def _setup_logging(fmt: str) -> None:
+    import logging
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(), format=fmt)
+
+
+def _stop_on_signals():
+    """Event impostato da SIGINT/SIGTERM (i comandi a ciclo finiscono il passo in corso ed escono)."""
+    import signal
+    import threading
+    stop = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: stop.set())
+    return stop
 
 
 def cmd_due(args: argparse.Namespace) -> None:
-    within = int(args.within)
+    from app.jobs.manutenzioni import list_due
+    within = _env_int(args.within, "MAINTENANCE_WITHIN", 7)
     rows = list_due(within)
     if not rows:
         print(f"Nessuna scadenza entro {within} giorni.")
@@ -45,45 +58,156 @@ def cmd_due(args: argparse.Namespace) -> None:
 
 
 def cmd_send(args: argparse.Namespace) -> None:
-    within = int(args.within)
-    throttle = int(args.throttle)
+    from app.jobs.manutenzioni import run_send
+    within = _env_int(args.within, "MAINTENANCE_WITHIN", 7)
+    throttle = _env_int(args.throttle, "MAINTENANCE_THROTTLE", 7)
     dry_run = bool(args.dry_run)
     res = run_send(
         within_days=within,
         throttle_days=throttle,
         dry_run=dry_run,
-        advance_on_send=not args.no_advance
+        advance_on_send=not args.no_advance,
+        outbox=True if args.outbox else None,
     )
     print("Invio completato:", res)
 
 
+def cmd_dispatch(args: argparse.Namespace) -> None:
+    from app.jobs import outbox
+    # SIGTERM/SIGINT: termina il lotto in corso e poi esce
+    stop = _stop_on_signals()
+    res = outbox.run_dispatch(
+        batch_size=args.batch_size,
+        lease_sec=args.lease_sec,
+        loop=args.loop,
+        interval_sec=args.interval,
+        stop=stop,
+    )
+    print("Dispatch completato:", res, "| outbox:", outbox.outbox_stats())
+
+
 def cmd_mark_done(args: argparse.Namespace) -> None:
     task_id = int(args.task_id)
     op_id = int(args.operator_id) if args.operator_id is not None else None
     notes = args.notes
+    from app.jobs.manutenzioni import insert_event
     inserted = insert_event(task_id, op_id, notes)
     print(f"Inserito evento per task {task_id}: rows={inserted}")
 
 
+def cmd_rebuild_next_due(args: argparse.Namespace) -> None:
+    from app.jobs import manutenzioni
+    n = manutenzioni.rebuild_next_due()
+    print(f"maintenance_next_due ricalcolata: {n} task con scadenza.")
+
+
 def cmd_events(args: argparse.Namespace) -> None:
+    from app.core.db import ROW_SLOTS, db_session
+    from app.jobs.manutenzioni import iter_events
     task_id = int(args.task_id)
-    rows = list_events(task_id)
-    if not rows:
+    n = 0
+    # storico a pagine keyset: stampa man mano, senza caricare tutto in memoria
+    with db_session() as db:
+        for r in iter_events(task_id, db, row_format=ROW_SLOTS):
+            if not n:
+                print(f"Eventi per task {task_id}:")
+            n += 1
+            done = r.get("done_at")
+            opid = r.get("done_by_operator_id")
+            who = f"op:{opid}" if opid else "-"
+            print(f"- {done} | {who} | {r.get('first_name','') } {r.get('last_name','') } | {r.get('notes','')}")
+    if not n:
         print("Nessun evento trovato.")
+
+def cmd_forecast(args: argparse.Namespace) -> None:
+    from app.jobs import forecast
+    res = forecast.run_forecast(horizon_days=args.horizon)
+    out = forecast.render(res, args.format)
+    if not args.out:
+        print(out, end="")
         return
-    print(f"Eventi per task {task_id}:")
-    for r in rows:
-        done = r.get("done_at")
-        opid = r.get("done_by_operator_id")
-        who = f"op:{opid}" if opid else "-"
-        print(f"- {done} | {who} | {r.get('first_name','') } {r.get('last_name','') } | {r.get('notes','')}")
+    Path(args.out).write_text(out, encoding="utf-8")
+    print(f"Forecast scritto in {args.out}:", res["summary"])
+
+
+def cmd_serve(args: argparse.Namespace) -> None:
+    from app.jobs import serve
+    _setup_logging("%(asctime)s %(levelname)s %(threadName)s %(name)s: %(message)s")
+    stop = _stop_on_signals()
+    res = serve.serve(stop, dry_run=args.dry_run)
+    print("Serve terminato:" if not args.dry_run else "Job pianificati:", res)
+
+
+def cmd_watch(args: argparse.Namespace) -> None:
+    from app.jobs import watch
+    _setup_logging("%(asctime)s %(levelname)s %(name)s: %(message)s")
+    stop = _stop_on_signals()
+    res = watch.run_watch(stop, dry_run=args.dry_run)
+    print("Watch terminato:", res)
+
+
+def _print_dwh_report(rep: dict) -> None:
+    base = rep["baseline_elapsed_sec"]
+    print(f"Run #{rep['run_id']} {rep['started_at']} mode={rep['mode']} profile={rep['profile']} "
+          f"ok={rep['run_ok']} tempo={rep['elapsed_sec']:.1f}s "
+          f"(baseline {f'{base:.1f}s' if base is not None else 'n/d'} su {rep['baseline_runs']} run)")
+
+    def line(s: dict) -> str:
+        ref = f"{s['baseline_sec']:.1f}s x{s['ratio']}" if s["baseline_sec"] is not None else "nuovo"
+        return (f"  #{s['stmt_no']:<4} {s['elapsed_sec']:8.1f}s  ({ref})  righe={s['rows_affected']}  "
+                f"warning={s['warnings']}  {s['label']}")
+
+    print("Step più lenti:")
+    for s in rep["slowest"]:
+        print(line(s))
+    print("Step peggiorati rispetto alla baseline:" if rep["regressed"] else "Nessuno step peggiorato.")
+    for s in rep["regressed"]:
+        print(line(s))
+
 
 def cmd_dwh_refresh(args: argparse.Namespace) -> None:
-    res = dwh_refresh.run(dry_run=args.dry_run)
+    if args.action == "report":
+        from app.jobs import dwh_history
+        rep = dwh_history.compare(mode=args.mode, baseline_runs=args.baseline, top=args.top)
+        if not rep.get("ok"):
+            print(rep.get("error"))
+            raise SystemExit(1)
+        _print_dwh_report(rep)
+        return
+
+    from app.jobs import dwh_refresh
+    if args.incremental:
+        mode = dwh_refresh.MODE_INCREMENTAL
+    elif args.swap:
+        mode = dwh_refresh.MODE_SWAP
+    elif args.partitions:
+        mode = dwh_refresh.MODE_PARTITIONS
+    else:
+        mode = dwh_refresh.MODE_FULL
+    res = dwh_refresh.run(dry_run=args.dry_run, mode=mode, lookback_days=args.lookback_days, jobs=args.jobs,
+                          years=args.years, profile=args.profile, explain=args.explain or None,
+                          report_out=args.report_out, skip_unchanged=args.skip_unchanged or None,
+                          dim_merge=args.dim_merge or None, resume=args.resume, retries=args.retries)
     print(res)
+    if not res.get("ok"):
+        raise SystemExit(1)
+
 
+def cmd_dwh_etl(args: argparse.Namespace) -> None:
+    from app.jobs import dwh_etl
+    _setup_logging("%(asctime)s %(levelname)s %(name)s: %(message)s")
+    res = dwh_etl.run(lookback_days=args.lookback_days, method=args.method, batch_size=args.batch_size)
+    print(res)
+    if not res.get("ok"):
+        raise SystemExit(1)
 
 
+def cmd_dwh_export(args: argparse.Namespace) -> None:
+    from app.jobs import dwh_export
+    _setup_logging("%(asctime)s %(levelname)s %(name)s: %(message)s")
+    res = dwh_export.run_export(args.view, fmt=args.format, out=args.out, batch_size=args.batch_size)
+    print(res)
+
 
 def build_parser() -> argparse.ArgumentParser:
     p = argparse.ArgumentParser(
@@ -94,21 +218,35 @@ def build_parser() -> argparse.ArgumentParser:
 
     # due
     pdue = sub.add_parser("due", help="Mostra le scadenze entro N giorni.")
-    pdue.add_argument("--within", type=int, default=int(os.getenv("MAINTENANCE_WITHIN", "7")),
-                      help="Giorni da verificare (default da .env).")
+    pdue.add_argument("--within", type=int, default=None,
+                      help="Giorni da verificare (default MAINTENANCE_WITHIN da .env, o 7).")
     pdue.set_defaults(func=cmd_due)
 
     # send
     psend = sub.add_parser("send", help="Invia email (rispetta throttle/log).")
-    psend.add_argument("--within", type=int, default=int(os.getenv("MAINTENANCE_WITHIN", "7")),
-                       help="Giorni da verificare.")
-    psend.add_argument("--throttle", type=int, default=int(os.getenv("MAINTENANCE_THROTTLE", "7")),
-                       help="Finestra anti-duplicazione (giorni).")
+    psend.add_argument("--within", type=int, default=None,
+                       help="Giorni da verificare (default MAINTENANCE_WITHIN da .env, o 7).")
+    psend.add_argument("--throttle", type=int, default=None,
+                       help="Finestra anti-duplicazione in giorni (default MAINTENANCE_THROTTLE da .env, o 7).")
     psend.add_argument("--dry-run", action="store_true", help="Mostra cosa invierebbe, senza inviare.")
     psend.add_argument("--no-advance", action="store_true",
                        help="Non creare eventi AUTO_RESET dopo l'invio.")
+    psend.add_argument("--outbox", action="store_true",
+                       help="Accoda le email in maintenance_outbox invece di inviarle (default SCHEDULER_OUTBOX).")
     psend.set_defaults(func=cmd_send)
 
+    # dispatch
+    pdis = sub.add_parser("dispatch", help="Invia le email accodate in maintenance_outbox.")
+    pdis.add_argument("--loop", action="store_true",
+                      help="Resta in attesa di nuove email invece di uscire a coda vuota.")
+    pdis.add_argument("--interval", type=float, default=30.0,
+                      help="Secondi tra due controlli della coda in modalità --loop.")
+    pdis.add_argument("--batch-size", type=int, default=None,
+                      help="Email prese in carico per lotto (default OUTBOX_BATCH_SIZE o 50).")
+    pdis.add_argument("--lease-sec", type=int, default=None,
+                      help="Durata del lease di un lotto (default OUTBOX_LEASE_SEC o 300).")
+    pdis.set_defaults(func=cmd_dispatch)
+
     # mark-done
     pmk = sub.add_parser("mark-done", help="Registra manualmente un intervento.")
     pmk.add_argument("task_id", type=int, help="ID del task.")
@@ -116,16 +254,100 @@ def build_parser() -> argparse.ArgumentParser:
     pmk.add_argument("--notes", type=str, default="", help="Note intervento.")
     pmk.set_defaults(func=cmd_mark_done)
 
+    # rebuild-next-due
+    prnd = sub.add_parser("rebuild-next-due",
+                          help="Ricalcola da zero la tabella maintenance_next_due.")
+    prnd.set_defaults(func=cmd_rebuild_next_due)
+
     # events
     pe = sub.add_parser("events", help="Storico interventi di un task.")
     pe.add_argument("task_id", type=int, help="ID del task.")
     pe.set_defaults(func=cmd_events)
 
+    # forecast
+    pfc = sub.add_parser("forecast", help="Carico di manutenzione previsto per reparto e settimana.")
+    pfc.add_argument("--horizon", type=int, default=365, help="Giorni da proiettare (default 365).")
+    pfc.add_argument("--format", choices=["csv", "json"], default="csv", help="Formato di output.")
+    pfc.add_argument("--out", type=str, default=None, help="File di output (default stdout).")
+    pfc.set_defaults(func=cmd_forecast)
+
+    # serve
+    psrv = sub.add_parser("serve", help="Demone: esegue i job secondo gli orari SCHEDULE_* del .env.")
+    psrv.add_argument("--dry-run", action="store_true",
+                      help="Mostra i job pianificati e la prossima esecuzione, poi esce.")
+    psrv.set_defaults(func=cmd_serve)
+
+    # watch
+    pw = sub.add_parser("watch", help="Notifica ogni scadenza nel momento in cui arriva (WATCH_OFFSETS_MIN).")
+    pw.add_argument("--dry-run", action="store_true", help="Logga le notifiche senza inviarle.")
+    pw.set_defaults(func=cmd_watch)
+
     # --- DWH REFRESH ---
-    pdwh = sub.add_parser("dwh-refresh", help="Ricostruisce completamente il DWH da dwh_executions.sql")
+    pdwh = sub.add_parser("dwh-refresh", help="Aggiorna il DWH (completo o incrementale).")
+    pdwh.add_argument("action", nargs="?", choices=["run", "report"], default="run",
+                      help="run (default) esegue il refresh, report confronta l'ultimo run con la baseline.")
     pdwh.add_argument("--dry-run", action="store_true",
                       help="Non esegue le query, le logga soltanto.")
+    pmode = pdwh.add_mutually_exclusive_group()
+    pmode.add_argument("--full", action="store_true",
+                       help="Ricostruzione completa da dwh_executions.sql (default).")
+    pmode.add_argument("--incremental", action="store_true",
+                       help="Ricarica solo documenti/movimenti nuovi o modificati (watermark).")
+    pmode.add_argument("--swap", action="store_true",
+                       help="Blue/green: costruisce in dwh_next e promuove con RENAME TABLE atomico.")
+    pmode.add_argument("--partitions", action="store_true",
+                       help="Come --incremental, ma ricostruisce solo le partizioni/anno toccate dei fatti.")
+    pdwh.add_argument("--lookback-days", type=int, default=None,
+                      help="Finestra di rilettura dell'incrementale (default DWH_INCREMENTAL_LOOKBACK_DAYS o 7).")
+    pdwh.add_argument("--jobs", type=int, default=None,
+                      help="Blocchi indipendenti eseguiti in parallelo (default DWH_REFRESH_JOBS o 1).")
+    pdwh.add_argument("--profile", choices=["default", "bulk"], default=None,
+                      help="Caricamento (full/swap). bulk: indici e FK dei fatti dopo il caricamento, "
+                           "poi controllo righe orfane (default DWH_REFRESH_PROFILE o default).")
+    pdwh.add_argument("--years", type=int, nargs="+", default=None,
+                      help="Con --partitions: anni da ricostruire (default dal watermark all'anno corrente).")
+    pdwh.add_argument("--skip-unchanged", action="store_true",
+                      help="Con --full: non ricostruisce le dimensioni con sorgenti fox_staging invariate "
+                           "(default DWH_REFRESH_SKIP_UNCHANGED).")
+    pdwh.add_argument("--dim-merge", action="store_true",
+                      help="Con --full: aggiorna le dimensioni per chiave naturale invece di ricrearle, "
+                           "chiavi surrogate stabili (default DWH_REFRESH_DIM_MERGE).")
+    pdwh.add_argument("--resume", action="store_true",
+                      help="Riprende l'ultimo run interrotto dal primo blocco incompleto (stesso script e opzioni).")
+    pdwh.add_argument("--retries", type=int, default=None,
+                      help="Nuovi tentativi di un blocco dopo un errore MySQL temporaneo (default DWH_REFRESH_RETRIES o 2).")
+    pdwh.add_argument("--explain", action="store_true",
+                      help="Salva l'EXPLAIN della parte SELECT di ogni statement (default DWH_REFRESH_EXPLAIN).")
+    pdwh.add_argument("--report-out", default=None,
+                      help="File del report JSON (default in DWH_REFRESH_REPORT_DIR o reports/dwh_refresh).")
+    pdwh.add_argument("--mode", choices=["full", "incremental", "swap", "partitions"], default=None,
+                      help="report: ultimo run di questa modalità (default l'ultimo in assoluto).")
+    pdwh.add_argument("--baseline", type=int, default=10,
+                      help="report: run riusciti precedenti usati come baseline (mediana, default 10).")
+    pdwh.add_argument("--top", type=int, default=10,
+                      help="report: step da mostrare per classifica (default 10).")
     pdwh.set_defaults(func=cmd_dwh_refresh)
+
+    # --- DWH ETL (fatti da Python) ---
+    petl = sub.add_parser("dwh-etl",
+                          help="Refresh incrementale con chiavi surrogate risolte in Python e insert a lotti.")
+    petl.add_argument("--lookback-days", type=int, default=None,
+                      help="Finestra di rilettura (default DWH_INCREMENTAL_LOOKBACK_DAYS o 7).")
+    petl.add_argument("--method", choices=["insert", "infile"], default=None,
+                      help="INSERT multi-riga o LOAD DATA LOCAL INFILE (default DWH_ETL_METHOD o insert).")
+    petl.add_argument("--batch-size", type=int, default=None,
+                      help="Righe per lotto (default DWH_ETL_BATCH o 5000).")
+    petl.set_defaults(func=cmd_dwh_etl)
+
+    # --- DWH EXPORT ---
+    pexp = sub.add_parser("dwh-export", help="Esporta una vista/tabella del DWH su file (streaming).")
+    pexp.add_argument("view", help="Vista o tabella dello schema dwh (es. vw_fact_docrig_detail).")
+    pexp.add_argument("--format", choices=["parquet", "csv"], default="csv",
+                      help="Formato di output (parquet richiede pyarrow).")
+    pexp.add_argument("--out", required=True, help="File di destinazione.")
+    pexp.add_argument("--batch-size", type=int, default=None,
+                      help="Righe lette e scritte per lotto (default DWH_EXPORT_BATCH o 50000).")
+    pexp.set_defaults(func=cmd_dwh_export)
     
     return p
 
@@ -133,6 +355,7 @@ def build_parser() -> argparse.ArgumentParser:
 def main() -> None:
     parser = build_parser()
     args = parser.parse_args()
+    _load_env()
     args.func(args)
 
 
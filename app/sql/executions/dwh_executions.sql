@@ -645,6 +645,7 @@ CREATE TABLE fact_magmov (
   PRIMARY KEY (fact_id),
 
   KEY idx_mov_date    (mov_date_key),
+  KEY idx_mov_id      (mov_id),
   KEY idx_customer    (customer_key),
   KEY idx_article     (article_key),
   KEY idx_warehouse   (warehouse_key),
@@ -799,26 +800,57 @@ FROM fox_staging.magcls c;
 USE dwh;
 
 -- ============================================
--- VIEW: vendite per anno / mese / gruppo / classe
+-- AGGREGATI VENDITE (tabelle riepilogo)
 -- ============================================
-DROP VIEW IF EXISTS vw_sales_by_month_group_class;
+-- Le viste vw_sales_by_month_* leggono da qui: i report non riaggregano fact_docrig.
+-- Grana: mese x gruppo x classe articolo e mese x cliente (chiavi surrogate delle
+-- dimensioni, NULL = codice non risolto, come il LEFT JOIN delle viste originali).
+-- dwh_incremental.sql ricalcola solo i mesi toccati dalla finestra di rilettura.
+DROP TABLE IF EXISTS agg_sales_month_group_class;
+
+CREATE TABLE agg_sales_month_group_class (
+  agg_id         BIGINT        NOT NULL AUTO_INCREMENT,
+  month_key      INT           NOT NULL,       -- es: 202511 (date_key DIV 100)
+  year_num       SMALLINT      NOT NULL,
+  month_num      TINYINT       NOT NULL,
+  doc_year_month CHAR(7)       NOT NULL,       -- formato YYYY-MM
+  art_group_key  INT           NULL,
+  art_class_key  INT           NULL,
+
+  rows_count     BIGINT        NOT NULL,
+  qty_total      DECIMAL(30,6) NULL,
+  amount_eur     DECIMAL(38,14) NULL,
+
+  PRIMARY KEY (agg_id),
+  KEY idx_month       (month_key),
+  KEY idx_group_class (art_group_key, art_class_key)
+) ENGINE=InnoDB
+  DEFAULT CHARSET = utf8mb4
+  COLLATE = utf8mb4_unicode_520_ci;
 
-CREATE VIEW vw_sales_by_month_group_class AS
+INSERT INTO agg_sales_month_group_class (
+  month_key,
+  year_num,
+  month_num,
+  doc_year_month,
+  art_group_key,
+  art_class_key,
+  rows_count,
+  qty_total,
+  amount_eur
+)
 SELECT
-  d.year_num                      AS year_num,
-  d.month_num                     AS month_num,
-  d.year_month                    AS doc_year_month,
-
-  g.codice                        AS art_group_code,
-  g.descrizion                    AS art_group_descr,
-  c.codice                        AS art_class_code,
-  c.descrizion                    AS art_class_descr,
-
+  f.doc_date_key DIV 100          AS month_key,
+  d.year_num,
+  d.month_num,
+  d.year_month,
+  g.art_group_key,
+  c.art_class_key,
   COUNT(*)                        AS rows_count,
   SUM(f.quantita)                 AS qty_total,
   SUM(
-    CASE 
-      WHEN f.eurocambio IS NULL OR f.eurocambio = 0 
+    CASE
+      WHEN f.eurocambio IS NULL OR f.eurocambio = 0
         THEN f.prezzotot
       ELSE f.prezzotot * f.eurocambio
     END
@@ -833,13 +865,98 @@ LEFT JOIN dim_art_group g
 LEFT JOIN dim_art_class c
   ON c.codice = a.classe
 GROUP BY
+  f.doc_date_key DIV 100,
   d.year_num,
   d.month_num,
   d.year_month,
-  g.codice,
-  g.descrizion,
-  c.codice,
-  c.descrizion;
+  g.art_group_key,
+  c.art_class_key;
+
+DROP TABLE IF EXISTS agg_sales_month_customer;
+
+CREATE TABLE agg_sales_month_customer (
+  agg_id         BIGINT        NOT NULL AUTO_INCREMENT,
+  month_key      INT           NOT NULL,       -- es: 202511 (date_key DIV 100)
+  year_num       SMALLINT      NOT NULL,
+  month_num      TINYINT       NOT NULL,
+  doc_year_month CHAR(7)       NOT NULL,
+  customer_key   INT           NULL,
+
+  rows_count     BIGINT        NOT NULL,
+  qty_total      DECIMAL(30,6) NULL,
+  amount_eur     DECIMAL(38,14) NULL,
+
+  PRIMARY KEY (agg_id),
+  KEY idx_month    (month_key),
+  KEY idx_customer (customer_key)
+) ENGINE=InnoDB
+  DEFAULT CHARSET = utf8mb4
+  COLLATE = utf8mb4_unicode_520_ci;
+
+INSERT INTO agg_sales_month_customer (
+  month_key,
+  year_num,
+  month_num,
+  doc_year_month,
+  customer_key,
+  rows_count,
+  qty_total,
+  amount_eur
+)
+SELECT
+  f.doc_date_key DIV 100          AS month_key,
+  d.year_num,
+  d.month_num,
+  d.year_month,
+  c.customer_key,
+  COUNT(*)                        AS rows_count,
+  SUM(f.quantita)                 AS qty_total,
+  SUM(
+    CASE
+      WHEN f.eurocambio IS NULL OR f.eurocambio = 0
+        THEN f.prezzotot
+      ELSE f.prezzotot * f.eurocambio
+    END
+  )                               AS amount_eur
+FROM fact_docrig f
+JOIN dim_date d
+  ON d.date_key = f.doc_date_key
+LEFT JOIN dim_customer c
+  ON c.customer_key = f.customer_key
+GROUP BY
+  f.doc_date_key DIV 100,
+  d.year_num,
+  d.month_num,
+  d.year_month,
+  c.customer_key;
+
+
+USE dwh;
+
+-- ============================================
+-- VIEW: vendite per anno / mese / gruppo / classe
+-- ============================================
+DROP VIEW IF EXISTS vw_sales_by_month_group_class;
+
+CREATE VIEW vw_sales_by_month_group_class AS
+SELECT
+  s.year_num                      AS year_num,
+  s.month_num                     AS month_num,
+  s.doc_year_month                AS doc_year_month,
+
+  g.codice                        AS art_group_code,
+  g.descrizion                    AS art_group_descr,
+  c.codice                        AS art_class_code,
+  c.descrizion                    AS art_class_descr,
+
+  s.rows_count                    AS rows_count,
+  s.qty_total                     AS qty_total,
+  s.amount_eur                    AS amount_eur
+FROM agg_sales_month_group_class s
+LEFT JOIN dim_art_group g
+  ON g.art_group_key = s.art_group_key
+LEFT JOIN dim_art_class c
+  ON c.art_class_key = s.art_class_key;
 
 
 USE dwh;
@@ -851,9 +968,9 @@ DROP VIEW IF EXISTS vw_sales_by_month_customer;
 
 CREATE VIEW vw_sales_by_month_customer AS
 SELECT
-  d.year_num                      AS year_num,
-  d.month_num                     AS month_num,
-  d.year_month                    AS doc_year_month,
+  s.year_num                      AS year_num,
+  s.month_num                     AS month_num,
+  s.doc_year_month                AS doc_year_month,
 
   c.codice                        AS customer_code,
   c.descrizion                    AS customer_name,
@@ -862,30 +979,12 @@ SELECT
   c.localita                      AS localita,
   c.provincia                     AS provincia,
 
-  COUNT(*)                        AS rows_count,
-  SUM(f.quantita)                 AS qty_total,
-  SUM(
-    CASE 
-      WHEN f.eurocambio IS NULL OR f.eurocambio = 0 
-        THEN f.prezzotot
-      ELSE f.prezzotot * f.eurocambio
-    END
-  )                               AS amount_eur
-FROM fact_docrig f
-JOIN dim_date d
-  ON d.date_key = f.doc_date_key
+  s.rows_count                    AS rows_count,
+  s.qty_total                     AS qty_total,
+  s.amount_eur                    AS amount_eur
+FROM agg_sales_month_customer s
 LEFT JOIN dim_customer c
-  ON c.customer_key = f.customer_key
-GROUP BY
-  d.year_num,
-  d.month_num,
-  d.year_month,
-  c.codice,
-  c.descrizion,
-  c.partita_iva,
-  c.codice_fiscale,
-  c.localita,
-  c.provincia;
+  ON c.customer_key = s.customer_key;
 
 
 USE dwh;
@@ -970,3 +1069,40 @@ LEFT JOIN dim_warehouse w
   ON w.warehouse_key = f.warehouse_key
 LEFT JOIN dim_tipodoc td
   ON td.tipodoc_key = f.tipodoc_key;
+
+
+USE dwh;
+
+-- ============================================
+-- WATERMARK per il refresh incrementale
+-- ============================================
+-- Registra fin dove sono arrivati i fatti caricati: dwh_incremental.sql
+-- ricarica solo documenti/movimenti nuovi o modificati da qui in avanti.
+DROP TABLE IF EXISTS etl_watermark;
+
+CREATE TABLE etl_watermark (
+  table_name   VARCHAR(64)  NOT NULL,          -- fact_docrig / fact_magmov
+  wm_id        BIGINT       NULL,              -- es. MAX(magmov.id) caricato
+  wm_date      DATE         NULL,              -- data documento/movimento più recente (max oggi)
+  updated_at   TIMESTAMP    NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+
+  PRIMARY KEY (table_name)
+) ENGINE=InnoDB
+  DEFAULT CHARSET = utf8mb4
+  COLLATE = utf8mb4_unicode_520_ci;
+
+INSERT INTO etl_watermark (table_name, wm_id, wm_date)
+SELECT
+  'fact_docrig',
+  NULL,
+  LEAST(d.full_date, CURDATE())
+FROM dim_date d
+WHERE d.date_key = (SELECT MAX(doc_date_key) FROM fact_docrig);
+
+INSERT INTO etl_watermark (table_name, wm_id, wm_date)
+SELECT
+  'fact_magmov',
+  (SELECT MAX(mov_id) FROM fact_magmov),
+  (SELECT LEAST(d.full_date, CURDATE())
+     FROM dim_date d
+    WHERE d.date_key = (SELECT MAX(mov_date_key) FROM fact_magmov));
@@ -0,0 +1,549 @@
+-- ==========================================
+-- DWH REFRESH INCREMENTALE (watermark)
+-- ==========================================
+-- Presuppone un DWH già costruito da dwh_executions.sql (che crea anche etl_watermark).
+-- - Dimensioni: si aggiungono SOLO i codici nuovi, le chiavi surrogate esistenti non cambiano.
+-- - Fatti: si cancellano e ricaricano solo documenti/movimenti nuovi o modificati,
+--   cioè quelli successivi al watermark meno una finestra di rilettura (@lookback_days).
+-- - Aggregati vendite (agg_sales_month_*): si ricalcolano solo i mesi dal primo giorno
+--   del mese di @doc_from in poi, gli unici in cui fact_docrig può essere cambiata.
+--
+-- @lookback_days viene impostata da dwh_refresh.run() prima di questo script.
+
+USE dwh;
+
+CREATE TABLE IF NOT EXISTS etl_watermark (
+  table_name   VARCHAR(64)  NOT NULL,
+  wm_id        BIGINT       NULL,
+  wm_date      DATE         NULL,
+  updated_at   TIMESTAMP    NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+
+  PRIMARY KEY (table_name)
+) ENGINE=InnoDB
+  DEFAULT CHARSET = utf8mb4
+  COLLATE = utf8mb4_unicode_520_ci;
+
+-- ============================================
+-- WATERMARK letti dall'ultimo run
+-- ============================================
+SET @lookback_days := COALESCE(@lookback_days, 7);
+
+SET @wm_doc_date := (SELECT wm_date FROM etl_watermark WHERE table_name = 'fact_docrig');
+SET @doc_from    := DATE_SUB(COALESCE(@wm_doc_date, '1900-01-01'), INTERVAL @lookback_days DAY);
+SET @doc_from_key := CAST(DATE_FORMAT(@doc_from, '%Y%m%d') AS SIGNED);
+SET @agg_from_month := CAST(DATE_FORMAT(@doc_from, '%Y%m') AS SIGNED);
+
+SET @wm_mov_id   := (SELECT wm_id   FROM etl_watermark WHERE table_name = 'fact_magmov');
+SET @wm_mov_date := (SELECT wm_date FROM etl_watermark WHERE table_name = 'fact_magmov');
+SET @mov_from    := DATE_SUB(COALESCE(@wm_mov_date, '1900-01-01'), INTERVAL @lookback_days DAY);
+SET @mov_from_key := CAST(DATE_FORMAT(@mov_from, '%Y%m%d') AS SIGNED);
+
+-- ============================================
+-- DIMENSIONI: solo nuovi codici
+-- ============================================
+INSERT INTO dim_customer (
+  codice,
+  descrizion,
+  supragsoc,
+  partita_iva,
+  codice_fiscale,
+  estero,
+  stato_cf,
+  cod_nazione,
+  cod_iso,
+  localita,
+  provincia,
+  cap,
+  indirizzo,
+  telefono,
+  email,
+  cli_pa,
+  dt_ult_agg
+)
+SELECT
+  a.`CODICE`,
+  a.`DESCRIZION`,
+  a.`SUPRAGSOC`,
+  a.`PARTIVA`,
+  a.`CODFISCALE`,
+  a.`ESTERO`,
+  a.`STATOCF`,
+  a.`CODNAZIONE`,
+  a.`CODICEISO`,
+  a.`LOCALITA`,
+  a.`PROV`,
+  a.`CAP`,
+  a.`INDIRIZZO`,
+  a.`TELEFONO`,
+  a.`EMAIL`,
+  a.`CLI_PA`,
+  a.`DTULTAGG`
+FROM fox_staging.anagrafe a
+LEFT JOIN dwh.dim_customer d
+  ON d.codice = a.`CODICE`
+WHERE d.customer_key IS NULL;
+
+INSERT INTO dim_article (
+  codicearti,
+  descrizion,
+  unmisura,
+  gruppo,
+  classe,
+  classeabc,
+  statoart,
+  pesounit,
+  qtaconf,
+  ubicazione,
+  marca,
+  cer,
+  timestamp_src,
+  username_src
+)
+SELECT
+  m.`CODICE`,
+  m.`DESCRIZION`,
+  m.`UNMISURA`,
+  m.`GRUPPO`,
+  m.`CLASSE`,
+  m.`CLASSEABC`,
+  m.`STATOART`,
+  m.`PESOUNIT`,
+  m.`QTACONF`,
+  m.`UBICAZIONE`,
+  m.`MARCA`,
+  m.`CER`,
+  m.`TIMESTAMP`,
+  m.`USERNAME`
+FROM fox_staging.magart m
+LEFT JOIN dwh.dim_article d
+  ON d.codicearti = m.`CODICE`
+WHERE d.article_key IS NULL;
+
+INSERT INTO dim_warehouse (
+    codice,
+    descrizion,
+    fiscale,
+    nonfiscale,
+    cantiere,
+    vds,
+    timestamp_src,
+    username_src
+)
+SELECT
+    m.`codice`,
+    m.`descrizion`,
+    m.`fiscale`,
+    m.`nonfiscale`,
+    m.`cantiere`,
+    m.`vds`,
+    m.`timestamp_row`,
+    m.`username`
+FROM fox_staging.magana m
+LEFT JOIN dwh.dim_warehouse d
+  ON d.codice = m.`codice`
+WHERE d.warehouse_key IS NULL;
+
+INSERT INTO dim_tipodoc (
+  tipodoc,
+  descrizione,
+  tipo_fiscale,
+  direction,
+  is_order,
+  is_invoice,
+  is_ddt
+)
+SELECT
+  t.tipodoc,
+  t.tipodoc        AS descrizione,
+  CASE
+    WHEN t.tipodoc IN ('OC','OF','OR','OX')   THEN 'ORDINE'
+    WHEN t.tipodoc IN ('FA','FB','FI')        THEN 'FATTURA'
+    WHEN t.tipodoc IN ('DD','DT')             THEN 'DDT'
+    ELSE 'ALTRO'
+  END AS tipo_fiscale,
+  CASE
+    WHEN t.tipodoc IN ('OC','OF','OR','OX','DD','DT') THEN 'OUT'
+    WHEN t.tipodoc IN ('AI','AF','NA')               THEN 'IN'
+    ELSE 'OTHER'
+  END AS direction,
+  CASE WHEN t.tipodoc IN ('OC','OF','OR','OX') THEN 1 ELSE 0 END AS is_order,
+  CASE WHEN t.tipodoc IN ('FA','FB','FI')      THEN 1 ELSE 0 END AS is_invoice,
+  CASE WHEN t.tipodoc IN ('DD','DT')           THEN 1 ELSE 0 END AS is_ddt
+FROM (
+  SELECT DISTINCT tipodoc
+  FROM fox_staging.doctes
+  WHERE tipodoc IS NOT NULL AND tipodoc <> ''
+) AS t
+LEFT JOIN dwh.dim_tipodoc d
+  ON d.tipodoc = t.tipodoc
+WHERE d.tipodoc_key IS NULL;
+
+INSERT INTO dim_causale_mag (
+  codice,
+  descrizion,
+  magpflag,
+  magaflag,
+  clifor,
+  ppordin,
+  ppimpegn,
+  pcordin,
+  pcimpegn,
+  apordin,
+  apimpegn,
+  acordin,
+  acimpegn,
+  timestamp_src,
+  username_src
+)
+SELECT
+  c.codice,
+  c.descrizion,
+  c.magpflag,
+  c.magaflag,
+  c.clifor,
+  c.ppordin,
+  c.ppimpegn,
+  c.pcordin,
+  c.pcimpegn,
+  c.apordin,
+  c.apimpegn,
+  c.acordin,
+  c.acimpegn,
+  c.timestamp_row,
+  c.username
+FROM fox_staging.caumag c
+LEFT JOIN dwh.dim_causale_mag d
+  ON d.codice = c.codice
+WHERE d.causale_key IS NULL;
+
+INSERT INTO dim_lotto (
+  codicearti,
+  codice,
+  descrizion,
+  datascad,
+  timestamp_src,
+  username_src
+)
+SELECT
+  l.codicearti,
+  l.codice,
+  l.descrizion,
+  l.datascad,
+  l.timestamp_row,
+  l.username
+FROM fox_staging.lotti l
+LEFT JOIN dwh.dim_lotto d
+  ON d.codicearti = l.codicearti
+ AND d.codice     = l.codice
+WHERE d.lotto_key IS NULL;
+
+INSERT INTO dim_art_group (
+  codice,
+  descrizion,
+  livello
+)
+SELECT
+  g.`codice`,
+  g.`descrizion`,
+  g.`livello`
+FROM fox_staging.maggrp g
+LEFT JOIN dwh.dim_art_group d
+  ON d.codice = g.`codice`
+WHERE d.art_group_key IS NULL;
+
+INSERT INTO dim_art_class (
+  codice,
+  descrizion,
+  livello
+)
+SELECT
+  c.`codice`,
+  c.`descrizion`,
+  c.`livello`
+FROM fox_staging.magcls c
+LEFT JOIN dwh.dim_art_class d
+  ON d.codice = c.`codice`
+WHERE d.art_class_key IS NULL;
+
+-- =====================================================
+-- FACT DOCRIG: documenti con data >= @doc_from
+-- =====================================================
+-- 1) righe già caricate nella finestra (anche documenti poi cancellati in origine)
+DELETE FROM fact_docrig
+WHERE doc_date_key >= @doc_from_key;
+
+-- 2) documenti della finestra senza date_key (data fuori calendario)
+DELETE f
+FROM fact_docrig f
+JOIN fox_staging.doctes t
+  ON t.tipodoc   = f.tipodoc
+ AND t.esanno    = f.esanno
+ AND t.numerodoc = f.numerodoc
+WHERE t.datadoc >= @doc_from;
+
+INSERT INTO fact_docrig (
+  tipodoc,
+  esanno,
+  numerodoc,
+  numeroriga,
+  doc_date_key,
+  deliv_date_key,
+  customer_key,
+  article_key,
+  warehouse_key,
+  tipodoc_key,
+  codicecf,
+  codicearti,
+  magpartenz,
+  magarrivo,
+  lotto,
+  quantita,
+  quantitare,
+  prezzoun,
+  prezzotot,
+  scontiv,
+  aliiva,
+  valuta,
+  cambio,
+  eurocambio
+)
+SELECT
+  r.tipodoc,
+  r.esanno,
+  r.numerodoc,
+  r.numeroriga,
+
+  dd_doc.date_key    AS doc_date_key,
+  dd_deliv.date_key  AS deliv_date_key,
+
+  c.customer_key,
+  a.article_key,
+  w.warehouse_key,
+  td.tipodoc_key,
+
+  t.codicecf,
+  r.codicearti,
+  r.magpartenz,
+  r.magarrivo,
+  r.lotto,
+
+  r.quantita,
+  r.quantitare,
+  r.prezzoun,
+  r.prezzotot,
+  r.scontiv,
+  r.aliiva,
+
+  t.valuta,
+  t.cambio,
+  t.eurocambio
+FROM fox_staging.docrig r
+JOIN fox_staging.doctes t
+  ON t.tipodoc   = r.tipodoc
+ AND t.esanno    = r.esanno
+ AND t.numerodoc = r.numerodoc
+LEFT JOIN dwh.dim_date dd_doc
+  ON dd_doc.full_date = t.datadoc
+LEFT JOIN dwh.dim_date dd_deliv
+  ON dd_deliv.full_date = t.dataconseg
+LEFT JOIN dwh.dim_customer c
+  ON c.codice = t.codicecf
+LEFT JOIN dwh.dim_article a
+  ON a.codicearti = r.codicearti
+LEFT JOIN dwh.dim_warehouse w
+  ON w.codice = r.magpartenz
+LEFT JOIN dwh.dim_tipodoc td
+  ON td.tipodoc = r.tipodoc
+WHERE t.datadoc >= @doc_from;
+
+-- =====================================================
+-- FACT MAGMOV: id > watermark oppure data >= @mov_from
+-- =====================================================
+DELETE FROM fact_magmov
+WHERE mov_id > COALESCE(@wm_mov_id, -1)
+   OR mov_date_key >= @mov_from_key;
+
+DELETE f
+FROM fact_magmov f
+JOIN fox_staging.magmov m
+  ON m.id = f.mov_id
+WHERE m.datamov >= @mov_from;
+
+INSERT INTO fact_magmov (
+  mov_id,
+  mov_date_key,
+  customer_key,
+  article_key,
+  warehouse_key,
+  causale_key,
+  codicecf,
+  codicearti,
+  magazzino,
+  codcausale,
+  lotto,
+  quantita,
+  quantitare,
+  qtaindist,
+  valore,
+  ultcosto,
+  ordin,
+  impegn,
+  qtacar,
+  qtascar,
+  qtatcar,
+  qtatscar,
+  qtaret
+)
+SELECT
+  m.id                                       AS mov_id,
+
+  dd.date_key                                AS mov_date_key,
+
+  c.customer_key                             AS customer_key,
+  a.article_key                              AS article_key,
+  w.warehouse_key                            AS warehouse_key,
+  cm.causale_key                             AS causale_key,
+
+  m.codicecf,
+  m.codicearti,
+  m.magazzino,
+  m.codcausale,
+  m.lotto,
+
+  m.quantita,
+  m.quantitare,
+  m.qtaindist,
+  m.valore,
+  m.ultcosto,
+
+  m.ordin,
+  m.impegn,
+  m.qtacar,
+  m.qtascar,
+  m.qtatcar,
+  m.qtatscar,
+  m.qtaret
+FROM fox_staging.magmov m
+LEFT JOIN dwh.dim_date dd
+  ON dd.full_date = m.datamov
+LEFT JOIN dwh.dim_customer c
+  ON c.codice = m.codicecf
+LEFT JOIN dwh.dim_article a
+  ON a.codicearti = m.codicearti
+LEFT JOIN dwh.dim_warehouse w
+  ON w.codice = m.magazzino
+LEFT JOIN dwh.dim_causale_mag cm
+  ON cm.codice = m.codcausale
+WHERE m.id > COALESCE(@wm_mov_id, -1)
+   OR m.datamov >= @mov_from;
+
+-- =====================================================
+-- AGGREGATI VENDITE: mesi >= @agg_from_month
+-- =====================================================
+DELETE FROM agg_sales_month_group_class
+WHERE month_key >= @agg_from_month;
+
+INSERT INTO agg_sales_month_group_class (
+  month_key,
+  year_num,
+  month_num,
+  doc_year_month,
+  art_group_key,
+  art_class_key,
+  rows_count,
+  qty_total,
+  amount_eur
+)
+SELECT
+  f.doc_date_key DIV 100          AS month_key,
+  d.year_num,
+  d.month_num,
+  d.year_month,
+  g.art_group_key,
+  c.art_class_key,
+  COUNT(*)                        AS rows_count,
+  SUM(f.quantita)                 AS qty_total,
+  SUM(
+    CASE
+      WHEN f.eurocambio IS NULL OR f.eurocambio = 0
+        THEN f.prezzotot
+      ELSE f.prezzotot * f.eurocambio
+    END
+  )                               AS amount_eur
+FROM fact_docrig f
+JOIN dim_date d
+  ON d.date_key = f.doc_date_key
+LEFT JOIN dim_article a
+  ON a.article_key = f.article_key
+LEFT JOIN dim_art_group g
+  ON g.codice = a.gruppo
+LEFT JOIN dim_art_class c
+  ON c.codice = a.classe
+WHERE f.doc_date_key >= @agg_from_month * 100
+GROUP BY
+  f.doc_date_key DIV 100,
+  d.year_num,
+  d.month_num,
+  d.year_month,
+  g.art_group_key,
+  c.art_class_key;
+
+DELETE FROM agg_sales_month_customer
+WHERE month_key >= @agg_from_month;
+
+INSERT INTO agg_sales_month_customer (
+  month_key,
+  year_num,
+  month_num,
+  doc_year_month,
+  customer_key,
+  rows_count,
+  qty_total,
+  amount_eur
+)
+SELECT
+  f.doc_date_key DIV 100          AS month_key,
+  d.year_num,
+  d.month_num,
+  d.year_month,
+  c.customer_key,
+  COUNT(*)                        AS rows_count,
+  SUM(f.quantita)                 AS qty_total,
+  SUM(
+    CASE
+      WHEN f.eurocambio IS NULL OR f.eurocambio = 0
+        THEN f.prezzotot
+      ELSE f.prezzotot * f.eurocambio
+    END
+  )                               AS amount_eur
+FROM fact_docrig f
+JOIN dim_date d
+  ON d.date_key = f.doc_date_key
+LEFT JOIN dim_customer c
+  ON c.customer_key = f.customer_key
+WHERE f.doc_date_key >= @agg_from_month * 100
+GROUP BY
+  f.doc_date_key DIV 100,
+  d.year_num,
+  d.month_num,
+  d.year_month,
+  c.customer_key;
+
+-- ============================================
+-- AGGIORNAMENTO WATERMARK
+-- ============================================
+REPLACE INTO etl_watermark (table_name, wm_id, wm_date)
+SELECT
+  'fact_docrig',
+  NULL,
+  LEAST(d.full_date, CURDATE())
+FROM dim_date d
+WHERE d.date_key = (SELECT MAX(doc_date_key) FROM fact_docrig);
+
+REPLACE INTO etl_watermark (table_name, wm_id, wm_date)
+SELECT
+  'fact_magmov',
+  (SELECT MAX(mov_id) FROM fact_magmov),
+  (SELECT LEAST(d.full_date, CURDATE())
+     FROM dim_date d
+    WHERE d.date_key = (SELECT MAX(mov_date_key) FROM fact_magmov));
@@ -67,6 +67,31 @@ CREATE TABLE IF NOT EXISTS maintenance_notification_log (
   CONSTRAINT fk_mnl_task FOREIGN KEY (task_id) REFERENCES maintenance_tasks(id) ON DELETE CASCADE
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
 
+-- 1.5 outbox email (send la riempie, dispatch la svuota)
+--   dedupe_key : una riga per (giorno, destinatario) => rilanciare send non accoda doppioni
+--   log_rows   : JSON [[task_id, email], ...] da scrivere in maintenance_notification_log dopo l'invio
+--   lease_*    : riga "presa" da un dispatcher fino a lease_until (poi torna disponibile)
+CREATE TABLE IF NOT EXISTS maintenance_outbox (
+  id BIGINT PRIMARY KEY AUTO_INCREMENT,
+  dedupe_key VARCHAR(190) NOT NULL,
+  recipients TEXT NOT NULL,
+  subject VARCHAR(255) NOT NULL,
+  html MEDIUMTEXT NOT NULL,
+  log_rows MEDIUMTEXT NULL,
+  reason VARCHAR(64) NULL,
+  status ENUM('PENDING','SENDING','SENT','FAILED') NOT NULL DEFAULT 'PENDING',
+  attempts INT NOT NULL DEFAULT 0,
+  next_attempt_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  lease_owner VARCHAR(64) NULL,
+  lease_until DATETIME NULL,
+  last_error VARCHAR(500) NULL,
+  created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  sent_at DATETIME NULL,
+  UNIQUE KEY ux_mo_dedupe (dedupe_key),
+  KEY ix_mo_status_next (status, next_attempt_at),
+  KEY ix_mo_lease (lease_owner)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
 -- ---------------------------------------------------------
 -- 1.x INDICI (compat 5.7 con check su information_schema)
 -- ---------------------------------------------------------
@@ -196,6 +221,20 @@ SET @sql := (
   )
 ); PREPARE s FROM @sql; EXECUTE s; DEALLOCATE PREPARE s;
 
+-- ix_me_task_done (storico per task a pagine: list_events_page_sql)
+SET @sql := (
+  SELECT IF (
+    NOT EXISTS (
+      SELECT 1 FROM INFORMATION_SCHEMA.STATISTICS
+      WHERE TABLE_SCHEMA = DATABASE()
+        AND TABLE_NAME = 'maintenance_events'
+        AND INDEX_NAME = 'ix_me_task_done'
+    ),
+    'CREATE INDEX ix_me_task_done ON maintenance_events (task_id, done_at, id)',
+    'SELECT 1'
+  )
+); PREPARE s FROM @sql; EXECUTE s; DEALLOCATE PREPARE s;
+
 -- ---------------------------------------------------------
 -- 2) VIEW (no CTE → ok 5.7)
 -- ---------------------------------------------------------
@@ -226,6 +265,138 @@ LEFT JOIN (
 WHERE t.active = 1
 GROUP BY t.id, t.title;
 
+-- ---------------------------------------------------------
+-- 2.1) PROSSIMA SCADENZA MATERIALIZZATA
+--   stessa logica della vista, ma una riga per task aggiornata
+--   solo quando cambia (trigger su eventi / regole / task):
+--   list_due diventa un range scan su ix_mnd_next_due.
+--   Ricalcolo completo: python -m app.main rebuild-next-due
+-- ---------------------------------------------------------
+CREATE TABLE IF NOT EXISTS maintenance_next_due (
+  task_id BIGINT PRIMARY KEY,
+  next_due_at DATETIME NULL,
+  last_done_at DATETIME NULL,
+  updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  KEY ix_mnd_next_due (next_due_at),
+  KEY ix_mnd_updated (updated_at),
+  CONSTRAINT fk_mnd_task FOREIGN KEY (task_id) REFERENCES maintenance_tasks(id) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- Registro delle modifiche per il watcher (app/jobs/watch.py).
+--   Ogni ricalcolo incrementa la versione (riga unica di _seq): il lock sulla riga resta
+--   fino al commit, quindi le versioni diventano visibili in ordine di commit e il
+--   watcher può leggere "tutto sopra l'ultima versione vista" senza perdere modifiche.
+--   task_id NULL = ricalcolo completo (rebuild-next-due).
+CREATE TABLE IF NOT EXISTS maintenance_next_due_seq (
+  id TINYINT PRIMARY KEY,
+  version BIGINT NOT NULL
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+INSERT IGNORE INTO maintenance_next_due_seq (id, version) VALUES (1, 0);
+
+CREATE TABLE IF NOT EXISTS maintenance_next_due_log (
+  id BIGINT PRIMARY KEY AUTO_INCREMENT,
+  version BIGINT NOT NULL,
+  task_id BIGINT NULL,
+  changed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  KEY ix_mndl_version (version),
+  KEY ix_mndl_changed (changed_at)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+DROP PROCEDURE IF EXISTS sp_refresh_next_due;
+DROP TRIGGER IF EXISTS trg_me_ai;
+DROP TRIGGER IF EXISTS trg_me_au;
+DROP TRIGGER IF EXISTS trg_me_ad;
+DROP TRIGGER IF EXISTS trg_mr_ai;
+DROP TRIGGER IF EXISTS trg_mr_au;
+DROP TRIGGER IF EXISTS trg_mr_ad;
+DROP TRIGGER IF EXISTS trg_mt_au;
+
+DELIMITER $$
+
+CREATE PROCEDURE sp_refresh_next_due(IN p_task_id BIGINT)
+BEGIN
+  DECLARE v_version BIGINT;
+
+  UPDATE maintenance_next_due_seq SET version = version + 1 WHERE id = 1;
+  SELECT version INTO v_version FROM maintenance_next_due_seq WHERE id = 1;
+  INSERT INTO maintenance_next_due_log (version, task_id) VALUES (v_version, p_task_id);
+
+  DELETE FROM maintenance_next_due WHERE task_id = p_task_id;
+
+  INSERT INTO maintenance_next_due (task_id, next_due_at, last_done_at)
+  SELECT
+    t.id,
+    MIN(
+      CASE r.kind
+        WHEN 'INTERVAL_DAYS' THEN DATE_ADD(COALESCE(le.last_done_at, t.created_at), INTERVAL r.interval_days DAY)
+        WHEN 'WEEKLY'        THEN DATE_ADD(COALESCE(le.last_done_at, t.created_at), INTERVAL (7 * r.interval_weeks) DAY)
+        WHEN 'MONTHLY'       THEN DATE_ADD(COALESCE(le.last_done_at, t.created_at), INTERVAL r.interval_months MONTH)
+        WHEN 'YEARLY'        THEN DATE_ADD(COALESCE(le.last_done_at, t.created_at), INTERVAL r.interval_years YEAR)
+        ELSE NULL
+      END
+    ),
+    le.last_done_at
+  FROM maintenance_tasks t
+  JOIN maintenance_rules r
+    ON r.task_id = t.id AND r.active = 1
+  LEFT JOIN (
+    SELECT task_id, MAX(done_at) AS last_done_at
+    FROM maintenance_events
+    WHERE task_id = p_task_id
+    GROUP BY task_id
+  ) AS le
+    ON le.task_id = t.id
+  WHERE t.id = p_task_id
+    AND t.active = 1
+  GROUP BY t.id, le.last_done_at;
+END$$
+
+CREATE TRIGGER trg_me_ai AFTER INSERT ON maintenance_events FOR EACH ROW
+BEGIN
+  CALL sp_refresh_next_due(NEW.task_id);
+END$$
+
+CREATE TRIGGER trg_me_au AFTER UPDATE ON maintenance_events FOR EACH ROW
+BEGIN
+  CALL sp_refresh_next_due(NEW.task_id);
+  IF OLD.task_id <> NEW.task_id THEN
+    CALL sp_refresh_next_due(OLD.task_id);
+  END IF;
+END$$
+
+CREATE TRIGGER trg_me_ad AFTER DELETE ON maintenance_events FOR EACH ROW
+BEGIN
+  CALL sp_refresh_next_due(OLD.task_id);
+END$$
+
+CREATE TRIGGER trg_mr_ai AFTER INSERT ON maintenance_rules FOR EACH ROW
+BEGIN
+  CALL sp_refresh_next_due(NEW.task_id);
+END$$
+
+CREATE TRIGGER trg_mr_au AFTER UPDATE ON maintenance_rules FOR EACH ROW
+BEGIN
+  CALL sp_refresh_next_due(NEW.task_id);
+  IF OLD.task_id <> NEW.task_id THEN
+    CALL sp_refresh_next_due(OLD.task_id);
+  END IF;
+END$$
+
+CREATE TRIGGER trg_mr_ad AFTER DELETE ON maintenance_rules FOR EACH ROW
+BEGIN
+  CALL sp_refresh_next_due(OLD.task_id);
+END$$
+
+CREATE TRIGGER trg_mt_au AFTER UPDATE ON maintenance_tasks FOR EACH ROW
+BEGIN
+  IF NOT (OLD.active <=> NEW.active) OR NOT (OLD.created_at <=> NEW.created_at) THEN
+    CALL sp_refresh_next_due(NEW.id);
+  END IF;
+END$$
+
+DELIMITER ;
+
 -- ---------------------------------------------------------
 -- 3) SEED ATTIVITÀ + REGOLE
 -- ---------------------------------------------------------
@@ -466,3 +637,23 @@ WHERE @tid_fric IS NOT NULL
 -- FROM vw_maintenance_next_due v
 -- JOIN maintenance_tasks t ON t.id=v.task_id
 -- WHERE t.id=@tid_fric;
+
+-- ---------------------------------------------------------
+-- 6) ALLINEAMENTO maintenance_next_due (dati preesistenti ai trigger)
+-- ---------------------------------------------------------
+REPLACE INTO maintenance_next_due (task_id, next_due_at, last_done_at)
+SELECT task_id, next_due_at, last_done_at
+FROM (
+  SELECT v.task_id, v.next_due_at, le.last_done_at
+  FROM vw_maintenance_next_due v
+  LEFT JOIN (
+    SELECT task_id, MAX(done_at) AS last_done_at
+    FROM maintenance_events
+    GROUP BY task_id
+  ) AS le
+    ON le.task_id = v.task_id
+) AS x;
+
+UPDATE maintenance_next_due_seq SET version = version + 1 WHERE id = 1;
+INSERT INTO maintenance_next_due_log (version, task_id)
+SELECT version, NULL FROM maintenance_next_due_seq WHERE id = 1;
@@ -0,0 +1,637 @@
+"""
+MIT License
+(c) 2025 Riccardo Leonelli
+"""
+
+from typing import Iterable, List, Optional, Tuple
+
+
+class QuerySqlDwhMYSQL:
+    # ---------- CATALOGO ----------
+    @staticmethod
+    def list_base_tables_sql() -> str:
+        """
+        Elenco delle tabelle (non viste) di uno schema.
+        Parametri:
+          - schema
+        """
+        return """
+            SELECT TABLE_NAME AS table_name
+            FROM information_schema.TABLES
+            WHERE TABLE_SCHEMA = %s
+              AND TABLE_TYPE = 'BASE TABLE'
+            ORDER BY TABLE_NAME
+        """
+
+    # ---------- BLUE/GREEN ----------
+    @staticmethod
+    def create_schema_sql(schema: str) -> str:
+        """Crea lo schema (se manca) con lo stesso charset/collation del DWH."""
+        return f"""
+            CREATE DATABASE IF NOT EXISTS `{schema}`
+              CHARACTER SET utf8mb4
+              COLLATE utf8mb4_unicode_520_ci
+        """
+
+    @staticmethod
+    def drop_schema_sql(schema: str) -> str:
+        return f"DROP DATABASE IF EXISTS `{schema}`"
+
+    @staticmethod
+    def rename_tables_sql(moves: Iterable[Tuple[str, str, str, str]]) -> str:
+        """
+        Un unico RENAME TABLE (atomico) per tutte le coppie
+        (schema_da, tabella_da, schema_a, tabella_a), eseguite nell'ordine dato.
+        """
+        parts = [
+            f"`{s_from}`.`{t_from}` TO `{s_to}`.`{t_to}`"
+            for s_from, t_from, s_to, t_to in moves
+        ]
+        return "RENAME TABLE " + ",\n  ".join(parts)
+
+    # ---------- EXPORT ----------
+    @staticmethod
+    def list_columns_sql() -> str:
+        """
+        Colonne (in ordine) di una tabella o vista, con i dati per il tipo di destinazione.
+        Parametri:
+          - schema
+          - nome tabella/vista
+        """
+        return """
+            SELECT
+              COLUMN_NAME       AS column_name,
+              DATA_TYPE         AS data_type,
+              COLUMN_TYPE       AS column_type,
+              NUMERIC_PRECISION AS num_precision,
+              NUMERIC_SCALE     AS num_scale
+            FROM information_schema.COLUMNS
+            WHERE TABLE_SCHEMA = %s
+              AND TABLE_NAME = %s
+            ORDER BY ORDINAL_POSITION
+        """
+
+    @staticmethod
+    def select_all_sql(schema: str, table: str, columns: Iterable[str]) -> str:
+        """SELECT di tutte le colonne indicate (nomi già verificati sul catalogo)."""
+        def q(name: str) -> str:
+            return "`" + name.replace("`", "``") + "`"
+        cols = ",\n  ".join(q(c) for c in columns)
+        return f"SELECT\n  {cols}\nFROM {q(schema)}.{q(table)}"
+
+    # ---------- ETL PYTHON (dwh_etl) ----------
+    @staticmethod
+    def dim_key_map_sql(table: str, natural_key: str, surrogate_key: str) -> str:
+        """Mappa chiave naturale -> chiave surrogata di una dimensione (caricata una volta)."""
+        return f"SELECT {natural_key} AS nk, {surrogate_key} AS sk FROM {table}"
+
+    @staticmethod
+    def etl_window_sql() -> str:
+        """Finestra calcolata da dwh_incremental.sql (variabili di sessione)."""
+        return """
+            SELECT
+              CAST(@doc_from AS DATE)    AS doc_from,
+              CAST(@wm_mov_id AS SIGNED) AS wm_mov_id,
+              CAST(@mov_from AS DATE)    AS mov_from
+        """
+
+    @staticmethod
+    def etl_docrig_source_sql() -> str:
+        """
+        Righe documento da fox_staging, senza join sulle dimensioni.
+        Parametri:
+          - datadoc minima
+        """
+        return """
+            SELECT
+              r.tipodoc, r.esanno, r.numerodoc, r.numeroriga,
+              t.datadoc, t.dataconseg,
+              t.codicecf, r.codicearti, r.magpartenz, r.magarrivo, r.lotto,
+              r.quantita, r.quantitare, r.prezzoun, r.prezzotot, r.scontiv, r.aliiva,
+              t.valuta, t.cambio, t.eurocambio
+            FROM fox_staging.docrig r
+            JOIN fox_staging.doctes t
+              ON t.tipodoc   = r.tipodoc
+             AND t.esanno    = r.esanno
+             AND t.numerodoc = r.numerodoc
+            WHERE t.datadoc >= %s
+        """
+
+    @staticmethod
+    def etl_magmov_source_sql() -> str:
+        """
+        Movimenti di magazzino da fox_staging, senza join sulle dimensioni.
+        Parametri:
+          - id watermark (righe con id maggiore)
+          - datamov minima
+        """
+        return """
+            SELECT
+              m.id, m.datamov,
+              m.codicecf, m.codicearti, m.magazzino, m.codcausale, m.lotto,
+              m.quantita, m.quantitare, m.qtaindist, m.valore, m.ultcosto,
+              m.ordin, m.impegn, m.qtacar, m.qtascar, m.qtatcar, m.qtatscar, m.qtaret
+            FROM fox_staging.magmov m
+            WHERE m.id > %s
+               OR m.datamov >= %s
+        """
+
+    @staticmethod
+    def insert_rows_sql(table: str, columns: Iterable[str]) -> str:
+        """INSERT ... VALUES per executemany (il connector lo riscrive multi-riga)."""
+        cols = list(columns)
+        return (
+            f"INSERT INTO {table} ({', '.join(cols)}) "
+            f"VALUES ({', '.join(['%s'] * len(cols))})"
+        )
+
+    @staticmethod
+    def load_data_local_sql(path: str, table: str, columns: Iterable[str]) -> str:
+        """LOAD DATA LOCAL INFILE di un file TSV (NULL = \\N), colonne nell'ordine dato."""
+        quoted = path.replace("\\", "/").replace("'", "''")
+        return (
+            f"LOAD DATA LOCAL INFILE '{quoted}' INTO TABLE {table} "
+            "CHARACTER SET utf8mb4 "
+            "FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' "
+            "LINES TERMINATED BY '\\n' "
+            f"({', '.join(columns)})"
+        )
+
+    # ---------- PARTIZIONI PER ANNO (dwh_partitions) ----------
+    @staticmethod
+    def partitions_sql() -> str:
+        """
+        Partizioni di una tabella (nessuna riga con nome = tabella non partizionata).
+        Parametri:
+          - schema
+          - tabella
+        """
+        return """
+            SELECT
+              PARTITION_NAME        AS partition_name,
+              PARTITION_DESCRIPTION AS less_than,
+              TABLE_ROWS            AS table_rows
+            FROM information_schema.PARTITIONS
+            WHERE TABLE_SCHEMA = %s
+              AND TABLE_NAME = %s
+              AND PARTITION_NAME IS NOT NULL
+            ORDER BY PARTITION_ORDINAL_POSITION
+        """
+
+    @staticmethod
+    def constraints_sql() -> str:
+        """
+        Vincoli di una tabella (PRIMARY KEY, UNIQUE, FOREIGN KEY).
+        Parametri:
+          - schema
+          - tabella
+        """
+        return """
+            SELECT
+              CONSTRAINT_NAME AS constraint_name,
+              CONSTRAINT_TYPE AS constraint_type
+            FROM information_schema.TABLE_CONSTRAINTS
+            WHERE TABLE_SCHEMA = %s
+              AND TABLE_NAME = %s
+        """
+
+    @staticmethod
+    def calendar_years_sql() -> str:
+        return "SELECT MIN(year_num) AS first_year, MAX(year_num) AS last_year FROM dim_date"
+
+    @staticmethod
+    def drop_foreign_keys_sql(table: str, names: Iterable[str]) -> str:
+        return f"ALTER TABLE {table} " + ", ".join(f"DROP FOREIGN KEY `{n}`" for n in names)
+
+    @staticmethod
+    def drop_primary_key_sql(table: str) -> str:
+        """La PK (fact_id) non contiene la colonna di partizione: resta un indice per l'AUTO_INCREMENT."""
+        return f"ALTER TABLE {table} DROP PRIMARY KEY, ADD KEY idx_fact_id (fact_id)"
+
+    @staticmethod
+    def partition_by_year_sql(table: str, date_col: str, first_year: int, last_year: int) -> str:
+        """
+        RANGE sulla chiave data (AAAAMMGG): p_old = prima del calendario e date non risolte
+        (NULL va nella prima partizione), una partizione per anno, p_max = oltre il calendario.
+        """
+        parts = [f"PARTITION p_old VALUES LESS THAN ({first_year}0101)"]
+        parts += [f"PARTITION p{y} VALUES LESS THAN ({y + 1}0101)" for y in range(first_year, last_year + 1)]
+        parts.append("PARTITION p_max VALUES LESS THAN MAXVALUE")
+        return f"ALTER TABLE {table} PARTITION BY RANGE ({date_col}) (\n  " + ",\n  ".join(parts) + "\n)"
+
+    @staticmethod
+    def create_stage_sql(stage: str, table: str) -> List[str]:
+        """Tabella di appoggio con la stessa struttura ma senza partizioni (requisito di EXCHANGE)."""
+        return [
+            QuerySqlDwhMYSQL.drop_table_sql(stage),
+            f"CREATE TABLE {stage} LIKE {table}",
+            f"ALTER TABLE {stage} REMOVE PARTITIONING",
+        ]
+
+    @staticmethod
+    def drop_table_sql(table: str) -> str:
+        return f"DROP TABLE IF EXISTS {table}"
+
+    @staticmethod
+    def next_fact_id_sql(table: str) -> str:
+        return f"SELECT COALESCE(MAX(fact_id), 0) + 1 AS next_id FROM {table}"
+
+    @staticmethod
+    def set_auto_increment_sql(table: str, value: int) -> str:
+        return f"ALTER TABLE {table} AUTO_INCREMENT = {int(value)}"
+
+    @staticmethod
+    def exchange_partition_sql(table: str, partition: str, stage: str) -> str:
+        return f"ALTER TABLE {table} EXCHANGE PARTITION {partition} WITH TABLE {stage}"
+
+    @staticmethod
+    def min_new_magmov_date_sql() -> str:
+        """
+        Data minima dei movimenti oltre il watermark id (possono avere date di anni precedenti).
+        Parametri:
+          - id watermark
+        """
+        return "SELECT MIN(datamov) AS min_date FROM fox_staging.magmov WHERE id > %s"
+
+    @staticmethod
+    def stage_docrig_sql(stage: str) -> str:
+        """
+        Righe documento di un anno nella tabella di appoggio (stesse colonne del caricamento completo).
+        Parametri:
+          - data inizio (inclusa), data fine (esclusa)
+        """
+        return f"""
+            INSERT INTO {stage} (
+              tipodoc, esanno, numerodoc, numeroriga,
+              doc_date_key, deliv_date_key,
+              customer_key, article_key, warehouse_key, tipodoc_key,
+              codicecf, codicearti, magpartenz, magarrivo, lotto,
+              quantita, quantitare, prezzoun, prezzotot, scontiv, aliiva,
+              valuta, cambio, eurocambio
+            )
+            SELECT
+              r.tipodoc, r.esanno, r.numerodoc, r.numeroriga,
+              dd_doc.date_key, dd_deliv.date_key,
+              c.customer_key, a.article_key, w.warehouse_key, td.tipodoc_key,
+              t.codicecf, r.codicearti, r.magpartenz, r.magarrivo, r.lotto,
+              r.quantita, r.quantitare, r.prezzoun, r.prezzotot, r.scontiv, r.aliiva,
+              t.valuta, t.cambio, t.eurocambio
+            FROM fox_staging.docrig r
+            JOIN fox_staging.doctes t
+              ON t.tipodoc   = r.tipodoc
+             AND t.esanno    = r.esanno
+             AND t.numerodoc = r.numerodoc
+            JOIN dim_date dd_doc
+              ON dd_doc.full_date = t.datadoc
+            LEFT JOIN dim_date dd_deliv
+              ON dd_deliv.full_date = t.dataconseg
+            LEFT JOIN dim_customer c
+              ON c.codice = t.codicecf
+            LEFT JOIN dim_article a
+              ON a.codicearti = r.codicearti
+            LEFT JOIN dim_warehouse w
+              ON w.codice = r.magpartenz
+            LEFT JOIN dim_tipodoc td
+              ON td.tipodoc = r.tipodoc
+            WHERE t.datadoc >= %s
+              AND t.datadoc < %s
+        """
+
+    @staticmethod
+    def stage_magmov_sql(stage: str) -> str:
+        """
+        Movimenti di un anno nella tabella di appoggio.
+        Parametri:
+          - data inizio (inclusa), data fine (esclusa)
+        """
+        return f"""
+            INSERT INTO {stage} (
+              mov_id, mov_date_key,
+              customer_key, article_key, warehouse_key, causale_key,
+              codicecf, codicearti, magazzino, codcausale, lotto,
+              quantita, quantitare, qtaindist, valore, ultcosto,
+              ordin, impegn, qtacar, qtascar, qtatcar, qtatscar, qtaret
+            )
+            SELECT
+              m.id, dd.date_key,
+              c.customer_key, a.article_key, w.warehouse_key, cm.causale_key,
+              m.codicecf, m.codicearti, m.magazzino, m.codcausale, m.lotto,
+              m.quantita, m.quantitare, m.qtaindist, m.valore, m.ultcosto,
+              m.ordin, m.impegn, m.qtacar, m.qtascar, m.qtatcar, m.qtatscar, m.qtaret
+            FROM fox_staging.magmov m
+            JOIN dim_date dd
+              ON dd.full_date = m.datamov
+            LEFT JOIN dim_customer c
+              ON c.codice = m.codicecf
+            LEFT JOIN dim_article a
+              ON a.codicearti = m.codicearti
+            LEFT JOIN dim_warehouse w
+              ON w.codice = m.magazzino
+            LEFT JOIN dim_causale_mag cm
+              ON cm.codice = m.codcausale
+            WHERE m.datamov >= %s
+              AND m.datamov < %s
+        """
+
+    # ---------- BULK LOAD ----------
+    @staticmethod
+    def add_deferred_keys_sql(table: str, definitions: Iterable[str]) -> str:
+        """
+        Un solo ALTER TABLE per tutti gli indici secondari e le FK rimandati dal profilo bulk:
+        InnoDB costruisce gli indici in un'unica passata (ordinamento), le FK aggiunte con
+        foreign_key_checks=0 non rileggono la tabella.
+        """
+        return f"ALTER TABLE {table}\n  ADD " + ",\n  ADD ".join(definitions)
+
+    @staticmethod
+    def orphans_sql(schema: str, table: str, fks: Iterable[Tuple[str, str, str, str]]) -> str:
+        """
+        Righe orfane per ogni FK (nome, colonna, tabella riferita, colonna riferita) con una
+        sola scansione della tabella dei fatti: valore presente ma assente nella dimensione.
+        """
+        sums = []
+        joins = []
+        for i, (name, col, ref_table, ref_col) in enumerate(fks):
+            sums.append(f"COALESCE(SUM(f.`{col}` IS NOT NULL AND d{i}.`{ref_col}` IS NULL), 0) AS `{name}`")
+            joins.append(f"LEFT JOIN `{schema}`.`{ref_table}` d{i} ON d{i}.`{ref_col}` = f.`{col}`")
+        return (
+            "SELECT\n  " + ",\n  ".join(sums)
+            + f"\nFROM `{schema}`.`{table}` f\n" + "\n".join(joins)
+        )
+
+    # ---------- MERGE DELLE DIMENSIONI (dwh_merge) ----------
+    @staticmethod
+    def merge_update_dim_sql(table: str, columns: Iterable[str], key: Iterable[str], select: str) -> str:
+        """
+        Aggiorna le sole righe della dimensione con almeno una colonna (fuori chiave) diversa.
+        `select`: SELECT sorgente con le colonne già rinominate come quelle della dimensione.
+        """
+        key = list(key)
+        values = [c for c in columns if c not in key]
+        on = " AND ".join(f"cur.`{c}` = s.`{c}`" for c in key)
+        sets = ",\n  ".join(f"cur.`{c}` = s.`{c}`" for c in values)
+        same = "\n  AND ".join(f"cur.`{c}` <=> s.`{c}`" for c in values)
+        return f"""UPDATE `{table}` cur
+JOIN (
+{select}
+) AS s ON {on}
+SET {sets}
+WHERE NOT (
+  {same}
+)"""
+
+    @staticmethod
+    def merge_insert_dim_sql(table: str, columns: Iterable[str], key: Iterable[str], select: str) -> str:
+        """Inserisce i soli codici non ancora presenti (le chiavi surrogate esistenti non cambiano)."""
+        key = list(key)
+        cols = ", ".join(f"`{c}`" for c in columns)
+        src = ", ".join(f"s.`{c}`" for c in columns)
+        on = " AND ".join(f"cur.`{c}` = s.`{c}`" for c in key)
+        return f"""INSERT INTO `{table}` ({cols})
+SELECT {src}
+FROM (
+{select}
+) AS s
+LEFT JOIN `{table}` cur ON {on}
+WHERE cur.`{key[0]}` IS NULL"""
+
+    # ---------- SORGENTI INVARIATE (dwh_checksum) ----------
+    @staticmethod
+    def list_objects_sql() -> str:
+        """
+        Tabelle e viste di uno schema.
+        Parametri:
+          - schema
+        """
+        return """
+            SELECT TABLE_NAME AS table_name
+            FROM information_schema.TABLES
+            WHERE TABLE_SCHEMA = %s
+        """
+
+    @staticmethod
+    def checksum_table_sql(table: str) -> str:
+        """CHECKSUM TABLE di una tabella qualificata (schema.tabella): colonne Table, Checksum."""
+        return "CHECKSUM TABLE " + ".".join(f"`{p}`" for p in table.split("."))
+
+    @staticmethod
+    def source_stats_sql(table: str, stamp_col: Optional[str]) -> str:
+        """Numero di righe e massimo della colonna di ultimo aggiornamento (NULL se non c'è)."""
+        stamp = f"MAX(`{stamp_col}`)" if stamp_col else "NULL"
+        name = ".".join(f"`{p}`" for p in table.split("."))
+        return f"SELECT COUNT(*) AS row_count, {stamp} AS max_stamp FROM {name}"
+
+    @staticmethod
+    def block_state_ddl() -> str:
+        return """
+            CREATE TABLE IF NOT EXISTS dwh_refresh_block_state (
+              block_name VARCHAR(128) PRIMARY KEY,
+              sql_hash CHAR(16) NOT NULL,
+              inputs_hash CHAR(16) NOT NULL,
+              inputs_json TEXT NOT NULL,
+              built_at DATETIME NOT NULL
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        """
+
+    @staticmethod
+    def block_states_sql() -> str:
+        return """
+            SELECT block_name, sql_hash, inputs_hash, inputs_json, built_at
+            FROM dwh_refresh_block_state
+        """
+
+    @staticmethod
+    def upsert_block_state_sql() -> str:
+        """Stato di un blocco (REPLACE sulla PK block_name, come etl_watermark)."""
+        return """
+            REPLACE INTO dwh_refresh_block_state (block_name, sql_hash, inputs_hash, inputs_json, built_at)
+            VALUES (%s, %s, %s, %s, %s)
+        """
+
+    # ---------- CHECKPOINT DEL REFRESH (dwh_checkpoint) ----------
+    # Nello schema applicativo, come lo storico: il DROP DATABASE dwh non li cancella.
+    @staticmethod
+    def checkpoint_ddl() -> str:
+        return """
+            CREATE TABLE IF NOT EXISTS dwh_refresh_checkpoints (
+              script_hash CHAR(16) NOT NULL,
+              block_no INT NOT NULL,
+              stmt_no INT NOT NULL,
+              stmt_hash CHAR(16) NOT NULL,
+              block_name VARCHAR(128) NOT NULL,
+              mode VARCHAR(20) NOT NULL,
+              completed_at DATETIME NOT NULL,
+              PRIMARY KEY (script_hash, block_no, stmt_no)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        """
+
+    @staticmethod
+    def checkpoints_sql() -> str:
+        """
+        Statement completati di uno script.
+        Parametri:
+          - script_hash
+        """
+        return """
+            SELECT block_no, stmt_no, stmt_hash, block_name, completed_at
+            FROM dwh_refresh_checkpoints
+            WHERE script_hash = %s
+            ORDER BY block_no, stmt_no
+        """
+
+    @staticmethod
+    def checkpoint_scripts_sql() -> str:
+        """
+        Script con checkpoint registrati per una modalità (per spiegare una ripresa da zero).
+        Parametri:
+          - mode
+        """
+        return """
+            SELECT script_hash, mode, COUNT(DISTINCT block_no) AS blocks, MAX(completed_at) AS last_at
+            FROM dwh_refresh_checkpoints
+            WHERE mode = %s
+            GROUP BY script_hash, mode
+        """
+
+    @staticmethod
+    def upsert_checkpoint_sql() -> str:
+        """Checkpoint di uno statement (REPLACE sulla PK, come etl_watermark)."""
+        return """
+            REPLACE INTO dwh_refresh_checkpoints
+              (script_hash, block_no, stmt_no, stmt_hash, block_name, mode, completed_at)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+        """
+
+    @staticmethod
+    def delete_checkpoints_sql() -> str:
+        """
+        Checkpoint di uno script: quelli degli altri script (es. un full interrotto mentre
+        gira un incrementale) restano riprendibili.
+        Parametri:
+          - script_hash
+          - mode
+        """
+        return "DELETE FROM dwh_refresh_checkpoints WHERE script_hash = %s AND mode = %s"
+
+    @staticmethod
+    def prune_checkpoints_sql() -> str:
+        """
+        Checkpoint abbandonati (script cambiato, run mai ripreso).
+        Parametri:
+          - giorni da conservare
+        """
+        return "DELETE FROM dwh_refresh_checkpoints WHERE completed_at < NOW() - INTERVAL %s DAY"
+
+    # ---------- STORICO DEI REFRESH (dwh_history) ----------
+    # Le tabelle stanno nello schema applicativo (connessione di default), non in dwh:
+    # il refresh completo fa DROP DATABASE dwh e lo storico andrebbe perso.
+    @staticmethod
+    def refresh_history_ddl() -> List[str]:
+        return [
+            """
+            CREATE TABLE IF NOT EXISTS dwh_refresh_runs (
+              run_id BIGINT PRIMARY KEY AUTO_INCREMENT,
+              started_at DATETIME NOT NULL,
+              finished_at DATETIME NOT NULL,
+              mode VARCHAR(20) NOT NULL,
+              profile VARCHAR(20) NOT NULL,
+              jobs INT NOT NULL,
+              ok TINYINT(1) NOT NULL,
+              statements INT NOT NULL,
+              executed INT NOT NULL,
+              elapsed_sec DECIMAL(12,3) NOT NULL,
+              report_path VARCHAR(500) NULL,
+              KEY ix_drr_mode (mode, profile, run_id)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS dwh_refresh_steps (
+              id BIGINT PRIMARY KEY AUTO_INCREMENT,
+              run_id BIGINT NOT NULL,
+              stmt_no INT NOT NULL,
+              step_hash CHAR(16) NOT NULL,
+              target VARCHAR(128) NULL,
+              label VARCHAR(255) NOT NULL,
+              executions INT NOT NULL,
+              status VARCHAR(10) NOT NULL,
+              elapsed_sec DECIMAL(12,3) NOT NULL,
+              rows_affected BIGINT NULL,
+              warnings INT NOT NULL DEFAULT 0,
+              warning_sample VARCHAR(1000) NULL,
+              explain_json MEDIUMTEXT NULL,
+              KEY ix_drs_run (run_id, stmt_no),
+              KEY ix_drs_hash (step_hash, run_id),
+              CONSTRAINT fk_drs_run FOREIGN KEY (run_id) REFERENCES dwh_refresh_runs(run_id) ON DELETE CASCADE
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+            """,
+        ]
+
+    @staticmethod
+    def insert_refresh_run_sql() -> str:
+        return """
+            INSERT INTO dwh_refresh_runs
+              (started_at, finished_at, mode, profile, jobs, ok, statements, executed, elapsed_sec, report_path)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        """
+
+    @staticmethod
+    def insert_refresh_step_sql() -> str:
+        return """
+            INSERT INTO dwh_refresh_steps
+              (run_id, stmt_no, step_hash, target, label, executions, status,
+               elapsed_sec, rows_affected, warnings, warning_sample, explain_json)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        """
+
+    @staticmethod
+    def set_refresh_report_path_sql() -> str:
+        return "UPDATE dwh_refresh_runs SET report_path = %s WHERE run_id = %s"
+
+    @staticmethod
+    def last_refresh_run_sql(with_mode: bool) -> str:
+        """
+        Ultimo run registrato.
+        Parametri:
+          - modalità (solo se with_mode)
+        """
+        where = "WHERE mode = %s" if with_mode else ""
+        return f"""
+            SELECT run_id, started_at, mode, profile, jobs, ok, statements, executed, elapsed_sec
+            FROM dwh_refresh_runs
+            {where}
+            ORDER BY run_id DESC
+            LIMIT 1
+        """
+
+    @staticmethod
+    def baseline_refresh_runs_sql() -> str:
+        """
+        Run riusciti precedenti con stessa modalità e profilo (baseline mobile).
+        Parametri:
+          - run_id di riferimento (esclusivo)
+          - modalità
+          - profilo
+          - numero di run
+        """
+        return """
+            SELECT run_id, elapsed_sec
+            FROM dwh_refresh_runs
+            WHERE run_id < %s
+              AND mode = %s
+              AND profile = %s
+              AND ok = 1
+            ORDER BY run_id DESC
+            LIMIT %s
+        """
+
+    @staticmethod
+    def refresh_steps_sql(n_runs: int) -> str:
+        """Step dei run indicati (n_runs placeholder)."""
+        marks = ", ".join(["%s"] * max(1, n_runs))
+        return f"""
+            SELECT run_id, stmt_no, step_hash, target, label, executions, status,
+                   elapsed_sec, rows_affected, warnings, warning_sample
+            FROM dwh_refresh_steps
+            WHERE run_id IN ({marks})
+            ORDER BY run_id, stmt_no
+        """
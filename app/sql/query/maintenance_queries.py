@@ -3,12 +3,19 @@ MIT License
 (c) 2025 Riccardo Leonelli
 """
 
+
+def _placeholders(n: int) -> str:
+    """'%s, %s, ...' per una lista IN di n elementi."""
+    return ", ".join(["%s"] * max(1, n))
+
+
 class QuerySqlManutenzioniMYSQL:
     # ---------- SCADENZE ----------
     @staticmethod
     def list_due_within_sql() -> str:
         """
-        Restituisce le attività di manutenzione con scadenza entro N giorni.
+        Restituisce le attività di manutenzione con scadenza entro N giorni
+        (range scan su maintenance_next_due.next_due_at).
         Parametri:
           - days: numero di giorni (int)
         """
@@ -19,7 +26,7 @@ class QuerySqlManutenzioniMYSQL:
               v.next_due_at,
               d.name          AS department_name,
               t.area_label
-            FROM vw_maintenance_next_due v
+            FROM maintenance_next_due v
             JOIN maintenance_tasks t
               ON t.id = v.task_id
             LEFT JOIN departments d
@@ -29,6 +36,226 @@ class QuerySqlManutenzioniMYSQL:
             ORDER BY v.next_due_at ASC, t.title ASC
         """
 
+    # ---------- PROSSIMA SCADENZA (tabella materializzata) ----------
+    @staticmethod
+    def _next_due_select_sql(task_filter: str) -> str:
+        # stessa logica di vw_maintenance_next_due, limitata ai task di task_filter
+        return f"""
+            SELECT
+              t.id AS task_id,
+              MIN(
+                CASE r.kind
+                  WHEN 'INTERVAL_DAYS' THEN DATE_ADD(COALESCE(le.last_done_at, t.created_at), INTERVAL r.interval_days DAY)
+                  WHEN 'WEEKLY'        THEN DATE_ADD(COALESCE(le.last_done_at, t.created_at), INTERVAL (7 * r.interval_weeks) DAY)
+                  WHEN 'MONTHLY'       THEN DATE_ADD(COALESCE(le.last_done_at, t.created_at), INTERVAL r.interval_months MONTH)
+                  WHEN 'YEARLY'        THEN DATE_ADD(COALESCE(le.last_done_at, t.created_at), INTERVAL r.interval_years YEAR)
+                  ELSE NULL
+                END
+              ) AS next_due_at,
+              le.last_done_at
+            FROM maintenance_tasks t
+            JOIN maintenance_rules r
+              ON r.task_id = t.id AND r.active = 1
+            LEFT JOIN (
+              SELECT e.task_id, MAX(e.done_at) AS last_done_at
+              FROM maintenance_events e
+              WHERE {task_filter.format(col="e.task_id")}
+              GROUP BY e.task_id
+            ) AS le
+              ON le.task_id = t.id
+            WHERE t.active = 1
+              AND {task_filter.format(col="t.id")}
+            GROUP BY t.id, le.last_done_at
+        """
+
+    @staticmethod
+    def delete_next_due_sql(n_tasks: int) -> str:
+        """
+        Parametri:
+          - task_id x n_tasks
+        """
+        return f"DELETE FROM maintenance_next_due WHERE task_id IN ({_placeholders(n_tasks)})"
+
+    @staticmethod
+    def refresh_next_due_sql(n_tasks: int) -> str:
+        """
+        Ricalcola la prossima scadenza di N task (da eseguire dopo delete_next_due_sql,
+        nella stessa transazione: i task senza regole attive restano senza riga).
+        Parametri:
+          - task_id x n_tasks (filtro eventi)
+          - task_id x n_tasks (filtro task)
+        """
+        in_list = _placeholders(n_tasks)
+        return (
+            "INSERT INTO maintenance_next_due (task_id, next_due_at, last_done_at)"
+            + QuerySqlManutenzioniMYSQL._next_due_select_sql("{col} IN (" + in_list + ")")
+        )
+
+    @staticmethod
+    def clear_next_due_sql() -> str:
+        return "DELETE FROM maintenance_next_due"
+
+    @staticmethod
+    def rebuild_next_due_sql() -> str:
+        """Ricalcolo completo (dopo clear_next_due_sql, nella stessa transazione). Nessun parametro."""
+        return (
+            "INSERT INTO maintenance_next_due (task_id, next_due_at, last_done_at)"
+            + QuerySqlManutenzioniMYSQL._next_due_select_sql("1 = 1")
+        )
+
+    @staticmethod
+    def due_rows_for_tasks_sql(n_tasks: int) -> str:
+        """
+        Stesse colonne di list_due_within_sql per un insieme di task.
+        Parametri:
+          - task_id x n_tasks
+        """
+        return f"""
+            SELECT
+              t.id            AS task_id,
+              t.title,
+              v.next_due_at,
+              d.name          AS department_name,
+              t.area_label
+            FROM maintenance_next_due v
+            JOIN maintenance_tasks t
+              ON t.id = v.task_id
+            LEFT JOIN departments d
+              ON d.id = t.department_id
+            WHERE v.task_id IN ({_placeholders(n_tasks)})
+              AND t.active = 1
+        """
+
+    # ---------- VERSIONE / REGISTRO MODIFICHE di maintenance_next_due ----------
+    # La riga unica di maintenance_next_due_seq resta bloccata fino al commit di chi la
+    # incrementa: le versioni diventano visibili in ordine di commit (vedi maintance_exec.sql).
+    @staticmethod
+    def bump_next_due_version_sql() -> str:
+        return "UPDATE maintenance_next_due_seq SET version = version + 1 WHERE id = 1"
+
+    @staticmethod
+    def next_due_version_sql() -> str:
+        """
+        Versione corrente e più vecchia ancora nel registro (marcatore del watcher: una
+        lettura per PK). Nessun parametro.
+        """
+        return """
+            SELECT s.version,
+                   (SELECT MIN(l.version) FROM maintenance_next_due_log l) AS min_logged
+            FROM maintenance_next_due_seq s
+            WHERE s.id = 1
+        """
+
+    @staticmethod
+    def insert_next_due_log_sql() -> str:
+        """
+        Una riga per task ricalcolato (task_id NULL = ricalcolo completo).
+        Parametri:
+          - version
+          - task_id
+        """
+        return "INSERT INTO maintenance_next_due_log (version, task_id) VALUES (%s, %s)"
+
+    @staticmethod
+    def next_due_log_sql() -> str:
+        """
+        Task ricalcolati tra due versioni.
+        Parametri:
+          - versione già vista (esclusa)
+          - versione letta dal marcatore (inclusa)
+        """
+        return """
+            SELECT DISTINCT task_id
+            FROM maintenance_next_due_log
+            WHERE version > %s
+              AND version <= %s
+        """
+
+    @staticmethod
+    def prune_next_due_log_sql() -> str:
+        """
+        Parametri:
+          - giorni di registro da conservare
+        """
+        return "DELETE FROM maintenance_next_due_log WHERE changed_at < NOW() - INTERVAL %s DAY"
+
+    @staticmethod
+    def next_due_for_tasks_sql(n_tasks: int) -> str:
+        """
+        Parametri:
+          - task_id x n_tasks
+        """
+        return f"""
+            SELECT task_id, next_due_at, updated_at
+            FROM maintenance_next_due
+            WHERE task_id IN ({_placeholders(n_tasks)})
+        """
+
+    @staticmethod
+    def next_due_all_sql() -> str:
+        return """
+            SELECT task_id, next_due_at, updated_at
+            FROM maintenance_next_due
+        """
+
+    @staticmethod
+    def notified_since_sql() -> str:
+        """
+        Notifica già registrata per task e motivo da un certo istante (riavvii del watcher).
+        Parametri:
+          - task_id
+          - reason
+          - since
+        """
+        return """
+            SELECT COUNT(*) AS n
+            FROM maintenance_notification_log
+            WHERE task_id = %s
+              AND reason = %s
+              AND sent_at >= %s
+        """
+
+    # ---------- FORECAST (letture massive) ----------
+    @staticmethod
+    def forecast_tasks_sql() -> str:
+        """Task attivi con reparto, durata stimata, data creazione e ultimo intervento. Nessun parametro."""
+        return """
+            SELECT
+              t.id                AS task_id,
+              t.title,
+              t.estimated_minutes,
+              t.created_at,
+              COALESCE(d.name, t.area_label) AS department_name,
+              le.last_done_at
+            FROM maintenance_tasks t
+            LEFT JOIN departments d
+              ON d.id = t.department_id
+            LEFT JOIN (
+              SELECT task_id, MAX(done_at) AS last_done_at
+              FROM maintenance_events
+              GROUP BY task_id
+            ) AS le
+              ON le.task_id = t.id
+            WHERE t.active = 1
+        """
+
+    @staticmethod
+    def forecast_rules_sql() -> str:
+        """Regole attive dei task attivi. Nessun parametro."""
+        return """
+            SELECT
+              r.task_id,
+              r.kind,
+              r.interval_days,
+              r.interval_weeks,
+              r.interval_months,
+              r.interval_years
+            FROM maintenance_rules r
+            JOIN maintenance_tasks t
+              ON t.id = r.task_id AND t.active = 1
+            WHERE r.active = 1
+        """
+
     # ---------- DESTINATARI (solo RESPONSABILE TASK) ----------
     @staticmethod
     def recipients_for_task_sql() -> str:
@@ -45,6 +272,33 @@ class QuerySqlManutenzioniMYSQL:
               AND o.email IS NOT NULL
         """
 
+    @staticmethod
+    def recipients_with_throttle_sql(n_tasks: int) -> str:
+        """
+        Versione "a insieme" di recipients_for_task_sql + throttle_check_sql:
+        per N task restituisce il responsabile e se è già stato notificato
+        negli ultimi throttle_days giorni (recent = 1).
+        Parametri:
+          - throttle_days
+          - task_id x n_tasks
+        """
+        return f"""
+            SELECT
+              t.id    AS task_id,
+              o.email AS email,
+              EXISTS (
+                SELECT 1
+                FROM maintenance_notification_log l
+                WHERE l.task_id = t.id
+                  AND l.recipient_email = o.email
+                  AND l.sent_at >= DATE_SUB(NOW(), INTERVAL %s DAY)
+              ) AS recent
+            FROM maintenance_tasks t
+            JOIN operators o ON o.id = t.responsible_operator_id
+            WHERE t.id IN ({_placeholders(n_tasks)})
+              AND o.email IS NOT NULL
+        """
+
     # ---------- THROTTLE ----------
     @staticmethod
     def throttle_check_sql() -> str:
@@ -64,11 +318,30 @@ class QuerySqlManutenzioniMYSQL:
               AND sent_at >= DATE_SUB(NOW(), INTERVAL %s DAY)
         """
 
+    @staticmethod
+    def throttled_pairs_sql(n_tasks: int, n_emails: int) -> str:
+        """
+        Coppie (task, destinatario) già notificate negli ultimi N giorni,
+        per un insieme di task e di indirizzi in una sola query.
+        Parametri:
+          - task_id x n_tasks
+          - email x n_emails
+          - throttle_days
+        """
+        return f"""
+            SELECT DISTINCT task_id, recipient_email AS email
+            FROM maintenance_notification_log
+            WHERE task_id IN ({_placeholders(n_tasks)})
+              AND recipient_email IN ({_placeholders(n_emails)})
+              AND sent_at >= DATE_SUB(NOW(), INTERVAL %s DAY)
+        """
+
     # ---------- LOG EMAIL ----------
     @staticmethod
     def insert_log_sql() -> str:
         """
         Registra un invio di notifica per evitare duplicati futuri.
+        Usata anche con executemany: il connector la trasforma in INSERT multi-riga.
         Parametri:
           - task_id
           - email
@@ -81,6 +354,108 @@ class QuerySqlManutenzioniMYSQL:
             VALUES (%s, %s, %s, %s)
         """
 
+    # ---------- OUTBOX ----------
+    @staticmethod
+    def outbox_enqueue_sql() -> str:
+        """
+        Accoda una email già renderizzata; i doppioni (stessa dedupe_key) vengono ignorati.
+        Parametri:
+          - dedupe_key
+          - recipients (JSON {"to": [...], "cc": [...], "bcc": [...]})
+          - subject
+          - html
+          - log_rows (JSON [[task_id, email], ...])
+          - reason
+        """
+        return """
+            INSERT IGNORE INTO maintenance_outbox
+              (dedupe_key, recipients, subject, html, log_rows, reason)
+            VALUES (%s, %s, %s, %s, %s, %s)
+        """
+
+    @staticmethod
+    def outbox_lease_sql() -> str:
+        """
+        Prende in carico fino a N email: quelle in attesa il cui tentativo è dovuto
+        e quelle con un lease scaduto (dispatcher interrotto a metà).
+        Parametri:
+          - lease_owner
+          - lease_sec
+          - limit
+        """
+        return """
+            UPDATE maintenance_outbox
+            SET status = 'SENDING',
+                lease_owner = %s,
+                lease_until = DATE_ADD(NOW(), INTERVAL %s SECOND),
+                attempts = attempts + 1
+            WHERE (status = 'PENDING' AND next_attempt_at <= NOW())
+               OR (status = 'SENDING' AND lease_until < NOW())
+            ORDER BY next_attempt_at ASC, id ASC
+            LIMIT %s
+        """
+
+    @staticmethod
+    def outbox_leased_sql() -> str:
+        """
+        Email prese in carico da un dispatcher.
+        Parametri:
+          - lease_owner
+        """
+        return """
+            SELECT id, dedupe_key, recipients, subject, html, log_rows, reason, attempts
+            FROM maintenance_outbox
+            WHERE lease_owner = %s
+              AND status = 'SENDING'
+            ORDER BY id ASC
+        """
+
+    @staticmethod
+    def outbox_mark_sent_sql() -> str:
+        """
+        Parametri:
+          - id
+          - lease_owner (solo se il lease è ancora nostro)
+        """
+        return """
+            UPDATE maintenance_outbox
+            SET status = 'SENT', sent_at = NOW(), last_error = NULL,
+                lease_owner = NULL, lease_until = NULL
+            WHERE id = %s
+              AND lease_owner = %s
+        """
+
+    @staticmethod
+    def outbox_mark_failed_sql() -> str:
+        """
+        Rilascia l'email dopo un errore: di nuovo PENDING fra delay_sec secondi,
+        oppure FAILED definitivo.
+        Parametri:
+          - give_up (0/1)
+          - delay_sec
+          - last_error
+          - id
+          - lease_owner
+        """
+        return """
+            UPDATE maintenance_outbox
+            SET status = IF(%s, 'FAILED', 'PENDING'),
+                next_attempt_at = DATE_ADD(NOW(), INTERVAL %s SECOND),
+                last_error = %s,
+                lease_owner = NULL, lease_until = NULL
+            WHERE id = %s
+              AND lease_owner = %s
+        """
+
+    @staticmethod
+    def outbox_stats_sql() -> str:
+        """Conteggio per stato."""
+        return """
+            SELECT status, COUNT(*) AS n
+            FROM maintenance_outbox
+            GROUP BY status
+        """
+
     # ---------- EVENTI ----------
     @staticmethod
     def insert_event_sql() -> str:
@@ -117,3 +492,31 @@ class QuerySqlManutenzioniMYSQL:
             WHERE e.task_id = %s
             ORDER BY e.done_at DESC
         """
+
+    @staticmethod
+    def list_events_page_sql(after: bool) -> str:
+        """
+        Una pagina dello storico interventi (keyset: dal più recente, senza OFFSET).
+        Usa l'indice ix_me_task_done (task_id, done_at, id).
+        Parametri:
+          - task_id
+          - solo se after: done_at, done_at, id dell'ultima riga della pagina precedente
+          - limit
+        """
+        seek = """
+              AND (e.done_at < %s OR (e.done_at = %s AND e.id < %s))""" if after else ""
+        return f"""
+            SELECT
+              e.id,
+              e.task_id,
+              e.done_at,
+              e.done_by_operator_id,
+              o.first_name,
+              o.last_name,
+              e.notes
+            FROM maintenance_events e
+            LEFT JOIN operators o ON o.id = e.done_by_operator_id
+            WHERE e.task_id = %s{seek}
+            ORDER BY e.done_at DESC, e.id DESC
+            LIMIT %s
+        """
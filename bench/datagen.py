@@ -0,0 +1,518 @@
+# bench/datagen.py
+# Generatore deterministico di dati sintetici per i benchmark (bench/workload.py).
+#
+#   python bench/datagen.py --scale small            # riempie lo schema di bench + fox_staging
+#   python bench/datagen.py --scale prod --method infile
+#
+# Stesso seed + stessa data di riferimento (--anchor, default oggi) => stessi dati.
+# Ogni tabella ha il suo generatore (random.Random(f"{seed}:{tabella}")): cambiare la scala
+# di una tabella non cambia il contenuto delle altre.
+#
+# Tabelle riempite:
+#   - schema applicativo di bench (BENCH_MYSQL_DB, default plax_bench): departments, operators,
+#     maintenance_tasks / rules / events / notification_log (struttura presa da
+#     app/sql/executions/maintance_exec.sql, indici compresi)
+#   - fox_staging: anagrafe, magart, magana, caumag, lotti, maggrp, magcls, doctes, docrig, magmov
+#     (solo le colonne lette da dwh_executions.sql / dwh_incremental.sql)
+# ATTENZIONE: fox_staging e gli schemi di bench vengono ricreati. Solo su un'istanza locale.
+
+from __future__ import annotations
+
+import os
+import re
+import sys
+import random
+import logging
+import argparse
+from dataclasses import dataclass, fields, replace
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+logger = logging.getLogger("bench.datagen")
+
+MAINTENANCE_SQL = ROOT / "app" / "sql" / "executions" / "maintance_exec.sql"
+STAGING_SCHEMA = "fox_staging"
+DEFAULT_BENCH_DB = "plax_bench"
+LOCAL_HOSTS = ("localhost", "127.0.0.1", "::1")
+
+
+@dataclass(frozen=True)
+class Scale:
+    departments: int
+    operators: int
+    tasks: int
+    events_per_task: int
+    log_per_task: int
+    customers: int
+    articles: int
+    warehouses: int
+    causali: int
+    groups: int
+    classes: int
+    lots: int
+    doc_rows: int
+    rows_per_doc: int
+    mov_rows: int
+    years: int
+
+
+SCALES: Dict[str, Scale] = {
+    "small": Scale(departments=5, operators=20, tasks=200, events_per_task=5, log_per_task=3,
+                   customers=500, articles=2_000, warehouses=5, causali=15, groups=10, classes=30,
+                   lots=2_000, doc_rows=20_000, rows_per_doc=5, mov_rows=20_000, years=2),
+    "medium": Scale(departments=10, operators=100, tasks=2_000, events_per_task=10, log_per_task=5,
+                    customers=5_000, articles=20_000, warehouses=10, causali=30, groups=30, classes=100,
+                    lots=20_000, doc_rows=500_000, rows_per_doc=6, mov_rows=500_000, years=4),
+    "prod": Scale(departments=20, operators=300, tasks=10_000, events_per_task=20, log_per_task=10,
+                  customers=20_000, articles=50_000, warehouses=20, causali=40, groups=50, classes=200,
+                  lots=100_000, doc_rows=5_000_000, rows_per_doc=8, mov_rows=5_000_000, years=8),
+}
+
+TIPODOC = ["OC", "DT", "FA", "FB", "OF", "DD", "AF"]
+RULE_KINDS = [("INTERVAL_DAYS", 3, (7, 120)), ("WEEKLY", 4, (1, 8)), ("MONTHLY", 5, (1, 12)), ("YEARLY", 6, (1, 3))]
+
+
+def scale_from_args(name: str, **overrides: Optional[int]) -> Scale:
+    """Scala predefinita con eventuali valori sostituiti (None = lascia quello della scala)."""
+    base = SCALES[name]
+    changes = {k: int(v) for k, v in overrides.items() if v is not None}
+    unknown = set(changes) - {f.name for f in fields(Scale)}
+    if unknown:
+        raise ValueError(f"Parametri di scala sconosciuti: {', '.join(sorted(unknown))}")
+    return replace(base, **changes)
+
+
+def check_local(host: str, allow_remote: bool) -> None:
+    if host not in LOCAL_HOSTS and not allow_remote:
+        raise SystemExit(f"Il bench ricrea fox_staging: host {host} non locale (usa --allow-remote se voluto)")
+
+
+# ---------------------------
+# Struttura
+# ---------------------------
+APP_DDL = [
+    """
+    CREATE TABLE departments (
+      id BIGINT PRIMARY KEY AUTO_INCREMENT,
+      name VARCHAR(120) NOT NULL
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """,
+    """
+    CREATE TABLE operators (
+      id BIGINT PRIMARY KEY AUTO_INCREMENT,
+      first_name VARCHAR(80) NULL,
+      last_name VARCHAR(80) NULL,
+      email VARCHAR(190) NULL
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """,
+]
+
+STAGING_DDL = [
+    """
+    CREATE TABLE anagrafe (
+      CODICE CHAR(6) NOT NULL PRIMARY KEY, DESCRIZION VARCHAR(50), SUPRAGSOC VARCHAR(40),
+      PARTIVA VARCHAR(28), CODFISCALE VARCHAR(16), ESTERO TINYINT, STATOCF CHAR(1),
+      CODNAZIONE CHAR(3), CODICEISO CHAR(2), LOCALITA VARCHAR(40), PROV CHAR(2), CAP VARCHAR(5),
+      INDIRIZZO VARCHAR(50), TELEFONO VARCHAR(16), EMAIL VARCHAR(80), CLI_PA TINYINT, DTULTAGG DATE
+    )
+    """,
+    """
+    CREATE TABLE magart (
+      CODICE VARCHAR(20) NOT NULL PRIMARY KEY, DESCRIZION VARCHAR(50), UNMISURA CHAR(2),
+      GRUPPO VARCHAR(5), CLASSE VARCHAR(5), CLASSEABC CHAR(1), STATOART CHAR(1),
+      PESOUNIT DECIMAL(18,6), QTACONF DECIMAL(18,6), UBICAZIONE VARCHAR(6), MARCA VARCHAR(3),
+      CER VARCHAR(6), `TIMESTAMP` DATETIME, USERNAME VARCHAR(20)
+    )
+    """,
+    """
+    CREATE TABLE magana (
+      codice VARCHAR(5) NOT NULL PRIMARY KEY, descrizion VARCHAR(50), fiscale TINYINT(1),
+      nonfiscale TINYINT(1), cantiere VARCHAR(12), vds VARCHAR(11), timestamp_row DATETIME,
+      username VARCHAR(20)
+    )
+    """,
+    """
+    CREATE TABLE caumag (
+      codice VARCHAR(5) NOT NULL PRIMARY KEY, descrizion VARCHAR(80), magpflag TINYINT(1),
+      magaflag TINYINT(1), clifor SMALLINT, ppordin CHAR(1), ppimpegn CHAR(1), pcordin CHAR(1),
+      pcimpegn CHAR(1), apordin CHAR(1), apimpegn CHAR(1), acordin CHAR(1), acimpegn CHAR(1),
+      timestamp_row DATETIME, username VARCHAR(40)
+    )
+    """,
+    """
+    CREATE TABLE lotti (
+      codicearti VARCHAR(20) NOT NULL, codice VARCHAR(20) NOT NULL, descrizion VARCHAR(40),
+      datascad DATE, timestamp_row DATETIME, username VARCHAR(20),
+      PRIMARY KEY (codicearti, codice)
+    )
+    """,
+    """
+    CREATE TABLE maggrp (
+      codice VARCHAR(5) NOT NULL PRIMARY KEY, descrizion VARCHAR(30), livello INT
+    )
+    """,
+    """
+    CREATE TABLE magcls (
+      codice VARCHAR(5) NOT NULL PRIMARY KEY, descrizion VARCHAR(60), livello INT
+    )
+    """,
+    """
+    CREATE TABLE doctes (
+      tipodoc CHAR(2) NOT NULL, esanno CHAR(4) NOT NULL, numerodoc VARCHAR(20) NOT NULL,
+      datadoc DATE, dataconseg DATE, codicecf CHAR(6), valuta CHAR(3),
+      cambio DECIMAL(18,8), eurocambio DECIMAL(18,6),
+      PRIMARY KEY (tipodoc, esanno, numerodoc),
+      KEY idx_datadoc (datadoc)
+    )
+    """,
+    """
+    CREATE TABLE docrig (
+      tipodoc CHAR(2) NOT NULL, esanno CHAR(4) NOT NULL, numerodoc VARCHAR(20) NOT NULL,
+      numeroriga INT NOT NULL, codicearti VARCHAR(20), magpartenz VARCHAR(5), magarrivo VARCHAR(5),
+      lotto VARCHAR(20), quantita DECIMAL(18,6), quantitare DECIMAL(18,6), prezzoun DECIMAL(18,8),
+      prezzotot DECIMAL(18,8), scontiv DECIMAL(18,8), aliiva CHAR(3),
+      PRIMARY KEY (tipodoc, esanno, numerodoc, numeroriga)
+    )
+    """,
+    """
+    CREATE TABLE magmov (
+      id BIGINT NOT NULL PRIMARY KEY, datamov DATE, codicecf VARCHAR(6), codicearti VARCHAR(20),
+      magazzino VARCHAR(5), codcausale VARCHAR(5), lotto VARCHAR(20),
+      quantita DECIMAL(18,6), quantitare DECIMAL(18,6), qtaindist DECIMAL(18,6),
+      valore DECIMAL(18,6), ultcosto DECIMAL(18,6),
+      ordin SMALLINT, impegn SMALLINT, qtacar SMALLINT, qtascar SMALLINT,
+      qtatcar SMALLINT, qtatscar SMALLINT, qtaret SMALLINT,
+      KEY idx_datamov (datamov)
+    )
+    """,
+]
+
+
+def maintenance_ddl() -> List[str]:
+    """
+    CREATE TABLE + indici della sezione 1) di maintance_exec.sql e maintenance_next_due
+    (con versione e registro delle modifiche):
+    il bench usa la stessa struttura dello schema reale (niente seed, viste e trigger).
+    """
+    text = MAINTENANCE_SQL.read_text(encoding="utf-8")
+    lines = [ln for ln in text.splitlines() if ln.strip() and not ln.strip().startswith("--")]
+    cleaned = "\n".join(lines)
+    start = cleaned.index("CREATE TABLE IF NOT EXISTS maintenance_tasks")
+    end = cleaned.index("CREATE OR REPLACE VIEW") if "CREATE OR REPLACE VIEW" in cleaned else cleaned.index("CREATE VIEW")
+    stmts = [s.strip() for s in cleaned[start:end].split(";") if s.strip()]
+    for pattern in (r"CREATE TABLE IF NOT EXISTS maintenance_next_due \(.*?\)[^;]*",
+                    r"CREATE TABLE IF NOT EXISTS maintenance_next_due_seq \(.*?\)[^;]*",
+                    r"INSERT IGNORE INTO maintenance_next_due_seq [^;]*",
+                    r"CREATE TABLE IF NOT EXISTS maintenance_next_due_log \(.*?\)[^;]*"):
+        m = re.search(pattern, cleaned, re.S)
+        if m:
+            stmts.append(m.group(0))
+    return stmts
+
+
+# ---------------------------
+# Generatori
+# ---------------------------
+Rows = Iterator[tuple]
+
+
+def _rng(seed: int, table: str) -> random.Random:
+    return random.Random(f"{seed}:{table}")
+
+
+def _money(rng: random.Random, lo: float, hi: float, places: int = 4) -> Decimal:
+    return Decimal(str(round(rng.uniform(lo, hi), places)))
+
+
+def _customer(i: int) -> str:
+    return f"C{i:05d}"
+
+
+def _article(i: int) -> str:
+    return f"ART{i:07d}"
+
+
+def gen_departments(s: Scale, seed: int, anchor: date) -> Rows:
+    for i in range(1, s.departments + 1):
+        yield (i, f"REPARTO {i:02d}")
+
+
+def gen_operators(s: Scale, seed: int, anchor: date) -> Rows:
+    for i in range(1, s.operators + 1):
+        yield (i, f"Nome{i}", f"Cognome{i}", f"operatore{i}@bench.local")
+
+
+def gen_tasks(s: Scale, seed: int, anchor: date) -> Rows:
+    rng = _rng(seed, "maintenance_tasks")
+    for i in range(1, s.tasks + 1):
+        created = datetime.combine(anchor, datetime.min.time()) - timedelta(days=rng.randint(30, 1000))
+        resp = rng.randint(1, s.operators) if rng.random() < 0.9 else None
+        yield (i, f"Attività di manutenzione {i}", None, rng.choice([None, 15, 30, 60, 120]),
+               rng.randint(1, s.departments), f"AREA {rng.randint(1, 20)}", resp,
+               1 if rng.random() < 0.95 else 0, created)
+
+
+def gen_rules(s: Scale, seed: int, anchor: date) -> Rows:
+    rng = _rng(seed, "maintenance_rules")
+    rid = 0
+    for task in range(1, s.tasks + 1):
+        for _ in range(1 if rng.random() < 0.8 else 2):
+            kind, col, (lo, hi) = rng.choice(RULE_KINDS)
+            values = [None, None, None, None]
+            values[col - 3] = rng.randint(lo, hi)
+            rid += 1
+            yield (rid, task, kind, *values, 1)
+
+
+def gen_events(s: Scale, seed: int, anchor: date) -> Rows:
+    rng = _rng(seed, "maintenance_events")
+    now = datetime.combine(anchor, datetime.min.time())
+    eid = 0
+    for task in range(1, s.tasks + 1):
+        for _ in range(rng.randint(0, 2 * s.events_per_task)):
+            eid += 1
+            done = now - timedelta(days=rng.randint(0, 730), minutes=rng.randint(0, 600))
+            who = rng.randint(1, s.operators) if rng.random() < 0.7 else None
+            yield (eid, task, done, who, None)
+
+
+def gen_notification_log(s: Scale, seed: int, anchor: date) -> Rows:
+    rng = _rng(seed, "maintenance_notification_log")
+    now = datetime.combine(anchor, datetime.min.time())
+    lid = 0
+    for task in range(1, s.tasks + 1):
+        for _ in range(rng.randint(0, 2 * s.log_per_task)):
+            lid += 1
+            sent = now - timedelta(days=rng.randint(0, 60), minutes=rng.randint(0, 600))
+            yield (lid, task, f"operatore{rng.randint(1, s.operators)}@bench.local", sent,
+                   "[Manutenzioni] bench", "due_time")
+
+
+def gen_anagrafe(s: Scale, seed: int, anchor: date) -> Rows:
+    rng = _rng(seed, "anagrafe")
+    for i in range(1, s.customers + 1):
+        yield (_customer(i), f"Cliente {i} S.r.l.", None, f"{rng.randint(10**10, 10**11 - 1)}", None,
+               1 if rng.random() < 0.1 else 0, "A", "ITA", "IT", f"Località {rng.randint(1, 500)}",
+               rng.choice(["MI", "BG", "BS", "TO", "VR", "RM"]), f"{rng.randint(10000, 99999)}",
+               f"Via Roma {rng.randint(1, 200)}", None, f"cliente{i}@example.com", 0,
+               anchor - timedelta(days=rng.randint(0, 2000)))
+
+
+def gen_maggrp(s: Scale, seed: int, anchor: date) -> Rows:
+    for i in range(1, s.groups + 1):
+        yield (f"G{i:03d}", f"Gruppo {i}", 1)
+
+
+def gen_magcls(s: Scale, seed: int, anchor: date) -> Rows:
+    for i in range(1, s.classes + 1):
+        yield (f"K{i:03d}", f"Classe {i}", 1 + i % 3)
+
+
+def gen_magart(s: Scale, seed: int, anchor: date) -> Rows:
+    rng = _rng(seed, "magart")
+    for i in range(1, s.articles + 1):
+        yield (_article(i), f"Articolo {i}", rng.choice(["PZ", "KG", "MT"]),
+               f"G{rng.randint(1, s.groups):03d}", f"K{rng.randint(1, s.classes):03d}",
+               rng.choice("ABC"), "A", _money(rng, 0.01, 50, 6), _money(rng, 1, 1000, 6),
+               None, None, None, datetime(2020, 1, 1), "bench")
+
+
+def gen_magana(s: Scale, seed: int, anchor: date) -> Rows:
+    for i in range(1, s.warehouses + 1):
+        yield (f"M{i:02d}", f"Magazzino {i}", 1, 0, None, None, datetime(2020, 1, 1), "bench")
+
+
+def gen_caumag(s: Scale, seed: int, anchor: date) -> Rows:
+    for i in range(1, s.causali + 1):
+        yield (f"Q{i:02d}", f"Causale {i}", 1, 0, 1 + i % 2, "", "", "", "", "", "", "", "",
+               datetime(2020, 1, 1), "bench")
+
+
+def gen_lotti(s: Scale, seed: int, anchor: date) -> Rows:
+    rng = _rng(seed, "lotti")
+    for i in range(1, s.lots + 1):
+        yield (_article(1 + (i - 1) % s.articles), f"L{i:08d}", None,
+               anchor + timedelta(days=rng.randint(-200, 900)), datetime(2020, 1, 1), "bench")
+
+
+def _docs(s: Scale, seed: int, anchor: date) -> Iterator[Tuple[str, str, str, date, int]]:
+    """Testate (tipodoc, esanno, numerodoc, data, righe): stessa sequenza per doctes e docrig."""
+    rng = _rng(seed, "doctes")
+    n_docs = max(1, -(-s.doc_rows // s.rows_per_doc))
+    span = max(1, s.years * 365)
+    for i in range(n_docs):
+        d = anchor - timedelta(days=rng.randint(0, span))
+        rows = min(s.rows_per_doc, s.doc_rows - i * s.rows_per_doc)
+        yield rng.choice(TIPODOC), str(d.year), str(i + 1), d, rows
+
+
+def gen_doctes(s: Scale, seed: int, anchor: date) -> Rows:
+    rng = _rng(seed, "doctes:extra")
+    for tipodoc, esanno, numero, d, _ in _docs(s, seed, anchor):
+        yield (tipodoc, esanno, numero, d, d + timedelta(days=rng.randint(0, 30)),
+               _customer(rng.randint(1, s.customers)), "EUR", Decimal("1"), Decimal("1"))
+
+
+def gen_docrig(s: Scale, seed: int, anchor: date) -> Rows:
+    rng = _rng(seed, "docrig")
+    for tipodoc, esanno, numero, _, rows in _docs(s, seed, anchor):
+        for riga in range(1, rows + 1):
+            qty = _money(rng, 1, 500, 2)
+            price = _money(rng, 0.1, 80)
+            yield (tipodoc, esanno, numero, riga, _article(rng.randint(1, s.articles)),
+                   f"M{rng.randint(1, s.warehouses):02d}", None, None, qty, Decimal(0),
+                   price, qty * price, Decimal(0), "22")
+
+
+def gen_magmov(s: Scale, seed: int, anchor: date) -> Rows:
+    rng = _rng(seed, "magmov")
+    span = max(1, s.years * 365)
+    for i in range(1, s.mov_rows + 1):
+        qty = _money(rng, 1, 500, 2)
+        car = 1 if rng.random() < 0.5 else 0
+        yield (i, anchor - timedelta(days=rng.randint(0, span)),
+               _customer(rng.randint(1, s.customers)) if rng.random() < 0.6 else None,
+               _article(rng.randint(1, s.articles)), f"M{rng.randint(1, s.warehouses):02d}",
+               f"Q{rng.randint(1, s.causali):02d}", None, qty, Decimal(0), Decimal(0),
+               _money(rng, 1, 5000), _money(rng, 0.1, 80), 0, 0, car, 1 - car, 0, 0, 0)
+
+
+# (schema: "app" | "staging", tabella, colonne, generatore)
+TABLES: List[Tuple[str, str, List[str], Callable[[Scale, int, date], Rows]]] = [
+    ("app", "departments", ["id", "name"], gen_departments),
+    ("app", "operators", ["id", "first_name", "last_name", "email"], gen_operators),
+    ("app", "maintenance_tasks", ["id", "title", "notes_oper", "estimated_minutes", "department_id",
+                                  "area_label", "responsible_operator_id", "active", "created_at"], gen_tasks),
+    ("app", "maintenance_rules", ["id", "task_id", "kind", "interval_days", "interval_weeks",
+                                  "interval_months", "interval_years", "active"], gen_rules),
+    ("app", "maintenance_events", ["id", "task_id", "done_at", "done_by_operator_id", "notes"], gen_events),
+    ("app", "maintenance_notification_log", ["id", "task_id", "recipient_email", "sent_at",
+                                             "subject", "reason"], gen_notification_log),
+    ("staging", "anagrafe", ["CODICE", "DESCRIZION", "SUPRAGSOC", "PARTIVA", "CODFISCALE", "ESTERO",
+                             "STATOCF", "CODNAZIONE", "CODICEISO", "LOCALITA", "PROV", "CAP",
+                             "INDIRIZZO", "TELEFONO", "EMAIL", "CLI_PA", "DTULTAGG"], gen_anagrafe),
+    ("staging", "maggrp", ["codice", "descrizion", "livello"], gen_maggrp),
+    ("staging", "magcls", ["codice", "descrizion", "livello"], gen_magcls),
+    ("staging", "magart", ["CODICE", "DESCRIZION", "UNMISURA", "GRUPPO", "CLASSE", "CLASSEABC",
+                           "STATOART", "PESOUNIT", "QTACONF", "UBICAZIONE", "MARCA", "CER",
+                           "`TIMESTAMP`", "USERNAME"], gen_magart),
+    ("staging", "magana", ["codice", "descrizion", "fiscale", "nonfiscale", "cantiere", "vds",
+                           "timestamp_row", "username"], gen_magana),
+    ("staging", "caumag", ["codice", "descrizion", "magpflag", "magaflag", "clifor", "ppordin",
+                           "ppimpegn", "pcordin", "pcimpegn", "apordin", "apimpegn", "acordin",
+                           "acimpegn", "timestamp_row", "username"], gen_caumag),
+    ("staging", "lotti", ["codicearti", "codice", "descrizion", "datascad", "timestamp_row",
+                          "username"], gen_lotti),
+    ("staging", "doctes", ["tipodoc", "esanno", "numerodoc", "datadoc", "dataconseg", "codicecf",
+                           "valuta", "cambio", "eurocambio"], gen_doctes),
+    ("staging", "docrig", ["tipodoc", "esanno", "numerodoc", "numeroriga", "codicearti", "magpartenz",
+                           "magarrivo", "lotto", "quantita", "quantitare", "prezzoun", "prezzotot",
+                           "scontiv", "aliiva"], gen_docrig),
+    ("staging", "magmov", ["id", "datamov", "codicecf", "codicearti", "magazzino", "codcausale", "lotto",
+                           "quantita", "quantitare", "qtaindist", "valore", "ultcosto", "ordin", "impegn",
+                           "qtacar", "qtascar", "qtatcar", "qtatscar", "qtaret"], gen_magmov),
+]
+
+
+# ---------------------------
+# Caricamento
+# ---------------------------
+def _run(db, sql: str) -> None:
+    from app.core.db import QueryType
+    db.execute_query(sql, None, fetchall=False, query_type=QueryType.INSERT)
+
+
+def generate(
+    *,
+    scale: Scale,
+    seed: int = 42,
+    anchor: Optional[date] = None,
+    bench_db: str = DEFAULT_BENCH_DB,
+    method: str = "insert",
+    batch_size: int = 5000,
+) -> Dict[str, int]:
+    """Ricrea gli schemi di bench e fox_staging e li riempie. Ritorna le righe per tabella."""
+    from app.core.db import MySQLDb
+    from app.jobs.dwh_etl import _FactWriter
+
+    anchor = anchor or date.today()
+    db = MySQLDb()
+    db.allow_local_infile = method == "infile"
+    db.db_name = None          # gli schemi vengono (ri)creati qui
+    db.open()
+    counts: Dict[str, int] = {}
+    try:
+        for schema, ddl in ((bench_db, APP_DDL + maintenance_ddl()), (STAGING_SCHEMA, STAGING_DDL)):
+            _run(db, f"DROP DATABASE IF EXISTS `{schema}`")
+            _run(db, f"CREATE DATABASE `{schema}` CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_520_ci")
+            _run(db, f"USE `{schema}`")
+            for stmt in ddl:
+                _run(db, stmt)
+        # caricamento: niente controlli FK/unique riga per riga, i dati sono coerenti per costruzione
+        _run(db, "SET SESSION foreign_key_checks = 0")
+        _run(db, "SET SESSION unique_checks = 0")
+        for where, table, columns, gen in TABLES:
+            schema = bench_db if where == "app" else STAGING_SCHEMA
+            t0 = datetime.now()
+            out = _FactWriter(db, f"`{schema}`.`{table}`", columns, method, batch_size)
+            for row in gen(scale, seed, anchor):
+                out.add(row)
+            out.flush()
+            counts[f"{schema}.{table}"] = out.rows
+            logger.info("BENCH_DATAGEN %s.%s: %s righe in %.1fs", schema, table, out.rows,
+                        (datetime.now() - t0).total_seconds())
+    finally:
+        db.close()
+    return counts
+
+
+def add_scale_args(ap: argparse.ArgumentParser) -> None:
+    ap.add_argument("--scale", choices=sorted(SCALES), default="small", help="Scala predefinita (default small)")
+    ap.add_argument("--tasks", type=int, default=None, help="Sostituisce il numero di task della scala")
+    ap.add_argument("--doc-rows", type=int, default=None, help="Sostituisce le righe documento (docrig)")
+    ap.add_argument("--mov-rows", type=int, default=None, help="Sostituisce i movimenti di magazzino (magmov)")
+    ap.add_argument("--seed", type=int, default=42, help="Seed del generatore (default 42)")
+    ap.add_argument("--anchor", type=date.fromisoformat, default=None,
+                    help="Data di riferimento AAAA-MM-GG (default oggi)")
+    ap.add_argument("--bench-db", default=None,
+                    help=f"Schema applicativo di bench (default BENCH_MYSQL_DB o {DEFAULT_BENCH_DB})")
+    ap.add_argument("--method", choices=["insert", "infile"], default="insert",
+                    help="INSERT multi-riga o LOAD DATA LOCAL INFILE (richiede local_infile=ON)")
+    ap.add_argument("--allow-remote", action="store_true", help="Consente un host MySQL non locale")
+
+
+def prepare_env(bench_db: Optional[str]) -> str:
+    """Carica .env e punta l'applicazione sullo schema di bench. Ritorna il nome dello schema."""
+    try:
+        from dotenv import load_dotenv
+        load_dotenv(dotenv_path=ROOT / ".env")
+    except ImportError:
+        pass
+    name = bench_db or os.getenv("BENCH_MYSQL_DB") or DEFAULT_BENCH_DB
+    os.environ["API_MYSQL_DB"] = name
+    return name
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Genera dati sintetici deterministici per i benchmark.")
+    add_scale_args(ap)
+    args = ap.parse_args()
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(), format="%(asctime)s %(levelname)s %(message)s")
+
+    bench_db = prepare_env(args.bench_db)
+    check_local(os.getenv("API_MYSQL_HOSTNAME", "localhost"), args.allow_remote)
+    scale = scale_from_args(args.scale, tasks=args.tasks, doc_rows=args.doc_rows, mov_rows=args.mov_rows)
+    counts = generate(scale=scale, seed=args.seed, anchor=args.anchor, bench_db=bench_db, method=args.method)
+    for name, n in counts.items():
+        print(f"{name:<45} {n:>10}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,249 @@
+# bench/mail.py
+# Benchmark di invio email su un server SMTP locale (bench/smtp_sink.py): nessun operatore
+# riceve nulla e non serve MySQL.
+#
+#   python bench/mail.py                                   # 2000 riepiloghi, una SmtpSession
+#   python bench/mail.py --workers 4 --latency-ms 20       # MailDispatcher con 4 connessioni
+#   python bench/mail.py --fail-rate 0.02 --disconnect-rate 0.01 --max-per-session 100
+#   python bench/mail.py --compare bench/results/<file>.json
+#
+# I messaggi sono riepiloghi scadenze prodotti da _render_table (come `send`) con righe
+# sintetiche e passano da build_message + SmtpSession / MailDispatcher con STARTTLS e AUTH
+# verso il sink. Le variabili SMTP_* vengono impostate qui (il .env NON viene caricato:
+# il relay reale resta fuori).
+#
+# Riporta messaggi/s (solo invio; il rendering è misurato a parte), connessioni aperte,
+# latenza di send() per messaggio (p50/p99/max, reconnect e retry della sessione inclusi) e
+# gli esiti lato sink. Risultato JSON in bench/results/mail_<data>.json.
+
+from __future__ import annotations
+
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import platform
+import threading
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from smtp_sink import SmtpSink  # noqa: E402
+
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+logger = logging.getLogger("bench.mail")
+
+_TITLES = ["Controllo estintori", "Taratura bilancia", "Pulizia filtri", "Verifica impianto elettrico",
+           "Ingrassaggio catene", "Sostituzione lame", "Revisione compressore", "Controllo muletto"]
+_AREAS = ["Produzione", "Magazzino", "Confezionamento", "Uffici", "Spedizioni"]
+
+
+def digests(count: int, rows: int, seed: int) -> List[Tuple[str, str, str]]:
+    """(oggetto, html, destinatario) per `count` riepiloghi da `rows` righe (deterministici)."""
+    from app.jobs.manutenzioni import _render_table
+
+    rng = random.Random(seed)
+    today = date.today()
+    out = []
+    for i in range(count):
+        due = [{
+            "task_id": rng.randint(1, 10_000),
+            "title": rng.choice(_TITLES),
+            "next_due_at": today + timedelta(days=rng.randint(0, 7)),
+            "department_name": rng.choice(_AREAS),
+        } for _ in range(rows)]
+        out.append((f"[Manutenzioni] {rows} scadenze entro 7 giorni",
+                    _render_table(due, 7),
+                    f"operatore{i % 500:03d}@bench.invalid"))
+    return out
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """Percentile nearest-rank."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    k = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[k]
+
+
+def _timed_session_factory(latencies: List[float], sessions: List[Any], lock: threading.Lock):
+    from app.core.mailer import SmtpSession
+
+    class TimedSession(SmtpSession):
+        def send(self, msg, rcpts):
+            t0 = time.perf_counter()
+            try:
+                return super().send(msg, rcpts)
+            finally:
+                elapsed = time.perf_counter() - t0
+                with lock:
+                    latencies.append(elapsed)
+
+    def factory() -> SmtpSession:
+        s = TimedSession()
+        with lock:
+            sessions.append(s)
+        return s
+
+    return factory
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    sink = SmtpSink(
+        tls=not args.no_tls,
+        credentials=None if args.no_auth else ("bench", "bench"),
+        latency_ms=args.latency_ms,
+        connect_latency_ms=args.connect_latency_ms,
+        fail_rate=args.fail_rate,
+        reject_rate=args.reject_rate,
+        disconnect_rate=args.disconnect_rate,
+        max_per_session=args.max_per_session,
+        seed=args.seed,
+    )
+    with sink:
+        os.environ.update(sink.env())
+        os.environ["SMTP_FROM"] = "scheduler@bench.invalid"
+        os.environ["SMTP_TIMEOUT"] = "30"
+        if args.session_size:
+            os.environ["SMTP_MAX_PER_SESSION"] = str(args.session_size)
+
+        from app.core import mailer
+        from app.core.mail_dispatch import MailDispatcher, MailJob
+        mailer._CFG = None       # rilegge SMTP_* appena impostate
+
+        t0 = time.perf_counter()
+        rendered = digests(args.messages, args.rows, args.seed)
+        jobs = [MailJob(*mailer.build_message(subject, html, [to])) for subject, html, to in rendered]
+        prepare_sec = time.perf_counter() - t0
+
+        latencies: List[float] = []
+        sessions: List[Any] = []
+        lock = threading.Lock()
+        factory = _timed_session_factory(latencies, sessions, lock)
+
+        ok = failed = 0
+        t0 = time.perf_counter()
+        if args.workers > 0:
+            with MailDispatcher(workers=args.workers, rate_per_sec=0, retries=args.retries,
+                                backoff_sec=args.backoff, session_factory=factory) as dispatcher:
+                for r in dispatcher.send_batch(jobs):
+                    ok, failed = (ok + 1, failed) if r.ok else (ok, failed + 1)
+        else:
+            with factory() as smtp:
+                for job in jobs:
+                    try:
+                        smtp.send(job.msg, job.rcpts)
+                        ok += 1
+                    except mailer.SchedulerEmailException as ex:
+                        logger.debug("invio fallito: %s", ex)
+                        failed += 1
+        send_sec = time.perf_counter() - t0
+
+    stats = sink.stats
+    ms = [v * 1000 for v in latencies]
+    return {
+        "meta": {
+            "started_at": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "messages": args.messages,
+            "rows_per_digest": args.rows,
+            "workers": args.workers,
+            "session_size": args.session_size or int(os.getenv("SMTP_MAX_PER_SESSION", "100")),
+            "tls": not args.no_tls,
+            "auth": not args.no_auth,
+            "latency_ms": args.latency_ms,
+            "connect_latency_ms": args.connect_latency_ms,
+            "fail_rate": args.fail_rate,
+            "reject_rate": args.reject_rate,
+            "disconnect_rate": args.disconnect_rate,
+            "max_per_session": args.max_per_session,
+            "seed": args.seed,
+        },
+        "prepare_sec": round(prepare_sec, 3),
+        "send_sec": round(send_sec, 3),
+        "msgs_per_sec": round(ok / send_sec, 1) if send_sec else None,
+        "sent_ok": ok,
+        "failed": failed,
+        "connections": sum(s.connections for s in sessions),
+        "avg_message_kb": round(stats.bytes_received / stats.accepted / 1024, 1) if stats.accepted else None,
+        "latency_ms": {
+            "samples": len(ms),
+            "p50": round(percentile(ms, 50), 2) if ms else None,
+            "p99": round(percentile(ms, 99), 2) if ms else None,
+            "max": round(max(ms), 2) if ms else None,
+        },
+        "sink": {k: v for k, v in stats.__dict__.items()},
+    }
+
+
+def compare(current: Dict[str, Any], previous: Dict[str, Any]) -> List[str]:
+    rows = [
+        ("msgs_per_sec", lambda r: r.get("msgs_per_sec")),
+        ("connections", lambda r: r.get("connections")),
+        ("p50_ms", lambda r: r.get("latency_ms", {}).get("p50")),
+        ("p99_ms", lambda r: r.get("latency_ms", {}).get("p99")),
+    ]
+    lines = [f"{'metrica':<14} {'precedente':>12} {'attuale':>12} {'delta':>8}"]
+    for name, get in rows:
+        a, b = get(previous), get(current)
+        pct = f"{(b - a) / a * 100:+.0f}%" if a and b is not None else "n/d"
+        lines.append(f"{name:<14} {a if a is not None else 'n/d':>12} {b if b is not None else 'n/d':>12} {pct:>8}")
+    return lines
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Benchmark di invio email verso un SMTP locale simulato.")
+    ap.add_argument("--messages", type=int, default=2000, help="Riepiloghi da inviare (default 2000)")
+    ap.add_argument("--rows", type=int, default=15, help="Righe per riepilogo (default 15)")
+    ap.add_argument("--workers", type=int, default=0,
+                    help="0 = una SmtpSession sequenziale (come send), N = MailDispatcher con N worker")
+    ap.add_argument("--session-size", type=int, default=None,
+                    help="Messaggi per connessione lato client (SMTP_MAX_PER_SESSION)")
+    ap.add_argument("--retries", type=int, default=3, help="Retry del dispatcher sugli errori temporanei")
+    ap.add_argument("--backoff", type=float, default=0.05, help="Backoff iniziale del dispatcher in secondi")
+    ap.add_argument("--latency-ms", type=float, default=0.0, help="Ritardo del sink sulla risposta al DATA")
+    ap.add_argument("--connect-latency-ms", type=float, default=0.0, help="Ritardo del sink sul banner")
+    ap.add_argument("--fail-rate", type=float, default=0.0, help="Probabilità di 451 sul DATA")
+    ap.add_argument("--reject-rate", type=float, default=0.0, help="Probabilità di 550 sul DATA")
+    ap.add_argument("--disconnect-rate", type=float, default=0.0, help="Probabilità di disconnessione sul DATA")
+    ap.add_argument("--max-per-session", type=int, default=0, help="421 dopo N messaggi per connessione (0 = no)")
+    ap.add_argument("--no-tls", action="store_true", help="Senza STARTTLS")
+    ap.add_argument("--no-auth", action="store_true", help="Senza AUTH")
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--out", default=None, help="File JSON del risultato (default bench/results/...)")
+    ap.add_argument("--compare", default=None, help="Risultato JSON precedente da confrontare")
+    args = ap.parse_args()
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "WARNING").upper(), format="%(asctime)s %(levelname)s %(message)s")
+
+    res = run(args)
+    out = Path(args.out) if args.out else RESULTS_DIR / f"mail_{datetime.now():%Y%m%d_%H%M%S}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(res, ensure_ascii=False, indent=2, default=str) + "\n", encoding="utf-8")
+
+    lat = res["latency_ms"]
+    sink = res["sink"]
+    print(f"messaggi     {res['sent_ok']} ok, {res['failed']} falliti in {res['send_sec']:.2f} s "
+          f"(preparazione {res['prepare_sec']:.2f} s, {res['avg_message_kb']} KB/messaggio)")
+    print(f"throughput   {res['msgs_per_sec']} msg/s")
+    print(f"connessioni  {res['connections']}")
+    print(f"latenza      p50 {lat['p50']} ms, p99 {lat['p99']} ms, max {lat['max']} ms")
+    print(f"sink         accettati {sink['accepted']}, 451 {sink['temp_failures']}, 550 {sink['rejected']}, "
+          f"disconnessioni {sink['disconnects']}, 421 {sink['session_limits']}")
+    print(f"Risultato: {out}")
+    if args.compare:
+        previous = json.loads(Path(args.compare).read_text(encoding="utf-8"))
+        print("\n".join(compare(res, previous)))
+    return 0 if not sink["errors"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
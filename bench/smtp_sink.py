@@ -0,0 +1,424 @@
+# bench/smtp_sink.py
+# Server SMTP locale in-process per benchmark e prove del mailer (nessuna email esce davvero).
+#
+#   with SmtpSink(latency_ms=20, fail_rate=0.01) as sink:
+#       os.environ["SMTP_PORT"] = str(sink.port)
+#       ...
+#       sink.messages   # messaggi ricevuti
+#
+# Supporta EHLO/HELO, STARTTLS (certificato autofirmato generato con `openssl`, oppure
+# cert_file/key_file), AUTH PLAIN / LOGIN, MAIL, RCPT, DATA, RSET, NOOP, QUIT.
+# smtplib.starttls() senza contesto non verifica il certificato: il mailer si collega senza
+# modifiche.
+#
+# Guasti iniettabili (probabilità per messaggio, generatore con seed => ripetibili):
+#   - fail_rate:        451 sul DATA (errore temporaneo: il dispatcher ritenta)
+#   - reject_rate:      550 sul DATA (errore permanente)
+#   - disconnect_rate:  chiusura della connessione al posto della risposta al DATA
+#   - max_per_session:  421 e chiusura dopo N messaggi sulla stessa connessione (limite del relay)
+# latency_ms / connect_latency_ms ritardano la risposta al DATA e il banner iniziale.
+
+from __future__ import annotations
+
+import ssl
+import base64
+import random
+import shutil
+import logging
+import tempfile
+import threading
+import subprocess
+import socketserver
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from time import sleep
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger("bench.smtp_sink")
+
+_MAX_LINE = 8192
+
+
+@dataclass
+class ReceivedMessage:
+    session: int
+    mail_from: str
+    rcpts: List[str]
+    size: int
+    received_at: datetime
+    data: Optional[bytes] = None      # solo con keep_data=True
+
+
+@dataclass
+class SinkStats:
+    connections: int = 0
+    tls: int = 0
+    auth_ok: int = 0
+    auth_failed: int = 0
+    accepted: int = 0
+    temp_failures: int = 0
+    rejected: int = 0
+    disconnects: int = 0
+    session_limits: int = 0
+    bytes_received: int = 0
+    errors: List[str] = field(default_factory=list)
+
+
+def self_signed_cert(directory: Path, host: str = "localhost") -> Tuple[Path, Path]:
+    """Crea certificato e chiave autofirmati in `directory` con la CLI openssl."""
+    if shutil.which("openssl") is None:
+        raise RuntimeError("openssl non trovato: passare cert_file/key_file oppure tls=False")
+    cert, key = directory / "sink.crt", directory / "sink.key"
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+         "-subj", f"/CN={host}", "-keyout", str(key), "-out", str(cert)],
+        check=True, capture_output=True,
+    )
+    return cert, key
+
+
+class _Disconnect(Exception):
+    pass
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    server: "_Server"
+
+    # ---------------------------
+    # I/O
+    # ---------------------------
+    def _reply(self, line: str) -> None:
+        self.wfile.write(line.encode("ascii") + b"\r\n")
+        self.wfile.flush()
+
+    def _readline(self) -> str:
+        raw = self.rfile.readline(_MAX_LINE)
+        if not raw:
+            raise _Disconnect()
+        return raw.decode("utf-8", "replace").rstrip("\r\n")
+
+    def _read_data(self) -> bytes:
+        chunks: List[bytes] = []
+        while True:
+            raw = self.rfile.readline(_MAX_LINE * 8)
+            if not raw:
+                raise _Disconnect()
+            if raw in (b".\r\n", b".\n"):
+                return b"".join(chunks)
+            chunks.append(raw[1:] if raw.startswith(b"..") else raw)
+
+    # ---------------------------
+    # Sessione
+    # ---------------------------
+    def handle(self) -> None:
+        sink = self.server.sink
+        self.session_id = sink._new_session()
+        self.tls = False
+        self.authed = False
+        self.in_session = 0
+        self._reset()
+        try:
+            if sink.connect_latency_ms:
+                sleep(sink.connect_latency_ms / 1000)
+            self._reply("220 smtp-sink ESMTP pronto")
+            while True:
+                line = self._readline()
+                verb, _, arg = line.partition(" ")
+                handler = getattr(self, f"_cmd_{verb.upper()}", None)
+                if handler is None:
+                    self._reply("502 5.5.2 comando non riconosciuto")
+                    continue
+                if handler(arg.strip()) is False:
+                    break
+        except (_Disconnect, ConnectionError, ssl.SSLError, OSError):
+            pass
+        except Exception as ex:          # errore del sink: resta nelle statistiche
+            sink._error(f"{type(ex).__name__}: {ex}")
+
+    def _reset(self) -> None:
+        self.mail_from: Optional[str] = None
+        self.rcpts: List[str] = []
+
+    def _auth_required(self) -> bool:
+        sink = self.server.sink
+        if sink.require_tls and not self.tls:
+            self._reply("530 5.7.0 eseguire prima STARTTLS")
+            return True
+        if sink.credentials and not self.authed:
+            self._reply("530 5.7.0 autenticazione richiesta")
+            return True
+        return False
+
+    # ---------------------------
+    # Comandi
+    # ---------------------------
+    def _cmd_EHLO(self, arg: str) -> None:
+        sink = self.server.sink
+        lines = ["smtp-sink", "8BITMIME", "PIPELINING", f"SIZE {sink.max_size}"]
+        if sink.ssl_context is not None and not self.tls:
+            lines.append("STARTTLS")
+        if sink.credentials and (self.tls or not sink.require_tls):
+            lines.append("AUTH PLAIN LOGIN")
+        for ln in lines[:-1]:
+            self._reply(f"250-{ln}")
+        self._reply(f"250 {lines[-1]}")
+
+    def _cmd_HELO(self, arg: str) -> None:
+        self._reply("250 smtp-sink")
+
+    def _cmd_STARTTLS(self, arg: str) -> None:
+        sink = self.server.sink
+        if sink.ssl_context is None or self.tls:
+            self._reply("454 4.7.0 TLS non disponibile")
+            return
+        self._reply("220 2.0.0 pronto per TLS")
+        self.wfile.flush()
+        conn = sink.ssl_context.wrap_socket(self.connection, server_side=True)
+        self.connection = self.request = conn
+        self.rfile = conn.makefile("rb")
+        self.wfile = conn.makefile("wb")
+        self.tls = True
+        self._reset()
+        sink._count("tls")
+
+    def _cmd_AUTH(self, arg: str) -> None:
+        sink = self.server.sink
+        if sink.require_tls and not self.tls:
+            self._reply("530 5.7.0 eseguire prima STARTTLS")
+            return
+        mech, _, initial = arg.partition(" ")
+        try:
+            if mech.upper() == "PLAIN":
+                if not initial:
+                    self._reply("334 ")
+                    initial = self._readline()
+                _, user, password = base64.b64decode(initial).decode("utf-8").split("\0", 2)
+            elif mech.upper() == "LOGIN":
+                if not initial:
+                    self._reply("334 " + base64.b64encode(b"Username:").decode())
+                    initial = self._readline()
+                user = base64.b64decode(initial).decode("utf-8")
+                self._reply("334 " + base64.b64encode(b"Password:").decode())
+                password = base64.b64decode(self._readline()).decode("utf-8")
+            else:
+                self._reply("504 5.5.4 meccanismo non supportato")
+                return
+        except (ValueError, UnicodeDecodeError):
+            self._reply("501 5.5.2 risposta AUTH non valida")
+            return
+        if sink.credentials and sink.credentials != (user, password):
+            sink._count("auth_failed")
+            self._reply("535 5.7.8 credenziali non valide")
+            return
+        self.authed = True
+        sink._count("auth_ok")
+        self._reply("235 2.7.0 autenticato")
+
+    def _cmd_MAIL(self, arg: str) -> None:
+        if self._auth_required():
+            return
+        self._reset()
+        self.mail_from = _address(arg)
+        self._reply("250 2.1.0 ok")
+
+    def _cmd_RCPT(self, arg: str) -> None:
+        if self.mail_from is None:
+            self._reply("503 5.5.1 MAIL FROM mancante")
+            return
+        self.rcpts.append(_address(arg))
+        self._reply("250 2.1.5 ok")
+
+    def _cmd_DATA(self, arg: str) -> Optional[bool]:
+        sink = self.server.sink
+        if not self.rcpts:
+            self._reply("503 5.5.1 RCPT TO mancante")
+            return None
+        self._reply("354 terminare con <CRLF>.<CRLF>")
+        data = self._read_data()
+        if sink.latency_ms:
+            sleep(sink.latency_ms / 1000)
+
+        outcome = sink._outcome(self.in_session)
+        if outcome == "session_limits":
+            self._reply("421 4.7.0 troppi messaggi per sessione, chiudo")
+            return False
+        if outcome == "disconnects":
+            return False
+        if outcome == "temp_failures":
+            self._reply("451 4.3.0 errore temporaneo simulato")
+        elif outcome == "rejected":
+            self._reply("550 5.7.1 messaggio rifiutato (simulato)")
+        else:
+            sink._store(ReceivedMessage(
+                session=self.session_id,
+                mail_from=self.mail_from or "",
+                rcpts=list(self.rcpts),
+                size=len(data),
+                received_at=datetime.now(),
+                data=data if sink.keep_data else None,
+            ))
+            self.in_session += 1
+            self._reply("250 2.0.0 accettato")
+        self._reset()
+        return None
+
+    def _cmd_RSET(self, arg: str) -> None:
+        self._reset()
+        self._reply("250 2.0.0 ok")
+
+    def _cmd_NOOP(self, arg: str) -> None:
+        self._reply("250 2.0.0 ok")
+
+    def _cmd_QUIT(self, arg: str) -> bool:
+        self._reply("221 2.0.0 arrivederci")
+        return False
+
+
+def _address(arg: str) -> str:
+    """'FROM:<a@b> SIZE=123' -> 'a@b'."""
+    _, _, rest = arg.partition(":")
+    rest = rest.strip()
+    if rest.startswith("<"):
+        return rest[1:rest.find(">")] if ">" in rest else rest[1:]
+    return rest.split(" ", 1)[0]
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    sink: "SmtpSink"
+
+
+class SmtpSink:
+    """
+    Server SMTP in un thread del processo corrente, in ascolto su host:port
+    (port=0 => porta libera scelta dal sistema, vedi .port).
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        *,
+        tls: bool = True,
+        require_tls: Optional[bool] = None,
+        cert_file: Optional[str] = None,
+        key_file: Optional[str] = None,
+        credentials: Optional[Tuple[str, str]] = ("bench", "bench"),
+        latency_ms: float = 0.0,
+        connect_latency_ms: float = 0.0,
+        fail_rate: float = 0.0,
+        reject_rate: float = 0.0,
+        disconnect_rate: float = 0.0,
+        max_per_session: int = 0,
+        keep_data: bool = False,
+        max_size: int = 35 * 1024 * 1024,
+        seed: int = 42,
+    ):
+        self.host = host
+        self.credentials = tuple(credentials) if credentials else None
+        self.latency_ms = float(latency_ms)
+        self.connect_latency_ms = float(connect_latency_ms)
+        self.fail_rate = float(fail_rate)
+        self.reject_rate = float(reject_rate)
+        self.disconnect_rate = float(disconnect_rate)
+        self.max_per_session = int(max_per_session)
+        self.keep_data = keep_data
+        self.max_size = int(max_size)
+        self.require_tls = tls if require_tls is None else require_tls
+
+        self.messages: List[ReceivedMessage] = []
+        self.stats = SinkStats()
+        self._lock = threading.Lock()
+        self._rng = random.Random(seed)
+        self._tmpdir: Optional[tempfile.TemporaryDirectory] = None
+
+        self.ssl_context: Optional[ssl.SSLContext] = None
+        if tls:
+            if not (cert_file and key_file):
+                self._tmpdir = tempfile.TemporaryDirectory(prefix="smtp_sink_")
+                cert, key = self_signed_cert(Path(self._tmpdir.name))
+                cert_file, key_file = str(cert), str(key)
+            self.ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            self.ssl_context.load_cert_chain(cert_file, key_file)
+
+        self._server = _Server((host, port), _Handler)
+        self._server.sink = self
+        self.port = self._server.server_address[1]
+        self._thread: Optional[threading.Thread] = None
+
+    def __enter__(self) -> "SmtpSink":
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.stop()
+        return False
+
+    def start(self) -> "SmtpSink":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="smtp-sink", daemon=True)
+        self._thread.start()
+        logger.info("SMTP sink in ascolto su %s:%s (tls=%s, auth=%s)",
+                    self.host, self.port, self.ssl_context is not None, bool(self.credentials))
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._tmpdir is not None:
+            self._tmpdir.cleanup()
+            self._tmpdir = None
+
+    def env(self) -> Dict[str, str]:
+        """Variabili SMTP_* per puntare app.core.mailer su questo sink."""
+        user, password = self.credentials or ("", "")
+        return {
+            "SMTP_HOST": self.host,
+            "SMTP_PORT": str(self.port),
+            "SMTP_USER": user,
+            "SMTP_PASSWORD": password,
+            "SMTP_TLS": "true" if self.ssl_context is not None else "false",
+        }
+
+    # ---------------------------
+    # Stato condiviso (thread delle connessioni)
+    # ---------------------------
+    def _new_session(self) -> int:
+        with self._lock:
+            self.stats.connections += 1
+            return self.stats.connections
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            setattr(self.stats, name, getattr(self.stats, name) + 1)
+
+    def _error(self, text: str) -> None:
+        with self._lock:
+            self.stats.errors.append(text)
+
+    def _store(self, msg: ReceivedMessage) -> None:
+        with self._lock:
+            self.messages.append(msg)
+            self.stats.accepted += 1
+            self.stats.bytes_received += msg.size
+
+    def _outcome(self, in_session: int) -> str:
+        """Esito del DATA: 'ok' o il nome del contatore del guasto iniettato."""
+        with self._lock:
+            if self.max_per_session and in_session >= self.max_per_session:
+                outcome = "session_limits"
+            else:
+                r = self._rng.random()
+                if r < self.disconnect_rate:
+                    outcome = "disconnects"
+                elif r < self.disconnect_rate + self.fail_rate:
+                    outcome = "temp_failures"
+                elif r < self.disconnect_rate + self.fail_rate + self.reject_rate:
+                    outcome = "rejected"
+                else:
+                    return "ok"
+            setattr(self.stats, outcome, getattr(self.stats, outcome) + 1)
+        return outcome
@@ -0,0 +1,110 @@
+# bench/startup.py
+# Benchmark dei tempi di avvio della CLI basato su `python -X importtime`.
+#
+#   python bench/startup.py            # misura e confronta con bench/startup_budget.json
+#   python bench/startup.py --update   # riscrive il budget (misurato x 1.5)
+#
+# Per ogni caso esegue l'interprete N volte e prende il minimo del tempo cumulativo degli
+# import di primo livello (meno rumoroso del tempo totale di processo). Esce con codice 1 se:
+#   - un caso importa un modulo vietato (es. mysql.connector per un semplice --help)
+#   - il tempo supera il budget salvato
+
+from __future__ import annotations
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+ROOT = Path(__file__).resolve().parents[1]
+BUDGET_FILE = Path(__file__).with_name("startup_budget.json")
+
+# moduli che non devono comparire per parse degli argomenti / help
+_CLI_FORBIDDEN = ["mysql.connector", "numpy", "smtplib", "dotenv", "app.jobs"]
+
+# nome caso -> (argomenti python, moduli vietati)
+CASES: Dict[str, Tuple[List[str], List[str]]] = {
+    "help": (["-m", "app.main", "--help"], _CLI_FORBIDDEN),
+    "events-help": (["-m", "app.main", "events", "--help"], _CLI_FORBIDDEN),
+    "send-help": (["-m", "app.main", "send", "--help"], _CLI_FORBIDDEN),
+    "dwh-refresh-help": (["-m", "app.main", "dwh-refresh", "--help"], _CLI_FORBIDDEN),
+    "import-manutenzioni": (
+        ["-c", "import app.jobs.manutenzioni"],
+        ["numpy", "app.jobs.dwh_refresh", "app.jobs.forecast", "app.jobs.dwh_graph"],
+    ),
+}
+
+
+def _parse_importtime(stderr: str) -> Tuple[int, List[str]]:
+    """Ritorna (microsecondi cumulativi degli import di primo livello, moduli importati)."""
+    total = 0
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        _, cumulative, name = line.split("|", 2)
+        name = name.rstrip()
+        modules.append(name.strip())
+        if not name.startswith("  "):    # livello 0: il cumulativo include i figli
+            total += int(cumulative)
+    return total, modules
+
+
+def _measure(args: List[str], runs: int) -> Tuple[int, List[str]]:
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    best = None
+    modules: List[str] = []
+    for _ in range(runs):
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", *args],
+            cwd=ROOT, env=env, capture_output=True, text=True,
+        )
+        if proc.returncode != 0:
+            raise SystemExit(f"{' '.join(args)} è uscito con codice {proc.returncode}:\n{proc.stderr[-2000:]}")
+        total, modules = _parse_importtime(proc.stderr)
+        best = total if best is None else min(best, total)
+    return best or 0, modules
+
+
+def _forbidden(modules: List[str], prefixes: List[str]) -> List[str]:
+    return sorted({m for m in modules for p in prefixes if m == p or m.startswith(p + ".")})
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Benchmark dei tempi di import all'avvio della CLI.")
+    ap.add_argument("--runs", type=int, default=5, help="Esecuzioni per caso (si tiene il minimo)")
+    ap.add_argument("--update", action="store_true", help="Riscrive il budget con i tempi misurati x 1.5")
+    args = ap.parse_args()
+
+    budget = json.loads(BUDGET_FILE.read_text(encoding="utf-8")) if BUDGET_FILE.exists() else {}
+    measured: Dict[str, int] = {}
+    failures: List[str] = []
+
+    for name, (cmd, forbidden) in CASES.items():
+        us, modules = _measure(cmd, args.runs)
+        measured[name] = us
+        bad = _forbidden(modules, forbidden)
+        limit = budget.get(name)
+        status = "ok"
+        if bad:
+            status = "VIETATI: " + ", ".join(bad)
+            failures.append(name)
+        elif limit is not None and us > limit and not args.update:
+            status = f"OLTRE BUDGET ({limit / 1000:.1f} ms)"
+            failures.append(name)
+        print(f"{name:<22} {us / 1000:8.1f} ms  {len(modules):4d} moduli  {status}")
+
+    if args.update:
+        BUDGET_FILE.write_text(
+            json.dumps({k: int(v * 1.5) for k, v in measured.items()}, indent=2) + "\n",
+            encoding="utf-8",
+        )
+        print(f"Budget aggiornato: {BUDGET_FILE}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
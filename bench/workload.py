@@ -0,0 +1,254 @@
+# bench/workload.py
+# Benchmark di send e dwh-refresh su dati sintetici (istanza MySQL/MariaDB locale).
+#
+#   python bench/workload.py --scale small                      # genera i dati ed esegue tutte le fasi
+#   python bench/workload.py --scale prod --skip-generate       # riusa i dati già generati
+#   python bench/workload.py --phases dwh-full --compare bench/results/<file>.json
+#
+# Connessione dalle stesse variabili API_MYSQL_* dell'applicazione (.env), ma con lo schema
+# applicativo BENCH_MYSQL_DB (default plax_bench); fox_staging e dwh sono quelli dell'istanza,
+# per questo l'host deve essere locale (o --allow-remote).
+#
+# Per ogni fase:
+#   - wall_sec:     tempo a parete
+#   - round_trips:  statement ricevuti dal server (delta di Questions globale: l'istanza deve
+#                   essere dedicata al bench, le letture del contatore sono escluse)
+#   - peak_mem_mb:  picco delle allocazioni Python (tracemalloc, rallenta: --no-tracemalloc)
+#   - rss_max_mb:   massimo RSS del processo fino a quel momento (dove disponibile)
+# Il risultato va in bench/results/workload_<scala>_<data>.json; --compare stampa le
+# differenze rispetto a un risultato precedente.
+
+from __future__ import annotations
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+import subprocess
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import datagen
+
+ROOT = datagen.ROOT
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+logger = logging.getLogger("bench.workload")
+
+
+def _rss_max_mb() -> Optional[float]:
+    try:
+        import resource
+    except ImportError:       # Windows
+        return None
+    kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(kb / (1048576 if sys.platform == "darwin" else 1024), 1)
+
+
+class _Questions:
+    """Contatore Questions del server letto da una connessione dedicata."""
+
+    def __init__(self):
+        from app.core.db import MySQLDb
+        self._db = MySQLDb()
+        self._db.db_name = None     # lo schema di bench può non esistere ancora (fase generate)
+        self._db.open()
+
+    def read(self) -> int:
+        from app.core.db import QueryType
+        row = self._db.execute_query("SHOW GLOBAL STATUS LIKE 'Questions'", None,
+                                     fetchall=False, query_type=QueryType.GET) or {}
+        return int(row.get("Value") or 0)
+
+    def server_version(self) -> str:
+        from app.core.db import QueryType
+        row = self._db.execute_query("SELECT VERSION() AS v", None, fetchall=False, query_type=QueryType.GET)
+        return str(row["v"])
+
+    def close(self) -> None:
+        self._db.close()
+
+
+def measure(name: str, fn: Callable[[], Any], questions: _Questions, use_tracemalloc: bool) -> Dict[str, Any]:
+    logger.info("BENCH fase %s: start", name)
+    q0 = questions.read()
+    if use_tracemalloc:
+        tracemalloc.start()
+        tracemalloc.reset_peak()
+    t0 = time.perf_counter()
+    error = None
+    result: Any = None
+    try:
+        result = fn()
+    except Exception as e:       # la fase fallita resta nel risultato
+        error = f"{type(e).__name__}: {e}"
+        logger.exception("BENCH fase %s fallita", name)
+    wall = time.perf_counter() - t0
+    peak = None
+    if use_tracemalloc:
+        peak = round(tracemalloc.get_traced_memory()[1] / 1048576, 1)
+        tracemalloc.stop()
+    # -1: la lettura iniziale del contatore è già inclusa nel valore finale
+    trips = questions.read() - q0 - 1
+    out = {
+        "wall_sec": round(wall, 3),
+        "round_trips": trips,
+        "peak_mem_mb": peak,
+        "rss_max_mb": _rss_max_mb(),
+        "ok": error is None,
+    }
+    if error:
+        out["error"] = error
+    if isinstance(result, dict):
+        out["result"] = result
+    logger.info("BENCH fase %s: %.1fs, %s round trip, picco %s MB", name, wall, trips, peak)
+    return out
+
+
+# ---------------------------
+# Fasi
+# ---------------------------
+def _phase_rebuild_next_due() -> Dict[str, Any]:
+    from app.jobs.manutenzioni import rebuild_next_due
+    return {"tasks": rebuild_next_due()}
+
+
+def _phase_send(outbox: bool, within_days: int) -> Callable[[], Any]:
+    def run() -> Dict[str, Any]:
+        from app.core.db import MySQLDb, QueryType
+        from app.jobs.manutenzioni import run_send
+        if outbox:
+            # stessa partenza a ogni esecuzione: la dedupe_key salterebbe le email già accodate
+            db = MySQLDb()
+            db.open()
+            try:
+                db.execute_query("DELETE FROM maintenance_outbox", None, fetchall=False, query_type=QueryType.DELETE)
+            finally:
+                db.close()
+        return run_send(within_days=within_days, dry_run=not outbox, outbox=outbox)
+    return run
+
+
+def _phase_dwh(mode: str, jobs: Optional[int]) -> Callable[[], Any]:
+    def run() -> Dict[str, Any]:
+        from app.jobs import dwh_refresh
+        res = dwh_refresh.run(mode=mode, jobs=jobs)
+        if not res.get("ok"):
+            raise RuntimeError(f"dwh_refresh {mode} fallito: {res.get('failures') or res}")
+        return res
+    return run
+
+
+PHASES = ["generate", "rebuild-next-due", "send-dry-run", "send-outbox", "dwh-full", "dwh-incremental"]
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def compare(current: Dict[str, Any], previous: Dict[str, Any]) -> List[str]:
+    lines = [f"{'fase':<20} {'wall_sec':>18} {'round_trips':>22} {'peak_mem_mb':>18}"]
+    for name, cur in current["phases"].items():
+        prev = previous.get("phases", {}).get(name)
+        if prev is None:
+            lines.append(f"{name:<20} {'(nuova)':>18}")
+            continue
+        cells = []
+        for key, width in (("wall_sec", 18), ("round_trips", 22), ("peak_mem_mb", 18)):
+            a, b = prev.get(key), cur.get(key)
+            if a is None or b is None:
+                cells.append(f"{'n/d':>{width}}")
+                continue
+            pct = f"{(b - a) / a * 100:+.0f}%" if a else "n/d"
+            cells.append(f"{f'{a} -> {b} ({pct})':>{width}}")
+        lines.append(f"{name:<20} " + " ".join(cells))
+    return lines
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Benchmark di send e dwh-refresh su dati sintetici.")
+    datagen.add_scale_args(ap)
+    ap.add_argument("--phases", default=",".join(PHASES),
+                    help=f"Fasi separate da virgola (default tutte: {','.join(PHASES)})")
+    ap.add_argument("--skip-generate", action="store_true", help="Non rigenera i dati (riusa quelli presenti)")
+    ap.add_argument("--within-days", type=int, default=7, help="Finestra delle scadenze per send (default 7)")
+    ap.add_argument("--jobs", type=int, default=None, help="Job paralleli di dwh-refresh (default DWH_REFRESH_JOBS)")
+    ap.add_argument("--no-tracemalloc", action="store_true", help="Non misura il picco di memoria Python")
+    ap.add_argument("--out", default=None, help="File JSON del risultato (default bench/results/...)")
+    ap.add_argument("--compare", default=None, help="Risultato JSON precedente da confrontare")
+    args = ap.parse_args()
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(), format="%(asctime)s %(levelname)s %(message)s")
+
+    bench_db = datagen.prepare_env(args.bench_db)
+    datagen.check_local(os.getenv("API_MYSQL_HOSTNAME", "localhost"), args.allow_remote)
+    os.environ.setdefault("SCHEDULER_USE_DB_RECIPIENTS", "1")
+    scale = datagen.scale_from_args(args.scale, tasks=args.tasks, doc_rows=args.doc_rows, mov_rows=args.mov_rows)
+    anchor = args.anchor or datetime.now().date()
+
+    selected = [p.strip() for p in args.phases.split(",") if p.strip()]
+    unknown = set(selected) - set(PHASES)
+    if unknown:
+        ap.error(f"fasi sconosciute: {', '.join(sorted(unknown))}")
+    if args.skip_generate and "generate" in selected:
+        selected.remove("generate")
+
+    steps: Dict[str, Callable[[], Any]] = {
+        "generate": lambda: datagen.generate(scale=scale, seed=args.seed, anchor=anchor,
+                                             bench_db=bench_db, method=args.method),
+        "rebuild-next-due": _phase_rebuild_next_due,
+        "send-dry-run": _phase_send(False, args.within_days),
+        "send-outbox": _phase_send(True, args.within_days),
+        "dwh-full": _phase_dwh("full", args.jobs),
+        "dwh-incremental": _phase_dwh("incremental", args.jobs),
+    }
+
+    questions = _Questions()
+    results: Dict[str, Any] = {
+        "meta": {
+            "started_at": datetime.now().isoformat(timespec="seconds"),
+            "scale_name": args.scale,
+            "scale": scale.__dict__,
+            "seed": args.seed,
+            "anchor": anchor.isoformat(),
+            "method": args.method,
+            "bench_db": bench_db,
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "server": questions.server_version(),
+            "tracemalloc": not args.no_tracemalloc,
+        },
+        "phases": {},
+    }
+    try:
+        for name in PHASES:
+            if name in selected:
+                results["phases"][name] = measure(name, steps[name], questions, not args.no_tracemalloc)
+    finally:
+        questions.close()
+
+    out = Path(args.out) if args.out else RESULTS_DIR / f"workload_{args.scale}_{datetime.now():%Y%m%d_%H%M%S}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(results, ensure_ascii=False, indent=2, default=str) + "\n", encoding="utf-8")
+
+    for name, r in results["phases"].items():
+        status = "ok" if r["ok"] else f"ERRORE {r.get('error')}"
+        print(f"{name:<20} {r['wall_sec']:9.2f} s  {r['round_trips']:>9} round trip  "
+              f"{r['peak_mem_mb'] if r['peak_mem_mb'] is not None else '-':>8} MB  {status}")
+    print(f"Risultato: {out}")
+    if args.compare:
+        previous = json.loads(Path(args.compare).read_text(encoding="utf-8"))
+        print("\n".join(compare(results, previous)))
+    return 0 if all(r["ok"] for r in results["phases"].values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,80 @@
+# tests/test_cron.py
+# Espressioni cron e calcolo della prossima esecuzione (app/core/cron.py).
+
+from datetime import datetime
+
+import pytest
+
+from app.core.cron import CronError, CronSchedule
+
+
+@pytest.mark.parametrize("expr, now, expected", [
+    # ogni minuto: il successivo, secondi azzerati
+    ("* * * * *", datetime(2025, 3, 10, 8, 15, 42), datetime(2025, 3, 10, 8, 16)),
+    # strettamente successivo: l'istante corrente non conta
+    ("30 6 * * *", datetime(2025, 3, 10, 6, 30), datetime(2025, 3, 11, 6, 30)),
+    ("30 6 * * *", datetime(2025, 3, 10, 6, 29, 59), datetime(2025, 3, 10, 6, 30)),
+    # passo e intervallo con passo
+    ("*/15 * * * *", datetime(2025, 3, 10, 8, 46), datetime(2025, 3, 10, 9, 0)),
+    ("0 8-18/2 * * *", datetime(2025, 3, 10, 12, 1), datetime(2025, 3, 10, 14, 0)),
+    # valore con passo: da quel valore fino al massimo
+    ("5/20 * * * *", datetime(2025, 3, 10, 8, 26), datetime(2025, 3, 10, 8, 45)),
+    # lista di giorni, cambio di mese e di anno
+    ("0 7 1,15 * *", datetime(2025, 3, 15, 7, 0), datetime(2025, 4, 1, 7, 0)),
+    ("0 0 1 1 *", datetime(2025, 6, 1), datetime(2026, 1, 1)),
+    # giorno-settimana: lunedì-venerdì, domenica sia 0 che 7
+    ("0 9 * * 1-5", datetime(2025, 3, 14, 10, 0), datetime(2025, 3, 17, 9, 0)),
+    ("0 9 * * 7", datetime(2025, 3, 10), datetime(2025, 3, 16, 9, 0)),
+    ("0 9 * * 0", datetime(2025, 3, 10), datetime(2025, 3, 16, 9, 0)),
+    # 29 febbraio: salta al prossimo anno bisestile
+    ("0 0 29 2 *", datetime(2025, 3, 1), datetime(2028, 2, 29)),
+    # alias
+    ("@hourly", datetime(2025, 3, 10, 8, 0), datetime(2025, 3, 10, 9, 0)),
+    ("@daily", datetime(2025, 12, 31, 23, 59), datetime(2026, 1, 1)),
+    ("@weekly", datetime(2025, 3, 10), datetime(2025, 3, 16)),
+    ("@monthly", datetime(2025, 1, 31, 12, 0), datetime(2025, 2, 1)),
+])
+def test_next_after(expr, now, expected):
+    assert CronSchedule(expr).next_after(now) == expected
+
+
+def test_day_of_month_or_day_of_week():
+    # come cron: con entrambi ristretti basta uno dei due (il 13 oppure un venerdì)
+    cron = CronSchedule("0 0 13 * 5")
+    fires = []
+    t = datetime(2025, 6, 1)
+    for _ in range(4):
+        t = cron.next_after(t)
+        fires.append(t.date().isoformat())
+    assert fires == ["2025-06-06", "2025-06-13", "2025-06-20", "2025-06-27"]
+
+
+def test_next_after_always_matches():
+    cron = CronSchedule("10,40 6-20/7 * 2,8 1")
+    t = datetime(2025, 1, 1)
+    for _ in range(20):
+        nxt = cron.next_after(t)
+        assert nxt > t and cron.matches(nxt)
+        t = nxt
+
+
+def test_impossible_schedule():
+    with pytest.raises(CronError):
+        CronSchedule("0 0 31 2 *").next_after(datetime(2025, 1, 1))
+
+
+@pytest.mark.parametrize("expr", [
+    "* * * *",
+    "60 * * * *",
+    "* 24 * * *",
+    "* * 0 * *",
+    "* * * 13 *",
+    "* * * * 8",
+    "*/0 * * * *",
+    "10-5 * * * *",
+    "a * * * *",
+    "@yearly",
+])
+def test_invalid_expressions(expr):
+    with pytest.raises(CronError):
+        CronSchedule(expr)
@@ -0,0 +1,255 @@
+# tests/test_dwh_graph.py
+# Divisione dello script in blocchi, dipendenze ed esecuzione (app/jobs/dwh_graph.py).
+
+import threading
+
+import pytest
+
+from app.core.db import SchedulerDbException
+from app.jobs.dwh_graph import (
+    _statement_kind,
+    _statement_reads,
+    _statement_target,
+    build_blocks,
+    execute_blocks,
+    is_transient,
+)
+
+SCRIPT = [
+    "DROP DATABASE IF EXISTS dwh",
+    "CREATE DATABASE dwh",
+    "USE dwh",
+    "SET @wm := (SELECT wm_date FROM etl_watermark WHERE table_name = 'fact_docrig')",
+    "DROP TABLE IF EXISTS dim_customer",
+    "CREATE TABLE dim_customer (customer_key INT AUTO_INCREMENT PRIMARY KEY, codice VARCHAR(20))",
+    "INSERT INTO dim_customer (codice) SELECT codice FROM fox_staging.anagrafe",
+    "DROP TABLE IF EXISTS dim_article",
+    "CREATE TABLE dim_article (article_key INT AUTO_INCREMENT PRIMARY KEY, codicearti VARCHAR(20))",
+    "INSERT INTO dim_article (codicearti) SELECT codicearti FROM fox_staging.magart",
+    "CREATE TABLE fact_docrig (fact_id INT PRIMARY KEY, customer_key INT, "
+    "FOREIGN KEY (customer_key) REFERENCES dim_customer(customer_key))",
+    "INSERT INTO fact_docrig SELECT r.id, c.customer_key FROM fox_staging.docrig r "
+    "LEFT JOIN dim_customer c ON c.codice = r.codicecf LEFT JOIN `dwh`.`dim_article` a ON a.codicearti = r.codicearti",
+    "CREATE OR REPLACE VIEW vw_sales AS SELECT * FROM fact_docrig",
+]
+
+
+def _by_name(blocks):
+    return {b.name: b for b in blocks}
+
+
+# ---------------------------
+# Target e tabelle lette
+# ---------------------------
+@pytest.mark.parametrize("sql, target", [
+    ("CREATE TABLE IF NOT EXISTS `dwh`.`dim_date` (date_key INT)", "dim_date"),
+    ("CREATE OR REPLACE VIEW vw_x AS SELECT 1", "vw_x"),
+    ("DROP TABLE IF EXISTS dim_customer", "dim_customer"),
+    ("INSERT IGNORE INTO dim_lotto (codice) SELECT 1", "dim_lotto"),
+    ("REPLACE INTO etl_watermark (table_name) VALUES ('x')", "etl_watermark"),
+    ("DELETE FROM fact_magmov WHERE mov_id > 10", "fact_magmov"),
+    ("DELETE f FROM fact_docrig f JOIN fox_staging.docrig r ON r.id = f.source_id", "fact_docrig"),
+    ("UPDATE dim_article SET descr = 'x'", "dim_article"),
+    ("TRUNCATE TABLE agg_sales_month_customer", "agg_sales_month_customer"),
+    ("ALTER TABLE fact_docrig ADD INDEX ix_doc (doc_date_key)", "fact_docrig"),
+    ("INSERT INTO fox_staging.anagrafe SELECT 1", "fox_staging.anagrafe"),
+])
+def test_statement_target(sql, target):
+    assert _statement_target(sql, "dwh") == target
+    assert _statement_kind(sql) == "table"
+
+
+@pytest.mark.parametrize("sql, kind", [
+    ("USE dwh", "session"),
+    ("SET @lookback_days := 7", "session"),
+    ("DROP DATABASE IF EXISTS dwh", "barrier"),
+    ("RENAME TABLE dwh.a TO dwh_old.a", "barrier"),
+])
+def test_statement_kind_session_and_barrier(sql, kind):
+    assert _statement_kind(sql) == kind
+    assert _statement_target(sql, "dwh") is None
+
+
+def test_statement_reads():
+    sql = ("INSERT INTO fact_docrig SELECT * FROM fox_staging.docrig r "
+           "LEFT JOIN `dwh`.`dim_customer` c ON c.codice = r.codicecf "
+           "JOIN dim_article a ON a.codicearti = r.codicearti")
+    assert _statement_reads(sql, "dwh") == {"fox_staging.docrig", "dim_customer", "dim_article"}
+    # con un altro schema corrente il nome qualificato resta tale
+    assert "dwh.dim_customer" in _statement_reads(sql, "dwh_next")
+    assert _statement_reads("CREATE TABLE f (k INT, FOREIGN KEY (k) REFERENCES dim_date(date_key))",
+                            "dwh") == {"dim_date"}
+
+
+# ---------------------------
+# Blocchi e dipendenze
+# ---------------------------
+def test_build_blocks_groups_by_target():
+    blocks = build_blocks(SCRIPT)
+    assert [b.name for b in blocks] == [
+        "__barrier_0__", "__barrier_1__", "dim_customer", "dim_article", "fact_docrig", "vw_sales",
+    ]
+    b = _by_name(blocks)
+    assert len(b["dim_customer"].statements) == 3
+    assert len(b["fact_docrig"].statements) == 2
+    assert b["dim_customer"].external_reads == {"fox_staging.anagrafe"}
+
+
+def test_build_blocks_prelude_and_session_reads():
+    b = _by_name(build_blocks(SCRIPT))
+    assert b["dim_customer"].prelude == ["USE dwh", SCRIPT[3]]
+    assert b["__barrier_0__"].prelude == []
+    # la tabella letta da un SET di sessione è una lettura di tutti i blocchi successivi
+    assert "etl_watermark" in b["dim_article"].reads
+
+
+def test_build_blocks_dependencies():
+    b = _by_name(build_blocks(SCRIPT))
+    idx = {name: blk.index for name, blk in b.items()}
+    # dimensioni indipendenti tra loro, dopo le barriere
+    assert b["dim_customer"].deps == {idx["__barrier_0__"], idx["__barrier_1__"]}
+    assert b["dim_article"].deps == {idx["__barrier_0__"], idx["__barrier_1__"]}
+    # il fatto legge entrambe le dimensioni, la vista legge il fatto
+    assert {idx["dim_customer"], idx["dim_article"]} <= b["fact_docrig"].deps
+    assert idx["fact_docrig"] in b["vw_sales"].deps
+
+
+def test_build_blocks_write_after_read():
+    blocks = build_blocks([
+        "INSERT INTO agg_a SELECT * FROM fact_docrig",
+        "DELETE FROM fact_docrig WHERE doc_date_key < 20200101",
+    ])
+    # chi riscrive una tabella letta prima deve aspettare il lettore
+    assert blocks[1].deps == {0}
+
+
+def test_build_blocks_new_block_when_session_changes():
+    blocks = build_blocks([
+        "USE dwh",
+        "INSERT INTO t SELECT 1",
+        "SET @x := 1",
+        "INSERT INTO t SELECT 2",
+    ])
+    assert [b.name for b in blocks] == ["t", "t"]
+    assert blocks[1].prelude == ["USE dwh", "SET @x := 1"]
+    assert blocks[1].deps == {0}
+
+
+def test_build_blocks_only_backward_dependencies():
+    # le dipendenze puntano sempre a blocchi precedenti: il grafo non ha cicli e l'ordine
+    # dello script è un ordinamento valido, anche con scritture incrociate
+    blocks = build_blocks([
+        "INSERT INTO a SELECT * FROM b",
+        "INSERT INTO b SELECT * FROM a",
+        "INSERT INTO a SELECT * FROM b",
+    ])
+    for blk in blocks:
+        assert all(d < blk.index for d in blk.deps)
+    assert blocks[1].deps == {0}
+    assert blocks[2].deps == {0, 1}
+
+
+# ---------------------------
+# Esecuzione
+# ---------------------------
+class FakeDb:
+    """Connessione finta: registra gli statement eseguiti (con l'id della connessione)."""
+
+    opened = 0
+
+    def __init__(self, log, lock):
+        self.log = log
+        self.lock = lock
+        self.closed = False
+
+    def open(self):
+        FakeDb.opened += 1
+        self.conn_no = FakeDb.opened
+
+    def close(self):
+        self.closed = True
+
+
+def _executor(log, lock, fail=None):
+    fail = fail if fail is not None else {}
+
+    def execute(db, stmt):
+        with lock:
+            if fail.get(stmt):
+                errno = fail[stmt].pop(0)
+                raise SchedulerDbException(f"Errore query MySQL: {errno} (HY000): boom")
+            log.append((db.conn_no, stmt))
+        return 1
+    return execute
+
+
+def _run(blocks, jobs=1, fail=None, **kwargs):
+    log, lock = [], threading.Lock()
+    res = execute_blocks(blocks, jobs=jobs, db_factory=lambda: FakeDb(log, lock),
+                         execute=_executor(log, lock, fail), backoff_sec=0, **kwargs)
+    return res, [s for _, s in log], log
+
+
+@pytest.mark.parametrize("jobs", [1, 3])
+def test_execute_blocks_respects_dependencies(jobs):
+    blocks = build_blocks(SCRIPT)
+    res, executed, _ = _run(blocks, jobs=jobs)
+    assert res["ok"] and res["blocks_ok"] == len(blocks)
+    assert res["executed"] == sum(len(b.statements) for b in blocks)
+    for blk in blocks:
+        last_of_deps = max((executed.index(blocks[d].statements[-1]) for d in blk.deps), default=-1)
+        assert executed.index(blk.statements[0]) > last_of_deps
+
+
+def test_execute_blocks_retries_transient_on_new_connection():
+    blocks = build_blocks(SCRIPT)
+    insert = SCRIPT[6]
+    completed = []
+    res, _, log = _run(blocks, fail={insert: [2013]}, retries=2, on_complete=completed.append)
+    assert res["ok"]
+    assert res["retries"] == 1
+    entry = next(e for e in res["report"] if e["block"] == "dim_customer")
+    assert entry["retries"] == 1
+    # il blocco riparte da capo (prelude compreso) su una connessione nuova
+    conns = [c for c, s in log if s == "USE dwh"]
+    assert len(set(conns)) > 1
+    assert [b.name for b in completed].count("dim_customer") == 1
+
+
+def test_execute_blocks_fails_on_permanent_error():
+    blocks = build_blocks(SCRIPT)
+    res, executed, _ = _run(blocks, fail={SCRIPT[6]: [1054]}, retries=2)
+    assert not res["ok"]
+    assert res["retries"] == 0
+    assert [f["block"] for f in res["failures"]] == ["dim_customer"]
+    assert res["failures"][0]["statement"] == 3
+    reasons = {e["block"]: e.get("reason") for e in res["report"]}
+    assert reasons["fact_docrig"] == "dipendenza fallita"
+    assert reasons["vw_sales"] == "dipendenza fallita"
+    assert SCRIPT[-1] not in executed
+
+
+def test_execute_blocks_retries_exhausted():
+    blocks = build_blocks(SCRIPT)
+    res, _, _ = _run(blocks, fail={SCRIPT[6]: [1205, 1213, 1205]}, retries=2)
+    assert not res["ok"]
+    assert res["retries"] == 2
+
+
+def test_execute_blocks_skip_and_resumed():
+    blocks = build_blocks(SCRIPT)
+    b = _by_name(blocks)
+    res, executed, _ = _run(blocks, skip={b["dim_article"].index: "invariata"},
+                            resumed={0: "completato", 1: "completato"})
+    assert res["ok"]
+    assert res["blocks_unchanged"] == 1 and res["blocks_resumed"] == 2
+    assert not any(s.startswith(("DROP DATABASE", "CREATE DATABASE")) for s in executed)
+    assert SCRIPT[9] not in executed
+    assert SCRIPT[11] in executed
+
+
+def test_is_transient():
+    assert is_transient(SchedulerDbException("Errore query MySQL: 2013 (HY000): Lost connection"))
+    assert is_transient(SchedulerDbException("Errore query MySQL: 1213 (40001): Deadlock found"))
+    assert not is_transient(SchedulerDbException("Errore query MySQL: 1054 (42S22): Unknown column"))
+    assert not is_transient(ValueError("boom"))
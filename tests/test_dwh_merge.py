@@ -0,0 +1,150 @@
+# tests/test_dwh_merge.py
+# Riscrittura dello script completo per il merge delle dimensioni (app/jobs/dwh_merge.py).
+
+import pytest
+
+from app.jobs.dwh_merge import MergeCounter, merge_keys, prepare, source_select
+from app.sql.query.dwh_queries import QuerySqlDwhMYSQL as Q
+
+CREATE_CUSTOMER = """CREATE TABLE dim_customer (
+  customer_key INT NOT NULL AUTO_INCREMENT,
+  codice       VARCHAR(20) NOT NULL,   -- codice cliente (PRIMARY KEY nel gestionale)
+  ragsoc       VARCHAR(100) NULL,
+  citta        VARCHAR(50) NULL,
+  PRIMARY KEY (customer_key),
+  UNIQUE KEY uq_dim_customer (codice)
+)"""
+
+INSERT_CUSTOMER = """INSERT INTO dim_customer (
+  codice,
+  ragsoc,
+  citta
+)
+SELECT
+  TRIM(a.codice) AS cod,
+  COALESCE(NULLIF(TRIM(a.descrizion), ''), (SELECT MAX(x.descr) FROM fox_staging.alias x WHERE x.codice = a.codice)),
+  a.localita
+FROM fox_staging.anagrafe a
+WHERE a.codice <> ''"""
+
+CREATE_DATE = """CREATE TABLE dim_date (
+  `date_key`  INT  NOT NULL,      -- es: 20251119
+  `full_date` DATE NOT NULL,
+  PRIMARY KEY (`date_key`)
+)"""
+
+
+# ---------------------------
+# Chiave naturale
+# ---------------------------
+def test_merge_keys_unique_key():
+    assert merge_keys(CREATE_CUSTOMER) == ["codice"]
+
+
+def test_merge_keys_composite_unique():
+    sql = ("CREATE TABLE dim_lotto (lotto_key INT NOT NULL AUTO_INCREMENT, codicearti VARCHAR(20), "
+           "codice VARCHAR(20), PRIMARY KEY (lotto_key), UNIQUE KEY uq_lotto (`codicearti`, `codice`))")
+    assert merge_keys(sql) == ["codicearti", "codice"]
+
+
+def test_merge_keys_natural_primary_key():
+    # il commento con "es:" non deve confondere la ricerca della PK
+    assert merge_keys(CREATE_DATE) == ["date_key"]
+
+
+def test_merge_keys_auto_increment_without_unique():
+    sql = """CREATE TABLE dim_x (
+  x_key INT NOT NULL AUTO_INCREMENT,
+  codice VARCHAR(10),
+  PRIMARY KEY (x_key)
+)"""
+    with pytest.raises(ValueError):
+        merge_keys(sql)
+
+
+# ---------------------------
+# SELECT sorgente
+# ---------------------------
+def test_source_select_renames_expressions():
+    table, columns, select = source_select(INSERT_CUSTOMER)
+    assert table == "dim_customer"
+    assert columns == ["codice", "ragsoc", "citta"]
+    lines = select.splitlines()
+    assert lines[0] == "SELECT"
+    # alias originale sostituito dal nome della colonna di destinazione
+    assert lines[1] == "  TRIM(a.codice) AS `codice`,"
+    # il FROM della sottoquery non è quello principale
+    assert lines[2].endswith("WHERE x.codice = a.codice)) AS `ragsoc`,")
+    assert lines[3] == "  a.localita AS `citta`"
+    assert select.endswith("FROM fox_staging.anagrafe a\nWHERE a.codice <> ''")
+
+
+def test_source_select_column_count_mismatch():
+    with pytest.raises(ValueError):
+        source_select("INSERT INTO dim_x (a, b) SELECT 1 FROM t")
+
+
+# ---------------------------
+# SQL di merge
+# ---------------------------
+def test_merge_update_sql_null_safe_compare():
+    sql = Q.merge_update_dim_sql("dim_customer", ["codice", "ragsoc", "citta"], ["codice"], "SELECT 1")
+    assert sql.startswith("UPDATE `dim_customer` cur\nJOIN (\nSELECT 1\n) AS s ON cur.`codice` = s.`codice`")
+    assert "SET cur.`ragsoc` = s.`ragsoc`,\n  cur.`citta` = s.`citta`\n" in sql
+    # confronto NULL-safe: NULL -> valore e valore -> NULL contano come modifiche
+    assert sql.endswith("WHERE NOT (\n  cur.`ragsoc` <=> s.`ragsoc`\n  AND cur.`citta` <=> s.`citta`\n)")
+    # la chiave non viene né aggiornata né confrontata
+    assert "cur.`codice` <=>" not in sql
+    assert "cur.`codice` = s.`codice`," not in sql
+
+
+def test_merge_update_sql_composite_key():
+    sql = Q.merge_update_dim_sql("dim_lotto", ["codicearti", "codice", "scadenza"],
+                                 ["codicearti", "codice"], "SELECT 1")
+    assert "ON cur.`codicearti` = s.`codicearti` AND cur.`codice` = s.`codice`" in sql
+    assert "SET cur.`scadenza` = s.`scadenza`" in sql
+
+
+def test_merge_insert_sql_anti_join():
+    sql = Q.merge_insert_dim_sql("dim_customer", ["codice", "ragsoc"], ["codice"], "SELECT 1")
+    assert sql.startswith("INSERT INTO `dim_customer` (`codice`, `ragsoc`)\nSELECT s.`codice`, s.`ragsoc`")
+    assert "LEFT JOIN `dim_customer` cur ON cur.`codice` = s.`codice`" in sql
+    assert sql.endswith("WHERE cur.`codice` IS NULL")
+
+
+# ---------------------------
+# Riscrittura dello script
+# ---------------------------
+def test_prepare_rewrites_dimensions_only():
+    fact = "INSERT INTO fact_docrig (customer_key) SELECT c.customer_key FROM dim_customer c"
+    stmts, keys = prepare([
+        "DROP TABLE IF EXISTS dim_customer",
+        CREATE_CUSTOMER,
+        INSERT_CUSTOMER,
+        "DROP TABLE IF EXISTS fact_docrig",
+        fact,
+    ])
+    assert keys == {"dim_customer": ["codice"]}
+    assert stmts[0].startswith("CREATE TABLE IF NOT EXISTS dim_customer (")
+    assert stmts[1].startswith("UPDATE `dim_customer` cur")
+    assert stmts[2].startswith("INSERT INTO `dim_customer` (`codice`, `ragsoc`, `citta`)")
+    # i fatti restano come nello script
+    assert stmts[3:] == ["DROP TABLE IF EXISTS fact_docrig", fact]
+
+
+def test_prepare_key_only_dimension_has_no_update():
+    create = ("CREATE TABLE dim_tipodoc (tipodoc_key INT NOT NULL AUTO_INCREMENT, tipodoc CHAR(2) NOT NULL, "
+              "PRIMARY KEY (tipodoc_key), UNIQUE KEY uq_tipodoc (tipodoc))")
+    stmts, _ = prepare([create, "INSERT INTO dim_tipodoc (tipodoc) SELECT DISTINCT tipodoc FROM fox_staging.doctes"])
+    assert len(stmts) == 2
+    assert stmts[1].startswith("INSERT INTO `dim_tipodoc`")
+
+
+def test_merge_counter():
+    results = iter([3, 5, 2, 7])
+    counter = MergeCounter(lambda db, stmt: next(results))
+    counter(None, "UPDATE `dim_customer` cur JOIN (...)")
+    counter(None, "INSERT INTO `dim_customer` (`codice`) SELECT ...")
+    counter(None, "INSERT INTO fact_docrig SELECT ...")
+    counter(None, "INSERT INTO `dim_customer` (`codice`) SELECT ...")
+    assert counter.report() == {"dim_customer": {"updated": 3, "inserted": 12}}
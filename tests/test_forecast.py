@@ -0,0 +1,147 @@
+# tests/test_forecast.py
+# Proiezione delle scadenze e aggregazione per settimana (app/jobs/forecast.py).
+
+import random
+from datetime import date, timedelta
+from operator import itemgetter
+
+import pytest
+
+from app.jobs import forecast
+from app.jobs.forecast import _TaskPlan, _add_months, _occurrences_scalar, _rule_step
+
+
+def _plan(anchor, step_days=None, step_months=None, department="Reparto A", minutes=30, task_id=1):
+    return _TaskPlan(task_id=task_id, department=department, minutes=minutes or 0,
+                     has_estimate=minutes is not None, anchor=anchor,
+                     step_days=step_days, step_months=step_months)
+
+
+# ---------------------------
+# Util date e regole
+# ---------------------------
+@pytest.mark.parametrize("d, months, expected", [
+    (date(2024, 1, 31), 1, date(2024, 2, 29)),
+    (date(2023, 1, 31), 1, date(2023, 2, 28)),
+    (date(2024, 11, 30), 3, date(2025, 2, 28)),
+    (date(2024, 2, 29), 12, date(2025, 2, 28)),
+    (date(2024, 5, 15), 0, date(2024, 5, 15)),
+])
+def test_add_months_like_date_add(d, months, expected):
+    assert _add_months(d, months) == expected
+
+
+@pytest.mark.parametrize("rule, expected", [
+    ({"kind": "INTERVAL_DAYS", "interval_days": 10}, ("D", 10)),
+    ({"kind": "WEEKLY", "interval_weeks": 2}, ("D", 14)),
+    ({"kind": "MONTHLY", "interval_months": 3}, ("M", 3)),
+    ({"kind": "YEARLY", "interval_years": 1}, ("M", 12)),
+    ({"kind": "MONTHLY", "interval_months": None}, None),
+    ({"kind": "INTERVAL_DAYS", "interval_days": 0}, None),
+    ({"kind": "WEEKLY", "interval_weeks": None}, None),
+    ({"kind": "ONCE"}, None),
+])
+def test_rule_step(rule, expected):
+    assert _rule_step(rule) == expected
+
+
+# ---------------------------
+# Proiezione task per task
+# ---------------------------
+def test_occurrences_future_chain():
+    p = _plan(date(2025, 1, 1), step_days=7)
+    occ = _occurrences_scalar(p, today=date(2025, 1, 5), end=date(2025, 1, 31))
+    assert occ == [date(2025, 1, 8), date(2025, 1, 15), date(2025, 1, 22), date(2025, 1, 29)]
+
+
+def test_occurrences_overdue_counted_today():
+    p = _plan(date(2024, 1, 1), step_days=30)
+    occ = _occurrences_scalar(p, today=date(2025, 3, 10), end=date(2025, 5, 1))
+    # scaduta: oggi, poi la catena riparte da oggi
+    assert occ == [date(2025, 3, 10), date(2025, 4, 9)]
+
+
+def test_occurrences_month_end_day_is_dragged():
+    p = _plan(date(2025, 1, 31), step_months=1)
+    occ = _occurrences_scalar(p, today=date(2025, 1, 31), end=date(2025, 5, 31))
+    # come DATE_ADD applicato all'occorrenza precedente: dal 28/02 in poi resta il 28
+    assert occ == [date(2025, 2, 28), date(2025, 3, 28), date(2025, 4, 28), date(2025, 5, 28)]
+
+
+def test_occurrences_mixed_rules_take_the_earliest():
+    p = _plan(date(2025, 1, 1), step_days=45, step_months=1)
+    occ = _occurrences_scalar(p, today=date(2025, 1, 1), end=date(2025, 3, 31))
+    assert occ == [date(2025, 2, 1), date(2025, 3, 1)]
+
+
+# ---------------------------
+# numpy: stesso risultato del calcolo task per task
+# ---------------------------
+def _random_plans(n, today, seed=7):
+    rnd = random.Random(seed)
+    plans = []
+    for i in range(n):
+        anchor = today - timedelta(days=rnd.randint(0, 800)) + timedelta(days=rnd.randint(0, 60))
+        kind = rnd.choice(["D", "M", "DM"])
+        plans.append(_plan(
+            anchor,
+            step_days=rnd.choice([1, 7, 10, 14, 30, 90]) if "D" in kind else None,
+            step_months=rnd.choice([1, 2, 3, 6, 12, 24]) if "M" in kind else None,
+            department=rnd.choice(["Reparto A", "Reparto B", forecast._NO_DEPT]),
+            minutes=rnd.choice([None, 15, 60]),
+            task_id=i + 1,
+        ))
+    # fine mese: il caso che il calcolo a vettori tratta a parte
+    plans.append(_plan(date(2024, 1, 31), step_months=1, task_id=n + 1))
+    plans.append(_plan(date(2024, 8, 31), step_months=6, task_id=n + 2))
+    return plans
+
+
+@pytest.mark.parametrize("today", [date(2025, 1, 31), date(2025, 2, 28), date(2025, 6, 15)])
+def test_numpy_projection_matches_scalar(today):
+    if forecast._numpy() is None:
+        pytest.skip("numpy non installato")
+    plans = _random_plans(300, today)
+    end = today + timedelta(days=400)
+
+    occ, idx = forecast._project_numpy(plans, today, end)
+    got = sorted((int(i), int(o)) for o, i in zip(occ, idx))
+    expected = sorted(
+        (i, (d - forecast._EPOCH).days)
+        for i, p in enumerate(plans)
+        for d in _occurrences_scalar(p, today, end)
+    )
+    assert got == expected
+
+    rows_np = forecast._aggregate_numpy(plans, occ, idx)
+    rows_py, total = forecast._aggregate_python(plans, today, end)
+    assert total == len(occ)
+    key = itemgetter("week_start", "department")
+    assert sorted(rows_np, key=key) == sorted(rows_py, key=key)
+
+
+def test_aggregate_python_week_rows():
+    today = date(2025, 3, 3)   # lunedì
+    plans = [
+        _plan(date(2025, 3, 1), step_days=3, minutes=20, task_id=1),
+        _plan(date(2025, 3, 1), step_days=7, minutes=None, task_id=2),
+    ]
+    rows, total = forecast._aggregate_python(plans, today, today + timedelta(days=6))
+    assert total == 3
+    assert rows == [{
+        "department": "Reparto A",
+        "iso_week": "2025-W10",
+        "week_start": "2025-03-03",
+        "occurrences": 3,
+        "estimated_minutes": 40,
+        "without_estimate": 1,
+    }]
+
+
+def test_render_csv():
+    result = {"rows": [{"department": "A", "iso_week": "2025-W10", "week_start": "2025-03-03",
+                        "occurrences": 1, "estimated_minutes": 5, "without_estimate": 0}]}
+    assert forecast.render(result).splitlines() == [
+        "department,iso_week,week_start,occurrences,estimated_minutes,without_estimate",
+        "A,2025-W10,2025-03-03,1,5,0",
+    ]